@@ -5,7 +5,7 @@ import os
 from typing import Type
 
 from celery import Celery
-from flask import Flask
+from flask import Flask, has_app_context
 from flask_login import LoginManager
 from flask_mail import Mail
 from flask_migrate import Migrate
@@ -13,6 +13,25 @@ from flask_sqlalchemy import SQLAlchemy
 
 from config import config
 
+from .apikeys import KeyUsageTracker
+from .batch import BatchRunner
+from .cache import ResponseCache
+from .coalesce import SingleFlight
+from .engine import LocalEngine
+from .entitlements import EntitlementService
+from .identity import IdentityCache
+from .keycache import ApiKeyCache
+from .kvstore import RedisStore
+from .llm import LLMGateway
+from .mailer import SMTPPool
+from .metering import UsageMeter
+from .passwords import PasswordHasher
+from .ratelimit import RateLimiter
+from .router import ModelRouter
+from .semantic_cache import SemanticCache
+from .templating import TemplateCache
+from . import payloads, queues
+
 # Optional Sentry import (keeps local dev lean)
 try:
     import sentry_sdk
@@ -25,13 +44,30 @@ except ImportError:  # pragma: no cover
 
 db: SQLAlchemy = SQLAlchemy()
 mail: Mail = Mail()
+smtp_pool: SMTPPool = SMTPPool()
 migrate: Migrate = Migrate(render_as_batch=True)
 login_manager: LoginManager = LoginManager()
 login_manager.login_view = "auth.login"
+kv: RedisStore = RedisStore()
+llm: LLMGateway = LLMGateway()
+engine: LocalEngine = LocalEngine()
+router: ModelRouter = ModelRouter()
+batch_runner: BatchRunner = BatchRunner()
+response_cache: ResponseCache = ResponseCache()
+api_key_cache: ApiKeyCache = ApiKeyCache()
+api_key_usage: KeyUsageTracker = KeyUsageTracker()
+identity_cache: IdentityCache = IdentityCache()
+password_hasher: PasswordHasher = PasswordHasher()
+entitlements: EntitlementService = EntitlementService()
+semantic_cache: SemanticCache = SemanticCache()
+single_flight: SingleFlight = SingleFlight()
+rate_limiter: RateLimiter = RateLimiter()
+usage_meter: UsageMeter = UsageMeter()
+template_cache: TemplateCache = TemplateCache()
 
 # Celery instance is module‑level so tasks can import it directly.
 # Broker / backend are injected via env‑vars in render.yaml.
-celery: Celery = Celery(__name__)
+celery: Celery = Celery(__name__, task_cls=payloads.PayloadTask)
 
 # ---------------------------------------------------------------------------
 # Application Factory
@@ -58,6 +94,23 @@ def create_app(config_name: str | None = None) -> Flask:
     mail.init_app(app)
     migrate.init_app(app, db)
     login_manager.init_app(app)
+    kv.init_app(app)
+    llm.init_app(app)
+    engine.init_app(app)
+    router.init_app(app)
+    batch_runner.init_app(app)
+    response_cache.init_app(app, kv)
+    api_key_cache.init_app(app, kv)
+    api_key_usage.init_app(app, kv)
+    identity_cache.init_app(app, kv)
+    password_hasher.init_app(app)
+    smtp_pool.init_app(app, kv)
+    entitlements.init_app(app, kv)
+    semantic_cache.init_app(app)
+    single_flight.init_app(app, kv)
+    rate_limiter.init_app(app, kv)
+    usage_meter.init_app(app)
+    template_cache.init_app(app, kv)
 
     # Celery needs broker / backend + app context
     celery.conf.update(
@@ -66,12 +119,43 @@ def create_app(config_name: str | None = None) -> Flask:
         task_serializer="json",
         result_serializer="json",
         accept_content=["json"],
+        result_expires=app.config.get("CELERY_RESULT_EXPIRES", 3600),
+        task_always_eager=app.config.get("CELERY_TASK_ALWAYS_EAGER", False),
+        task_store_eager_result=app.config.get("CELERY_TASK_ALWAYS_EAGER", False),
+        task_payload_max_bytes=app.config.get("TASK_PAYLOAD_MAX_BYTES", 256 * 1024),
+        beat_schedule={
+            "usage-rollup": {
+                "task": "usage.rollup",
+                "schedule": app.config.get("USAGE_ROLLUP_INTERVAL", 300),
+                "kwargs": {"hours": 2},
+            },
+            "api-key-usage-flush": {
+                "task": "apikeys.flush_usage",
+                "schedule": app.config.get("API_KEY_USAGE_FLUSH_INTERVAL", 60) or 60,
+            },
+            "stripe-events-sweep": {
+                "task": "billing.process_pending",
+                "schedule": app.config.get("STRIPE_EVENT_SWEEP_INTERVAL", 60),
+            },
+            "email-outbox-drain": {
+                "task": "email.drain_outbox",
+                "schedule": app.config.get("SMTP_OUTBOX_SWEEP_INTERVAL", 60),
+            },
+            "stripe-reconcile": {
+                "task": "billing.reconcile_subscriptions",
+                "schedule": app.config.get("STRIPE_RECONCILE_INTERVAL", 6 * 3600),
+            },
+        },
     )
 
-    class FlaskTask(celery.Task):
+    queues.configure(celery, app.config)  # realtime / billing / email / bulk routing
+
+    class FlaskTask(payloads.PayloadTask):  # not celery.Task, or each create_app() would stack another app context
         def __call__(self, *args, **kwargs):  # type: ignore[override]
+            if self.request.is_eager and has_app_context():  # inline call: stay in the caller's app
+                return super().__call__(*args, **kwargs)
             with app.app_context():
-                return self.run(*args, **kwargs)
+                return super().__call__(*args, **kwargs)
 
     celery.Task = FlaskTask  # type: ignore[assignment]
 
@@ -96,6 +180,9 @@ def create_app(config_name: str | None = None) -> Flask:
     from .features import features as features_bp
     from .api import api as api_bp
     from .admin import admin as admin_ext
+    from . import usage  # noqa: F401  (registers the usage.* and apikeys.* Celery tasks)
+    from . import billing, reconcile  # noqa: F401  (register the billing.* Celery tasks)
+    from . import campaigns  # noqa: F401  (registers the email.*campaign* Celery tasks)
 
     app.register_blueprint(main_bp)
     app.register_blueprint(auth_bp, url_prefix="/auth")
@@ -105,6 +192,9 @@ def create_app(config_name: str | None = None) -> Flask:
 
     admin_ext.init_app(app)
 
+    if app.config.get("TEMPLATE_WARMUP"):
+        template_cache.warm(app)  # after the blueprints: their template folders count too
+
     # ---------------------------------------------------------------------
     # User loader
     # ---------------------------------------------------------------------
@@ -113,6 +203,7 @@ def create_app(config_name: str | None = None) -> Flask:
 
     @login_manager.user_loader
     def load_user(user_id: str) -> User | None:  # type: ignore[name-defined]
-        return User.query.get(int(user_id))  # type: ignore[attr-defined]
+        # Cached identity snapshot; on a miss one eager-loaded query (see app/identity.py)
+        return identity_cache.load(int(user_id))
 
     return app
@@ -5,7 +5,7 @@ from flask_admin.contrib.sqla import ModelView
 from flask_login import current_user
 from flask import redirect, url_for
 from . import db
-from .models import User, Organization, Membership
+from .models import ApiKey, User, Organization, Membership, UsageHourly
 
 class MyAdminIndexView(AdminIndexView):
     def is_accessible(self):
@@ -37,17 +37,34 @@ class UserAdminView(AdminView):
     can_create = False
 
 class OrganizationAdminView(AdminView):
-    column_list = ('id', 'name', 'is_subscribed', 'stripe_customer_id', 'created_at')
+    column_list = ('id', 'name', 'is_subscribed', 'stripe_customer_id', 'response_cache_enabled', 'created_at')
     column_searchable_list = ('name', 'stripe_customer_id')
-    column_filters = ('is_subscribed',)
+    column_filters = ('is_subscribed', 'response_cache_enabled')
 
 class MembershipAdminView(AdminView):
     column_list = ('user.email', 'organization.name', 'role')
     column_searchable_list = ('user.email', 'organization.name')
 
+class ApiKeyAdminView(AdminView):
+    # Keys are issued from the dashboard (the plaintext is shown once); admins can re-scope, expire or revoke
+    column_list = ('prefix', 'user.email', 'name', 'scopes', 'created_at', 'expires_at', 'revoked_at', 'last_used_at', 'request_count')
+    column_searchable_list = ('prefix', 'user.email', 'name')
+    form_columns = ('name', 'scopes', 'expires_at', 'revoked_at')
+    column_exclude_list = ('key_hash',)
+    can_create = False
+
+class UsageHourlyAdminView(AdminView):
+    # Read-only: rows are rebuilt from raw usage events by the usage.rollup task
+    column_list = ('organization_id', 'hour', 'requests', 'errors', 'prompt_tokens', 'completion_tokens', 'max_latency_ms')
+    column_filters = ('organization_id', 'hour')
+    column_default_sort = ('hour', True)
+    can_create = can_edit = can_delete = False
+
 admin = Admin(name='SaaS Admin', template_mode='bootstrap4', index_view=MyAdminIndexView())
 
 # Add the customized User model view to the admin interface
 admin.add_view(UserAdminView(User, db.session))
 admin.add_view(OrganizationAdminView(Organization, db.session))
-admin.add_view(MembershipAdminView(Membership, db.session))
\ No newline at end of file
+admin.add_view(MembershipAdminView(Membership, db.session))
+admin.add_view(ApiKeyAdminView(ApiKey, db.session, name='API Keys'))
+admin.add_view(UsageHourlyAdminView(UsageHourly, db.session, name='Usage'))
\ No newline at end of file
@@ -1,8 +1,12 @@
 # app/api.py
 
-from openai import OpenAI
-from flask import Blueprint, jsonify, request, g, current_app
+import json
+
+from flask import Blueprint, Response, jsonify, request, g, stream_with_context, url_for
+from . import batch_runner, entitlements, generation, jobs, usage_meter
+from .llm import Completion
 from .decorators import api_key_required
+from .ratelimit import rate_limited
 
 api = Blueprint('api', __name__)
 
@@ -16,25 +20,121 @@ def status():
     })
 
 @api.route('/generate', methods=['POST'])
-@api_key_required
+@api_key_required(scope='generate')
+@rate_limited()
 def generate():
     """A premium API endpoint for generating text."""
     org = g.current_user.current_organization
-    if not org or not org.is_subscribed:
+    if not org or not entitlements.get(org.id).active:
         return jsonify({'error': 'This endpoint requires an active subscription.'}), 403
 
     prompt = request.json.get('prompt')
     if not prompt:
         return jsonify({'error': 'Prompt is required.'}), 400
 
+    if request.json.get('stream'):
+        return _stream_completion(prompt, org, g.current_user.id)
+
+    if request.json.get('async'):
+        callback_url = request.json.get('callback_url')
+        if callback_url:
+            try:
+                jobs.check_callback_url(callback_url)
+            except jobs.UnsafeCallbackURL as e:
+                return jsonify({'error': str(e)}), 400
+        job_id = jobs.enqueue_generation(org.id, prompt, max_tokens=60, callback_url=callback_url)
+        return jsonify({
+            'job_id': job_id,
+            'status': 'queued',
+            'status_url': url_for('api.job_status', job_id=job_id, _external=True),
+        }), 202
+
     try:
-        client = OpenAI(api_key=current_app.config['OPENAI_API_KEY'])
-        response = client.completions.create(
-            model="gpt-3.5-turbo-instruct",
-            prompt=prompt,
-            max_tokens=60
-        )
-        generated_text = response.choices[0].text.strip()
-        return jsonify({'generated_text': generated_text})
+        with usage_meter.track(org.id, 'api.generate', user_id=g.current_user.id) as usage:
+            usage.completion = generation.complete(prompt, org=org, max_tokens=60)
+        return jsonify({'generated_text': usage.completion.text})
     except Exception as e:
         return jsonify({'error': f'An error occurred: {e}'}), 500
+
+def _batch_cost():
+    """One token per prompt; malformed batches cost one and are rejected below."""
+    prompts = (request.json or {}).get('prompts')
+    if isinstance(prompts, list) and 0 < len(prompts) <= batch_runner.max_items:
+        return len(prompts)
+    return 1
+
+@api.route('/generate/batch', methods=['POST'])
+@api_key_required(scope='generate')
+@rate_limited(cost=_batch_cost)
+def generate_batch():
+    """Generate text for many prompts in one call, fanned out concurrently."""
+    org = g.current_user.current_organization
+    if not org or not entitlements.get(org.id).active:
+        return jsonify({'error': 'This endpoint requires an active subscription.'}), 403
+
+    prompts = (request.json or {}).get('prompts')
+    if not isinstance(prompts, list) or not prompts:
+        return jsonify({'error': 'Prompts must be a non-empty list.'}), 400
+    if len(prompts) > batch_runner.max_items:
+        return jsonify({'error': f'At most {batch_runner.max_items} prompts per batch.'}), 400
+
+    user_id = g.current_user.id
+
+    def run(prompt):
+        if not isinstance(prompt, str) or not prompt.strip():
+            raise ValueError('Prompt is required.')
+        with usage_meter.track(org.id, 'api.generate.batch', user_id=user_id) as usage:
+            usage.completion = generation.complete(prompt, org=org, max_tokens=60)
+        return usage.completion.text
+
+    results = []
+    for index, result in enumerate(batch_runner.map(org.id, run, prompts)):
+        if result.ok:
+            results.append({'index': index, 'generated_text': result.value})
+        else:
+            results.append({'index': index, 'error': f'An error occurred: {result.error}'})
+    return jsonify({'results': results})
+
+@api.route('/jobs/<job_id>')
+@api_key_required
+def job_status(job_id):
+    """Status (and, once finished, the result) of an async generation job."""
+    org = g.current_user.current_organization
+    if not org or jobs.job_owner(job_id) != org.id:
+        return jsonify({'error': 'Job not found.'}), 404
+
+    result = jobs.run_generation.AsyncResult(job_id)
+    payload = {'job_id': job_id, 'status': result.state.lower()}
+    if result.successful():
+        payload.update(result.result)
+    elif result.failed():
+        payload['error'] = f'An error occurred: {result.result}'
+    return jsonify(payload)
+
+def _sse(payload, event=None):
+    """Format one Server-Sent-Events message."""
+    head = f'event: {event}\n' if event else ''
+    return f'{head}data: {json.dumps(payload)}\n\n'
+
+def _stream_completion(prompt, org, user_id):
+    """Relay completion tokens to the caller as they arrive (text/event-stream)."""
+    def events():
+        parts = []
+        try:
+            with usage_meter.track(org.id, 'api.generate.stream', user_id=user_id) as usage:
+                for delta in generation.stream(prompt, org=org, max_tokens=60):
+                    parts.append(delta)
+                    yield _sse({'text': delta})
+                # Streamed completions carry no usage block; one delta is one token.
+                usage.completion = Completion(text=''.join(parts), model=generation.default_model(),
+                                              completion_tokens=len(parts))
+        except Exception as e:
+            yield _sse({'error': f'An error occurred: {e}'}, event='error')
+            return
+        yield _sse({'generated_text': ''.join(parts).strip()}, event='done')
+
+    return Response(
+        stream_with_context(events()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
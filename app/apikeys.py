@@ -0,0 +1,181 @@
+"""Write‑behind ``last_used_at`` / ``request_count`` tracking for API keys.
+
+Authenticating a request must not cost an ``UPDATE api_keys …``.  Instead
+:meth:`KeyUsageTracker.touch` bumps counters in Redis (one pipelined
+``HINCRBY`` + ``HSET``) or, without Redis, in an in‑process buffer, and
+:meth:`KeyUsageTracker.flush` folds everything accumulated since the last
+flush into the table with one ``executemany`` UPDATE.
+
+The ``apikeys.flush_usage`` task (:mod:`app.usage`) runs the flush from
+celery beat every ``API_KEY_USAGE_FLUSH_INTERVAL`` seconds.  The in‑process
+buffer (no Redis) is flushed by the web worker itself, on a background
+thread, at the same interval.
+
+Usage:
+  api_key_usage.touch(principal.key_id)
+  api_key_usage.flush()  # -> number of keys updated
+"""
+from __future__ import annotations
+
+import logging
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Dict, Optional, Tuple
+
+import redis
+from sqlalchemy import bindparam, case, or_, update
+
+from .metrics import metrics
+
+__all__ = ["KeyUsageTracker"]
+
+logger = logging.getLogger(__name__)
+
+# key id -> (requests, last used as epoch seconds)
+Usage = Dict[int, Tuple[int, float]]
+
+
+def _merge(into: Usage, more: Usage) -> Usage:
+    for key_id, (count, last) in more.items():
+        prev_count, prev_last = into.get(key_id, (0, 0.0))
+        into[key_id] = (prev_count + count, max(prev_last, last))
+    return into
+
+
+class KeyUsageTracker:
+    """Accumulates per‑key usage in Redis (or locally) and writes it in bulk."""
+
+    key_prefix = "apikey:usage:"
+
+    def __init__(self, app=None) -> None:
+        self.flush_interval = 60.0
+        self._app = None
+        self._kv = None
+        self._local: Usage = {}
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app, kv=None) -> None:
+        self.flush_interval = app.config.get("API_KEY_USAGE_FLUSH_INTERVAL", self.flush_interval)
+        self._app = app
+        self._kv = kv
+        with self._lock:
+            self._local = {}
+        app.extensions["api_key_usage"] = self
+
+    @property
+    def redis(self):
+        return self._kv.client if self._kv is not None else None
+
+    # ------------------------------------------------------------------
+    # Hot path
+    # ------------------------------------------------------------------
+
+    def touch(self, key_id: int, when: Optional[float] = None) -> None:
+        """Count one request for *key_id*; never touches the database."""
+        when = when or time.time()
+        client = self.redis
+        if client is not None:
+            try:
+                pipe = client.pipeline(transaction=False)
+                pipe.hincrby(self.key_prefix + "count", key_id, 1)
+                pipe.hset(self.key_prefix + "last", key_id, when)
+                pipe.execute()
+                return
+            except redis.RedisError:
+                metrics.counter("apikey.usage.redis_errors").inc()
+        with self._lock:
+            _merge(self._local, {key_id: (1, when)})
+        if self.flush_interval > 0 and time.monotonic() - self._last_flush >= self.flush_interval:
+            self._last_flush = time.monotonic()
+            threading.Thread(target=self._flush_in_app, name="apikey-usage-flush", daemon=True).start()
+
+    def _flush_in_app(self) -> None:
+        try:
+            with self._app.app_context():
+                self.flush()
+        except Exception:  # keep the thread quiet; counts were requeued
+            logger.exception("API key usage flush failed")
+
+    # ------------------------------------------------------------------
+    # Flushing
+    # ------------------------------------------------------------------
+
+    def _drain_redis(self) -> Usage:
+        client = self.redis
+        if client is None:
+            return {}
+        suffix = uuid.uuid4().hex
+        drained: Usage = {}
+        try:
+            snapshot = {}
+            for field in ("count", "last"):
+                taken = f"{self.key_prefix}{field}:flushing:{suffix}"
+                try:
+                    client.rename(self.key_prefix + field, taken)  # atomic hand‑off from writers
+                except redis.ResponseError:  # nothing accumulated
+                    snapshot[field] = {}
+                    continue
+                snapshot[field] = client.hgetall(taken)
+                client.delete(taken)
+        except redis.RedisError:
+            metrics.counter("apikey.usage.redis_errors").inc()
+            return {}
+        lasts = {int(k): float(v) for k, v in snapshot["last"].items()}
+        for key, count in snapshot["count"].items():
+            drained[int(key)] = (int(count), lasts.get(int(key), time.time()))
+        return drained
+
+    def drain(self) -> Usage:
+        """Take everything accumulated so far (local buffer and Redis)."""
+        with self._lock:
+            local, self._local = self._local, {}
+        return _merge(local, self._drain_redis())
+
+    def flush(self) -> int:
+        """Write accumulated usage with one bulk UPDATE; returns keys updated."""
+        from . import db
+        from .models import ApiKey
+
+        with self._flush_lock:
+            usage = self.drain()
+            if not usage:
+                return 0
+            last = bindparam("b_last")
+            stmt = (
+                update(ApiKey)
+                .where(ApiKey.id == bindparam("b_id"))
+                .values(
+                    request_count=ApiKey.request_count + bindparam("b_count"),
+                    last_used_at=case(
+                        (or_(ApiKey.last_used_at.is_(None), ApiKey.last_used_at < last), last),
+                        else_=ApiKey.last_used_at,
+                    ),
+                )
+                .execution_options(synchronize_session=False)
+            )
+            rows = [
+                {"b_id": key_id, "b_count": count, "b_last": datetime.fromtimestamp(when, timezone.utc).replace(tzinfo=None)}
+                for key_id, (count, when) in usage.items()
+            ]
+            try:
+                with db.engine.begin() as conn:
+                    conn.execute(stmt, rows)
+            except Exception:
+                with self._lock:
+                    _merge(self._local, usage)  # retry on the next flush
+                metrics.counter("apikey.usage.flush_errors").inc()
+                raise
+        metrics.counter("apikey.usage.flushed").inc(len(rows))
+        return len(rows)
+
+    @property
+    def pending(self) -> int:
+        with self._lock:
+            return len(self._local)
+
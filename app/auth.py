@@ -1,14 +1,25 @@
 # app/auth.py
 
-from flask import Blueprint, render_template, redirect, request, url_for, flash
+from flask import Blueprint, current_app, render_template, redirect, request, url_for, flash
 from flask_login import login_user, logout_user, login_required, current_user
 
-from . import db
+from . import db, password_hasher
 from .models import User, Organization, Membership
 from .email import send_email
+from .payloads import ref
+from .passwords import HashPoolSaturated
 
 auth = Blueprint('auth', __name__)
 
+
+@auth.errorhandler(HashPoolSaturated)
+def hashing_busy(error):
+    """The password hashing pool is full: shed the request instead of queueing it."""
+    flash('We are handling a lot of sign-ins right now. Please try again in a moment.', 'error')
+    template = f"{request.endpoint.rpartition('.')[2]}.html"  # the form that was submitted
+    return render_template(template, **(request.view_args or {})), 503, {'Retry-After': '1'}
+
+
 @auth.route('/register', methods=['GET', 'POST'])
 def register():
     if request.method == 'POST':
@@ -41,7 +52,7 @@ def register():
         db.session.commit()
 
         token = new_user.generate_confirmation_token()
-        send_email.delay(new_user.email, 'Confirm Your Account', 'email/confirm', user=new_user, token=token)
+        send_email.delay(new_user.email, 'Confirm Your Account', 'email/confirm', user=ref(new_user), token=token)
 
         flash('A confirmation email has been sent to you by email.', 'info')
         return redirect(url_for('auth.login'))
@@ -60,6 +71,16 @@ def login():
             flash('Invalid email or password.', 'error')
             return redirect(url_for('auth.login'))
 
+        if password_hasher.needs_rehash(user.password_hash):
+            # Older algorithm or cost: upgrade while we have the plaintext.
+            try:
+                user.set_password(password)
+            except HashPoolSaturated as e:
+                # The password checked out; the upgrade can wait for the next login.
+                current_app.logger.warning('Skipped password hash upgrade for user %s: %s', user.id, e)
+            else:
+                db.session.commit()
+
         login_user(user)
 
         if not user.confirmed:
@@ -103,7 +124,8 @@ def unconfirmed():
 @login_required
 def resend_confirmation():
     token = current_user.generate_confirmation_token()
-    send_email.delay(current_user.email, 'Confirm Your Account', 'email/confirm', user=current_user, token=token)
+    send_email.delay(current_user.email, 'Confirm Your Account', 'email/confirm',
+                     user=ref(User, current_user.id), token=token)
     flash('A new confirmation email has been sent to you.', 'info')
     return redirect(url_for('auth.unconfirmed'))
 
@@ -115,7 +137,7 @@ def forgot_password():
         user = User.query.filter_by(email=email).first()
         if user:
             token = user.get_reset_token()
-            send_email.delay(user.email, 'Reset Your Password', 'email/reset_password', user=user, token=token)
+            send_email.delay(user.email, 'Reset Your Password', 'email/reset_password', user=ref(user), token=token)
         flash('A password reset link has been sent to your email address.', 'info')
         return redirect(url_for('auth.login'))
     return render_template('forgot_password.html')
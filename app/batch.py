@@ -0,0 +1,115 @@
+"""Bounded concurrent fan‑out for batch generation.
+
+All batch requests in a worker process share one thread pool, while each
+organization gets its own semaphore so a single tenant can never have more
+than ``BATCH_CONCURRENCY_PER_ORG`` upstream calls in flight — no matter how
+many batch requests it sends in parallel.
+
+Usage:
+  results = batch_runner.map(org.id, run_one, prompts)
+  [r.value if r.ok else r.error for r in results]  # same order as prompts
+"""
+from __future__ import annotations
+
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from flask import current_app
+
+__all__ = ["BatchResult", "BatchRunner"]
+
+
+@dataclass
+class BatchResult:
+    """Outcome of one batch item: either ``value`` or ``error`` is set."""
+
+    value: Any = None
+    error: Optional[BaseException] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+class BatchRunner:
+    """Process‑wide thread pool with per‑organization concurrency caps."""
+
+    def __init__(self, app=None) -> None:
+        self.per_org = 4
+        self.max_workers = 32
+        self.max_items = 100
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._executor_pid: Optional[int] = None
+        self._semaphores: Dict[Any, threading.BoundedSemaphore] = {}
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app) -> None:
+        self.per_org = app.config.get("BATCH_CONCURRENCY_PER_ORG", self.per_org)
+        self.max_workers = app.config.get("BATCH_WORKER_THREADS", self.max_workers)
+        self.max_items = app.config.get("BATCH_MAX_PROMPTS", self.max_items)
+        with self._lock:
+            self._semaphores.clear()
+        app.extensions["batch_runner"] = self
+
+    # ------------------------------------------------------------------
+    # Internals
+    # ------------------------------------------------------------------
+
+    def _pool(self) -> ThreadPoolExecutor:
+        pid = os.getpid()
+        with self._lock:
+            if self._executor is None or self._executor_pid != pid:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers, thread_name_prefix="batch"
+                )
+                self._executor_pid = pid
+            return self._executor
+
+    def _semaphore(self, key: Any) -> threading.BoundedSemaphore:
+        with self._lock:
+            sem = self._semaphores.get(key)
+            if sem is None:
+                sem = self._semaphores[key] = threading.BoundedSemaphore(self.per_org)
+            return sem
+
+    # ------------------------------------------------------------------
+    # Public API
+    # ------------------------------------------------------------------
+
+    def map(self, key: Any, fn: Callable[[Any], Any], items: Iterable[Any]) -> List[BatchResult]:
+        """Run ``fn`` over ``items`` with at most ``per_org`` in flight for ``key``.
+
+        Each call runs inside an app context. Exceptions are captured per item
+        and returned as :class:`BatchResult` errors, in input order.
+        """
+        app = current_app._get_current_object()
+        sem = self._semaphore(key)
+        pool = self._pool()
+
+        def run(item: Any) -> Any:
+            with app.app_context():
+                return fn(item)
+
+        futures: List[Future] = []
+        for item in items:
+            sem.acquire()  # back‑pressure: the request thread waits for a free slot
+            try:
+                future = pool.submit(run, item)
+            except BaseException:
+                sem.release()
+                raise
+            future.add_done_callback(lambda _f: sem.release())
+            futures.append(future)
+
+        results: List[BatchResult] = []
+        for future in futures:
+            try:
+                results.append(BatchResult(value=future.result()))
+            except Exception as exc:  # noqa: BLE001 (reported per item)
+                results.append(BatchResult(error=exc))
+        return results
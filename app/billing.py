@@ -0,0 +1,255 @@
+"""Stripe webhook ingestion and asynchronous event processing.
+
+The webhook endpoint only verifies the signature and calls
+:func:`ingest_event`, which stores the event in ``stripe_events`` with one
+``INSERT`` keyed by Stripe's event id (a redelivery hits the primary key and
+is acknowledged as a duplicate) and hands the event's *account* to the
+``billing.process_events`` task.  Stripe gets its 200 within a few
+milliseconds however busy the database is.
+
+The task applies every pending event of one account (≈ one organization)
+in ``created`` order, in a single transaction, via the :data:`HANDLERS`
+table.  ``Organization.stripe_event_at`` remembers the newest event applied,
+so a late retry of an older event cannot roll the subscription back.  A
+failing event stops its account's batch (later events stay pending, order is
+kept) and is retried up to ``STRIPE_EVENT_MAX_ATTEMPTS`` times.  The
+``billing.process_pending`` beat task sweeps up anything a lost task left
+behind and purges processed events past the retention window.
+"""
+from __future__ import annotations
+
+import json
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional
+
+from flask import current_app
+from sqlalchemy import delete, insert, select
+from sqlalchemy.exc import IntegrityError
+
+from . import celery, db
+from .metrics import metrics
+from .models import Organization, StripeEvent
+
+__all__ = ["HANDLERS", "account_for", "ingest_event", "period_end", "process_account", "process_events",
+           "process_pending"]
+
+# Subscription states that keep the organization's paid features on.  Stripe
+# is still retrying the card while ``past_due``.
+ACTIVE_STATUSES = frozenset({"active", "trialing", "past_due"})
+
+
+def account_for(event: Dict[str, Any]) -> Optional[str]:
+    """The key grouping *event* with the other events of the same organization."""
+    obj = event["data"]["object"]
+    if event["type"].startswith("customer.") and obj.get("object") == "customer":
+        return obj.get("id")
+    customer = obj.get("customer")
+    if isinstance(customer, dict):  # expanded
+        customer = customer.get("id")
+    if customer:
+        return customer
+    if obj.get("client_reference_id"):
+        return f"org:{obj['client_reference_id']}"
+    return None
+
+
+# ---------------------------------------------------------------------------
+# Ingestion (web worker)
+# ---------------------------------------------------------------------------
+
+def ingest_event(event: Dict[str, Any]) -> bool:
+    """Store a verified event and queue its processing; ``False`` for a duplicate delivery."""
+    account = account_for(event)
+    created = datetime.utcfromtimestamp(event["created"]) if event.get("created") else datetime.utcnow()
+    try:
+        with db.engine.begin() as conn:
+            conn.execute(insert(StripeEvent).values(
+                id=event["id"],
+                type=event["type"],
+                account=account,
+                created=created,
+                payload=json.dumps(event),
+                status=StripeEvent.PENDING if account else StripeEvent.IGNORED,
+                attempts=0,
+                received_at=datetime.utcnow(),
+            ))
+    except IntegrityError:
+        metrics.counter("billing.duplicates").inc()
+        return False
+    metrics.counter("billing.received").inc()
+    if account:
+        process_events.delay(account)
+    return True
+
+
+# ---------------------------------------------------------------------------
+# Handlers: one per event type, applied to the organization the event is about
+# ---------------------------------------------------------------------------
+
+def _org_for(account: str, objects: List[Dict[str, Any]]) -> Optional[Organization]:
+    """The organization behind *account*.
+
+    A Checkout session names it (``client_reference_id``) before the customer is
+    linked, and Stripe usually sends ``customer.subscription.created`` first –
+    so any reference in the batch wins over the customer lookup.
+    """
+    reference = next((obj["client_reference_id"] for obj in objects if obj.get("client_reference_id")), None)
+    if reference is None and account.startswith("org:"):
+        reference = account[4:]
+    if reference is not None:
+        return db.session.get(Organization, int(reference))
+    return db.session.scalars(select(Organization).filter_by(stripe_customer_id=account)).first()
+
+
+def period_end(subscription: Dict[str, Any]) -> Optional[datetime]:
+    """``current_period_end`` of a subscription (per item on newer API versions)."""
+    items = (subscription.get("items") or {}).get("data") or []
+    end = subscription.get("current_period_end") or (items[0].get("current_period_end") if items else None)
+    return datetime.utcfromtimestamp(end) if end else None
+
+
+def _checkout_completed(org: Organization, obj: Dict[str, Any]) -> None:
+    if obj.get("customer"):
+        org.stripe_customer_id = obj["customer"]
+    if obj.get("mode", "subscription") == "subscription":
+        org.subscription_id = obj.get("subscription")
+        org.is_subscribed = True
+        org.subscription_status = org.subscription_status if org.subscription_status in ACTIVE_STATUSES else "active"
+
+
+def _subscription_changed(org: Organization, obj: Dict[str, Any]) -> None:
+    org.subscription_id = obj.get("id")
+    org.is_subscribed = obj.get("status") in ACTIVE_STATUSES
+    org.subscription_status = obj.get("status")
+    org.current_period_end = period_end(obj)
+    items = (obj.get("items") or {}).get("data") or []
+    if items and items[0].get("price"):
+        org.stripe_price_id = items[0]["price"].get("id")
+
+
+def _subscription_deleted(org: Organization, obj: Dict[str, Any]) -> None:
+    if org.subscription_id in (None, obj.get("id")):
+        org.is_subscribed = False
+        org.subscription_id = None
+        org.subscription_status = "canceled"
+
+
+def _subscription_paused(org: Organization, obj: Dict[str, Any]) -> None:
+    org.is_subscribed = False
+    org.subscription_status = "paused"
+
+
+def _invoice_paid(org: Organization, obj: Dict[str, Any]) -> None:
+    if obj.get("subscription") and org.subscription_id in (None, obj["subscription"]):
+        org.subscription_id = obj["subscription"]
+        org.is_subscribed = True
+
+
+def _invoice_payment_failed(org: Organization, obj: Dict[str, Any]) -> None:
+    # Access follows the subscription's status (past_due / unpaid), sent as
+    # customer.subscription.updated; the failure itself is only logged.
+    current_app.logger.warning("Stripe invoice %s payment failed for organization %s", obj.get("id"), org.id)
+
+
+def _customer_deleted(org: Organization, obj: Dict[str, Any]) -> None:
+    org.stripe_customer_id = None
+    org.subscription_id = None
+    org.is_subscribed = False
+    org.subscription_status = None
+    org.current_period_end = None
+
+
+HANDLERS: Dict[str, Callable[[Organization, Dict[str, Any]], None]] = {
+    "checkout.session.completed": _checkout_completed,
+    "checkout.session.async_payment_succeeded": _checkout_completed,
+    "customer.subscription.created": _subscription_changed,
+    "customer.subscription.updated": _subscription_changed,
+    "customer.subscription.resumed": _subscription_changed,
+    "customer.subscription.paused": _subscription_paused,
+    "customer.subscription.deleted": _subscription_deleted,
+    "invoice.paid": _invoice_paid,
+    "invoice.payment_succeeded": _invoice_paid,
+    "invoice.payment_failed": _invoice_payment_failed,
+    "customer.deleted": _customer_deleted,
+}
+
+
+# ---------------------------------------------------------------------------
+# Processing (Celery worker)
+# ---------------------------------------------------------------------------
+
+def _apply(event: StripeEvent, obj: Dict[str, Any], org: Optional[Organization]) -> str:
+    handler = HANDLERS.get(event.type)
+    if handler is None or org is None:
+        return StripeEvent.IGNORED
+    if org.stripe_event_at is not None and event.created < org.stripe_event_at:
+        metrics.counter("billing.stale").inc()
+        return StripeEvent.IGNORED  # superseded by a newer event already applied
+    handler(org, obj)
+    org.stripe_event_at = event.created
+    return StripeEvent.PROCESSED
+
+
+def process_account(account: str) -> int:
+    """Apply the pending events of *account* in ``created`` order, in one transaction.
+
+    Returns the number of events settled (processed or ignored).
+    """
+    max_attempts = current_app.config.get("STRIPE_EVENT_MAX_ATTEMPTS", 5)
+    events: List[StripeEvent] = db.session.scalars(
+        select(StripeEvent)
+        .where(StripeEvent.account == account, StripeEvent.status == StripeEvent.PENDING)
+        .order_by(StripeEvent.created, StripeEvent.received_at)
+        .with_for_update(skip_locked=True)  # a concurrent task for the same account skips these rows
+    ).all()
+    if not events:
+        return 0
+    objects = [json.loads(event.payload)["data"]["object"] for event in events]
+    org = _org_for(account, objects)
+    settled = 0
+    failed: Optional[tuple] = None
+    now = datetime.utcnow()
+    for event, obj in zip(events, objects):
+        try:
+            with db.session.begin_nested():
+                event.status = _apply(event, obj, org)
+        except Exception as exc:  # noqa: BLE001 (recorded on the event and retried)
+            current_app.logger.exception("Stripe event %s failed", event.id)
+            failed = (event.id, repr(exc))
+            break
+        event.processed_at = now
+        settled += 1
+    if failed is not None:
+        # Stop at the failing event so later ones keep their order; record it after the rollback.
+        event = db.session.get(StripeEvent, failed[0])
+        event.attempts += 1
+        event.last_error = failed[1]
+        if event.attempts >= max_attempts:
+            event.status = StripeEvent.FAILED
+        metrics.counter("billing.errors").inc()
+    db.session.commit()
+    metrics.counter("billing.processed").inc(settled)
+    return settled
+
+
+@celery.task(name="billing.process_events")
+def process_events(account: str) -> int:
+    """Apply the pending Stripe events of one account (queued by the webhook)."""
+    return process_account(account)
+
+
+@celery.task(name="billing.process_pending")
+def process_pending() -> int:
+    """Periodic (celery beat) sweep of events whose task was lost or failed, plus retention."""
+    accounts = db.session.scalars(
+        select(StripeEvent.account).where(StripeEvent.status == StripeEvent.PENDING).distinct()
+    ).all()
+    settled = sum(process_account(account) for account in accounts)
+
+    retention = current_app.config.get("STRIPE_EVENT_RETENTION_DAYS", 30)
+    db.session.execute(delete(StripeEvent).where(
+        StripeEvent.status != StripeEvent.PENDING,
+        StripeEvent.received_at < datetime.utcnow() - timedelta(days=retention),
+    ))
+    db.session.commit()
+    return settled
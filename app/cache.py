@@ -0,0 +1,183 @@
+"""Two‑tier prompt/response cache for the generation endpoints.
+
+Tier 1 is an in‑process LRU with size and TTL eviction; tier 2 is the shared
+Redis instance (see :mod:`app.kvstore`), so a completion produced by one
+gunicorn worker is served from cache by every other worker and host.
+
+Keys are derived from the normalized ``(model, prompt, max_tokens, params)``
+tuple.  Organizations can opt out with ``Organization.response_cache_enabled``.
+
+Usage:
+  key = response_cache.make_key(model, prompt, max_tokens, params)
+  completion = response_cache.get(key) or produce()
+  response_cache.set(key, completion)
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Mapping, Optional
+
+import redis
+
+from .llm import Completion
+from .metrics import metrics
+
+__all__ = ["LRUCache", "ResponseCache", "normalize_prompt"]
+
+
+def normalize_prompt(prompt: str) -> str:
+    """Canonical form used for cache keys: NFC, ``\\n`` newlines, trimmed ends."""
+    prompt = unicodedata.normalize("NFC", prompt)
+    return prompt.replace("\r\n", "\n").replace("\r", "\n").strip()
+
+
+class LRUCache:
+    """Thread‑safe LRU mapping with per‑entry TTL.
+
+    Hit / miss / eviction / expiry counts are published to the metrics
+    registry under ``<name>.*``.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 300.0, name: str = "lru") -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.name = name
+        self._data: "OrderedDict[Hashable, tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Any:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[0] <= now:
+                del self._data[key]
+                metrics.counter(f"{self.name}.expired").inc()
+                entry = None
+            if entry is None:
+                metrics.counter(f"{self.name}.misses").inc()
+                return None
+            self._data.move_to_end(key)
+        metrics.counter(f"{self.name}.hits").inc()
+        return entry[1]
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        expires = time.monotonic() + (self.ttl if ttl is None else ttl)
+        evicted = 0
+        with self._lock:
+            self._data[key] = (expires, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                evicted += 1
+        if evicted:
+            metrics.counter(f"{self.name}.evictions").inc(evicted)
+
+    def delete(self, key: Hashable) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def items(self) -> list:
+        """Snapshot of live ``(key, value)`` pairs (no LRU reordering)."""
+        now = time.monotonic()
+        with self._lock:
+            return [(key, value) for key, (expires, value) in self._data.items() if expires > now]
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class ResponseCache:
+    """In‑process LRU in front of a shared Redis tier."""
+
+    key_prefix = "respcache:"
+
+    def __init__(self, app=None) -> None:
+        self.enabled = True
+        self.redis_ttl = 3600
+        self.local = LRUCache(name="cache.local")
+        self._kv = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app, kv=None) -> None:
+        self.enabled = app.config.get("RESPONSE_CACHE_ENABLED", True)
+        self.redis_ttl = app.config.get("RESPONSE_CACHE_REDIS_TTL", self.redis_ttl)
+        self.local = LRUCache(
+            maxsize=app.config.get("RESPONSE_CACHE_LOCAL_MAXSIZE", 1024),
+            ttl=app.config.get("RESPONSE_CACHE_LOCAL_TTL", 300),
+            name="cache.local",
+        )
+        self._kv = kv
+        app.extensions["response_cache"] = self
+
+    # ------------------------------------------------------------------
+    # Keys
+    # ------------------------------------------------------------------
+
+    @staticmethod
+    def make_key(model: str, prompt: str, max_tokens: int, params: Optional[Mapping[str, Any]] = None) -> str:
+        material = json.dumps(
+            [model, normalize_prompt(prompt), int(max_tokens), dict(params or {})],
+            sort_keys=True,
+            separators=(",", ":"),
+            ensure_ascii=False,
+        )
+        return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+    def enabled_for(self, org) -> bool:
+        return self.enabled and (org is None or getattr(org, "response_cache_enabled", True) is not False)
+
+    # ------------------------------------------------------------------
+    # Lookup / store
+    # ------------------------------------------------------------------
+
+    @property
+    def redis(self):
+        return self._kv.client if self._kv is not None else None
+
+    def get(self, key: str) -> Optional[Completion]:
+        data = self.local.get(key)
+        if data is not None:
+            return Completion.from_dict({**data, "meta": {"cache": "local"}})
+
+        client = self.redis
+        if client is None:
+            return None
+        try:
+            raw = client.get(self.key_prefix + key)
+        except redis.RedisError:
+            metrics.counter("cache.redis.errors").inc()
+            return None
+        if raw is None:
+            metrics.counter("cache.redis.misses").inc()
+            return None
+        metrics.counter("cache.redis.hits").inc()
+        data = json.loads(raw)
+        self.local.set(key, data)
+        return Completion.from_dict({**data, "meta": {"cache": "redis"}})
+
+    def set(self, key: str, completion: Completion) -> None:
+        data = {k: v for k, v in completion.to_dict().items() if k != "meta"}
+        self.local.set(key, data)
+        client = self.redis
+        if client is None:
+            return
+        try:
+            client.set(self.key_prefix + key, json.dumps(data), ex=self.redis_ttl)
+        except redis.RedisError:
+            metrics.counter("cache.redis.errors").inc()
+
+    def clear_local(self) -> None:
+        self.local.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return metrics.snapshot(prefix="cache.")["counters"]
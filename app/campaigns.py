@@ -0,0 +1,233 @@
+"""Bulk email campaigns to organization members, sent in chunked Celery tasks.
+
+One ``send_email.delay`` per recipient puts a broker message, with the whole
+template context, on the queue for every single address.  A campaign
+instead stores the subject, template and shared context once
+(:class:`~app.models.Campaign`) and fans out in two steps:
+
+* ``email.plan_campaign`` streams the recipient ids – confirmed users with a
+  membership in the organization, or in any organization – through a
+  server-side cursor (``yield_per``) in ``Campaign.chunk_size`` partitions.
+  Each partition becomes a :class:`~app.models.CampaignChunk` row (an id
+  range, not a list of addresses).  Rows are bulk-inserted and their tasks
+  enqueued every ``CAMPAIGN_PLAN_BATCH`` chunks, so the planner holds one
+  partition at a time however many recipients there are.
+* ``email.send_campaign_chunk(campaign_id, index)`` loads its users, renders
+  each message and sends the chunk over one pooled SMTP connection
+  (:meth:`app.mailer.SMTPPool.deliver`).  Sent and failed counts are added to
+  the chunk and to the campaign in one transaction.  Messages the pool
+  defers (SMTP server unreachable, a recipient refused with 4xx) are
+  recorded on the chunk by user id (``deferred_user_ids``) and the chunk is
+  retried with backoff.  A retry sends to exactly those users, and the chunk
+  is marked failed once the retries are used up.
+
+Progress is in the campaign row; :func:`campaign_progress` adds the failing
+chunks.
+
+Usage:
+  campaign = start_campaign("Our new models", "email/announcement", organization_id=org.id)
+  flask send-campaign "Our new models" email/announcement --all
+  flask campaign-status 42
+"""
+from __future__ import annotations
+
+import json
+import logging
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from flask import current_app
+from sqlalchemy import exists, insert, select, update
+
+from . import celery, db, smtp_pool
+from .email import render_message
+from .mailer import envelope
+from .metrics import metrics
+from .models import Campaign, CampaignChunk, Membership, User
+
+__all__ = ["DeliveryDeferred", "campaign_progress", "plan_campaign", "recipient_filter", "send_campaign_chunk",
+           "start_campaign"]
+
+logger = logging.getLogger(__name__)
+
+
+class DeliveryDeferred(RuntimeError):
+    """The SMTP server could not be reached for part of a chunk; the task is retried."""
+
+
+def recipient_filter(organization_id: Optional[int]) -> list:
+    """WHERE clauses selecting a campaign's recipients from ``users``."""
+    member = exists().where(Membership.user_id == User.id)
+    if organization_id is not None:
+        member = member.where(Membership.organization_id == organization_id)
+    return [User.confirmed.is_(True), member]
+
+
+def start_campaign(subject: str, template: str, *, organization_id: Optional[int] = None,
+                   context: Optional[Dict[str, Any]] = None, chunk_size: Optional[int] = None,
+                   created_by_id: Optional[int] = None) -> Campaign:
+    """Record a campaign and queue its planning; returns the new :class:`Campaign`."""
+    for extension in ("txt", "html"):
+        current_app.jinja_env.get_template(f"{template}.{extension}")  # fail now, not in every chunk
+    campaign = Campaign(
+        subject=subject,
+        template=template,
+        context=json.dumps(context) if context else None,
+        organization_id=organization_id,
+        created_by_id=created_by_id,
+        chunk_size=chunk_size or current_app.config.get("CAMPAIGN_CHUNK_SIZE", 500),
+    )
+    db.session.add(campaign)
+    db.session.commit()
+    plan_campaign.delay(campaign.id)
+    return campaign
+
+
+# ---------------------------------------------------------------------------
+# Celery tasks
+# ---------------------------------------------------------------------------
+
+@celery.task(name="email.plan_campaign")
+def plan_campaign(campaign_id: int) -> int:
+    """Split the recipients into chunks and queue one task per chunk; returns the chunk count."""
+    campaign = db.session.get(Campaign, campaign_id)
+    if campaign is None or campaign.status != Campaign.PLANNING:
+        return 0
+    chunk_size, plan_batch = campaign.chunk_size, current_app.config.get("CAMPAIGN_PLAN_BATCH", 100)
+    stmt = select(User.id).where(*recipient_filter(campaign.organization_id)).order_by(User.id)
+
+    chunks, recipients, pending = 0, 0, []
+    # A connection of its own: committing the chunk rows must not close the streaming cursor.
+    with db.engine.connect() as stream:
+        result = stream.execution_options(yield_per=chunk_size).execute(stmt)
+        for user_ids in result.scalars().partitions():
+            pending.append({"campaign_id": campaign_id, "index": chunks, "first_user_id": user_ids[0],
+                            "last_user_id": user_ids[-1], "recipients": len(user_ids)})
+            chunks += 1
+            recipients += len(user_ids)
+            if len(pending) >= plan_batch:
+                _enqueue(pending)
+                pending = []
+        _enqueue(pending)
+
+    db.session.execute(update(Campaign).where(Campaign.id == campaign_id)
+                       .values(recipients=recipients, chunks=chunks, status=Campaign.SENDING))
+    _finish_if_complete(campaign_id)
+    db.session.commit()
+    metrics.counter("campaign.chunks").inc(chunks)
+    return chunks
+
+
+def _enqueue(chunks: List[Dict[str, Any]]) -> None:
+    if not chunks:
+        return
+    db.session.execute(insert(CampaignChunk), chunks)
+    db.session.commit()
+    for chunk in chunks:
+        send_campaign_chunk.delay(chunk["campaign_id"], chunk["index"])
+
+
+@celery.task(name="email.send_campaign_chunk", bind=True, autoretry_for=(DeliveryDeferred,),
+             retry_backoff=True, retry_backoff_max=600, max_retries=5)
+def send_campaign_chunk(self, campaign_id: int, index: int) -> int:
+    """Render and send one chunk over a single SMTP connection; returns the messages sent."""
+    chunk = db.session.get(CampaignChunk, (campaign_id, index))
+    if chunk is None or chunk.status != CampaignChunk.PENDING:
+        return 0  # redelivered after it finished
+    campaign = db.session.get(Campaign, campaign_id)
+    context = json.loads(campaign.context or "{}")
+
+    if chunk.deferred_user_ids is not None:  # a retry: only the users whose messages were deferred
+        selected = User.id.in_(json.loads(chunk.deferred_user_ids))
+    else:
+        selected = User.id.between(chunk.first_user_id, chunk.last_user_id)
+    users = db.session.scalars(
+        select(User).where(*recipient_filter(campaign.organization_id), selected).order_by(User.id)
+    ).all()
+
+    envelopes, render_failed = [], 0
+    for user in users:
+        try:
+            msg = render_message(user.email, campaign.subject, campaign.template,
+                                 user=user, campaign=campaign, **context)
+        except Exception:
+            logger.exception("Campaign %s: rendering for user %s failed", campaign_id, user.id)
+            render_failed += 1
+            continue
+        envelopes.append({**envelope(msg), "user_id": user.id})  # deferred copies keep it
+
+    report = smtp_pool.deliver(envelopes)
+    failed = render_failed + len(report.rejected)
+    chunk.sent += report.sent
+    chunk.failed += failed
+    deferred = sorted({message["user_id"] for message in report.deferred})
+    chunk.deferred_user_ids = json.dumps(deferred) if deferred else None
+    if not deferred:
+        chunk.status = CampaignChunk.DONE
+    else:
+        chunk.attempts += 1
+        chunk.last_error = str(report.error)
+        if self.request.retries >= self.max_retries:  # give up on the deferred ones
+            failed += len(deferred)
+            chunk.failed += len(deferred)
+            chunk.status = CampaignChunk.FAILED
+    done = chunk.status != CampaignChunk.PENDING
+    if done:
+        chunk.finished_at = datetime.utcnow()
+
+    db.session.execute(update(Campaign).where(Campaign.id == campaign_id).values(
+        sent=Campaign.sent + report.sent, failed=Campaign.failed + failed,
+        chunks_done=Campaign.chunks_done + (1 if done else 0)))
+    if done:
+        _finish_if_complete(campaign_id)
+    db.session.commit()
+    metrics.counter("campaign.sent").inc(report.sent)
+    metrics.counter("campaign.failed").inc(failed)
+
+    if not done:
+        raise DeliveryDeferred(f"campaign {campaign_id} chunk {index}: {len(report.deferred)} messages deferred "
+                               f"({report.error})")
+    return report.sent
+
+
+def _finish_if_complete(campaign_id: int) -> None:
+    db.session.execute(
+        update(Campaign)
+        .where(Campaign.id == campaign_id, Campaign.status == Campaign.SENDING,
+               Campaign.chunks_done >= Campaign.chunks)
+        .values(status=Campaign.DONE, finished_at=datetime.utcnow())
+    )
+
+
+# ---------------------------------------------------------------------------
+# Progress
+# ---------------------------------------------------------------------------
+
+def campaign_progress(campaign_id: int, max_chunks: int = 20) -> Optional[Dict[str, Any]]:
+    """The campaign's counters plus up to *max_chunks* chunks that failed or had to retry."""
+    campaign = db.session.get(Campaign, campaign_id)
+    if campaign is None:
+        return None
+    db.session.refresh(campaign)
+    troubled = db.session.scalars(
+        select(CampaignChunk)
+        .where(CampaignChunk.campaign_id == campaign_id,
+               (CampaignChunk.status == CampaignChunk.FAILED) | (CampaignChunk.attempts > 0)
+               | (CampaignChunk.failed > 0))
+        .order_by(CampaignChunk.index).limit(max_chunks)
+    ).all()
+    return {
+        "id": campaign.id,
+        "status": campaign.status,
+        "recipients": campaign.recipients,
+        "sent": campaign.sent,
+        "failed": campaign.failed,
+        "chunks": campaign.chunks,
+        "chunks_done": campaign.chunks_done,
+        "finished_at": campaign.finished_at.isoformat() if campaign.finished_at else None,
+        "problem_chunks": [
+            {"index": c.index, "status": c.status, "sent": c.sent, "failed": c.failed, "attempts": c.attempts,
+             "last_error": c.last_error}
+            for c in troubled
+        ],
+    }
@@ -0,0 +1,197 @@
+"""Single‑flight coalescing of identical in‑flight generations.
+
+When many identical requests arrive together only one upstream call is made
+and every caller receives its result.
+
+* Within a worker process, concurrent callers with the same key wait on the
+  leader's in‑memory call.
+* Across gunicorn workers and hosts, the process leader takes a short Redis
+  lock (``SET NX PX``); other processes subscribe to a completion channel and
+  read the shared result when the lock holder publishes it.  If the leader
+  fails or disappears, followers fall back to calling upstream themselves.
+
+Usage:
+  completion = single_flight.do(cache_key, lambda: llm.complete(prompt))
+"""
+from __future__ import annotations
+
+import json
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, Optional
+
+import redis
+
+from .metrics import metrics
+
+__all__ = ["SingleFlight"]
+
+# Compare‑and‑delete so a leader never releases a lock that expired and was
+# re‑acquired by someone else.
+_RELEASE_LOCK = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+class _Call:
+    __slots__ = ("event", "result", "error")
+
+    def __init__(self) -> None:
+        self.event = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    """Collapse concurrent calls that share a key into one execution."""
+
+    prefix = "sf:"
+
+    def __init__(self, app=None, kv=None) -> None:
+        self.enabled = True
+        self.lock_ttl = 60.0
+        self.wait_timeout = 30.0
+        self.result_ttl = 10.0
+        self._kv = None
+        self._calls: Dict[str, _Call] = {}
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app, kv)
+
+    def init_app(self, app, kv=None) -> None:
+        self.enabled = app.config.get("COALESCE_ENABLED", True)
+        self.lock_ttl = app.config.get("COALESCE_LOCK_TTL", self.lock_ttl)
+        self.wait_timeout = app.config.get("COALESCE_WAIT_TIMEOUT", self.wait_timeout)
+        self.result_ttl = app.config.get("COALESCE_RESULT_TTL", self.result_ttl)
+        self._kv = kv
+        app.extensions["single_flight"] = self
+
+    @property
+    def redis(self):
+        return self._kv.client if self._kv is not None else None
+
+    # ------------------------------------------------------------------
+    # Public API
+    # ------------------------------------------------------------------
+
+    def do(
+        self,
+        key: str,
+        fn: Callable[[], Any],
+        dumps: Callable[[Any], str] = json.dumps,
+        loads: Callable[[str], Any] = json.loads,
+    ) -> Any:
+        """Run ``fn`` once per *key* across concurrent callers.
+
+        ``dumps`` / ``loads`` (de)serialize the result for the Redis channel.
+        """
+        if not self.enabled:
+            return fn()
+
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            metrics.counter("coalesce.collapsed.local").inc()
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = self._across_processes(key, fn, dumps, loads)
+            return call.result
+        except BaseException as exc:
+            call.error = exc
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.event.set()
+
+    # ------------------------------------------------------------------
+    # Cross‑process layer
+    # ------------------------------------------------------------------
+
+    def _across_processes(self, key, fn, dumps, loads) -> Any:
+        client = self.redis
+        if client is None:
+            metrics.counter("coalesce.leaders").inc()
+            return fn()
+
+        lock_key = f"{self.prefix}lock:{key}"
+        token = uuid.uuid4().hex
+        try:
+            acquired = client.set(lock_key, token, nx=True, px=int(self.lock_ttl * 1000))
+        except redis.RedisError:
+            metrics.counter("coalesce.redis.errors").inc()
+            metrics.counter("coalesce.leaders").inc()
+            return fn()
+
+        if acquired:
+            return self._lead(client, key, lock_key, token, fn, dumps)
+        return self._follow(client, key, lock_key, fn, loads)
+
+    def _lead(self, client, key, lock_key, token, fn, dumps) -> Any:
+        metrics.counter("coalesce.leaders").inc()
+        channel = f"{self.prefix}done:{key}"
+        try:
+            value = fn()
+        except BaseException:
+            self._safely(client.publish, channel, "error")
+            self._safely(client.eval, _RELEASE_LOCK, 1, lock_key, token)
+            raise
+
+        pipe = client.pipeline(transaction=False)
+        pipe.set(f"{self.prefix}result:{key}", dumps(value), px=int(self.result_ttl * 1000))
+        pipe.publish(channel, "ok")
+        pipe.eval(_RELEASE_LOCK, 1, lock_key, token)
+        self._safely(pipe.execute)
+        return value
+
+    def _follow(self, client, key, lock_key, fn, loads) -> Any:
+        result_key = f"{self.prefix}result:{key}"
+        raw = None
+        pubsub = client.pubsub(ignore_subscribe_messages=True)
+        try:
+            pubsub.subscribe(f"{self.prefix}done:{key}")
+            # The leader may have finished between our SET NX and SUBSCRIBE.
+            raw = client.get(result_key)
+            deadline = time.monotonic() + self.wait_timeout
+            while raw is None and time.monotonic() < deadline:
+                message = pubsub.get_message(timeout=min(0.5, max(0.0, deadline - time.monotonic())))
+                if message is not None:
+                    if message["data"] not in (b"ok", "ok"):
+                        break  # leader failed: do the work ourselves
+                    raw = client.get(result_key)
+                elif not client.exists(lock_key):
+                    raw = client.get(result_key)  # leader vanished without publishing
+                    break
+        except redis.RedisError:
+            metrics.counter("coalesce.redis.errors").inc()
+        finally:
+            self._safely(pubsub.close)
+
+        if raw is not None:
+            metrics.counter("coalesce.collapsed.remote").inc()
+            return loads(raw)
+        metrics.counter("coalesce.fallbacks").inc()
+        return fn()
+
+    @staticmethod
+    def _safely(fn, *args) -> Any:
+        try:
+            return fn(*args)
+        except redis.RedisError:
+            metrics.counter("coalesce.redis.errors").inc()
+            return None
+
+    def stats(self) -> Dict[str, int]:
+        return metrics.snapshot(prefix="coalesce.")["counters"]
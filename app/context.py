@@ -0,0 +1,70 @@
+"""Request‑scoped user / membership / organization context.
+
+An authenticated page used to cost three or four queries: ``load_user``
+fetched the user, ``current_organization`` lazy‑loaded ``memberships`` and
+then the organization, and ``role_required`` / ``subscription_required``
+walked the same relationships again.  :func:`load_user` now fetches the user
+with memberships and organizations eager‑loaded in one statement, and
+:func:`request_context` memoizes the resolved triple on :data:`flask.g` for
+every decorator and view of the request.
+
+Usage:
+  ctx = request_context()
+  if ctx.organization and ctx.organization.is_subscribed: ...
+  if ctx.role == 'owner': ...
+"""
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import Any, Optional
+
+from flask import g
+from flask_login import current_user
+from sqlalchemy import select
+from sqlalchemy.orm import joinedload
+
+__all__ = ["RequestContext", "load_user", "request_context"]
+
+
+@dataclass(frozen=True)
+class RequestContext:
+    """The authenticated user plus their current membership and organization."""
+
+    user: Optional[Any]
+    membership: Optional[Any]
+    organization: Optional[Any]
+
+    @property
+    def role(self) -> Optional[str]:
+        return self.membership.role if self.membership is not None else None
+
+
+def load_user(user_id: int):
+    """The user with ``memberships`` → ``organization`` eager‑loaded, in one query.
+
+    Called by Flask‑Login's user loader, which already memoizes the result on
+    ``g`` for the rest of the request.
+    """
+    from . import db
+    from .models import Membership, User
+
+    return db.session.scalars(
+        select(User)
+        .options(joinedload(User.memberships).joinedload(Membership.organization))
+        .where(User.id == user_id)
+    ).unique().first()
+
+
+def request_context() -> RequestContext:
+    """Resolve (once per request) the current user's membership and organization.
+
+    Mirrors ``User.current_organization``: the first membership wins.
+    """
+    user = current_user._get_current_object() if current_user.is_authenticated else None
+    ctx = g.get("_request_context")
+    if ctx is not None and ctx.user is user:
+        return ctx
+    membership = user.memberships[0] if user is not None and user.memberships else None
+    ctx = RequestContext(user, membership, membership.organization if membership is not None else None)
+    g._request_context = ctx
+    return ctx
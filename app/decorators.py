@@ -2,8 +2,8 @@
 
 from functools import wraps
 from flask import flash, redirect, url_for, request, g, jsonify
-from flask_login import current_user
-from .models import User
+from . import api_key_cache, api_key_usage, entitlements
+from .context import request_context
 
 def subscription_required(f):
     """
@@ -12,8 +12,8 @@ def subscription_required(f):
     """
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        org = current_user.current_organization
-        if not org or not org.is_subscribed:
+        org = request_context().organization
+        if not org or not entitlements.get(org.id).active:
             flash('This feature requires an active subscription.', 'warning')
             return redirect(url_for('main.dashboard'))
         return f(*args, **kwargs)
@@ -26,16 +26,13 @@ def role_required(role="owner"):
     def decorator(f):
         @wraps(f)
         def decorated_function(*args, **kwargs):
-            org = current_user.current_organization
-            if not org:
+            ctx = request_context()
+            if not ctx.organization:
                 flash("You are not part of any organization.", "error")
                 return redirect(url_for('main.dashboard'))
 
-            # Find the membership for the current organization
-            membership = next((m for m in current_user.memberships if m.organization_id == org.id), None)
-            
             # For simplicity, we'll check for a single role. This could be a list.
-            if not membership or membership.role != role:
+            if ctx.role != role:
                 flash(f"This action requires the '{role}' role.", "error")
                 return redirect(url_for('main.dashboard'))
             
@@ -43,23 +40,33 @@ def role_required(role="owner"):
         return decorated_function
     return decorator
 
-def api_key_required(f):
+def api_key_required(f=None, *, scope=None):
     """
     Ensures that a valid API key is provided in the Authorization header.
-    If valid, it sets `g.current_user` to the authenticated user.
+    If valid, it sets `g.current_user` to the authenticated principal, resolved
+    through the verified-key cache (see app/keycache.py) so repeat callers
+    cost no database queries. With `scope`, the key must also grant it
+    (403 otherwise). Usage is counted write-behind (see app/apikeys.py).
+
+    Use bare (`@api_key_required`) or with a scope (`@api_key_required(scope='generate')`).
     """
-    @wraps(f)
-    def decorated_function(*args, **kwargs):
-        auth_header = request.headers.get('Authorization')
-        if not auth_header or not auth_header.startswith('Bearer '):
-            return jsonify({'error': 'Authorization header is missing or invalid'}), 401
-        
-        api_key = auth_header.split(' ')[1]
-        user = User.query.filter_by(api_key=api_key).first()
-        
-        if not user:
-            return jsonify({'error': 'Invalid API key'}), 401
-        
-        g.current_user = user
-        return f(*args, **kwargs)
-    return decorated_function
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            auth_header = request.headers.get('Authorization')
+            if not auth_header or not auth_header.startswith('Bearer '):
+                return jsonify({'error': 'Authorization header is missing or invalid'}), 401
+
+            api_key = auth_header.split(' ')[1]
+            user = api_key_cache.resolve(api_key)
+
+            if not user:
+                return jsonify({'error': 'Invalid API key'}), 401
+            if not user.allows(scope):
+                return jsonify({'error': f"This API key lacks the '{scope}' scope."}), 403
+
+            api_key_usage.touch(user.key_id)
+            g.current_user = user
+            return f(*args, **kwargs)
+        return decorated_function
+    return decorator(f) if f is not None else decorator
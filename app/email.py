@@ -1,10 +1,14 @@
 """Utility module for sending emails via Celery + Flask‑Mail.
 
 Usage:
-  send_email.delay("user@example.com", "Confirm your account", "email/confirm", user=user, token=token)
+  send_email.delay("user@example.com", "Confirm your account", "email/confirm", user=ref(user), token=token)
 
 It renders both `<template>.txt` and `<template>.html` from your Flask templates
-folder, injecting any kwargs you pass.
+folder, injecting any kwargs you pass.  Objects travel as ids, ``ref(user)``
+from :mod:`app.payloads`, and are loaded again on the worker.  With
+``MAIL_DELIVERY_MODE = "pooled"`` the message goes through the worker's SMTP
+connection pool and Redis outbox (see :mod:`app.mailer`) instead of a fresh
+connection per email.
 """
 from __future__ import annotations
 
@@ -13,12 +17,28 @@ import typing as _t
 from flask import current_app, render_template
 from flask_mail import Message
 
-from . import mail, celery
+from . import mail, celery, smtp_pool
 
-__all__ = ["send_email"]
+__all__ = ["drain_outbox", "render_message", "send_email"]
+
+
+def render_message(to: str, subject: str, template: str, **kwargs: _t.Any) -> Message:
+    """Build the message for *to* from `<template>.txt` and `<template>.html`."""
+    # Pull sender from config (falls back to MAIL_USERNAME as best‑effort)
+    sender = (
+        current_app.config.get("MAIL_DEFAULT_SENDER")
+        or current_app.config.get("MAIL_USERNAME")
+    )
+
+    msg = Message(subject=subject, sender=sender, recipients=[to])
+
+    # Render plaintext and HTML bodies
+    msg.body = render_template(f"{template}.txt", **kwargs)
+    msg.html = render_template(f"{template}.html", **kwargs)
+    return msg
 
 # ---------------------------------------------------------------------------
-# Celery task
+# Celery tasks
 # ---------------------------------------------------------------------------
 
 @celery.task(name="email.send")
@@ -38,16 +58,15 @@ def send_email(to: str, subject: str, template: str, **kwargs: _t.Any) -> None:
         Keyword arguments forwarded to the template renderer.
     """
     with current_app.app_context():
-        # Pull sender from config (falls back to MAIL_USERNAME as best‑effort)
-        sender = (
-            current_app.config.get("MAIL_DEFAULT_SENDER")
-            or current_app.config.get("MAIL_USERNAME")
-        )
+        msg = render_message(to, subject, template, **kwargs)
 
-        msg = Message(subject=subject, sender=sender, recipients=[to])
+        if smtp_pool.mode == "pooled":
+            smtp_pool.submit(msg)
+        else:
+            mail.send(msg)
 
-        # Render plaintext and HTML bodies
-        msg.body = render_template(f"{template}.txt", **kwargs)
-        msg.html = render_template(f"{template}.html", **kwargs)
 
-        mail.send(msg)
+@celery.task(name="email.drain_outbox")
+def drain_outbox() -> int:
+    """Deliver the queued outbox in batches over pooled connections (see :mod:`app.mailer`)."""
+    return smtp_pool.drain()
@@ -0,0 +1,495 @@
+"""Local CPU inference engine behind the landing page and (optionally) the API.
+
+An *engine backend* turns a batch of prompts into texts in one vectorized
+forward pass::
+
+    class MyBackend:
+        name = "my-model"
+        def generate_batch(self, prompts, max_tokens, deadline=None) -> list[str]: ...
+
+Backends run in a dedicated process pool (``LOCAL_ENGINE_WORKERS``), so
+CPU‑bound inference never competes with the web worker for the GIL; the
+request thread only waits on a future, for at most the request's latency
+budget.  On timeout the queued work is cancelled, and work that already
+started is abandoned at its next deadline check.
+
+Single requests go through a :class:`MicroBatcher`: concurrent prompts that
+arrive within ``LOCAL_ENGINE_BATCH_WAIT_MS`` of each other (up to
+``LOCAL_ENGINE_BATCH_MAX_SIZE``) run as one batched forward pass and the
+results are split back to each caller.
+
+The :class:`LocalEngine` extension has the same ``complete`` / ``stream``
+signature as :class:`app.llm.LLMGateway`, so ``LLM_BACKEND = "local"`` serves
+``/api/v1/generate`` from it instead of OpenAI.
+
+Usage:
+  completion = engine.complete("A habit-tracking app for students", max_tokens=80)
+"""
+from __future__ import annotations
+
+import importlib
+import multiprocessing
+import os
+import re
+import threading
+import time
+from collections import deque
+from concurrent.futures import (
+    BrokenExecutor,
+    CancelledError,
+    Executor,
+    Future,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+)
+from concurrent.futures import TimeoutError as FutureTimeout
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional, Sequence
+
+import numpy as np
+
+from .llm import Completion
+from .metrics import metrics
+from .semantic_cache import HashingEmbedder
+
+__all__ = ["EngineError", "EngineOverloaded", "EngineTimeout", "LocalEngine", "MicroBatcher", "TemplateBackend"]
+
+
+class EngineError(RuntimeError):
+    """Base class for local engine failures."""
+
+
+class EngineTimeout(EngineError):
+    """The request's latency budget ran out before a result was produced."""
+
+
+class EngineOverloaded(EngineError):
+    """Too many requests are already queued for the engine."""
+
+
+def _check_deadline(deadline: Optional[float]) -> None:
+    if deadline is not None and time.time() >= deadline:
+        raise EngineTimeout("latency budget exhausted")
+
+
+# ---------------------------------------------------------------------------
+# Built‑in backend
+# ---------------------------------------------------------------------------
+
+_STOPWORDS = frozenset(
+    "a an and app application build create for from i in into is it me my of on or our platform "
+    "please project that the this to tool we with want would like make using about".split()
+)
+
+# (domain, description used for routing, plan steps).  "{topic}" is filled in.
+_DOMAINS = [
+    ("web", "website web app saas dashboard browser frontend backend users accounts login subscription", [
+        "Define the core user journey for {topic} and the smallest feature set that delivers it",
+        "Sketch the data model and API surface; choose the web stack and hosting",
+        "Build authentication, the main {topic} workflow and an admin view",
+        "Add billing, email notifications and basic analytics",
+        "Run a closed beta, fix the top usability issues, then launch publicly",
+    ]),
+    ("mobile", "mobile ios android phone app offline push notifications habit tracker students", [
+        "Interview target users of {topic} and list the three screens that matter most",
+        "Prototype the screens in a design tool and test the flow with five users",
+        "Implement the app shell, local storage and sync for {topic}",
+        "Add push notifications, onboarding and crash reporting",
+        "Ship to TestFlight / internal testing, iterate, then submit to the stores",
+    ]),
+    ("data", "data machine learning ai model prediction analytics dataset training forecast classifier", [
+        "Frame the {topic} problem as a measurable prediction target and success metric",
+        "Collect and clean a labelled dataset; set aside a held-out test split",
+        "Train a simple baseline, then iterate on features and model choice",
+        "Evaluate against the metric, check for bias and failure cases",
+        "Serve the model behind an API with monitoring and a retraining schedule",
+    ]),
+    ("commerce", "shop store ecommerce marketplace sell products payments checkout inventory orders", [
+        "Pick the first product range for {topic} and define pricing and margins",
+        "Set up the catalogue, checkout and payment provider",
+        "Arrange fulfilment, shipping rates and a returns policy",
+        "Launch marketing: landing page, email list and one paid channel",
+        "Track conversion and repeat purchases; expand the range that sells",
+    ]),
+    ("hardware", "hardware device iot sensor embedded robot arduino raspberry firmware prototype", [
+        "Write the requirements for {topic}: power, connectivity, size and cost targets",
+        "Build a breadboard prototype and validate the key sensor readings",
+        "Develop firmware and a companion app or dashboard",
+        "Design the enclosure and a small pilot production run",
+        "Field-test with early users, then plan certification and manufacturing",
+    ]),
+    ("content", "blog newsletter video youtube podcast course content marketing audience writing", [
+        "Define the audience for {topic} and the promise of each episode or issue",
+        "Plan the first ten pieces and a realistic publishing cadence",
+        "Produce and publish the first three pieces; set up analytics",
+        "Promote through communities, guests and cross-posting",
+        "Review what resonates each month and introduce a monetisation path",
+    ]),
+]
+
+
+class TemplateBackend:
+    """Small retrieval‑and‑template model in pure NumPy.
+
+    Prompts are embedded with the hashing embedder and routed to the closest
+    plan domain with one ``(batch × dim) @ (dim × domains)`` product; the plan
+    steps of that domain are then filled with the prompt's key phrase.
+    Deterministic, dependency‑free and fast enough for the landing page.
+    """
+
+    name = "template-v1"
+
+    def __init__(self, dim: int = 256) -> None:
+        self.embedder = HashingEmbedder(dim)
+        self.domains = [d for d, _, _ in _DOMAINS]
+        self.steps = [s for _, _, s in _DOMAINS]
+        self.weights = self.embedder.embed([desc for _, desc, _ in _DOMAINS]).T  # (dim, domains)
+
+    @staticmethod
+    def _topic(prompt: str) -> str:
+        words = [w for w in re.findall(r"[\w'-]+", prompt) if w.lower() not in _STOPWORDS]
+        return " ".join(words[:6]) or "your idea"
+
+    def forward(self, prompts: Sequence[str]) -> np.ndarray:
+        """Domain index per prompt – the batched part of inference."""
+        scores = self.embedder.embed(prompts) @ self.weights
+        return np.argmax(scores, axis=1)
+
+    def generate_batch(self, prompts: Sequence[str], max_tokens: int, deadline: Optional[float] = None) -> List[str]:
+        _check_deadline(deadline)
+        domains = self.forward(prompts)
+        _check_deadline(deadline)
+        texts = []
+        for prompt, domain in zip(prompts, domains):
+            topic = self._topic(prompt)
+            lines = [f"Project plan: {topic}"]
+            lines += [f"{i}. {step.format(topic=topic)}." for i, step in enumerate(self.steps[domain], 1)]
+            words = "\n".join(lines).split(" ")
+            texts.append(" ".join(words[:max_tokens]))
+        return texts
+
+
+def _load_backend(spec: str):
+    if spec == "template":
+        return TemplateBackend()
+    module, _, name = spec.partition(":")
+    return getattr(importlib.import_module(module), name)()
+
+
+# ---------------------------------------------------------------------------
+# Worker‑side entry points (module level so they pickle)
+# ---------------------------------------------------------------------------
+
+_backend = None
+_backend_spec: Optional[str] = None
+
+
+def _init_worker(spec: str) -> None:
+    global _backend, _backend_spec
+    _backend, _backend_spec = _load_backend(spec), spec
+
+
+def _run_batch(spec: str, prompts: List[str], max_tokens: int, deadline: Optional[float]) -> List[str]:
+    if _backend is None or _backend_spec != spec:
+        _init_worker(spec)
+    _check_deadline(deadline)  # skip work whose caller already gave up
+    return _backend.generate_batch(prompts, max_tokens, deadline)
+
+
+# ---------------------------------------------------------------------------
+# Micro‑batching scheduler
+# ---------------------------------------------------------------------------
+
+class _Pending:
+    __slots__ = ("prompt", "max_tokens", "deadline", "future", "enqueued")
+
+    def __init__(self, prompt: str, max_tokens: int, deadline: float) -> None:
+        self.prompt = prompt
+        self.max_tokens = max_tokens
+        self.deadline = deadline
+        self.future: Future = Future()
+        self.enqueued = time.monotonic()
+
+
+class MicroBatcher:
+    """Collect concurrent single prompts into batched backend calls.
+
+    A batch is dispatched when ``max_batch_size`` prompts are waiting or the
+    oldest has waited ``max_wait_ms``.  At most ``max_in_flight`` batches run at
+    once; while all slots are busy new prompts keep queueing, so batches grow
+    with load instead of queueing one‑prompt jobs.  Prompts are only batched
+    with others of the same ``max_tokens``.
+
+    ``dispatch(prompts, max_tokens, deadline)`` must return a future of the
+    texts in the same order.
+    """
+
+    def __init__(
+        self,
+        dispatch: Callable[[List[str], int, float], Future],
+        max_batch_size: int = 16,
+        max_wait_ms: float = 5.0,
+        max_in_flight: int = 2,
+    ) -> None:
+        self.dispatch = dispatch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue: Deque[_Pending] = deque()
+        self._cond = threading.Condition()
+        self._slots = threading.BoundedSemaphore(max_in_flight)
+        self._thread: Optional[threading.Thread] = None
+        self._thread_pid: Optional[int] = None
+        self._closed = False
+
+    def submit(self, prompt: str, max_tokens: int, deadline: float) -> Future:
+        """Queue one prompt; the returned future resolves to its text."""
+        item = _Pending(prompt, max_tokens, deadline)
+        with self._cond:
+            if self._closed:
+                raise EngineError("local engine is shutting down")
+            self._queue.append(item)
+            self._cond.notify()
+        self._ensure_thread()
+        return item.future
+
+    def close(self) -> None:
+        with self._cond:
+            self._closed = True
+            pending, self._queue = list(self._queue), deque()
+            self._cond.notify_all()
+        for item in pending:
+            item.future.cancel()
+
+    # ------------------------------------------------------------------
+    # Dispatcher thread
+    # ------------------------------------------------------------------
+
+    def _ensure_thread(self) -> None:
+        pid = os.getpid()
+        if self._thread_pid == pid and self._thread is not None and self._thread.is_alive():
+            return
+        with self._cond:
+            if self._thread_pid == pid and self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name="engine-batcher", daemon=True)
+            self._thread_pid = pid
+            self._thread.start()
+
+    def _next_batch(self) -> Optional[List[_Pending]]:
+        with self._cond:
+            while not self._queue and not self._closed:
+                self._cond.wait()
+            if self._closed:
+                return None
+            while len(self._queue) < self.max_batch_size and not self._closed:
+                remaining = self._queue[0].enqueued + self.max_wait - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+        self._slots.acquire()  # wait for a free pool slot; the queue keeps filling meanwhile
+        with self._cond:
+            if not self._queue:
+                self._slots.release()
+                return []
+            max_tokens = self._queue[0].max_tokens
+            batch, rest = [], deque()
+            while self._queue:
+                item = self._queue.popleft()
+                if item.max_tokens == max_tokens and len(batch) < self.max_batch_size:
+                    batch.append(item)
+                else:
+                    rest.append(item)
+            self._queue = rest
+            return batch
+
+    def _run(self) -> None:
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            if batch:
+                self._dispatch(batch)
+
+    def _dispatch(self, batch: List[_Pending]) -> None:
+        now = time.time()
+        live = []
+        for item in batch:
+            if not item.future.set_running_or_notify_cancel():
+                continue  # the caller gave up while queued
+            if item.deadline <= now:
+                item.future.set_exception(EngineTimeout("latency budget exhausted"))
+            else:
+                live.append(item)
+        if not live:
+            self._slots.release()
+            return
+
+        metrics.counter("engine.batches").inc()
+        metrics.counter("engine.batched_prompts").inc(len(live))
+        metrics.latency("engine.batch_wait").observe(time.monotonic() - live[0].enqueued)
+        try:
+            future = self.dispatch([i.prompt for i in live], live[0].max_tokens, max(i.deadline for i in live))
+        except BaseException as exc:
+            self._slots.release()
+            for item in live:
+                item.future.set_exception(exc)
+            return
+
+        def deliver(done: Future) -> None:
+            self._slots.release()
+            try:
+                texts = done.result()
+            except BaseException as exc:
+                for item in live:
+                    item.future.set_exception(exc)
+                return
+            for item, text in zip(live, texts):
+                item.future.set_result(text)
+
+        future.add_done_callback(deliver)
+
+
+# ---------------------------------------------------------------------------
+# Extension
+# ---------------------------------------------------------------------------
+
+class LocalEngine:
+    """Process pool running a local engine backend, with per‑request budgets."""
+
+    def __init__(self, app=None) -> None:
+        self.backend = "template"
+        self.mode = "process"
+        self.workers = 2
+        self.max_queue = 64
+        self.budget = 5.0
+        self.max_tokens = 120
+        self.batch_max_size = 16
+        self.batch_wait_ms = 5.0
+        self._batcher: Optional[MicroBatcher] = None
+        self._executor: Optional[Executor] = None
+        self._executor_pid: Optional[int] = None
+        self._pending = 0
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app) -> None:
+        self.backend = app.config.get("LOCAL_ENGINE_BACKEND", self.backend)
+        self.mode = app.config.get("LOCAL_ENGINE_MODE", self.mode)
+        self.workers = app.config.get("LOCAL_ENGINE_WORKERS", self.workers)
+        self.max_queue = app.config.get("LOCAL_ENGINE_MAX_QUEUE", self.max_queue)
+        self.budget = app.config.get("LOCAL_ENGINE_TIMEOUT", self.budget)
+        self.max_tokens = app.config.get("LOCAL_ENGINE_MAX_TOKENS", self.max_tokens)
+        self.batch_max_size = app.config.get("LOCAL_ENGINE_BATCH_MAX_SIZE", self.batch_max_size)
+        self.batch_wait_ms = app.config.get("LOCAL_ENGINE_BATCH_WAIT_MS", self.batch_wait_ms)
+        self.shutdown()
+        app.extensions["local_engine"] = self
+
+    @property
+    def default_model(self) -> str:
+        return f"local:{self.backend}"
+
+    # ------------------------------------------------------------------
+    # Pool
+    # ------------------------------------------------------------------
+
+    def _pool(self) -> Executor:
+        pid = os.getpid()
+        with self._lock:
+            if self._executor is None or self._executor_pid != pid:
+                if self.mode == "thread":
+                    self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="engine")
+                else:
+                    # spawn: never fork a (possibly multi‑threaded) web worker
+                    self._executor = ProcessPoolExecutor(
+                        max_workers=self.workers,
+                        mp_context=multiprocessing.get_context("spawn"),
+                        initializer=_init_worker,
+                        initargs=(self.backend,),
+                    )
+                self._executor_pid = pid
+            return self._executor
+
+    def _submit(self, prompts: List[str], max_tokens: int, deadline: float) -> Future:
+        return self._pool().submit(_run_batch, self.backend, prompts, max_tokens, deadline)
+
+    @property
+    def batcher(self) -> MicroBatcher:
+        with self._lock:
+            if self._batcher is None:
+                self._batcher = MicroBatcher(self._submit, self.batch_max_size, self.batch_wait_ms, self.workers)
+            return self._batcher
+
+    def shutdown(self) -> None:
+        with self._lock:
+            executor, self._executor = self._executor, None
+            batcher, self._batcher = self._batcher, None
+        if batcher is not None:
+            batcher.close()
+        if executor is not None and self._executor_pid == os.getpid():
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    # ------------------------------------------------------------------
+    # Inference
+    # ------------------------------------------------------------------
+
+    def generate_batch(self, prompts: Sequence[str], max_tokens: Optional[int] = None,
+                       budget: Optional[float] = None) -> List[str]:
+        """Run *prompts* as one batch in the pool; raises :class:`EngineTimeout`."""
+        budget = self.budget if budget is None else budget
+        return self._wait(lambda deadline: self._submit(list(prompts), max_tokens or self.max_tokens, deadline),
+                          budget)
+
+    def _wait(self, submit: Callable[[float], Future], budget: float) -> Any:
+        """Admit, submit and wait up to *budget* seconds for the result."""
+        with self._lock:
+            if self._pending >= self.max_queue:
+                metrics.counter("engine.rejected").inc()
+                raise EngineOverloaded("local engine queue is full")
+            self._pending += 1
+        try:
+            future = submit(time.time() + budget)
+            try:
+                return future.result(timeout=budget)
+            except (FutureTimeout, CancelledError):
+                future.cancel()  # frees the slot if it never started
+                metrics.counter("engine.timeouts").inc()
+                raise EngineTimeout(f"no result within {budget:.2f}s") from None
+        except BrokenExecutor as exc:
+            # A worker process died (e.g. OOM); start a fresh pool next time.
+            metrics.counter("engine.errors").inc()
+            self.shutdown()
+            raise EngineError("local engine worker crashed") from exc
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    def complete(self, prompt: str, *, model: Optional[str] = None, max_tokens: Optional[int] = None,
+                 budget: Optional[float] = None, **params: Any) -> Completion:
+        """Gateway‑compatible single completion (``params`` are ignored)."""
+        started = time.perf_counter()
+        budget = self.budget if budget is None else budget
+        max_tokens = max_tokens or self.max_tokens
+        if self.batch_max_size > 1:
+            text = self._wait(lambda deadline: self.batcher.submit(prompt, max_tokens, deadline), budget)
+        else:
+            (text,) = self.generate_batch([prompt], max_tokens, budget)
+        elapsed = time.perf_counter() - started
+        metrics.latency("engine.complete").observe(elapsed)
+        return Completion(
+            text=text,
+            model=self.default_model,
+            completion_tokens=len(text.split()),
+            latency_ms=round(elapsed * 1000, 3),
+        )
+
+    def stream(self, prompt: str, *, model: Optional[str] = None, max_tokens: Optional[int] = None,
+               **params: Any) -> Iterator[str]:
+        """Gateway‑compatible stream: the finished text, one word per delta."""
+        words = self.complete(prompt, max_tokens=max_tokens).text.split(" ")
+        for i, word in enumerate(words):
+            yield word if i == 0 else f" {word}"
+
+    def stats(self) -> Dict[str, Any]:
+        snapshot = metrics.snapshot(prefix="engine.")
+        snapshot["pending"] = self._pending
+        return snapshot
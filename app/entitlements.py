@@ -0,0 +1,227 @@
+"""Per-organization entitlement snapshots for premium checks.
+
+Premium checks (``subscription_required``, ``/api/v1/generate``) ask
+:meth:`EntitlementService.get` instead of reading ``Organization`` rows.  The
+answer is a compact :class:`Entitlement` (plan, subscription status, limits,
+period end) served from a process-local TTL cache, then Redis
+(``entitlement:<org_id>``), and only on a double miss from the database.
+
+Snapshots are pushed, not pulled.  ORM hooks rebuild the snapshot of every
+organization whose billing fields change, in the same flush (webhook
+processing, admin edits), and write it through to Redis after the commit.
+Bulk writers (``app.reconcile``) call :meth:`EntitlementService.refresh`.
+Database fills use ``SET NX``, so a fill that raced a publish can never
+overwrite the newer snapshot.
+
+Consistency: a cancellation is visible in the committing process at once,
+and in every other process within ``ENTITLEMENT_LOCAL_TTL`` seconds, the
+lifetime of their local copies.  If Redis is unreachable at publish time,
+the Redis copy is bounded by ``ENTITLEMENT_REDIS_TTL`` instead.
+
+Usage:
+  if not entitlements.get(org.id).active: abort(403)
+"""
+from __future__ import annotations
+
+import json
+import time
+from dataclasses import asdict, dataclass, field
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional
+
+import redis
+from sqlalchemy import event, inspect, select
+from sqlalchemy.orm import Session
+
+from .cache import LRUCache
+from .metrics import metrics
+
+__all__ = ["Entitlement", "EntitlementService"]
+
+# Organization columns an entitlement is derived from.
+_BILLING_FIELDS = ("is_subscribed", "stripe_price_id", "subscription_status", "current_period_end")
+
+
+@dataclass(frozen=True)
+class Entitlement:
+    """What an organization may use right now."""
+
+    org_id: int
+    active: bool = False
+    plan: Optional[str] = None  # Stripe price id
+    status: Optional[str] = None  # Stripe subscription status
+    period_end: Optional[float] = None  # epoch seconds
+    limits: Dict[str, Any] = field(default_factory=dict)  # the plan's RateLimit fields
+    as_of: float = 0.0
+
+    @classmethod
+    def from_org(cls, org) -> "Entitlement":
+        from . import rate_limiter
+
+        period_end = org.current_period_end
+        return cls(
+            org_id=org.id,
+            active=bool(org.is_subscribed),
+            plan=org.stripe_price_id,
+            status=org.subscription_status or ("active" if org.is_subscribed else None),
+            period_end=(period_end - datetime(1970, 1, 1)).total_seconds() if period_end else None,
+            limits=asdict(rate_limiter.plan_for(org)),
+            as_of=time.time(),
+        )
+
+    def to_json(self) -> str:
+        return json.dumps(asdict(self))
+
+    @classmethod
+    def from_json(cls, raw) -> "Entitlement":
+        return cls(**json.loads(raw))
+
+
+class EntitlementService:
+    """Local TTL cache over Redis over ``organizations``, fed by billing writes."""
+
+    key_prefix = "entitlement:"
+
+    def __init__(self, app=None, kv=None) -> None:
+        self.enabled = True
+        self.redis_ttl = 3600
+        self.local = LRUCache(name="entitlement.local")
+        self._kv = None
+        if app is not None:
+            self.init_app(app, kv)
+
+    def init_app(self, app, kv=None) -> None:
+        self.enabled = app.config.get("ENTITLEMENT_CACHE_ENABLED", True)
+        self.redis_ttl = app.config.get("ENTITLEMENT_REDIS_TTL", self.redis_ttl)
+        self.local = LRUCache(maxsize=app.config.get("ENTITLEMENT_LOCAL_MAXSIZE", 10_000),
+                              ttl=app.config.get("ENTITLEMENT_LOCAL_TTL", 5), name="entitlement.local")
+        self._kv = kv
+        app.extensions["entitlements"] = self
+
+    @property
+    def redis(self):
+        return self._kv.client if self._kv is not None else None
+
+    # ------------------------------------------------------------------
+    # Reads
+    # ------------------------------------------------------------------
+
+    def get(self, org_id: int) -> Entitlement:
+        if not self.enabled:
+            return self._load(org_id)
+        entitlement = self.local.get(org_id)
+        if entitlement is not None:
+            return entitlement
+
+        client = self.redis
+        if client is not None:
+            try:
+                raw = client.get(f"{self.key_prefix}{org_id}")
+            except redis.RedisError:
+                metrics.counter("entitlement.redis.errors").inc()
+                raw = None
+            if raw is not None:
+                metrics.counter("entitlement.redis.hits").inc()
+                entitlement = Entitlement.from_json(raw)
+                self.local.set(org_id, entitlement)
+                return entitlement
+
+        metrics.counter("entitlement.db_loads").inc()
+        entitlement = self._load(org_id)
+        self._store([entitlement], only_if_absent=True)
+        return entitlement
+
+    def _load(self, org_id: int) -> Entitlement:
+        from . import db
+        from .models import Organization
+
+        org = db.session.get(Organization, org_id)
+        return Entitlement.from_org(org) if org is not None else Entitlement(org_id=org_id, as_of=time.time())
+
+    # ------------------------------------------------------------------
+    # Writes
+    # ------------------------------------------------------------------
+
+    def _store(self, entitlements: List[Entitlement], only_if_absent: bool = False) -> None:
+        for entitlement in entitlements:
+            self.local.set(entitlement.org_id, entitlement)
+        client = self.redis
+        if client is None or not entitlements:
+            return
+        try:
+            pipe = client.pipeline(transaction=False)
+            for entitlement in entitlements:
+                pipe.set(f"{self.key_prefix}{entitlement.org_id}", entitlement.to_json(),
+                         ex=self.redis_ttl, nx=only_if_absent)
+            pipe.execute()
+        except redis.RedisError:
+            metrics.counter("entitlement.redis.errors").inc()
+
+    def publish(self, entitlements: List[Entitlement]) -> None:
+        """Write fresh snapshots through to Redis and this process."""
+        self._store(entitlements)
+        metrics.counter("entitlement.published").inc(len(entitlements))
+
+    def retract(self, org_ids: Iterable[int]) -> None:
+        org_ids = list(org_ids)
+        for org_id in org_ids:
+            self.local.delete(org_id)
+        client = self.redis
+        if client is None or not org_ids:
+            return
+        try:
+            client.delete(*(f"{self.key_prefix}{org_id}" for org_id in org_ids))
+        except redis.RedisError:
+            metrics.counter("entitlement.redis.errors").inc()
+
+    def refresh(self, org_ids: Iterable[int]) -> None:
+        """Rebuild and publish snapshots from the database (after writes that bypass the ORM)."""
+        from . import db
+        from .models import Organization
+
+        orgs = db.session.scalars(select(Organization).where(Organization.id.in_(list(org_ids)))).all()
+        self.publish([Entitlement.from_org(org) for org in orgs])
+
+    def clear_local(self) -> None:
+        self.local.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return metrics.snapshot(prefix="entitlement.")["counters"]
+
+
+# ---------------------------------------------------------------------------
+# ORM hooks: snapshot billing changes in the flush, publish after commit
+# ---------------------------------------------------------------------------
+
+@event.listens_for(Session, "after_flush")
+def _collect_entitlements(session: Session, flush_context) -> None:
+    from .models import Organization
+
+    pending = session.info.setdefault("entitlements", {})
+    for obj in session.new:
+        if isinstance(obj, Organization):
+            pending[obj.id] = Entitlement.from_org(obj)
+    for obj in session.dirty:
+        if isinstance(obj, Organization):
+            state = inspect(obj)
+            if any(state.attrs[name].history.has_changes() for name in _BILLING_FIELDS):
+                pending[obj.id] = Entitlement.from_org(obj)
+    for obj in session.deleted:
+        if isinstance(obj, Organization):
+            pending[obj.id] = None
+
+
+@event.listens_for(Session, "after_commit")
+def _publish_entitlements(session: Session) -> None:
+    pending = session.info.pop("entitlements", None)
+    if not pending:
+        return
+    from . import entitlements
+
+    entitlements.publish([e for e in pending.values() if e is not None])
+    entitlements.retract(org_id for org_id, e in pending.items() if e is None)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_entitlements(session: Session) -> None:
+    session.info.pop("entitlements", None)
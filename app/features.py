@@ -1,8 +1,9 @@
 # app/features.py
 
-from openai import OpenAI
-from flask import Blueprint, render_template, current_app, flash, request
-from flask_login import login_required
+from flask import Blueprint, render_template, flash, request
+from flask_login import current_user, login_required
+from . import generation, usage_meter
+from .context import request_context
 from .decorators import subscription_required
 
 features = Blueprint('features', __name__)
@@ -19,13 +20,10 @@ def generate_text():
     if request.method == 'POST':
         prompt = request.form.get('prompt', 'A short poem about a robot learning to code:')
         try:
-            client = OpenAI(api_key=current_app.config['OPENAI_API_KEY'])
-            response = client.completions.create(
-                model="gpt-3.5-turbo-instruct",
-                prompt=prompt,
-                max_tokens=60
-            )
-            generated_text = response.choices[0].text.strip()
+            org = request_context().organization
+            with usage_meter.track(org.id if org else None, 'features.generate_text', user_id=current_user.id) as usage:
+                usage.completion = generation.complete(prompt, org=org, max_tokens=60)
+            generated_text = usage.completion.text
         except Exception as e:
             flash(f"An error occurred while contacting the AI service: {e}", "error")
 
@@ -0,0 +1,134 @@
+"""Text‑generation pipeline shared by the API and the feature pages.
+
+Endpoints call :func:`complete` / :func:`stream` instead of the gateway
+directly, so cross‑cutting layers apply uniformly:
+
+  response cache  →  semantic cache  →  single‑flight coalescing  →  LLM gateway
+
+The gateway is OpenAI (:mod:`app.llm`) unless ``LLM_BACKEND = "local"``, in
+which case the local inference engine (:mod:`app.engine`) serves the request,
+or ``"router"``, which spreads requests over several backends (:mod:`app.router`).
+
+Usage:
+  completion = generation.complete(prompt, org=org, max_tokens=60)
+"""
+from __future__ import annotations
+
+import json
+from typing import Any, Iterator, Optional
+
+from flask import current_app
+
+from . import engine, llm, response_cache, router, semantic_cache, single_flight
+from .llm import Completion
+from .models import Organization
+
+__all__ = ["complete", "default_model", "stream"]
+
+
+def _gateway():
+    """The upstream that actually produces completions."""
+    backend = current_app.config.get("LLM_BACKEND", "openai")
+    if backend == "local":
+        return engine
+    return router if backend == "router" else llm
+
+
+def default_model() -> str:
+    """Model name recorded for completions that don't specify one."""
+    return _gateway().default_model
+
+
+def _cache_key(prompt: str, model: str, max_tokens: int, params: dict) -> str:
+    return response_cache.make_key(model, prompt, max_tokens, params)
+
+
+def _shares_results(org: Optional[Organization]) -> bool:
+    """False for organizations that opted out of shared caching."""
+    return org is None or getattr(org, "response_cache_enabled", True) is not False
+
+
+def complete(
+    prompt: str,
+    *,
+    org: Optional[Organization] = None,
+    model: Optional[str] = None,
+    max_tokens: int = 60,
+    **params: Any,
+) -> Completion:
+    """Return a completion, serving repeats from the response cache.
+
+    Concurrent identical requests share one upstream call.  Organizations that
+    opted out of the cache also skip coalescing, so their prompts and results
+    never touch shared storage.
+    """
+    gateway = _gateway()
+    if not _shares_results(org):
+        return gateway.complete(prompt, model=model, max_tokens=max_tokens, **params)
+
+    model = model or gateway.default_model
+    key = _cache_key(prompt, model, max_tokens, params)
+    use_cache = response_cache.enabled
+    cached = response_cache.get(key) if use_cache else None
+    if cached is not None:
+        return cached
+
+    semantic = dict(org=org, model=model, max_tokens=max_tokens, params=params)
+    if semantic_cache.enabled:
+        similar = semantic_cache.lookup(prompt, **semantic)
+        if similar is not None:
+            return similar
+
+    def produce() -> Completion:
+        completion = gateway.complete(prompt, model=model, max_tokens=max_tokens, **params)
+        if use_cache:
+            response_cache.set(key, completion)
+        if semantic_cache.enabled:
+            semantic_cache.store(prompt, completion, **semantic)
+        return completion
+
+    return single_flight.do(
+        key,
+        produce,
+        dumps=lambda c: json.dumps(c.to_dict()),
+        loads=lambda raw: Completion.from_dict(json.loads(raw)),
+    )
+
+
+def stream(
+    prompt: str,
+    *,
+    org: Optional[Organization] = None,
+    model: Optional[str] = None,
+    max_tokens: int = 60,
+    **params: Any,
+) -> Iterator[str]:
+    """Yield text deltas; a cache hit is replayed as a single delta."""
+    gateway = _gateway()
+    model = model or gateway.default_model
+    use_cache = response_cache.enabled_for(org)
+    key = _cache_key(prompt, model, max_tokens, params) if use_cache else None
+    if key is not None:
+        cached = response_cache.get(key)
+        if cached is not None:
+            yield cached.text
+            return
+
+    semantic = dict(org=org, model=model, max_tokens=max_tokens, params=params)
+    use_semantic = semantic_cache.enabled_for(org)
+    if use_semantic:
+        similar = semantic_cache.lookup(prompt, **semantic)
+        if similar is not None:
+            yield similar.text
+            return
+
+    parts = []
+    for delta in gateway.stream(prompt, model=model, max_tokens=max_tokens, **params):
+        parts.append(delta)
+        yield delta
+
+    completion = Completion(text="".join(parts).strip(), model=model)
+    if key is not None:
+        response_cache.set(key, completion)
+    if use_semantic:
+        semantic_cache.store(prompt, completion, **semantic)
@@ -0,0 +1,309 @@
+"""Cached session identities for Flask‑Login's ``user_loader``.
+
+Every request carrying a session cookie used to load the user (with
+memberships and organizations, see :mod:`app.context`) from the database.
+:class:`IdentityCache` keeps a compact snapshot of that graph instead –
+user flags, memberships and the organization fields pages and decorators
+read – and hands Flask‑Login a :class:`SessionUser` built from it:
+
+* with Redis, the snapshot lives at ``session:user:<id>`` and is fetched
+  together with the user's version stamp in one ``MGET``;
+* without Redis, it lives in an in‑process TTL cache.
+
+``User.session_version`` is the stamp.  It is bumped in the same flush as a
+password, e‑mail, admin or confirmation change, a membership or role
+change, or a change to one of the user's organizations, and published after
+commit (``session:ver:<id>`` plus local eviction).  A snapshot whose version
+is older than the published stamp is rejected and reloaded.
+
+Consistency: with Redis, a demoted admin or a cancelled subscription takes
+effect on the very next request in every process.  Without Redis (or while
+it is unreachable) only the committing process evicts its copy; every other
+process sees the change within ``IDENTITY_CACHE_LOCAL_TTL`` seconds, the
+lifetime of its local snapshots.  If Redis is unreachable at publish time,
+the Redis copy is bounded by ``IDENTITY_CACHE_REDIS_TTL`` instead.
+
+Bulk ``UPDATE`` statements bypass the ORM hooks and must call
+:func:`bump_members` / :meth:`IdentityCache.invalidate` themselves.
+
+Usage:
+  @login_manager.user_loader
+  def load_user(user_id):
+      return identity_cache.load(int(user_id))
+"""
+from __future__ import annotations
+
+import json
+from typing import Any, Dict, List, Optional, Tuple
+
+import redis
+from flask_login import UserMixin
+from sqlalchemy import event, select, update
+from sqlalchemy.orm import Session
+
+from .cache import LRUCache
+from .keycache import CachedOrganization
+from .metrics import metrics
+
+__all__ = ["IdentityCache", "SessionUser", "bump_members"]
+
+_USER_FIELDS = ("email", "is_admin", "confirmed", "session_version")
+_ORG_FIELDS = ("name", "is_subscribed", "stripe_customer_id", "stripe_price_id", "response_cache_enabled")
+_VERSIONED_USER_FIELDS = ("password_hash", "email", "is_admin", "confirmed")
+
+
+class _CachedMembership:
+    __slots__ = ("organization_id", "role", "organization")
+
+    def __init__(self, data: Dict[str, Any]) -> None:
+        self.organization_id = data["org_id"]
+        self.role = data["role"]
+        self.organization = CachedOrganization(data, fields=_ORG_FIELDS)
+
+
+class SessionUser(UserMixin):
+    """The logged‑in user as seen by views, built from a cached snapshot.
+
+    Exposes the snapshot's fields, ``memberships`` and
+    ``current_organization``; anything else (methods such as ``confirm``,
+    ``api_keys``, …) loads the real ``User`` once and delegates to it.
+    """
+
+    def __init__(self, data: Dict[str, Any]) -> None:
+        self.id = data["id"]
+        for field in _USER_FIELDS:
+            setattr(self, field, data[field])
+        self.memberships = [_CachedMembership(m) for m in data["memberships"]]
+        self._row = None
+
+    @property
+    def current_organization(self):
+        return self.memberships[0].organization if self.memberships else None
+
+    def __getattr__(self, name: str) -> Any:
+        if name.startswith("_"):
+            raise AttributeError(name)
+        if self._row is None:
+            from . import db
+            from .models import User
+
+            metrics.counter("identity.fallback_loads").inc()
+            self._row = db.session.get(User, self.id)
+        return getattr(self._row, name)
+
+    def __repr__(self) -> str:
+        return f"<SessionUser {self.email}>"
+
+
+def _snapshot(user) -> Dict[str, Any]:
+    return {
+        "id": user.id,
+        **{field: getattr(user, field) for field in _USER_FIELDS},
+        "memberships": [
+            {"org_id": m.organization_id, "role": m.role,
+             **{field: getattr(m.organization, field) for field in _ORG_FIELDS}}
+            for m in user.memberships
+        ],
+    }
+
+
+class IdentityCache:
+    """Snapshot cache behind Flask‑Login's user loader."""
+
+    snapshot_prefix = "session:user:"
+    version_prefix = "session:ver:"
+
+    def __init__(self, app=None) -> None:
+        self.enabled = True
+        self.redis_ttl = 300
+        self.version_ttl = 7 * 24 * 3600  # must outlive any snapshot
+        self.local = LRUCache(name="identity.local")
+        self._versions = LRUCache(name="identity.versions")
+        self._kv = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app, kv=None) -> None:
+        self.enabled = app.config.get("IDENTITY_CACHE_ENABLED", True)
+        self.redis_ttl = app.config.get("IDENTITY_CACHE_REDIS_TTL", self.redis_ttl)
+        ttl = app.config.get("IDENTITY_CACHE_LOCAL_TTL", 60)
+        maxsize = app.config.get("IDENTITY_CACHE_LOCAL_MAXSIZE", 10_000)
+        self.local = LRUCache(maxsize=maxsize, ttl=ttl, name="identity.local")
+        self._versions = LRUCache(maxsize=maxsize, ttl=ttl, name="identity.versions")
+        self._kv = kv
+        app.extensions["identity_cache"] = self
+
+    @property
+    def redis(self):
+        return self._kv.client if self._kv is not None else None
+
+    # ------------------------------------------------------------------
+    # Loading
+    # ------------------------------------------------------------------
+
+    def load(self, user_id: int):
+        """The session user for *user_id*, or ``None`` if it no longer exists."""
+        from .context import load_user
+
+        if not self.enabled:
+            return load_user(user_id)
+
+        data = self._cached(user_id)
+        if data is not None:
+            metrics.counter("identity.hits").inc()
+            return SessionUser(data)
+
+        metrics.counter("identity.db_loads").inc()
+        user = load_user(user_id)
+        if user is None:
+            return None
+        self._store(_snapshot(user))
+        return user  # this request already has the real row
+
+    def _cached(self, user_id: int) -> Optional[Dict[str, Any]]:
+        client = self.redis
+        if client is None:
+            return self.local.get(user_id)
+        try:
+            raw, version = client.mget(f"{self.snapshot_prefix}{user_id}", f"{self.version_prefix}{user_id}")
+        except redis.RedisError:
+            metrics.counter("identity.redis.errors").inc()
+            return self.local.get(user_id)
+        if raw is None:
+            return None
+        data = json.loads(raw)
+        if version is not None and int(version) > data["session_version"]:
+            metrics.counter("identity.stale").inc()
+            return None
+        return data
+
+    def _store(self, data: Dict[str, Any]) -> None:
+        known = self._versions.get(data["id"])
+        if known is not None and known > data["session_version"]:
+            return  # loaded before a bump this process has already published
+        client = self.redis
+        if client is None:
+            self.local.set(data["id"], data)
+            return
+        try:
+            client.set(f"{self.snapshot_prefix}{data['id']}", json.dumps(data), ex=self.redis_ttl)
+        except redis.RedisError:
+            metrics.counter("identity.redis.errors").inc()
+            self.local.set(data["id"], data)
+
+    # ------------------------------------------------------------------
+    # Invalidation
+    # ------------------------------------------------------------------
+
+    def invalidate(self, versions: List[Tuple[int, int]]) -> None:
+        """Publish ``(user_id, session_version)`` stamps and drop older snapshots."""
+        if not versions:
+            return
+        for user_id, version in versions:
+            self.local.delete(user_id)
+            self._versions.set(user_id, version)
+        metrics.counter("identity.invalidations").inc(len(versions))
+        client = self.redis
+        if client is None:
+            return
+        try:
+            pipe = client.pipeline(transaction=False)
+            for user_id, version in versions:
+                pipe.set(f"{self.version_prefix}{user_id}", version, ex=self.version_ttl)
+                pipe.delete(f"{self.snapshot_prefix}{user_id}")
+            pipe.execute()
+        except redis.RedisError:
+            metrics.counter("identity.redis.errors").inc()
+
+    def clear_local(self) -> None:
+        self.local.clear()
+        self._versions.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return metrics.snapshot(prefix="identity.")["counters"]
+
+
+# ---------------------------------------------------------------------------
+# ORM hooks: bump session_version in the flush, publish after commit
+# ---------------------------------------------------------------------------
+
+def bump_members(conn, org_ids: List[int]) -> Dict[int, int]:
+    """Bump ``session_version`` of every member of *org_ids* on *conn*; returns ``{user_id: version}``.
+
+    For writes that bypass the ORM (bulk ``UPDATE organizations``): publish
+    the result with :meth:`IdentityCache.invalidate` after the commit.
+    """
+    from .models import Membership, User
+
+    members = select(Membership.user_id).where(Membership.organization_id.in_(org_ids))
+    conn.execute(update(User).where(User.id.in_(members))
+                 .values(session_version=User.session_version + 1)
+                 .execution_options(synchronize_session=False))
+    return dict(conn.execute(select(User.id, User.session_version).where(User.id.in_(members))).all())
+
+
+def _bump(user, bumped: set) -> None:
+    if user is not None and user.id not in bumped:
+        user.session_version = (user.session_version or 1) + 1
+        bumped.add(user.id)
+
+
+@event.listens_for(Session, "before_flush")
+def _bump_session_versions(session: Session, flush_context, instances) -> None:
+    from sqlalchemy import inspect
+
+    from .models import Membership, User
+
+    bumped = session.info.setdefault("identity_bumped", set())
+    for obj in list(session.dirty):
+        if isinstance(obj, User) and obj.id is not None:
+            state = inspect(obj)
+            if any(state.attrs[f].history.has_changes() for f in _VERSIONED_USER_FIELDS):
+                _bump(obj, bumped)
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, Membership) and obj.user_id is not None:
+            if obj in session.dirty and not inspect(obj).attrs.role.history.has_changes():
+                continue
+            user = session.get(User, obj.user_id)
+            if user is not None and user not in session.deleted:
+                _bump(user, bumped)
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_versions(session: Session, flush_context) -> None:
+    from sqlalchemy import inspect
+
+    from .models import Organization, User
+
+    pending: Dict[int, int] = session.info.setdefault("identity_versions", {})
+    for obj in session.dirty:
+        if isinstance(obj, User) and obj.id in session.info.get("identity_bumped", ()):
+            pending[obj.id] = obj.session_version
+    for obj in session.deleted:
+        if isinstance(obj, User):
+            pending[obj.id] = (obj.session_version or 1) + 1  # reject snapshots still in flight
+
+    # Organization changes reach every member: bump them in this transaction.
+    changed_orgs = [
+        obj.id for obj in list(session.dirty) + list(session.deleted)
+        if isinstance(obj, Organization)
+        and (obj in session.deleted or any(inspect(obj).attrs[f].history.has_changes() for f in _ORG_FIELDS))
+    ]
+    if changed_orgs:
+        pending.update(bump_members(session.connection(), changed_orgs))
+    session.info.pop("identity_bumped", None)
+
+
+@event.listens_for(Session, "after_commit")
+def _publish_versions(session: Session) -> None:
+    pending = session.info.pop("identity_versions", None)
+    if pending:
+        from . import identity_cache
+
+        identity_cache.invalidate(sorted(pending.items()))
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_versions(session: Session) -> None:
+    session.info.pop("identity_versions", None)
+    session.info.pop("identity_bumped", None)
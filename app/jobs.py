@@ -0,0 +1,146 @@
+"""Asynchronous generation jobs backed by Celery.
+
+``POST /api/v1/generate`` with ``"async": true`` enqueues :func:`run_generation`
+and returns a job id straight away, so long completions no longer hold a
+gunicorn worker.  Callers poll ``GET /api/v1/jobs/<id>`` or pass a
+``callback_url`` that receives the result when the job finishes.
+
+Job ids carry the owning organization (``"<org_id>.<uuid>"``) so ownership can
+be checked in any task state without extra storage.  Results live in the
+Celery result backend for ``CELERY_RESULT_EXPIRES`` seconds.
+
+A ``callback_url`` is fetched from inside our network, so
+:func:`check_callback_url` refuses hosts that resolve to private, loopback,
+link-local or reserved addresses, at enqueue time and again before each
+delivery (DNS can change in between).  ``JOB_CALLBACK_ALLOWED_HOSTS``
+replaces that check with an explicit list of host names.  Redirects are not
+followed.
+"""
+from __future__ import annotations
+
+import hashlib
+import hmac
+import ipaddress
+import json
+import socket
+import uuid
+from typing import Any, Dict, Optional
+from urllib.parse import urlparse
+
+import requests
+from flask import current_app
+
+from . import celery, db, generation, usage_meter
+from .models import Organization
+
+__all__ = ["UnsafeCallbackURL", "check_callback_url", "deliver_callback", "enqueue_generation", "job_owner",
+           "run_generation"]
+
+# One pooled HTTP session per worker process for webhook callbacks.
+_http = requests.Session()
+
+
+class UnsafeCallbackURL(ValueError):
+    """The callback URL is not http(s) or points into a private network."""
+
+
+def _is_internal(address: str) -> bool:
+    ip = ipaddress.ip_address(address.split("%", 1)[0])  # drop an IPv6 scope id
+    if ip.version == 6 and ip.ipv4_mapped:
+        ip = ip.ipv4_mapped
+    return (ip.is_private or ip.is_loopback or ip.is_link_local or ip.is_reserved
+            or ip.is_multicast or ip.is_unspecified)
+
+
+def check_callback_url(url: str) -> None:
+    """Raise :class:`UnsafeCallbackURL` unless *url* may be POSTed to from a worker."""
+    parsed = urlparse(url)
+    if parsed.scheme not in ("http", "https") or not parsed.hostname:
+        raise UnsafeCallbackURL("callback_url must be an http(s) URL.")
+    host = parsed.hostname.lower()
+    allowed = {name.strip().lower() for name in (current_app.config.get("JOB_CALLBACK_ALLOWED_HOSTS") or "").split(",")
+               if name.strip()}
+    if allowed:
+        if host not in allowed:
+            raise UnsafeCallbackURL(f"callback_url host {host!r} is not allowed.")
+        return
+    try:
+        port = parsed.port or (443 if parsed.scheme == "https" else 80)
+        addresses = {info[4][0] for info in socket.getaddrinfo(host, port, proto=socket.IPPROTO_TCP)}
+    except (OSError, ValueError) as exc:
+        raise UnsafeCallbackURL(f"callback_url host {host!r} cannot be resolved.") from exc
+    if any(_is_internal(address) for address in addresses):
+        raise UnsafeCallbackURL("callback_url must not point to a private or reserved address.")
+
+
+def new_job_id(org_id: int) -> str:
+    return f"{org_id}.{uuid.uuid4().hex}"
+
+
+def job_owner(job_id: str) -> Optional[int]:
+    """Return the organization id encoded in *job_id* (``None`` if malformed)."""
+    head, _, tail = job_id.partition(".")
+    return int(head) if head.isdigit() and tail else None
+
+
+def enqueue_generation(org_id: int, prompt: str, max_tokens: int = 60, callback_url: Optional[str] = None) -> str:
+    """Queue a generation for *org_id* and return its job id."""
+    job_id = new_job_id(org_id)
+    run_generation.apply_async(
+        args=(org_id, prompt),
+        kwargs={"max_tokens": max_tokens, "callback_url": callback_url},
+        task_id=job_id,
+    )
+    return job_id
+
+
+# ---------------------------------------------------------------------------
+# Celery tasks
+# ---------------------------------------------------------------------------
+
+@celery.task(name="generation.run", bind=True)
+def run_generation(self, org_id: int, prompt: str, max_tokens: int = 60,
+                   callback_url: Optional[str] = None) -> Dict[str, Any]:
+    """Run one completion; optionally notify *callback_url* when done."""
+    org = db.session.get(Organization, org_id)
+    try:
+        with usage_meter.track(org_id, "api.generate.async") as usage:
+            usage.completion = completion = generation.complete(prompt, org=org, max_tokens=max_tokens)
+    except Exception as exc:
+        if callback_url:
+            deliver_callback.delay(callback_url, {
+                "job_id": self.request.id, "status": "failure", "error": str(exc),
+            })
+        raise
+
+    result = {"generated_text": completion.text}
+    if callback_url:
+        deliver_callback.delay(callback_url, {"job_id": self.request.id, "status": "success", **result})
+    return result
+
+
+@celery.task(
+    name="generation.callback",
+    autoretry_for=(requests.RequestException,),
+    retry_backoff=True,
+    retry_backoff_max=300,
+    max_retries=5,
+)
+def deliver_callback(url: str, payload: Dict[str, Any]) -> int:
+    """POST *payload* to the caller's webhook, signed when a secret is set.
+
+    Raises :class:`UnsafeCallbackURL` (not retried) if the host now resolves
+    to an internal address.
+    """
+    check_callback_url(url)
+    body = json.dumps(payload, separators=(",", ":"))
+    headers = {"Content-Type": "application/json"}
+    secret = current_app.config.get("JOB_CALLBACK_SECRET")
+    if secret:
+        digest = hmac.new(secret.encode(), body.encode(), hashlib.sha256).hexdigest()
+        headers["X-AIGenesis-Signature"] = f"sha256={digest}"
+
+    response = _http.post(url, data=body, headers=headers,
+                          timeout=current_app.config.get("JOB_CALLBACK_TIMEOUT", 5), allow_redirects=False)
+    response.raise_for_status()
+    return response.status_code
@@ -0,0 +1,321 @@
+"""Verified API‑key cache for :func:`app.decorators.api_key_required`.
+
+Resolving a bearer key costs an ``api_keys`` lookup by prefix, a hash check,
+and the user / organization loads behind ``current_organization``.  The cache
+maps ``sha256(key)`` (which is also ``ApiKey.key_hash``) to the handful of
+fields the API hot path needs (key id, scopes and expiry, user id and email,
+org id, subscription flag, plan price id, cache opt‑out), in two tiers:
+
+* an in‑process LRU with a short TTL (``API_KEY_CACHE_LOCAL_TTL``), and
+* the shared Redis instance (``API_KEY_CACHE_REDIS_TTL``), so one worker's
+  lookup warms every other worker.
+
+Unknown keys are cached too (``API_KEY_CACHE_NEGATIVE_TTL``), so a flood of
+invalid keys costs one query per distinct key rather than one per request.
+
+Entries are invalidated after commit when a key is created, revoked,
+re‑scoped or deleted, a user or membership changes, or an organization's
+subscription, plan or cache opt‑out changes (ORM unit‑of‑work only – bulk ``UPDATE`` statements must call
+:meth:`ApiKeyCache.invalidate_org` / :meth:`~ApiKeyCache.invalidate_key`
+themselves).  Invalidation reaches this process's LRU and Redis; other
+workers' LRUs expire within the local TTL.
+
+Usage:
+  principal = api_key_cache.resolve(api_key)  # None for an unknown key
+  principal.current_organization.is_subscribed  # no query
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import time
+from datetime import timezone
+from typing import Any, Dict, Iterable, Optional
+
+import redis
+from sqlalchemy import event, func, select
+from sqlalchemy.orm import Session
+
+from .cache import LRUCache
+from .metrics import metrics
+
+__all__ = ["ApiKeyCache", "ApiPrincipal", "CachedOrganization", "key_digest"]
+
+_MISSING = {"missing": True}
+_ORG_FIELDS = ("is_subscribed", "stripe_price_id", "response_cache_enabled")
+
+
+def key_digest(api_key: str) -> str:
+    """Cache identity of a key (equal to ``ApiKey.key_hash``); raw keys are never stored."""
+    return hashlib.sha256(api_key.encode()).hexdigest()
+
+
+class CachedOrganization:
+    """Organization fields cached with the key; anything else loads the row."""
+
+    def __init__(self, data: Dict[str, Any], fields: Iterable[str] = _ORG_FIELDS) -> None:
+        self.id = data["org_id"]
+        for field in fields:
+            setattr(self, field, data[field])
+        self._row = None
+
+    def __getattr__(self, name: str) -> Any:
+        if name.startswith("_"):
+            raise AttributeError(name)
+        if self._row is None:
+            from . import db
+            from .models import Organization
+
+            metrics.counter("apikey.fallback_loads").inc()
+            self._row = db.session.get(Organization, self.id)
+        return getattr(self._row, name)
+
+
+class ApiPrincipal:
+    """Stand‑in for the authenticated ``User`` on API requests.
+
+    Exposes ``id``, ``email``, ``current_organization`` and the key's
+    ``key_id`` / ``scopes`` from the cache; any other attribute loads the real
+    ``User`` once and delegates to it.
+    """
+
+    def __init__(self, data: Dict[str, Any]) -> None:
+        self.id = data["user_id"]
+        self.email = data["email"]
+        self.key_id = data["key_id"]
+        self.scopes = frozenset(data["scopes"].split())
+        self.current_organization = CachedOrganization(data) if data.get("org_id") is not None else None
+        self._row = None
+
+    def __getattr__(self, name: str) -> Any:
+        if name.startswith("_"):
+            raise AttributeError(name)
+        if self._row is None:
+            from . import db
+            from .models import User
+
+            metrics.counter("apikey.fallback_loads").inc()
+            self._row = db.session.get(User, self.id)
+        return getattr(self._row, name)
+
+    def allows(self, scope: Optional[str]) -> bool:
+        return scope is None or "*" in self.scopes or scope in self.scopes
+
+
+class ApiKeyCache:
+    """LRU + Redis cache of verified (and known‑invalid) API keys."""
+
+    key_prefix = "apikey:"
+
+    def __init__(self, app=None) -> None:
+        self.enabled = True
+        self.redis_ttl = 300
+        self.negative_ttl = 60.0
+        self.local = LRUCache(name="apikey.local")
+        self._kv = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app, kv=None) -> None:
+        self.enabled = app.config.get("API_KEY_CACHE_ENABLED", True)
+        self.redis_ttl = app.config.get("API_KEY_CACHE_REDIS_TTL", self.redis_ttl)
+        self.negative_ttl = app.config.get("API_KEY_CACHE_NEGATIVE_TTL", self.negative_ttl)
+        self.local = LRUCache(
+            maxsize=app.config.get("API_KEY_CACHE_LOCAL_MAXSIZE", 10_000),
+            ttl=app.config.get("API_KEY_CACHE_LOCAL_TTL", 30),
+            name="apikey.local",
+        )
+        self._kv = kv
+        app.extensions["api_key_cache"] = self
+
+    @property
+    def redis(self):
+        return self._kv.client if self._kv is not None else None
+
+    # ------------------------------------------------------------------
+    # Lookup
+    # ------------------------------------------------------------------
+
+    def resolve(self, api_key: str) -> Optional[ApiPrincipal]:
+        """Return the principal for *api_key*, or ``None`` if the key is unknown."""
+        if not self.enabled:
+            data = self._load(api_key)
+            return ApiPrincipal(data) if data is not None and self._live(data) else None
+
+        digest = key_digest(api_key)
+        data = self.local.get(digest) or self._redis_get(digest)
+        if data is None:
+            metrics.counter("apikey.db_lookups").inc()
+            data = self._load(api_key)
+            self._store(digest, data)
+        if data is None or data.get("missing"):
+            metrics.counter("apikey.rejected").inc()
+            return None
+        if data["expires_at"] is not None and data["expires_at"] <= time.time():
+            metrics.counter("apikey.expired").inc()
+            return None
+        return ApiPrincipal(data)
+
+    def _redis_get(self, digest: str) -> Optional[Dict[str, Any]]:
+        client = self.redis
+        if client is None:
+            return None
+        try:
+            raw = client.get(self.key_prefix + digest)
+        except redis.RedisError:
+            metrics.counter("apikey.redis.errors").inc()
+            return None
+        if raw is None:
+            metrics.counter("apikey.redis.misses").inc()
+            return None
+        metrics.counter("apikey.redis.hits").inc()
+        data = json.loads(raw)
+        self.local.set(digest, data, ttl=self.negative_ttl if data.get("missing") else None)
+        return data
+
+    @staticmethod
+    def _live(data: Dict[str, Any]) -> bool:
+        return data["expires_at"] is None or data["expires_at"] > time.time()
+
+    @staticmethod
+    def _load(api_key: str) -> Optional[Dict[str, Any]]:
+        """One round trip: the key by prefix, its user and org, then a constant‑time hash check.
+
+        The org is the key's own, or – for keys issued before the user joined
+        one – the user's first membership (``User.current_organization``).
+        """
+        from . import db
+        from .models import ApiKey, Membership, Organization, User
+
+        first_org = (select(Membership.organization_id).where(Membership.user_id == ApiKey.user_id)
+                     .limit(1).scalar_subquery())
+        row = db.session.execute(
+            select(ApiKey, User.email, Organization.id, *(getattr(Organization, f) for f in _ORG_FIELDS))
+            .join(User, User.id == ApiKey.user_id)
+            .outerjoin(Organization, Organization.id == func.coalesce(ApiKey.organization_id, first_org))
+            .where(ApiKey.prefix == ApiKey.prefix_of(api_key))
+        ).first()
+        if row is None:
+            return None
+        key, email, org_id, *org_values = row
+        if not key.verify(api_key) or key.revoked_at is not None:
+            return None
+        return {
+            "key_id": key.id,
+            "scopes": key.scopes,
+            "expires_at": key.expires_at.replace(tzinfo=timezone.utc).timestamp() if key.expires_at else None,
+            "user_id": key.user_id,
+            "email": email,
+            "org_id": org_id,
+            **dict(zip(_ORG_FIELDS, org_values)),
+        }
+
+    def _store(self, digest: str, data: Optional[Dict[str, Any]]) -> None:
+        value = data if data is not None else _MISSING
+        ttl = self.negative_ttl if data is None else None
+        self.local.set(digest, value, ttl=ttl)
+        client = self.redis
+        if client is None:
+            return
+        try:
+            pipe = client.pipeline(transaction=False)
+            pipe.set(self.key_prefix + digest, json.dumps(value), ex=int(ttl or self.redis_ttl))
+            if data is not None and data.get("org_id") is not None:
+                org_set = f"{self.key_prefix}org:{data['org_id']}"
+                pipe.sadd(org_set, digest)
+                pipe.expire(org_set, self.redis_ttl)
+            pipe.execute()
+        except redis.RedisError:
+            metrics.counter("apikey.redis.errors").inc()
+
+    # ------------------------------------------------------------------
+    # Invalidation
+    # ------------------------------------------------------------------
+
+    def invalidate_key(self, api_key: str) -> None:
+        self.invalidate_digests([key_digest(api_key)])
+
+    def invalidate_digests(self, digests: Iterable[str]) -> None:
+        digests = list(digests)
+        for digest in digests:
+            self.local.delete(digest)
+        client = self.redis
+        if client is None or not digests:
+            return
+        try:
+            client.delete(*(self.key_prefix + d for d in digests))
+        except redis.RedisError:
+            metrics.counter("apikey.redis.errors").inc()
+
+    def invalidate_org(self, org_id: int) -> None:
+        """Drop every cached key that resolved to *org_id*."""
+        stale = [digest for digest, data in self.local.items()
+                 if isinstance(data, dict) and data.get("org_id") == org_id]
+        client = self.redis
+        if client is not None:
+            org_set = f"{self.key_prefix}org:{org_id}"
+            try:
+                stale.extend(d.decode() if isinstance(d, bytes) else d for d in client.smembers(org_set))
+                client.delete(org_set)
+            except redis.RedisError:
+                metrics.counter("apikey.redis.errors").inc()
+        self.invalidate_digests(set(stale))
+        metrics.counter("apikey.invalidations").inc()
+
+    def clear_local(self) -> None:
+        self.local.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return metrics.snapshot(prefix="apikey.")["counters"]
+
+
+# ---------------------------------------------------------------------------
+# ORM hooks: collect what a flush changed, invalidate once it commits
+# ---------------------------------------------------------------------------
+
+def _pending(session: Session) -> Dict[str, set]:
+    return session.info.setdefault("api_key_invalidations", {"digests": set(), "orgs": set()})
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_invalidations(session: Session, flush_context) -> None:
+    from sqlalchemy import inspect
+
+    from .models import ApiKey, Membership, Organization, User
+
+    pending = _pending(session)
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, ApiKey):
+            pending["digests"].add(obj.key_hash)
+        elif isinstance(obj, User):
+            if obj in session.dirty and not inspect(obj).attrs.email.history.has_changes():
+                continue
+            pending["digests"].update(k.key_hash for k in obj.api_keys)
+        elif isinstance(obj, Organization):
+            state = inspect(obj)
+            if obj in session.deleted or any(state.attrs[f].history.has_changes() for f in _ORG_FIELDS):
+                pending["orgs"].add(obj.id)
+        elif isinstance(obj, Membership):
+            pending["orgs"].add(obj.organization_id)
+            user = session.get(User, obj.user_id) if obj.user_id is not None else None
+            if user is not None:
+                pending["digests"].update(k.key_hash for k in user.api_keys)
+
+
+@event.listens_for(Session, "after_commit")
+def _apply_invalidations(session: Session) -> None:
+    pending = session.info.pop("api_key_invalidations", None)
+    if not pending:
+        return
+    from . import api_key_cache
+
+    if pending["digests"]:
+        api_key_cache.invalidate_digests(pending["digests"])
+    for org_id in pending["orgs"]:
+        if org_id is not None:
+            api_key_cache.invalidate_org(org_id)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_invalidations(session: Session) -> None:
+    session.info.pop("api_key_invalidations", None)
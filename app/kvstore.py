@@ -0,0 +1,72 @@
+"""Shared Redis connection for caches, limiters and other hot‑path state.
+
+Reuses the Celery Redis instance unless ``REDIS_URL`` points elsewhere.  When
+no Redis is configured (local dev, tests) ``store.client`` is ``None`` and
+callers fall back to their in‑process tier.
+
+Usage:
+  from app import kv
+  if kv.client is not None:
+      kv.client.get("some-key")
+
+Tests swap in an in‑memory stand‑in:
+  kv.use(fakeredis.FakeRedis())
+"""
+from __future__ import annotations
+
+import os
+import threading
+from typing import Any, Optional
+
+import redis
+
+__all__ = ["RedisStore"]
+
+
+class RedisStore:
+    """Lazily‑connected, fork‑aware Redis client with a bounded pool."""
+
+    def __init__(self, app=None) -> None:
+        self.url: Optional[str] = None
+        self.max_connections = 20
+        self.socket_timeout = 0.25
+        self._client: Optional[Any] = None
+        self._client_pid: Optional[int] = None
+        self._override: Optional[Any] = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app) -> None:
+        url = app.config.get("REDIS_URL") or app.config.get("CELERY_BROKER_URL")
+        self.url = url if url and url.startswith(("redis://", "rediss://", "unix://")) else None
+        self.max_connections = app.config.get("REDIS_MAX_CONNECTIONS", self.max_connections)
+        self.socket_timeout = app.config.get("REDIS_SOCKET_TIMEOUT", self.socket_timeout)
+        self._client = None
+        self._client_pid = None
+        self._override = None
+        app.extensions["kv"] = self
+
+    def use(self, client: Optional[Any]) -> None:
+        """Force a specific client (e.g. ``fakeredis.FakeRedis()``); ``None`` clears it."""
+        self._override = client
+
+    @property
+    def client(self) -> Optional[Any]:
+        if self._override is not None:
+            return self._override
+        if self.url is None:
+            return None
+        pid = os.getpid()
+        if self._client is None or self._client_pid != pid:
+            with self._lock:
+                if self._client is None or self._client_pid != pid:
+                    pool = redis.ConnectionPool.from_url(
+                        self.url,
+                        max_connections=self.max_connections,
+                        socket_timeout=self.socket_timeout,
+                        socket_connect_timeout=self.socket_timeout,
+                    )
+                    self._client = redis.Redis(connection_pool=pool)
+                    self._client_pid = pid
+        return self._client
@@ -0,0 +1,277 @@
+"""App‑scoped LLM gateway shared by the API and the feature pages.
+
+The gateway owns a single keep‑alive HTTP connection pool per worker process
+(created lazily, so gunicorn's pre‑fork never shares sockets between workers)
+and wraps the OpenAI SDK with explicit timeouts, a retry budget and per‑call
+latency stats.
+
+Usage:
+  from app import llm
+  completion = llm.complete("Write a haiku", max_tokens=60)
+  completion.text
+"""
+from __future__ import annotations
+
+import os
+import threading
+import time
+from dataclasses import asdict, dataclass, field, replace
+from typing import Any, Dict, Iterator, Mapping, Optional
+
+import httpx
+import openai
+from openai import OpenAI
+
+from .metrics import metrics
+
+__all__ = ["Completion", "GatewaySettings", "LLMGateway", "RetryBudget"]
+
+# Errors worth another attempt; everything else (auth, bad request …) is final.
+RETRYABLE_ERRORS = (
+    openai.APIConnectionError,  # includes APITimeoutError
+    openai.RateLimitError,
+    openai.InternalServerError,
+)
+
+
+@dataclass(frozen=True)
+class GatewaySettings:
+    """Connection, timeout and retry knobs; built from the Flask config."""
+
+    api_key: Optional[str] = None
+    base_url: Optional[str] = None
+    model: str = "gpt-3.5-turbo-instruct"
+    max_tokens: int = 60
+    connect_timeout: float = 5.0
+    read_timeout: float = 30.0
+    pool_maxsize: int = 10
+    keepalive_expiry: float = 60.0
+    max_retries: int = 2
+    retry_backoff: float = 0.25
+    retry_budget_ratio: float = 0.2
+    retry_budget_min: int = 5
+
+    @classmethod
+    def from_config(cls, config: Mapping[str, Any]) -> "GatewaySettings":
+        return cls(
+            api_key=config.get("OPENAI_API_KEY"),
+            base_url=config.get("LLM_BASE_URL"),
+            model=config.get("LLM_MODEL", cls.model),
+            max_tokens=config.get("LLM_MAX_TOKENS", cls.max_tokens),
+            connect_timeout=config.get("LLM_CONNECT_TIMEOUT", cls.connect_timeout),
+            read_timeout=config.get("LLM_READ_TIMEOUT", cls.read_timeout),
+            pool_maxsize=config.get("LLM_POOL_MAXSIZE", cls.pool_maxsize),
+            keepalive_expiry=config.get("LLM_KEEPALIVE_EXPIRY", cls.keepalive_expiry),
+            max_retries=config.get("LLM_MAX_RETRIES", cls.max_retries),
+            retry_budget_ratio=config.get("LLM_RETRY_BUDGET", cls.retry_budget_ratio),
+        )
+
+
+@dataclass
+class Completion:
+    """A finished completion plus the usage numbers needed for metering."""
+
+    text: str
+    model: str
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    latency_ms: float = 0.0
+    meta: Dict[str, Any] = field(default_factory=dict)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+    @classmethod
+    def from_dict(cls, data: Mapping[str, Any]) -> "Completion":
+        return cls(**{k: data[k] for k in cls.__dataclass_fields__ if k in data})
+
+
+class RetryBudget:
+    """Token bucket that limits retries to a fraction of recent calls.
+
+    Every call deposits ``ratio`` tokens and every retry spends one, so when the
+    upstream is down we stop multiplying load by ``max_retries``.  ``minimum``
+    keeps a few retries available for low‑traffic workers; savings are capped
+    at roughly ``window`` calls' worth so a quiet hour can't bank a storm.
+    """
+
+    def __init__(self, ratio: float = 0.2, minimum: int = 5, window: int = 100) -> None:
+        self.ratio = ratio
+        self.capacity = minimum + ratio * window
+        self._tokens = float(minimum)
+        self._lock = threading.Lock()
+
+    def deposit(self) -> None:
+        with self._lock:
+            self._tokens = min(self._tokens + self.ratio, self.capacity)
+
+    def withdraw(self) -> bool:
+        with self._lock:
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return True
+            return False
+
+
+class LLMGateway:
+    """Pooled OpenAI client, one per worker process."""
+
+    def __init__(self, app=None) -> None:
+        self.settings = GatewaySettings()
+        self.retry_budget = RetryBudget()
+        self._client: Optional[OpenAI] = None
+        self._client_pid: Optional[int] = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    # ------------------------------------------------------------------
+    # Setup
+    # ------------------------------------------------------------------
+
+    def init_app(self, app) -> None:
+        self.settings = GatewaySettings.from_config(app.config)
+        self.reset()
+        app.extensions["llm"] = self
+
+    def configure(self, **overrides: Any) -> None:
+        """Override individual settings (tests, CLI) and rebuild the pool."""
+        self.settings = replace(self.settings, **overrides)
+        self.reset()
+
+    def reset(self) -> None:
+        """Drop the current pool; the next call opens a fresh one."""
+        with self._lock:
+            if self._client is not None and self._client_pid == os.getpid():
+                self._client.close()
+            self._client = None
+            self._client_pid = None
+        self.retry_budget = RetryBudget(self.settings.retry_budget_ratio, self.settings.retry_budget_min)
+
+    close = reset
+
+    @property
+    def default_model(self) -> str:
+        return self.settings.model
+
+    @property
+    def client(self) -> OpenAI:
+        """The process‑local SDK client (rebuilt after a fork)."""
+        pid = os.getpid()
+        if self._client is None or self._client_pid != pid:
+            with self._lock:
+                if self._client is None or self._client_pid != pid:
+                    self._client = self._build_client()
+                    self._client_pid = pid
+        return self._client
+
+    def _build_client(self) -> OpenAI:
+        s = self.settings
+        http_client = httpx.Client(
+            limits=httpx.Limits(
+                max_connections=s.pool_maxsize,
+                max_keepalive_connections=s.pool_maxsize,
+                keepalive_expiry=s.keepalive_expiry,
+            ),
+            timeout=httpx.Timeout(s.read_timeout, connect=s.connect_timeout),
+        )
+        return OpenAI(
+            api_key=s.api_key or "missing",
+            base_url=s.base_url,
+            timeout=httpx.Timeout(s.read_timeout, connect=s.connect_timeout),
+            max_retries=0,  # retries are governed by our own budget
+            http_client=http_client,
+        )
+
+    # ------------------------------------------------------------------
+    # Calls
+    # ------------------------------------------------------------------
+
+    def complete(
+        self,
+        prompt: str,
+        *,
+        model: Optional[str] = None,
+        max_tokens: Optional[int] = None,
+        **params: Any,
+    ) -> Completion:
+        """Run a (non‑streaming) completion, retrying within the budget."""
+        model = model or self.settings.model
+        max_tokens = max_tokens or self.settings.max_tokens
+        self.retry_budget.deposit()
+
+        attempt = 0
+        started = time.perf_counter()
+        while True:
+            try:
+                response = self.client.completions.create(
+                    model=model, prompt=prompt, max_tokens=max_tokens, **params
+                )
+                break
+            except RETRYABLE_ERRORS:
+                if attempt >= self.settings.max_retries or not self.retry_budget.withdraw():
+                    metrics.counter("llm.errors").inc()
+                    raise
+                metrics.counter("llm.retries").inc()
+                time.sleep(self.settings.retry_backoff * (2 ** attempt))
+                attempt += 1
+            except Exception:
+                metrics.counter("llm.errors").inc()
+                raise
+
+        elapsed = time.perf_counter() - started
+        metrics.latency("llm.complete").observe(elapsed)
+        usage = getattr(response, "usage", None)
+        return Completion(
+            text=response.choices[0].text.strip(),
+            model=model,
+            prompt_tokens=getattr(usage, "prompt_tokens", 0) or 0,
+            completion_tokens=getattr(usage, "completion_tokens", 0) or 0,
+            latency_ms=round(elapsed * 1000, 3),
+        )
+
+    def stream(
+        self,
+        prompt: str,
+        *,
+        model: Optional[str] = None,
+        max_tokens: Optional[int] = None,
+        **params: Any,
+    ) -> Iterator[str]:
+        """Yield completion text deltas as the upstream produces them.
+
+        Records time‑to‑first‑token and total duration.  Streams are not
+        retried: once bytes have reached the caller a replay would duplicate
+        output.
+        """
+        model = model or self.settings.model
+        max_tokens = max_tokens or self.settings.max_tokens
+
+        started = time.perf_counter()
+        first_token_at: Optional[float] = None
+        try:
+            response = self.client.completions.create(
+                model=model, prompt=prompt, max_tokens=max_tokens, stream=True, **params
+            )
+            try:
+                for chunk in response:
+                    text = chunk.choices[0].text if chunk.choices else ""
+                    if first_token_at is None:
+                        text = text.lstrip()
+                        if not text:
+                            continue
+                        first_token_at = time.perf_counter()
+                        metrics.latency("llm.stream.ttft").observe(first_token_at - started)
+                    if text:
+                        yield text
+            finally:
+                response.close()
+        except Exception:
+            metrics.counter("llm.errors").inc()
+            raise
+        finally:
+            metrics.latency("llm.stream.duration").observe(time.perf_counter() - started)
+
+    def stats(self) -> Dict[str, Any]:
+        """Latency percentiles plus error / retry counters for this process."""
+        return metrics.snapshot(prefix="llm.")
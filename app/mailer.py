@@ -0,0 +1,397 @@
+"""Pooled, batched SMTP delivery for Celery workers.
+
+Flask‑Mail's ``mail.send`` opens a fresh SMTP connection – TCP, STARTTLS,
+AUTH – for every message and quits it straight after.  With
+``MAIL_DELIVERY_MODE = "pooled"`` the ``email.send`` task hands the rendered
+message to :class:`SMTPPool` instead:
+
+* Messages are serialized into a Redis outbox (``mail:outbox``).  The first
+  message of a burst schedules one ``email.drain_outbox`` task,
+  ``SMTP_OUTBOX_LINGER`` seconds out, so the burst is delivered together.
+* The drain pops ``SMTP_BATCH_SIZE`` messages at a time and sends each batch
+  over a single connection from the worker's pool.  Up to ``SMTP_POOL_SIZE``
+  connections stay open per worker process between tasks.  A connection is
+  recycled after ``SMTP_POOL_MAX_MESSAGES`` messages or
+  ``SMTP_POOL_MAX_IDLE`` seconds without use, since servers drop idle
+  sessions.
+* A transient failure (dropped connection, refused connect, 4xx reply)
+  reconnects and retries the same message.  The first retry is immediate,
+  because a pooled connection may simply have been closed by the server.
+  Later retries back off exponentially (``SMTP_RETRY_BACKOFF`` up to
+  ``SMTP_RETRY_BACKOFF_MAX``).  After ``SMTP_MAX_RETRIES`` the undelivered
+  rest of the batch goes back to the head of the outbox.  A later drain
+  picks it up, as does the ``email-outbox-drain`` beat sweep.
+* A permanent 5xx rejection drops only that message.  Recipients refused
+  with a 4xx reply (greylisting, mailbox busy, 452 too many recipients) are
+  deferred instead, as a copy of the message addressed to them alone.
+  The copy counts its ``attempts``; a recipient still refused after
+  ``SMTP_MAX_DEFERRALS`` of them is rejected.
+* An SMTP error without a reply code other than a dropped connection
+  (STARTTLS or AUTH not offered, ``SMTPNotSupportedError``) is a
+  configuration problem; it is raised at once instead of retried.
+
+Without Redis, messages are delivered straight away through the pool.
+Delivery is at most once per message, like the default (early-ack)
+``email.send`` task: a worker killed mid-batch loses that batch.
+
+Usage:
+  smtp_pool.submit(msg)           # from email.send
+  smtp_pool.deliver([envelope])   # send now, returns a DeliveryReport
+"""
+from __future__ import annotations
+
+import atexit
+import json
+import logging
+import os
+import random
+import smtplib
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import redis
+from flask_mail import Message, sanitize_address, sanitize_addresses
+
+from .metrics import metrics
+
+__all__ = ["DeliveryReport", "SMTPPool", "envelope"]
+
+logger = logging.getLogger(__name__)
+
+# Failures worth reconnecting for.  SMTPResponseException carries a reply
+# code; only 4xx replies are retried, and of the other SMTPExceptions (all
+# OSError subclasses) only SMTPServerDisconnected (see _is_transient).
+_CONNECTION_ERRORS = (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError, OSError)
+
+
+def envelope(msg: Message) -> Dict[str, Any]:
+    """The serializable part of a Flask‑Mail message: MAIL FROM, RCPT TO and DATA."""
+    if msg.date is None:
+        msg.date = time.time()
+    return {
+        "from": sanitize_address(msg.sender),
+        "to": list(sanitize_addresses(msg.send_to)),
+        "data": msg.as_string(),
+    }
+
+
+@dataclass
+class DeliveryReport:
+    """Outcome of one :meth:`SMTPPool.deliver` call."""
+
+    sent: int = 0
+    rejected: List[Dict[str, Any]] = field(default_factory=list)  # permanent failures, dropped
+    deferred: List[Dict[str, Any]] = field(default_factory=list)  # transient failures, to retry later
+    error: Optional[BaseException] = None  # the last transient error, if any were deferred
+
+
+class _Connection:
+    __slots__ = ("host", "sent", "last_used")
+
+    def __init__(self, host) -> None:
+        self.host = host
+        self.sent = 0
+        self.last_used = time.monotonic()
+
+    def close(self) -> None:
+        try:
+            self.host.quit()
+        except Exception:  # already gone
+            self.host.close()
+
+
+class SMTPPool:
+    """Per‑process pool of persistent SMTP connections, fed from a Redis outbox."""
+
+    outbox_key = "mail:outbox"
+    scheduled_key = "mail:outbox:scheduled"
+
+    def __init__(self, app=None, kv=None) -> None:
+        self.mode = "direct"
+        self.server = "localhost"
+        self.port = 25
+        self.use_tls = False
+        self.use_ssl = False
+        self.username: Optional[str] = None
+        self.password: Optional[str] = None
+        self.suppress = False
+        self.timeout = 10.0
+        self.size = 2
+        self.max_idle = 30.0
+        self.max_messages = 500
+        self.batch_size = 100
+        self.linger = 1.0
+        self.max_retries = 4
+        self.max_deferrals = 10
+        self.backoff = 0.5
+        self.backoff_max = 30.0
+        self._kv = None
+        self._idle: List[_Connection] = []
+        self._idle_pid: Optional[int] = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app, kv)
+
+    def init_app(self, app, kv=None) -> None:
+        self.close()
+        config = app.config
+        self.mode = config.get("MAIL_DELIVERY_MODE", self.mode)
+        self.server = config.get("MAIL_SERVER") or "localhost"
+        self.port = config.get("MAIL_PORT", self.port)
+        self.use_tls = config.get("MAIL_USE_TLS", self.use_tls)
+        self.use_ssl = config.get("MAIL_USE_SSL", self.use_ssl)
+        self.username = config.get("MAIL_USERNAME")
+        self.password = config.get("MAIL_PASSWORD")
+        self.suppress = config.get("MAIL_SUPPRESS_SEND", app.testing)
+        self.timeout = config.get("SMTP_TIMEOUT", self.timeout)
+        self.size = config.get("SMTP_POOL_SIZE", self.size)
+        self.max_idle = config.get("SMTP_POOL_MAX_IDLE", self.max_idle)
+        self.max_messages = config.get("SMTP_POOL_MAX_MESSAGES", self.max_messages)
+        self.batch_size = config.get("SMTP_BATCH_SIZE", self.batch_size)
+        self.linger = config.get("SMTP_OUTBOX_LINGER", self.linger)
+        self.max_retries = config.get("SMTP_MAX_RETRIES", self.max_retries)
+        self.max_deferrals = config.get("SMTP_MAX_DEFERRALS", self.max_deferrals)
+        self.backoff = config.get("SMTP_RETRY_BACKOFF", self.backoff)
+        self.backoff_max = config.get("SMTP_RETRY_BACKOFF_MAX", self.backoff_max)
+        self._kv = kv
+        app.extensions["smtp_pool"] = self
+
+    @property
+    def redis(self):
+        return self._kv.client if self._kv is not None else None
+
+    # ------------------------------------------------------------------
+    # Connections
+    # ------------------------------------------------------------------
+
+    def _connect(self) -> _Connection:
+        if self.use_ssl:
+            host = smtplib.SMTP_SSL(self.server, self.port, timeout=self.timeout)
+        else:
+            host = smtplib.SMTP(self.server, self.port, timeout=self.timeout)
+        try:
+            if self.use_tls:
+                host.starttls()
+            if self.username and self.password:
+                host.login(self.username, self.password)
+        except BaseException:
+            host.close()
+            raise
+        metrics.counter("mail.connections.opened").inc()
+        return _Connection(host)
+
+    @contextmanager
+    def connection(self) -> Iterator[_Connection]:
+        """Check out a live connection; it is returned to the pool unless the block raises."""
+        conn = None
+        with self._lock:
+            if self._idle_pid != os.getpid():  # sockets inherited over fork belong to the parent
+                self._idle, self._idle_pid = [], os.getpid()
+            while self._idle:
+                candidate = self._idle.pop()
+                if time.monotonic() - candidate.last_used < self.max_idle:
+                    conn = candidate
+                    break
+                candidate.host.close()  # idle too long: the server has likely hung up already
+        if conn is None:
+            conn = self._connect()
+        else:
+            metrics.counter("mail.connections.reused").inc()
+
+        try:
+            yield conn
+        except BaseException:
+            conn.host.close()
+            raise
+        conn.last_used = time.monotonic()
+        if conn.sent >= self.max_messages:
+            conn.close()
+            return
+        with self._lock:
+            if len(self._idle) < self.size and self._idle_pid == os.getpid():
+                self._idle.append(conn)
+                return
+        conn.close()
+
+    def close(self) -> None:
+        """Quit every idle connection of this process."""
+        with self._lock:
+            idle = self._idle if self._idle_pid == os.getpid() else []
+            self._idle = []
+        for conn in idle:
+            conn.close()
+
+    # ------------------------------------------------------------------
+    # Delivery
+    # ------------------------------------------------------------------
+
+    def _delay(self, attempt: int) -> float:
+        if attempt <= 1:
+            return 0.0
+        return min(self.backoff_max, self.backoff * 2 ** (attempt - 2)) * random.uniform(0.5, 1.0)
+
+    def deliver(self, envelopes: List[Dict[str, Any]]) -> DeliveryReport:
+        """Send *envelopes* in order over one pooled connection, reconnecting as needed."""
+        report = DeliveryReport()
+        if self.suppress:
+            report.sent = len(envelopes)
+            return report
+
+        started = time.perf_counter()
+        index, attempt = 0, 0
+        while index < len(envelopes):
+            try:
+                with self.connection() as conn:
+                    while index < len(envelopes):
+                        if conn.sent >= self.max_messages:
+                            break  # recycle: the next pass opens a fresh connection
+                        message = envelopes[index]
+                        try:
+                            refused = conn.host.sendmail(message["from"], message["to"],
+                                                         message["data"].encode("utf-8"))
+                        except smtplib.SMTPRecipientsRefused as exc:
+                            self._refused(report, message, exc.recipients, exc)
+                        except smtplib.SMTPNotSupportedError as exc:  # e.g. SMTPUTF8 needed but not offered
+                            self._reject(report, message, exc)
+                        except smtplib.SMTPResponseException as exc:
+                            if _is_transient(exc):
+                                raise
+                            self._reject(report, message, exc)
+                        else:
+                            report.sent += 1
+                            if refused:  # accepted for some recipients only
+                                self._refused(report, message, refused, smtplib.SMTPRecipientsRefused(refused),
+                                              partial=True)
+                        conn.sent += 1
+                        index += 1
+                        attempt = 0
+            except (smtplib.SMTPResponseException, *_CONNECTION_ERRORS) as exc:
+                if not _is_transient(exc):
+                    raise  # connect-time 5xx (e.g. bad credentials), STARTTLS not offered: nothing to retry
+                attempt += 1
+                metrics.counter("mail.reconnects").inc()
+                if attempt > self.max_retries:
+                    report.deferred.extend(envelopes[index:])
+                    report.error = exc
+                    metrics.counter("mail.deferred").inc(len(envelopes) - index)
+                    logger.warning("SMTP delivery failed %d times (%s); deferring %d messages",
+                                   attempt, exc, len(envelopes) - index)
+                    break
+                time.sleep(self._delay(attempt))
+
+        metrics.counter("mail.sent").inc(report.sent)
+        metrics.latency("mail.batch").observe(time.perf_counter() - started)
+        return report
+
+    def _refused(self, report: DeliveryReport, message: Dict[str, Any], recipients: Dict[str, Tuple[int, bytes]],
+                 exc: smtplib.SMTPRecipientsRefused, partial: bool = False) -> None:
+        """Defer the recipients refused with a 4xx reply and reject those refused with a 5xx one.
+
+        A message already deferred ``max_deferrals`` times is rejected instead.
+        """
+        attempts = message.get("attempts", 0) + 1
+        later = [rcpt for rcpt, (code, _) in recipients.items() if 400 <= code < 500]
+        if later and attempts > self.max_deferrals:
+            metrics.counter("mail.deferrals_exhausted").inc()
+            later = []
+        if later:
+            report.deferred.append({**message, "to": later, "attempts": attempts})
+            report.error = exc
+            metrics.counter("mail.deferred").inc()
+            logger.info("SMTP server deferred a message to %s: %s", ", ".join(later), exc)
+        if len(later) == len(recipients):
+            return
+        if later or partial:
+            message = {**message, "to": [rcpt for rcpt in recipients if rcpt not in later]}
+        self._reject(report, message, exc)
+
+    @staticmethod
+    def _reject(report: DeliveryReport, message: Dict[str, Any], exc: Exception) -> None:
+        report.rejected.append(message)
+        metrics.counter("mail.rejected").inc()
+        logger.warning("SMTP server rejected a message to %s: %s", ", ".join(message["to"]), exc)
+
+    # ------------------------------------------------------------------
+    # Outbox
+    # ------------------------------------------------------------------
+
+    def submit(self, msg: Message) -> None:
+        """Queue *msg* for batched delivery (or send it now when there is no Redis)."""
+        message = envelope(msg)
+        client = self.redis
+        if client is not None:
+            try:
+                client.rpush(self.outbox_key, json.dumps(message))
+            except redis.RedisError:
+                metrics.counter("mail.redis.errors").inc()
+            else:
+                metrics.counter("mail.queued").inc()
+                self._schedule(client, self.linger)
+                return
+
+        report = self.deliver([message])
+        if report.deferred:
+            raise report.error
+
+    def _schedule(self, client, countdown: float) -> None:
+        # One drain per burst: whoever sets the flag schedules it, the drain clears it.
+        ttl = max(1, int(countdown + self.backoff_max + 60))  # a lost drain task must not block forever
+        if client.set(self.scheduled_key, 1, nx=True, ex=ttl):
+            from .email import drain_outbox
+
+            drain_outbox.apply_async(countdown=countdown)
+
+    def drain(self) -> int:
+        """Deliver everything in the outbox, one batch per connection checkout; returns messages sent."""
+        client = self.redis
+        if client is None:
+            return 0
+        client.delete(self.scheduled_key)  # messages queued from now on schedule a new drain
+        sent = 0
+        while True:
+            raw = client.lpop(self.outbox_key, self.batch_size)
+            if not raw:
+                return sent
+            try:
+                report = self.deliver([json.loads(item) for item in raw])
+            except Exception:
+                # Not retryable here (bad credentials, no STARTTLS): keep the batch for when it is fixed.
+                client.lpush(self.outbox_key, *reversed(raw))
+                raise
+            sent += report.sent
+            if report.deferred:
+                # Back to the head of the outbox, in order, for the next drain.
+                client.lpush(self.outbox_key, *(json.dumps(m) for m in reversed(report.deferred)))
+                self._schedule(client, self.backoff_max)
+                return sent
+
+    @property
+    def queued(self) -> int:
+        client = self.redis
+        return client.llen(self.outbox_key) if client is not None else 0
+
+    def stats(self) -> Dict[str, Any]:
+        snapshot = metrics.snapshot(prefix="mail.")
+        with self._lock:
+            snapshot["idle_connections"] = len(self._idle) if self._idle_pid == os.getpid() else 0
+        return snapshot
+
+
+def _is_transient(exc: OSError) -> bool:
+    if isinstance(exc, smtplib.SMTPResponseException):
+        return isinstance(exc, smtplib.SMTPConnectError) or 400 <= exc.smtp_code < 500
+    if isinstance(exc, smtplib.SMTPException):
+        return isinstance(exc, smtplib.SMTPServerDisconnected)
+    return True
+
+
+def _close_at_exit() -> None:
+    from . import smtp_pool
+
+    smtp_pool.close()
+
+
+atexit.register(_close_at_exit)
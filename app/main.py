@@ -1,8 +1,15 @@
 # app/main.py
 
-from flask import Blueprint, render_template, redirect, url_for, jsonify
+from datetime import datetime
+
+from flask import Blueprint, abort, flash, render_template, redirect, request, url_for, jsonify
 from flask_login import current_user, login_required
 
+from . import db, engine
+from .engine import EngineOverloaded, EngineTimeout
+from .metrics import metrics
+from .models import ApiKey
+
 main = Blueprint('main', __name__)
 
 @main.route('/healthz')
@@ -10,6 +17,14 @@ def health_check():
     """A simple health check endpoint that doesn't hit the database."""
     return jsonify(status="ok"), 200
 
+@main.route('/metrics')
+@login_required
+def metrics_snapshot():
+    """Process-local counters and latency percentiles (admins only)."""
+    if not current_user.is_admin:
+        abort(403)
+    return jsonify(metrics.snapshot())
+
 @main.route('/')
 def index():
     """Serves the landing page if the user is not authenticated, otherwise redirects to the dashboard."""
@@ -17,8 +32,51 @@ def index():
         return redirect(url_for('main.dashboard'))
     return render_template('landing_page.html')
 
+@main.route('/generate', methods=['POST'])
+def generate():
+    """Handles the AI generation request from the landing page (local engine, no upstream API)."""
+    data = request.get_json(silent=True)
+    if not data or not isinstance(data.get('prompt'), str) or not data['prompt'].strip():
+        return jsonify({'error': 'Prompt is empty or invalid.'}), 400
+
+    try:
+        completion = engine.complete(data['prompt'])
+        return jsonify({'result': completion.text})
+    except EngineOverloaded:
+        return jsonify({'error': 'The engine is busy. Please try again shortly.'}), 503
+    except EngineTimeout:
+        return jsonify({'error': 'Generation took too long. Please try a shorter prompt.'}), 504
+    except Exception as e:
+        return jsonify({'error': f'An error occurred during generation: {e}'}), 500
+
 @main.route('/dashboard')
 @login_required
 def dashboard():
     """Serves the user's dashboard, accessible only to logged-in users."""
-    return render_template('dashboard.html')
+    api_keys = [key for key in db.session.scalars(db.select(ApiKey).filter_by(user_id=current_user.id)
+                                                  .order_by(ApiKey.id)) if key.is_active]
+    return render_template('dashboard.html', api_keys=api_keys)
+
+@main.route('/dashboard/api-keys', methods=['POST'])
+@login_required
+def create_api_key():
+    """Issues a new API key; the plaintext is shown exactly once."""
+    org = current_user.current_organization
+    key, plaintext = ApiKey.generate(user_id=current_user.id, organization_id=org.id if org else None,
+                                     name=(request.form.get('name') or 'Default').strip()[:64] or 'Default')
+    db.session.add(key)
+    db.session.commit()
+    flash(f'Your new API key is {plaintext} - copy it now, it will not be shown again.', 'success')
+    return redirect(url_for('main.dashboard'))
+
+@main.route('/dashboard/api-keys/<int:key_id>/revoke', methods=['POST'])
+@login_required
+def revoke_api_key(key_id):
+    """Revokes one of the current user's API keys."""
+    key = db.session.get(ApiKey, key_id)
+    if key is None or key.user_id != current_user.id:
+        abort(404)
+    key.revoked_at = datetime.utcnow()
+    db.session.commit()
+    flash(f'API key {key.prefix}… has been revoked.', 'info')
+    return redirect(url_for('main.dashboard'))
@@ -0,0 +1,222 @@
+"""Buffered per‑organization usage metering.
+
+Every generation records one usage event (requests, prompt/completion tokens,
+latency).  Events are appended to an in‑process buffer and written in bulk –
+one multi‑row ``INSERT`` per flush instead of one per request – so metering
+adds no database round trip to the request path.
+
+A flush happens when the buffer reaches ``USAGE_BUFFER_SIZE`` events or is
+``USAGE_FLUSH_INTERVAL`` seconds old, on a background thread per worker
+process.  With ``USAGE_FLUSH_MODE = "celery"`` the batch is handed to the
+``usage.ingest`` task instead of being written by the web worker.
+
+Usage:
+  with usage_meter.track(org.id, 'api.generate', user_id=user.id) as usage:
+      usage.completion = generation.complete(prompt, org=org)
+"""
+from __future__ import annotations
+
+import atexit
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional
+
+from .llm import Completion
+from .metrics import metrics
+
+__all__ = ["UsageMeter"]
+
+logger = logging.getLogger(__name__)
+
+
+class _Usage:
+    """Handle yielded by :meth:`UsageMeter.track`; set ``completion`` on success."""
+
+    __slots__ = ("completion",)
+
+    def __init__(self) -> None:
+        self.completion: Optional[Completion] = None
+
+
+class UsageMeter:
+    """Collects usage events per worker process and flushes them in bulk."""
+
+    def __init__(self, app=None) -> None:
+        self.enabled = True
+        self.buffer_size = 500
+        self.flush_interval = 5.0
+        self.max_pending = 50_000
+        self.mode = "inline"
+        self._app = None
+        self._events: List[Dict[str, Any]] = []
+        self._oldest = 0.0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._flusher: Optional[threading.Thread] = None
+        self._flusher_pid: Optional[int] = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app) -> None:
+        self.enabled = app.config.get("USAGE_METERING_ENABLED", True)
+        self.buffer_size = app.config.get("USAGE_BUFFER_SIZE", self.buffer_size)
+        self.flush_interval = app.config.get("USAGE_FLUSH_INTERVAL", self.flush_interval)
+        self.max_pending = app.config.get("USAGE_MAX_PENDING", self.max_pending)
+        self.mode = app.config.get("USAGE_FLUSH_MODE", self.mode)
+        self._app = app
+        with self._lock:
+            self._events = []  # events belong to the app (database) they were recorded for
+        app.extensions["usage_meter"] = self
+
+    # ------------------------------------------------------------------
+    # Recording
+    # ------------------------------------------------------------------
+
+    def record(
+        self,
+        org_id: Optional[int],
+        endpoint: str,
+        completion: Optional[Completion] = None,
+        *,
+        user_id: Optional[int] = None,
+        latency_ms: float = 0.0,
+        status: str = "ok",
+    ) -> None:
+        """Buffer one usage event; never touches the database."""
+        if not self.enabled or org_id is None:
+            return
+        event = {
+            "organization_id": org_id,
+            "user_id": user_id,
+            "endpoint": endpoint,
+            "model": completion.model if completion else None,
+            "status": status,
+            "prompt_tokens": completion.prompt_tokens if completion else 0,
+            "completion_tokens": completion.completion_tokens if completion else 0,
+            "latency_ms": round(latency_ms, 3),
+            "created_at": datetime.utcnow(),
+        }
+        with self._lock:
+            if not self._events:
+                self._oldest = time.monotonic()
+            self._events.append(event)
+            full = len(self._events) >= self.buffer_size
+        metrics.counter("usage.recorded").inc()
+
+        if self.flush_interval > 0:
+            self._ensure_flusher()
+            if full:
+                self._wake.set()
+        elif full:
+            self.flush()
+
+    @contextmanager
+    def track(self, org_id: Optional[int], endpoint: str, user_id: Optional[int] = None) -> Iterator[_Usage]:
+        """Time the block and record it, as an error if it raises."""
+        usage = _Usage()
+        started = time.perf_counter()
+        status = "ok"
+        try:
+            yield usage
+        except BaseException:
+            status = "error"
+            raise
+        finally:
+            self.record(org_id, endpoint, usage.completion, user_id=user_id,
+                        latency_ms=(time.perf_counter() - started) * 1000, status=status)
+
+    @property
+    def pending(self) -> int:
+        with self._lock:
+            return len(self._events)
+
+    # ------------------------------------------------------------------
+    # Flushing
+    # ------------------------------------------------------------------
+
+    def flush(self) -> int:
+        """Write (or enqueue) everything buffered so far; returns the event count."""
+        with self._flush_lock:
+            with self._lock:
+                events, self._events = self._events, []
+            if not events:
+                return 0
+
+            started = time.perf_counter()
+            try:
+                with self._app.app_context():
+                    if self.mode == "celery":
+                        from .usage import ingest_usage
+
+                        # One task per buffer's worth keeps each under TASK_PAYLOAD_MAX_BYTES.
+                        for start in range(0, len(events), self.buffer_size):
+                            ingest_usage.delay([_serialize(e) for e in events[start:start + self.buffer_size]])
+                    else:
+                        from .usage import write_events
+
+                        write_events(events)
+            except Exception:
+                logger.exception("Usage flush of %d events failed; keeping them buffered", len(events))
+                metrics.counter("usage.flush.errors").inc()
+                self._requeue(events)
+                return 0
+
+            metrics.latency("usage.flush").observe(time.perf_counter() - started)
+            metrics.counter("usage.flushed").inc(len(events))
+            return len(events)
+
+    def _requeue(self, events: List[Dict[str, Any]]) -> None:
+        with self._lock:
+            merged = events + self._events
+            dropped = max(0, len(merged) - self.max_pending)
+            self._events = merged[dropped:]  # shed the oldest if the database stays down
+            self._oldest = time.monotonic()
+        if dropped:
+            metrics.counter("usage.dropped").inc(dropped)
+
+    def _ensure_flusher(self) -> None:
+        pid = os.getpid()
+        if self._flusher_pid == pid and self._flusher is not None and self._flusher.is_alive():
+            return
+        with self._lock:
+            if self._flusher_pid == pid and self._flusher is not None and self._flusher.is_alive():
+                return
+            self._flusher = threading.Thread(target=self._run_flusher, name="usage-flusher", daemon=True)
+            self._flusher_pid = pid
+            self._flusher.start()
+
+    def _run_flusher(self) -> None:
+        while self.flush_interval > 0:
+            self._wake.wait(timeout=self.flush_interval)
+            self._wake.clear()
+            with self._lock:
+                due = bool(self._events) and (
+                    len(self._events) >= self.buffer_size
+                    or time.monotonic() - self._oldest >= self.flush_interval
+                )
+            if due:
+                self.flush()
+
+    def stats(self) -> Dict[str, Any]:
+        snapshot = metrics.snapshot(prefix="usage.")
+        snapshot["pending"] = self.pending
+        return snapshot
+
+
+def _serialize(event: Dict[str, Any]) -> Dict[str, Any]:
+    return {**event, "created_at": event["created_at"].isoformat()}
+
+
+def _flush_at_exit() -> None:
+    from . import usage_meter
+
+    if usage_meter._app is not None and usage_meter.pending:
+        usage_meter.flush()
+
+
+atexit.register(_flush_at_exit)
@@ -0,0 +1,113 @@
+"""Process‑local counters and latency windows.
+
+Each gunicorn / Celery worker keeps its own registry; the numbers are meant
+for the ``/metrics`` endpoint and for log lines, not for long‑term storage.
+
+Usage:
+  metrics.counter("llm.errors").inc()
+  metrics.latency("llm.complete").observe(0.231)
+  metrics.snapshot()  # -> {"counters": {...}, "latency": {...}}
+"""
+from __future__ import annotations
+
+import threading
+from collections import deque
+from typing import Deque, Dict
+
+__all__ = ["Counter", "LatencyStats", "MetricsRegistry", "metrics"]
+
+
+def _nearest_rank(ordered: list, pct: float) -> float | None:
+    if not ordered:
+        return None
+    idx = min(len(ordered) - 1, max(0, int(round(pct / 100.0 * len(ordered))) - 1))
+    return ordered[idx]
+
+
+class Counter:
+    """Monotonic, thread‑safe integer counter."""
+
+    def __init__(self) -> None:
+        self._value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: int = 1) -> None:
+        with self._lock:
+            self._value += amount
+
+    @property
+    def value(self) -> int:
+        return self._value
+
+
+class LatencyStats:
+    """Rolling window of latency samples (seconds) with percentile summaries."""
+
+    def __init__(self, window: int = 1024) -> None:
+        self._samples: Deque[float] = deque(maxlen=window)
+        self._count = 0
+        self._total = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float) -> None:
+        with self._lock:
+            self._samples.append(seconds)
+            self._count += 1
+            self._total += seconds
+
+    def percentile(self, pct: float) -> float | None:
+        """Return the *pct* percentile (0–100) of the window in seconds."""
+        with self._lock:
+            ordered = sorted(self._samples)
+        return _nearest_rank(ordered, pct)
+
+    def snapshot(self) -> Dict[str, float | int | None]:
+        with self._lock:
+            ordered = sorted(self._samples)
+            count, total = self._count, self._total
+
+        def _ms(value: float | None) -> float | None:
+            return round(value * 1000, 3) if value is not None else None
+
+        return {
+            "count": count,
+            "mean_ms": _ms(total / count) if count else None,
+            "p50_ms": _ms(_nearest_rank(ordered, 50)),
+            "p95_ms": _ms(_nearest_rank(ordered, 95)),
+            "p99_ms": _ms(_nearest_rank(ordered, 99)),
+            "max_ms": _ms(ordered[-1]) if ordered else None,
+        }
+
+
+class MetricsRegistry:
+    """Named collection of :class:`Counter` and :class:`LatencyStats`."""
+
+    def __init__(self) -> None:
+        self._counters: Dict[str, Counter] = {}
+        self._latencies: Dict[str, LatencyStats] = {}
+        self._lock = threading.Lock()
+
+    def counter(self, name: str) -> Counter:
+        with self._lock:
+            return self._counters.setdefault(name, Counter())
+
+    def latency(self, name: str) -> LatencyStats:
+        with self._lock:
+            return self._latencies.setdefault(name, LatencyStats())
+
+    def snapshot(self, prefix: str = "") -> Dict[str, Dict]:
+        with self._lock:
+            counters = dict(self._counters)
+            latencies = dict(self._latencies)
+        return {
+            "counters": {k: c.value for k, c in sorted(counters.items()) if k.startswith(prefix)},
+            "latency": {k: l.snapshot() for k, l in sorted(latencies.items()) if k.startswith(prefix)},
+        }
+
+    def reset(self) -> None:
+        with self._lock:
+            self._counters.clear()
+            self._latencies.clear()
+
+
+metrics: MetricsRegistry = MetricsRegistry()
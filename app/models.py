@@ -2,15 +2,16 @@
 
 from __future__ import annotations
 
+import hashlib
+import hmac
 import secrets
 from datetime import datetime
 from typing import Optional, Tuple
 
 from flask import current_app
 from itsdangerous import BadTimeSignature, SignatureExpired, URLSafeTimedSerializer
-from werkzeug.security import check_password_hash, generate_password_hash
 
-from . import db
+from . import db, password_hasher
 from flask_login import UserMixin
 
 class Organization(db.Model):
@@ -24,6 +25,13 @@ class Organization(db.Model):
     is_subscribed: bool = db.Column(db.Boolean, default=False, nullable=False)
     subscription_id: Optional[str] = db.Column(db.String(120), unique=True, nullable=True)
     stripe_price_id: Optional[str] = db.Column(db.String(120), nullable=True)
+    subscription_status: Optional[str] = db.Column(db.String(32), nullable=True)  # Stripe's, e.g. 'active', 'past_due'
+    current_period_end: Optional[datetime] = db.Column(db.DateTime, nullable=True)
+    # `created` of the last Stripe event applied; older deliveries are skipped (see app/billing.py)
+    stripe_event_at: Optional[datetime] = db.Column(db.DateTime, nullable=True)
+
+    # Opt-out for the shared prompt/response cache (e.g. for sensitive prompts)
+    response_cache_enabled: bool = db.Column(db.Boolean, default=True, nullable=False, server_default=db.true())
 
     members = db.relationship('Membership', back_populates='organization', cascade="all, delete-orphan")
 
@@ -39,6 +47,188 @@ class Membership(db.Model):
     user = db.relationship('User', back_populates='memberships')
     organization = db.relationship('Organization', back_populates='members')
 
+class UsageEvent(db.Model):
+    """One metered generation; written in bulk by ``app.metering``."""
+    __tablename__ = 'usage_events'
+    __table_args__ = (db.Index('ix_usage_events_org_created', 'organization_id', 'created_at'),)
+
+    id: int = db.Column(db.BigInteger().with_variant(db.Integer, 'sqlite'), primary_key=True)
+    organization_id: int = db.Column(db.Integer, db.ForeignKey('organizations.id', ondelete='CASCADE'), nullable=False)
+    user_id: Optional[int] = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='SET NULL'), nullable=True)
+    endpoint: str = db.Column(db.String(64), nullable=False)  # e.g. 'api.generate', 'features.generate_text'
+    model: Optional[str] = db.Column(db.String(64), nullable=True)
+    status: str = db.Column(db.String(16), nullable=False, default='ok')  # 'ok' or 'error'
+    prompt_tokens: int = db.Column(db.Integer, nullable=False, default=0)
+    completion_tokens: int = db.Column(db.Integer, nullable=False, default=0)
+    latency_ms: float = db.Column(db.Float, nullable=False, default=0.0)
+    created_at: datetime = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+
+class UsageHourly(db.Model):
+    """Per-organization hourly aggregate of ``UsageEvent`` rows, kept by the rollup task."""
+    __tablename__ = 'usage_hourly'
+
+    organization_id: int = db.Column(db.Integer, db.ForeignKey('organizations.id', ondelete='CASCADE'), primary_key=True)
+    hour: datetime = db.Column(db.DateTime, primary_key=True)  # start of the hour, UTC
+    requests: int = db.Column(db.Integer, nullable=False, default=0)
+    errors: int = db.Column(db.Integer, nullable=False, default=0)
+    prompt_tokens: int = db.Column(db.BigInteger, nullable=False, default=0)
+    completion_tokens: int = db.Column(db.BigInteger, nullable=False, default=0)
+    total_latency_ms: float = db.Column(db.Float, nullable=False, default=0.0)
+    max_latency_ms: float = db.Column(db.Float, nullable=False, default=0.0)
+
+    @property
+    def avg_latency_ms(self) -> float:
+        return self.total_latency_ms / self.requests if self.requests else 0.0
+
+class StripeEvent(db.Model):
+    """A verified Stripe webhook delivery, stored on receipt and applied by ``app.billing``.
+
+    The primary key is Stripe's event id, so a redelivered event is a no-op.
+    ``account`` (the Stripe customer, or ``org:<id>`` before one exists) groups
+    the events that touch one organization so they are applied together in
+    ``created`` order.
+    """
+    __tablename__ = 'stripe_events'
+    __table_args__ = (db.Index('ix_stripe_events_status_account', 'status', 'account', 'created'),)
+
+    PENDING, PROCESSED, IGNORED, FAILED = 'pending', 'processed', 'ignored', 'failed'
+
+    id: str = db.Column(db.String(255), primary_key=True)  # evt_…
+    type: str = db.Column(db.String(100), nullable=False)
+    account: Optional[str] = db.Column(db.String(120), nullable=True)
+    created: datetime = db.Column(db.DateTime, nullable=False)  # Stripe's event timestamp
+    payload: str = db.Column(db.Text, nullable=False)  # the event as JSON
+    status: str = db.Column(db.String(16), nullable=False, default=PENDING)
+    attempts: int = db.Column(db.Integer, nullable=False, default=0)
+    last_error: Optional[str] = db.Column(db.Text, nullable=True)
+    received_at: datetime = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    processed_at: Optional[datetime] = db.Column(db.DateTime, nullable=True)
+
+    def __repr__(self) -> str:
+        return f'<StripeEvent {self.id} {self.type} {self.status}>'
+
+class Campaign(db.Model):
+    """A bulk email to the members of one organization, or of every organization.
+
+    ``app.campaigns`` streams the recipients into :class:`CampaignChunk` rows
+    and sends each chunk in one Celery task; the counters here are the
+    running totals of those chunks.  ``context`` holds the (small, JSON)
+    template variables shared by every message.
+    """
+    __tablename__ = 'email_campaigns'
+
+    PLANNING, SENDING, DONE, FAILED = 'planning', 'sending', 'done', 'failed'
+
+    id: int = db.Column(db.Integer, primary_key=True)
+    subject: str = db.Column(db.String(255), nullable=False)
+    template: str = db.Column(db.String(255), nullable=False)  # without .txt/.html
+    context: Optional[str] = db.Column(db.Text, nullable=True)  # JSON object
+    # None: every organization's members
+    organization_id: Optional[int] = db.Column(db.Integer, db.ForeignKey('organizations.id', ondelete='CASCADE'),
+                                               nullable=True)
+    created_by_id: Optional[int] = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='SET NULL'),
+                                             nullable=True)
+    chunk_size: int = db.Column(db.Integer, nullable=False)
+    status: str = db.Column(db.String(16), nullable=False, default=PLANNING)
+    recipients: int = db.Column(db.Integer, nullable=False, default=0)
+    chunks: int = db.Column(db.Integer, nullable=False, default=0)
+    chunks_done: int = db.Column(db.Integer, nullable=False, default=0)
+    sent: int = db.Column(db.Integer, nullable=False, default=0)
+    failed: int = db.Column(db.Integer, nullable=False, default=0)
+    created_at: datetime = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    finished_at: Optional[datetime] = db.Column(db.DateTime, nullable=True)
+
+    def __repr__(self) -> str:
+        return f'<Campaign {self.id} {self.status} {self.sent}/{self.recipients}>'
+
+class CampaignChunk(db.Model):
+    """Up to ``Campaign.chunk_size`` recipients: the users with ids in [first_user_id, last_user_id]."""
+    __tablename__ = 'email_campaign_chunks'
+
+    PENDING, DONE, FAILED = 'pending', 'done', 'failed'
+
+    campaign_id: int = db.Column(db.Integer, db.ForeignKey('email_campaigns.id', ondelete='CASCADE'),
+                                 primary_key=True)
+    index: int = db.Column(db.Integer, primary_key=True)
+    first_user_id: int = db.Column(db.Integer, nullable=False)
+    last_user_id: int = db.Column(db.Integer, nullable=False)
+    recipients: int = db.Column(db.Integer, nullable=False)
+    # JSON list of the users whose messages were deferred; a retried chunk sends to exactly these
+    deferred_user_ids: Optional[str] = db.Column(db.Text, nullable=True)
+    status: str = db.Column(db.String(16), nullable=False, default=PENDING)
+    sent: int = db.Column(db.Integer, nullable=False, default=0)
+    failed: int = db.Column(db.Integer, nullable=False, default=0)
+    attempts: int = db.Column(db.Integer, nullable=False, default=0)
+    last_error: Optional[str] = db.Column(db.Text, nullable=True)
+    finished_at: Optional[datetime] = db.Column(db.DateTime, nullable=True)
+
+    def __repr__(self) -> str:
+        return f'<CampaignChunk {self.campaign_id}/{self.index} {self.status}>'
+
+class ApiKey(db.Model):
+    """An API credential: public indexed prefix plus the SHA-256 of the full key.
+
+    Keys look like ``aig_<16 hex>_<secret>``; the first :attr:`PREFIX_LENGTH`
+    characters (64 random bits, so prefixes don't collide) are stored in the
+    clear for lookup and display, the rest is only ever compared by hash.
+    Older keys (``aig_<8 hex>_…``) and keys carried over from the old
+    ``users.api_key`` column (64 hex chars) use their first 12 characters.
+    ``last_used_at`` / ``request_count`` are written in bulk by
+    ``app.apikeys`` rather than on every request.
+    """
+    __tablename__ = 'api_keys'
+
+    PREFIX_LENGTH = 20
+    LEGACY_PREFIX_LENGTH = 12
+    ALL_SCOPES = '*'
+
+    id: int = db.Column(db.Integer, primary_key=True)
+    user_id: int = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False, index=True)
+    organization_id: Optional[int] = db.Column(db.Integer, db.ForeignKey('organizations.id', ondelete='CASCADE'), nullable=True)
+    name: str = db.Column(db.String(64), nullable=False, default='Default')
+    prefix: str = db.Column(db.String(24), unique=True, nullable=False, index=True)
+    key_hash: str = db.Column(db.String(64), nullable=False)
+    scopes: str = db.Column(db.String(255), nullable=False, default=ALL_SCOPES)  # space-separated, '*' = all
+    created_at: datetime = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    expires_at: Optional[datetime] = db.Column(db.DateTime, nullable=True)
+    revoked_at: Optional[datetime] = db.Column(db.DateTime, nullable=True)
+    last_used_at: Optional[datetime] = db.Column(db.DateTime, nullable=True)
+    request_count: int = db.Column(db.BigInteger, nullable=False, default=0)
+
+    user = db.relationship('User', back_populates='api_keys')
+
+    @staticmethod
+    def hash_key(key: str) -> str:
+        return hashlib.sha256(key.encode()).hexdigest()
+
+    @classmethod
+    def prefix_of(cls, key: str) -> str:
+        if key.startswith('aig_') and key.find('_', 4) == cls.PREFIX_LENGTH:
+            return key[:cls.PREFIX_LENGTH]
+        return key[:cls.LEGACY_PREFIX_LENGTH]
+
+    @classmethod
+    def generate(cls, **kwargs) -> Tuple[ApiKey, str]:
+        """Create an unsaved key; returns ``(row, plaintext)`` – the plaintext is never stored."""
+        plaintext = f'aig_{secrets.token_hex(8)}_{secrets.token_urlsafe(32)}'
+        return cls(prefix=cls.prefix_of(plaintext), key_hash=cls.hash_key(plaintext), **kwargs), plaintext
+
+    def verify(self, key: str) -> bool:
+        """Constant-time comparison of *key* against the stored hash."""
+        return hmac.compare_digest(self.key_hash, self.hash_key(key))
+
+    def allows(self, scope: Optional[str]) -> bool:
+        granted = self.scopes.split()
+        return scope is None or self.ALL_SCOPES in granted or scope in granted
+
+    @property
+    def is_active(self) -> bool:
+        now = datetime.utcnow()
+        return self.revoked_at is None and (self.expires_at is None or self.expires_at > now)
+
+    def __repr__(self) -> str:
+        return f'<ApiKey {self.prefix}…>'
+
 class User(UserMixin, db.Model):
     """
     User model for the application.
@@ -60,11 +250,17 @@ class User(UserMixin, db.Model):
     confirmed: bool = db.Column(db.Boolean, nullable=False, default=False)
     confirmed_on: Optional[datetime] = db.Column(db.DateTime, nullable=True)
 
-    # API Key
-    api_key: str = db.Column(db.String(64), unique=True, nullable=False, index=True)
+    # Bumped whenever cached session identities must be rejected (see app/identity.py)
+    session_version: int = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+
+    # Plaintext of the key issued when this object was created (see __init__);
+    # never persisted, so it is None on users loaded from the database.
+    api_key = None
 
     # Relationships
     memberships = db.relationship('Membership', back_populates='user', cascade="all, delete-orphan")
+    api_keys = db.relationship('ApiKey', back_populates='user', cascade="all, delete-orphan",
+                               order_by='ApiKey.id')
 
     @property
     def current_organization(self) -> Optional[Organization]:
@@ -81,8 +277,8 @@ class User(UserMixin, db.Model):
         return f'<User {self.email}>'
 
     def set_password(self, password: str) -> None:
-        """Hashes and sets the user's password."""
-        self.password_hash = generate_password_hash(password)
+        """Hashes and sets the user's password (in the bounded hashing pool, see app/passwords.py)."""
+        self.password_hash = password_hasher.hash(password)
 
     def check_password(self, password: str) -> bool:
         """
@@ -91,7 +287,7 @@ class User(UserMixin, db.Model):
         """
         if not self.password_hash:
             return False
-        return check_password_hash(self.password_hash, password)
+        return password_hasher.verify(self.password_hash, password)
 
     def generate_token(self, salt: str, expires_sec: int = 1800) -> str:
         """
@@ -183,5 +379,6 @@ class User(UserMixin, db.Model):
 
     def __init__(self, **kwargs):
         super(User, self).__init__(**kwargs)
-        if self.api_key is None:
-            self.api_key = secrets.token_hex(32)
+        if not self.api_keys:
+            key, self.api_key = ApiKey.generate()
+            self.api_keys.append(key)
@@ -0,0 +1,134 @@
+"""Bounded, configurable password hashing.
+
+Werkzeug's hashes are deliberately slow (tens to hundreds of ms).  Run inline
+in every request thread, a signup burst pins every worker thread on them and
+piles up requests without limit.  :class:`PasswordHasher` runs them in a small
+thread pool instead (``PASSWORD_HASH_WORKERS``; ``hashlib``'s scrypt and
+PBKDF2 release the GIL, so they use real cores).  At most
+``PASSWORD_HASH_MAX_PENDING`` hashes may be admitted at once; past that
+:class:`HashPoolSaturated` is raised straight away and ``auth`` answers 503
+with ``Retry-After``.  Nothing is queued without limit.  A hash whose caller
+gave up waiting (``PASSWORD_HASH_TIMEOUT``) keeps its slot until it actually
+finishes, since it still occupies a pool thread.
+
+The algorithm and cost come from ``PASSWORD_HASH_METHOD`` (any werkzeug
+method string, e.g. ``scrypt:32768:8:1`` or ``pbkdf2:sha256:600000``).
+:meth:`PasswordHasher.needs_rehash` tells whether a stored hash uses a
+different method, so ``auth.login`` can upgrade it after a successful login.
+
+Usage:
+  user.password_hash = password_hasher.hash(password)
+  if password_hasher.verify(user.password_hash, password): ...
+"""
+from __future__ import annotations
+
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+from typing import Any, Callable, Dict, Optional
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+from .metrics import metrics
+
+__all__ = ["HashPoolSaturated", "PasswordHasher"]
+
+
+class HashPoolSaturated(RuntimeError):
+    """Too many password hashes are already in flight; try again shortly."""
+
+
+class PasswordHasher:
+    """Flask extension running password hashes in a bounded thread pool."""
+
+    def __init__(self, app=None) -> None:
+        self.method = "scrypt"
+        self.workers = 2
+        self.max_pending = 8
+        self.timeout = 10.0
+        self._method_prefix: Optional[str] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._executor_pid: Optional[int] = None
+        self._pending = 0
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app) -> None:
+        self.shutdown()
+        self.method = app.config.get("PASSWORD_HASH_METHOD", self.method)
+        self.workers = app.config.get("PASSWORD_HASH_WORKERS", self.workers)
+        self.max_pending = app.config.get("PASSWORD_HASH_MAX_PENDING", self.max_pending)
+        self.timeout = app.config.get("PASSWORD_HASH_TIMEOUT", self.timeout)
+        self._method_prefix = None
+        app.extensions["password_hasher"] = self
+
+    # ------------------------------------------------------------------
+    # Pool
+    # ------------------------------------------------------------------
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        # Threads do not survive a fork: a pre-forked gunicorn worker gets its own pool.
+        with self._lock:
+            if self._executor is None or self._executor_pid != os.getpid():
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="password-hash")
+                self._executor_pid = os.getpid()
+            return self._executor
+
+    def shutdown(self) -> None:
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None and self._executor_pid == os.getpid():
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def _run(self, name: str, fn: Callable[..., Any], *args: Any) -> Any:
+        """Admit, run *fn* in the pool and wait for it; raises :class:`HashPoolSaturated`."""
+        with self._lock:
+            if self._pending >= self.max_pending:
+                metrics.counter("passwords.rejected").inc()
+                raise HashPoolSaturated("password hashing pool is saturated")
+            self._pending += 1
+        started = time.perf_counter()
+        try:
+            future = self.executor.submit(fn, *args)
+        except BaseException:
+            self._release()
+            raise
+        future.add_done_callback(self._release)  # also on cancel; not when the wait below times out
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeout:
+            future.cancel()
+            metrics.counter("passwords.timeouts").inc()
+            raise HashPoolSaturated(f"no {name} result within {self.timeout:.1f}s") from None
+        finally:
+            metrics.latency(f"passwords.{name}").observe(time.perf_counter() - started)
+
+    def _release(self, future: Optional[Future] = None) -> None:
+        with self._lock:
+            self._pending -= 1
+
+    # ------------------------------------------------------------------
+    # Hashing
+    # ------------------------------------------------------------------
+
+    def hash(self, password: str) -> str:
+        return self._run("hash", generate_password_hash, password, self.method)
+
+    def verify(self, password_hash: str, password: str) -> bool:
+        return self._run("verify", check_password_hash, password_hash, password)
+
+    def needs_rehash(self, password_hash: str) -> bool:
+        """Whether *password_hash* was made with another method or cost than the configured one."""
+        if self._method_prefix is None:
+            # Let werkzeug expand defaults ("scrypt" -> "scrypt:32768:8:1") once.
+            self._method_prefix = generate_password_hash("", self.method).split("$", 1)[0]
+        return password_hash.split("$", 1)[0] != self._method_prefix
+
+    def stats(self) -> Dict[str, Any]:
+        snapshot = metrics.snapshot(prefix="passwords.")
+        snapshot["pending"] = self._pending
+        return snapshot
@@ -0,0 +1,195 @@
+"""Lightweight Celery task payloads: references instead of ORM objects.
+
+Tasks are serialized as JSON, so a task argument must never be an ORM object.
+Pass :func:`ref` instead, a small ``{"$ref": "User", "id": 42}`` marker that
+carries nothing but the model name and primary key:
+
+  send_email.delay(user.email, "Confirm Your Account", "email/confirm", user=ref(user), token=token)
+
+:class:`PayloadTask`, the base class of every task on the app's Celery
+instance, applies the convention:
+
+* On the producer side, :func:`pack` rejects ORM objects with a
+  ``TypeError`` (instead of kombu's ``EncodeError`` in production and silent
+  success under eager tests).  It also rejects messages whose JSON is over
+  ``TASK_PAYLOAD_MAX_BYTES`` with :class:`PayloadTooLarge`.  A task can set
+  its own ``payload_max_bytes``; ``0`` turns the size check off for it.
+* On the worker side, :func:`hydrate` replaces every reference in the
+  arguments with the object it names.  All references to the same model are
+  loaded together in one ``SELECT … WHERE id IN (…)``;
+  :func:`hydrate_many` does the same across a batch of payloads.  A
+  reference to a deleted row hydrates to ``None``.
+"""
+from __future__ import annotations
+
+import json
+from collections import defaultdict
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from celery import Task
+
+from .metrics import metrics
+
+__all__ = ["PayloadTask", "PayloadTooLarge", "hydrate", "hydrate_many", "is_ref", "pack", "ref"]
+
+REF_KEY = "$ref"
+
+
+class PayloadTooLarge(ValueError):
+    """A task's arguments serialize to more than its payload limit."""
+
+    def __init__(self, task: str, size: int, limit: int) -> None:
+        super().__init__(f"Payload of task {task!r} is {size} bytes, over the {limit} byte limit; "
+                         f"pass ids (ref()) instead of data")
+        self.task, self.size, self.limit = task, size, limit
+
+
+def ref(obj_or_model: Any, id: Any = None) -> Dict[str, Any]:
+    """Reference to an ORM object, ``ref(user)``, or to a row by key, ``ref(User, user_id)``."""
+    if id is None:
+        from sqlalchemy import inspect
+
+        state = inspect(obj_or_model)
+        if state.identity is None:
+            raise ValueError(f"{obj_or_model!r} has no primary key yet; flush it before passing it to a task")
+        model, key = type(obj_or_model), state.identity
+        id = key[0] if len(key) == 1 else list(key)
+    else:
+        model = obj_or_model
+    return {REF_KEY: model.__name__, "id": id}
+
+
+def is_ref(value: Any) -> bool:
+    return isinstance(value, dict) and REF_KEY in value and len(value) == 2
+
+
+# ---------------------------------------------------------------------------
+# Producer side
+# ---------------------------------------------------------------------------
+
+def _check(value: Any, path: str) -> None:
+    from . import db
+
+    if isinstance(value, db.Model):
+        raise TypeError(f"Task argument {path} is a {type(value).__name__} object; pass ref(obj) instead")
+    if isinstance(value, dict):
+        for key, item in value.items():
+            _check(item, f"{path}[{key!r}]")
+    elif isinstance(value, (list, tuple)):
+        for index, item in enumerate(value):
+            _check(item, f"{path}[{index}]")
+
+
+def pack(task: str, args: Sequence[Any], kwargs: Dict[str, Any], limit: Optional[int]) -> int:
+    """Validate a task's arguments before they are sent; returns their JSON size in bytes."""
+    for index, value in enumerate(args):
+        _check(value, f"#{index}")
+    for key, value in kwargs.items():
+        _check(value, key)
+    size = len(json.dumps([args, kwargs], separators=(",", ":"), default=str))
+    if limit is not None and size > limit:
+        metrics.counter("task.payload.rejected").inc()
+        raise PayloadTooLarge(task, size, limit)
+    metrics.counter("task.payload.sent").inc()
+    metrics.counter("task.payload.bytes").inc(size)
+    return size
+
+
+# ---------------------------------------------------------------------------
+# Worker side
+# ---------------------------------------------------------------------------
+
+def _collect(value: Any, wanted: Dict[str, set]) -> None:
+    if is_ref(value):
+        wanted[value[REF_KEY]].add(_key(value["id"]))
+    elif isinstance(value, dict):
+        for item in value.values():
+            _collect(item, wanted)
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            _collect(item, wanted)
+
+
+def _replace(value: Any, loaded: Dict[str, Dict[Any, Any]]) -> Any:
+    if is_ref(value):
+        return loaded[value[REF_KEY]].get(_key(value["id"]))
+    if isinstance(value, dict):
+        return {key: _replace(item, loaded) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_replace(item, loaded) for item in value]
+    if isinstance(value, tuple):
+        return tuple(_replace(item, loaded) for item in value)
+    return value
+
+
+def _key(id: Any) -> Any:
+    return tuple(id) if isinstance(id, list) else id
+
+
+def _load(wanted: Dict[str, set]) -> Dict[str, Dict[Any, Any]]:
+    """One query per model for every referenced key."""
+    from sqlalchemy import select, tuple_
+
+    from . import db
+
+    registry = db.Model.registry._class_registry
+    loaded: Dict[str, Dict[Any, Any]] = {}
+    for name, keys in wanted.items():
+        model = registry.get(name)
+        if model is None:
+            raise LookupError(f"Task payload references unknown model {name!r}")
+        columns = model.__mapper__.primary_key
+        if len(columns) == 1:
+            condition = columns[0].in_(keys)
+        else:
+            condition = tuple_(*columns).in_(list(keys))
+        loaded[name] = {}
+        for obj in db.session.scalars(select(model).where(condition)):
+            identity = model.__mapper__.primary_key_from_instance(obj)
+            loaded[name][identity[0] if len(identity) == 1 else tuple(identity)] = obj
+        metrics.counter("task.hydrate.queries").inc()
+    return loaded
+
+
+def hydrate_many(payloads: List[Any]) -> List[Any]:
+    """Replace the references in every payload, loading each model's objects in one query."""
+    wanted: Dict[str, set] = defaultdict(set)
+    _collect(payloads, wanted)
+    if not wanted:
+        return payloads
+    loaded = _load(wanted)
+    return [_replace(payload, loaded) for payload in payloads]
+
+
+def hydrate(args: Sequence[Any], kwargs: Dict[str, Any]) -> Tuple[tuple, Dict[str, Any]]:
+    """The task's arguments with their references replaced by objects."""
+    args, kwargs = hydrate_many([list(args), kwargs])
+    return tuple(args), kwargs
+
+
+# ---------------------------------------------------------------------------
+# Task base class
+# ---------------------------------------------------------------------------
+
+class PayloadTask(Task):
+    """Checks arguments with :func:`pack` when sending and hydrates them with :func:`hydrate` when run."""
+
+    #: Overrides the app's ``task_payload_max_bytes`` for this task; 0 disables the size check.
+    payload_max_bytes: Optional[int] = None
+
+    def apply_async(self, args=None, kwargs=None, *rest, **options):  # type: ignore[override]
+        limit = self.payload_max_bytes
+        if limit is None:
+            limit = self.app.conf.get("task_payload_max_bytes")
+        pack(self.name, args or (), kwargs or {}, limit or None)
+        return super().apply_async(args, kwargs, *rest, **options)
+
+    def __call__(self, *args, **kwargs):  # type: ignore[override]
+        args, kwargs = hydrate(args, kwargs)
+        request = self.request_stack.top
+        if request is not None and not request.called_directly and not getattr(request, "_hydrated", False):
+            # Run by the tracer (worker or eager apply), which already pushed this task and its
+            # request; Task.__call__ would shadow that request with a bare one and lose its id.
+            request._hydrated = True
+            return self.run(*args, **kwargs)
+        return super().__call__(*args, **kwargs)
@@ -3,7 +3,7 @@
 This blueprint handles:
   • Creating a Checkout session for the current organization
   • Redirecting owners to the Stripe Customer Portal
-  • Receiving Stripe webhooks and updating org subscription state
+  • Receiving Stripe webhooks (stored and acknowledged here, applied by app.billing)
 
 All Stripe credentials are pulled from env‑vars that Render injects:
   STRIPE_SECRET_KEY, STRIPE_PUBLISHABLE_KEY, STRIPE_PRICE_ID, STRIPE_WEBHOOK_SECRET
@@ -16,7 +16,8 @@ import stripe
 from flask import Blueprint, current_app, flash, jsonify, redirect, request, url_for
 from flask_login import current_user, login_required
 
-from . import db
+from .billing import ingest_event
+from .context import request_context
 from .decorators import role_required
 from .models import Organization
 
@@ -26,6 +27,8 @@ from .models import Organization
 stripe.api_key = os.getenv("STRIPE_SECRET_KEY")
 if not stripe.api_key:
     raise RuntimeError("STRIPE_SECRET_KEY missing from environment variables.")
+if os.getenv("STRIPE_API_BASE"):  # e.g. a local stripe-mock
+    stripe.api_base = os.environ["STRIPE_API_BASE"]
 
 # Blueprint
 payments = Blueprint("payments", __name__)
@@ -38,7 +41,7 @@ payments = Blueprint("payments", __name__)
 @role_required("owner")
 def create_checkout_session():
     """Start a Stripe Checkout subscription flow for the caller’s organization."""
-    org: Organization | None = current_user.current_organization
+    org: Organization | None = request_context().organization
     if org is None:
         flash("You are not part of any organization.", "error")
         return redirect(url_for("main.dashboard"))
@@ -71,7 +74,7 @@ def create_checkout_session():
 @role_required("owner")
 def customer_portal():
     """Redirect the owner to Stripe’s Customer Portal to manage the subscription."""
-    org: Organization | None = current_user.current_organization
+    org: Organization | None = request_context().organization
     if not (org and org.stripe_customer_id):
         flash("Your organization doesn't have a subscription to manage.", "error")
         return redirect(url_for("main.dashboard"))
@@ -94,7 +97,7 @@ def customer_portal():
 # ---------------------------------------------------------------------------
 @payments.route("/stripe/webhook", methods=["POST"])
 def stripe_webhook():
-    """Receive Stripe webhook events & update subscription state."""
+    """Verify a Stripe webhook, store the event and acknowledge it (see app/billing.py)."""
     payload: str = request.get_data(as_text=True)
     sig_header: str | None = request.headers.get("Stripe-Signature")
     secret = current_app.config.get("STRIPE_WEBHOOK_SECRET")
@@ -109,31 +112,7 @@ def stripe_webhook():
         current_app.logger.warning("Invalid Stripe webhook: %s", exc)
         return "Invalid payload or signature", 400
 
-    event_type = event["type"]
-    data_obj = event["data"]["object"]
-
-    # ------------------ checkout.session.completed ------------------
-    if event_type == "checkout.session.completed":
-        org_id = data_obj.get("client_reference_id")
-        customer_id = data_obj.get("customer")
-        subscription_id = data_obj.get("subscription")
-
-        if org_id:
-            org = Organization.query.get(org_id)
-            if org:
-                org.stripe_customer_id = customer_id
-                org.subscription_id = subscription_id
-                org.is_subscribed = True
-                db.session.commit()
-
-    # ------------------ customer.subscription.deleted --------------
-    elif event_type == "customer.subscription.deleted":
-        customer_id = data_obj.get("customer")
-        if customer_id:
-            org = Organization.query.filter_by(stripe_customer_id=customer_id).first()
-            if org:
-                org.is_subscribed = False
-                org.subscription_id = None
-                db.session.commit()
-
+    # Persist and hand off: processing happens in the billing.process_events task
+    if not ingest_event(event):
+        return jsonify(status="duplicate"), 200
     return jsonify(status="success"), 200
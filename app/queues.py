@@ -0,0 +1,124 @@
+"""Celery queue topology: declared queues, task routes, priorities and worker profiles.
+
+With one default queue, a burst of campaign emails or a nightly
+reconciliation sits in front of generation jobs and Stripe webhooks.  Tasks
+are therefore routed by name to four queues:
+
+* ``realtime``: API generation jobs and their callbacks.  A caller is waiting.
+* ``billing``: Stripe webhook events and usage metering.
+* ``email``: transactional email (confirmation, password reset) and the
+  SMTP outbox.
+* ``bulk``: campaigns, rollups and reconciliation.  Throughput matters here,
+  latency does not.
+
+Each route also carries a priority level (``high``/``normal``/``low``), so
+within a queue a confirmation email overtakes an outbox sweep.  The number
+Celery gets depends on the broker: the Redis transport serves 0 first,
+AMQP serves ``x-max-priority`` (9) first.
+
+A worker consumes every queue unless it is started with a **profile**
+(``CELERY_WORKER_PROFILE``, see ``celery_worker.py``).  A profile selects
+its queues, concurrency and prefetch multiplier.  Real-time and bulk
+workers prefetch one message per process, so a long task never holds
+messages that another process could run; email workers prefetch more.
+``CELERY_WORKER_PROFILES`` overrides the defaults per profile, e.g.
+``{"realtime": {"concurrency": 16}}``.
+
+Upgrading from the single queue: messages published before the upgrade sit
+in Celery's old default queue, ``celery``.  It stays declared and the
+``realtime`` and ``all`` profiles keep consuming it
+(:data:`LEGACY_QUEUES`) for one release, so nothing queued during the
+deploy is stranded; drop it once ``redis-cli llen celery`` reports 0 on
+every broker.  The Redis priority lists keep kombu's default key separator,
+so a priority-0 message is still the bare ``celery`` list.
+
+Usage:
+  CELERY_WORKER_PROFILE=realtime celery -A celery_worker.celery worker -n realtime@%h
+  celery -A celery_worker.celery worker -Q bulk       # an explicit -Q still wins
+"""
+from __future__ import annotations
+
+import copy
+from typing import Any, Dict, Mapping, Tuple
+
+__all__ = ["LEGACY_QUEUES", "QUEUES", "ROUTES", "WORKER_PROFILES", "apply_worker_profile", "configure", "priorities"]
+
+QUEUES: Tuple[str, ...] = ("realtime", "billing", "email", "bulk")
+
+#: queues nothing routes to any more, still drained so messages from before the upgrade run
+LEGACY_QUEUES: Tuple[str, ...] = ("celery",)
+
+#: task name -> (queue, priority level)
+ROUTES: Dict[str, Tuple[str, str]] = {
+    "generation.run": ("realtime", "high"),
+    "generation.callback": ("realtime", "normal"),
+    "billing.process_events": ("billing", "high"),
+    "billing.process_pending": ("billing", "normal"),
+    "usage.ingest": ("billing", "normal"),
+    "apikeys.flush_usage": ("billing", "low"),
+    "email.send": ("email", "high"),
+    "email.drain_outbox": ("email", "normal"),
+    "email.plan_campaign": ("bulk", "normal"),
+    "email.send_campaign_chunk": ("bulk", "low"),
+    "usage.rollup": ("bulk", "low"),
+    "billing.reconcile_subscriptions": ("bulk", "low"),
+}
+
+WORKER_PROFILES: Dict[str, Dict[str, Any]] = {
+    "realtime": {"queues": ["realtime", *LEGACY_QUEUES], "concurrency": 8, "prefetch_multiplier": 1},
+    "billing": {"queues": ["billing"], "concurrency": 2, "prefetch_multiplier": 1},
+    "email": {"queues": ["email"], "concurrency": 4, "prefetch_multiplier": 4},
+    "bulk": {"queues": ["bulk"], "concurrency": 2, "prefetch_multiplier": 1},
+    "all": {"queues": [*QUEUES, *LEGACY_QUEUES], "concurrency": 4, "prefetch_multiplier": 1},  # local dev: one worker
+}
+
+MAX_PRIORITY = 9
+
+
+def _is_redis(broker_url: str | None) -> bool:
+    return (broker_url or "").startswith(("redis://", "rediss://", "sentinel://", "unix://"))
+
+
+def priorities(broker_url: str | None) -> Dict[str, int]:
+    """Priority numbers for the levels on *broker_url*'s transport."""
+    if _is_redis(broker_url):
+        return {"high": 0, "normal": 5, "low": MAX_PRIORITY}  # kombu's Redis transport serves 0 first
+    return {"high": MAX_PRIORITY, "normal": 5, "low": 0}
+
+
+def configure(celery, config: Mapping[str, Any]) -> None:
+    """Declare the queues, routes, priorities and worker profiles on *celery* from the Flask *config*."""
+    from kombu import Queue
+
+    broker_url = config.get("CELERY_BROKER_URL")
+    levels = priorities(broker_url)
+    profiles = copy.deepcopy(WORKER_PROFILES)
+    for name, overrides in (config.get("CELERY_WORKER_PROFILES") or {}).items():
+        profiles.setdefault(name, {"queues": [name], "concurrency": 2, "prefetch_multiplier": 1}).update(overrides)
+
+    options: Dict[str, Any] = {
+        "task_queues": [Queue(name, routing_key=name) for name in (*QUEUES, *LEGACY_QUEUES)],
+        "task_default_queue": config.get("CELERY_DEFAULT_QUEUE", "realtime"),
+        "task_routes": {task: {"queue": queue, "priority": levels[level]} for task, (queue, level) in ROUTES.items()},
+        "task_default_priority": levels["normal"],
+        "task_queue_max_priority": MAX_PRIORITY,  # AMQP: declare x-max-priority
+        "worker_profiles": profiles,
+    }
+    if _is_redis(broker_url):
+        # One Redis list per priority step, drained in priority order.  Keep kombu's default key
+        # separator: changing it would orphan the priority lists already in the broker.
+        options["broker_transport_options"] = {"queue_order_strategy": "priority",
+                                               "priority_steps": list(range(MAX_PRIORITY + 1))}
+    celery.conf.update(**options)
+
+
+def apply_worker_profile(celery, name: str) -> Dict[str, Any]:
+    """Make the worker about to start in this process consume *name*'s queues with its settings."""
+    profiles = celery.conf.get("worker_profiles") or WORKER_PROFILES
+    if name not in profiles:
+        raise ValueError(f"Unknown worker profile {name!r}; expected one of {', '.join(sorted(profiles))}")
+    profile = profiles[name]
+    celery.conf.update(worker_concurrency=profile["concurrency"],
+                       worker_prefetch_multiplier=profile["prefetch_multiplier"])
+    celery.amqp.queues.select(profile["queues"])  # what `-Q` does; an explicit -Q replaces it
+    return profile
@@ -0,0 +1,272 @@
+"""Per‑organization / per‑API‑key token‑bucket rate limiting and quotas.
+
+Buckets live in Redis and are updated by a single Lua script, so the check is
+atomic across gunicorn workers and costs one round trip.  When Redis is not
+configured or unreachable, an in‑process bucket keeps limiting per worker.
+
+Limits come from the organization's plan (``Organization.stripe_price_id``)
+via ``RATE_LIMIT_PLANS``; unknown or missing plans use ``RATE_LIMIT_DEFAULT``.
+
+Usage:
+  @api.route('/generate', methods=['POST'])
+  @api_key_required
+  @rate_limited()
+  def generate(): ...
+"""
+from __future__ import annotations
+
+import hashlib
+import math
+import threading
+import time
+from dataclasses import dataclass
+from functools import wraps
+from typing import Any, Callable, Dict, List, Mapping, Optional, Tuple
+
+import redis
+from flask import after_this_request, g, jsonify, request
+
+from .metrics import metrics
+
+__all__ = ["Decision", "RateLimit", "RateLimiter", "rate_limited"]
+
+# KEYS[1..n]  token buckets (hash: t = tokens, ts = last refill in ms)
+# KEYS[n+1]   fixed‑window quota counter (only read when quota > 0)
+# ARGV        now_ms, cost, n, (rate, burst) * n, quota, quota_window_s
+_TOKEN_BUCKET_LUA = """
+local now = tonumber(ARGV[1])
+local cost = tonumber(ARGV[2])
+local n = tonumber(ARGV[3])
+local allowed = 1
+local retry = 0
+local tokens = {}
+for i = 1, n do
+  local rate = tonumber(ARGV[2 + i * 2])
+  local burst = tonumber(ARGV[3 + i * 2])
+  local b = redis.call('HMGET', KEYS[i], 't', 'ts')
+  local t = tonumber(b[1])
+  local ts = tonumber(b[2])
+  if t == nil then t = burst; ts = now end
+  t = math.min(burst, t + math.max(0, now - ts) * rate / 1000)
+  tokens[i] = t
+  if t < cost then
+    allowed = 0
+    retry = math.max(retry, math.ceil((cost - t) * 1000 / rate))
+  end
+end
+local quota = tonumber(ARGV[4 + n * 2])
+local used = 0
+if quota > 0 then
+  used = tonumber(redis.call('GET', KEYS[n + 1]) or '0')
+  if used + cost > quota then
+    allowed = 0
+    retry = math.max(retry, redis.call('PTTL', KEYS[n + 1]))
+  end
+end
+local remaining = -1
+for i = 1, n do
+  local rate = tonumber(ARGV[2 + i * 2])
+  local burst = tonumber(ARGV[3 + i * 2])
+  if allowed == 1 then tokens[i] = tokens[i] - cost end
+  redis.call('HSET', KEYS[i], 't', tokens[i], 'ts', now)
+  redis.call('PEXPIRE', KEYS[i], math.ceil(burst * 1000 / rate) + 1000)
+  if remaining < 0 or tokens[i] < remaining then remaining = tokens[i] end
+end
+if allowed == 1 and quota > 0 then
+  used = redis.call('INCRBY', KEYS[n + 1], cost)
+  if used == cost then redis.call('EXPIRE', KEYS[n + 1], tonumber(ARGV[5 + n * 2])) end
+end
+return {allowed, tostring(remaining), retry, used}
+"""
+
+
+@dataclass(frozen=True)
+class RateLimit:
+    """Plan limits: sustained ``rate`` (req/s), ``burst`` size, daily quota (0 = none)."""
+
+    rate: float
+    burst: int
+    daily_quota: int = 0
+    key_rate: Optional[float] = None
+    key_burst: Optional[int] = None
+
+    @classmethod
+    def from_mapping(cls, data: Mapping[str, Any]) -> "RateLimit":
+        return cls(**{k: data[k] for k in cls.__dataclass_fields__ if k in data})
+
+    @property
+    def buckets(self) -> List[Tuple[float, int]]:
+        """``(rate, burst)`` for the org bucket and the API‑key bucket."""
+        return [(self.rate, self.burst), (self.key_rate or self.rate, self.key_burst or self.burst)]
+
+    @property
+    def max_cost(self) -> int:
+        """Most tokens one request can ever get: more than a full bucket (or the daily quota) never fits."""
+        most = min(burst for _, burst in self.buckets)
+        return min(most, self.daily_quota) if self.daily_quota else most
+
+
+@dataclass
+class Decision:
+    allowed: bool
+    limit: int
+    remaining: int
+    retry_after: float  # seconds
+    quota_used: int = 0
+
+    @property
+    def headers(self) -> Dict[str, str]:
+        headers = {
+            "X-RateLimit-Limit": str(self.limit),
+            "X-RateLimit-Remaining": str(max(0, self.remaining)),
+        }
+        if not self.allowed:
+            headers["Retry-After"] = str(max(1, math.ceil(self.retry_after)))
+        return headers
+
+
+class _LocalBuckets:
+    """In‑process fallback with the same semantics as the Lua script."""
+
+    def __init__(self) -> None:
+        self._buckets: Dict[str, List[float]] = {}
+        self._quota: Dict[str, List[float]] = {}
+        self._lock = threading.Lock()
+
+    def hit(self, keys: List[str], buckets, cost, quota_key, quota, window, now_ms) -> Tuple[bool, float, int, int]:
+        with self._lock:
+            allowed, retry, tokens = True, 0, []
+            for key, (rate, burst) in zip(keys, buckets):
+                t, ts = self._buckets.get(key, (burst, now_ms))
+                t = min(burst, t + max(0, now_ms - ts) * rate / 1000)
+                tokens.append(t)
+                if t < cost:
+                    allowed = False
+                    retry = max(retry, math.ceil((cost - t) * 1000 / rate))
+            used = 0
+            if quota > 0:
+                count, expires = self._quota.get(quota_key, (0, now_ms + window * 1000))
+                if expires <= now_ms:
+                    count, expires = 0, now_ms + window * 1000
+                used = count
+                if count + cost > quota:
+                    allowed = False
+                    retry = max(retry, expires - now_ms)
+                elif allowed:
+                    used = count + cost
+                self._quota[quota_key] = [used, expires]
+            for i, key in enumerate(keys):
+                if allowed:
+                    tokens[i] -= cost
+                self._buckets[key] = [tokens[i], now_ms]
+            return allowed, min(tokens), retry, used
+
+
+class RateLimiter:
+    """Token buckets keyed by organization id and API key."""
+
+    prefix = "rl:"
+
+    def __init__(self, app=None, kv=None) -> None:
+        self.enabled = True
+        self.default = RateLimit(rate=5, burst=30)
+        self.plans: Dict[str, RateLimit] = {}
+        self.quota_window = 86400
+        self._kv = None
+        self._script = None
+        self._local = _LocalBuckets()
+        if app is not None:
+            self.init_app(app, kv)
+
+    def init_app(self, app, kv=None) -> None:
+        self.enabled = app.config.get("RATE_LIMIT_ENABLED", True)
+        self.default = RateLimit.from_mapping(app.config.get("RATE_LIMIT_DEFAULT", {"rate": 5, "burst": 30}))
+        self.plans = {
+            price_id: RateLimit.from_mapping(limits)
+            for price_id, limits in app.config.get("RATE_LIMIT_PLANS", {}).items()
+        }
+        self._kv = kv
+        self._script = None
+        self._local = _LocalBuckets()
+        app.extensions["rate_limiter"] = self
+
+    def plan_for(self, org) -> RateLimit:
+        price_id = getattr(org, "stripe_price_id", None)
+        return self.plans.get(price_id, self.default) if price_id else self.default
+
+    def hit(self, org_id: Any, api_key: str, limit: RateLimit, cost: int = 1) -> Decision:
+        """Consume *cost* tokens from the org and key buckets if both allow it."""
+        key_id = hashlib.sha256(api_key.encode()).hexdigest()[:24]
+        keys = [f"{self.prefix}org:{org_id}", f"{self.prefix}key:{key_id}"]
+        quota_key = f"{self.prefix}quota:{org_id}"
+        now_ms = int(time.time() * 1000)
+
+        result = self._hit_redis(keys, limit, cost, quota_key, now_ms)
+        if result is None:
+            result = self._local.hit(keys, limit.buckets, cost, quota_key, limit.daily_quota,
+                                     self.quota_window, now_ms)
+        allowed, remaining, retry_ms, used = result
+        metrics.counter("ratelimit.allowed" if allowed else "ratelimit.limited").inc()
+        return Decision(bool(allowed), limit.burst, int(remaining), retry_ms / 1000.0, int(used))
+
+    def _hit_redis(self, keys, limit, cost, quota_key, now_ms):
+        client = self._kv.client if self._kv is not None else None
+        if client is None:
+            return None
+        if self._script is None:
+            self._script = client.register_script(_TOKEN_BUCKET_LUA)
+        args: List[Any] = [now_ms, cost, len(keys)]
+        for rate, burst in limit.buckets:
+            args += [rate, burst]
+        args += [limit.daily_quota, self.quota_window]
+        try:
+            allowed, remaining, retry, used = self._script(keys=keys + [quota_key], args=args, client=client)
+        except redis.RedisError:
+            metrics.counter("ratelimit.redis.errors").inc()
+            return None
+        return int(allowed), float(remaining), int(retry), int(used)
+
+
+def rate_limited(cost: Callable[[], int] | int = 1):
+    """Apply the caller's plan limits; must sit below ``api_key_required``.
+
+    Adds ``X-RateLimit-*`` headers to every response and answers 429 with
+    ``Retry-After`` when the org or key bucket (or daily quota) is exhausted.
+    A request costing more than a full bucket could never be admitted, so it
+    gets 413 at once instead of an endless series of 429s.
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            from . import rate_limiter  # late import: avoids an import cycle
+
+            if not rate_limiter.enabled:
+                return f(*args, **kwargs)
+
+            org = g.current_user.current_organization
+            units = cost() if callable(cost) else cost
+            limit = rate_limiter.plan_for(org)
+            if units > limit.max_cost:
+                metrics.counter("ratelimit.oversize").inc()
+                response = jsonify({"error": f"This request costs {units} rate-limit tokens but your plan allows "
+                                             f"at most {limit.max_cost} at once; split it into smaller batches."})
+                response.status_code = 413
+                response.headers["X-RateLimit-Limit"] = str(limit.burst)
+                return response
+            api_key = request.headers.get("Authorization", "").split(" ")[-1]
+            decision = rate_limiter.hit(org.id if org else f"user:{g.current_user.id}",
+                                        api_key, limit, units)
+            if not decision.allowed:
+                response = jsonify({"error": "Rate limit exceeded. Please retry later."})
+                response.status_code = 429
+                response.headers.update(decision.headers)
+                return response
+
+            @after_this_request
+            def add_headers(response):
+                response.headers.update(decision.headers)
+                return response
+
+            return f(*args, **kwargs)
+        return decorated_function
+    return decorator
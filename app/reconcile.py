@@ -0,0 +1,178 @@
+"""Bulk reconciliation of organization subscriptions against Stripe.
+
+Webhooks can be missed (endpoint down past Stripe's retry window, events
+for an old secret, …) and ``Organization.is_subscribed`` then drifts.
+:func:`reconcile_subscriptions` lists every subscription from Stripe with
+auto-pagination – one listing per status, ``STRIPE_RECONCILE_CONCURRENCY``
+of them in parallel – and keeps the best one per customer.  It then loads the
+Stripe-linked organizations in one query, diffs them in memory and writes the
+corrections as bulk ``UPDATE`` batches of ``STRIPE_RECONCILE_BATCH_SIZE`` rows.
+There are no per-row queries.  The ``UPDATE`` only touches a row whose
+``stripe_event_at`` is older than the listing, so a webhook applied while
+the listing ran is not overwritten; such rows are counted as ``skipped``.
+Caches that the ORM hooks would normally maintain (API keys, session
+identities, entitlements) are invalidated or republished explicitly per
+batch, for the rows actually updated.
+
+With ``dry_run`` nothing is written and the report lists what would change.
+``stripe.api_base`` (``STRIPE_API_BASE``) can point the listing at a local
+stripe-mock; tests replay recorded pages through a stub HTTP client.
+
+Usage:
+  flask reconcile-subscriptions --dry-run
+  reconcile_subscriptions.delay()          # also on celery beat
+"""
+from __future__ import annotations
+
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+import stripe
+from flask import current_app
+from sqlalchemy import bindparam, or_, select, update
+
+from . import celery, db
+from .billing import ACTIVE_STATUSES, period_end
+from .identity import bump_members
+from .metrics import metrics
+from .models import Organization
+
+__all__ = ["ReconcileReport", "reconcile", "reconcile_subscriptions"]
+
+# Every status a subscription can be listed by (``status=all`` would be a single cursor).
+SUBSCRIPTION_STATUSES = ("active", "trialing", "past_due", "unpaid", "paused",
+                         "incomplete", "incomplete_expired", "canceled")
+
+_FIELDS = ("is_subscribed", "subscription_id", "stripe_price_id", "subscription_status", "current_period_end")
+
+_organizations = Organization.__table__
+# Executed with one parameter set per row: the ``_FIELDS`` keys fill the SET clause.
+_CONDITIONAL_UPDATE = (
+    update(_organizations)
+    .where(_organizations.c.id == bindparam("org_id"))
+    .where(or_(_organizations.c.stripe_event_at.is_(None), _organizations.c.stripe_event_at < bindparam("listed_at")))
+    .values(stripe_event_at=bindparam("listed_at"))
+)
+
+
+@dataclass
+class ReconcileReport:
+    """What a reconciliation pass saw and changed."""
+
+    subscriptions: int = 0
+    organizations: int = 0
+    changes: List[Dict[str, Any]] = field(default_factory=list)  # {"id", "before", "after"}
+    dry_run: bool = False
+    batches: int = 0
+    skipped: int = 0  # changed by a webhook while the listing ran; left alone
+
+    def summary(self) -> str:
+        verb = "would update" if self.dry_run else "updated"
+        return (f"{self.subscriptions} Stripe subscriptions, {self.organizations} linked organizations; "
+                f"{verb} {len(self.changes)} in {self.batches} batch(es)"
+                + (f", skipped {self.skipped} changed by a newer webhook" if self.skipped else ""))
+
+
+def _list_status(status: str, page_size: int) -> List[Dict[str, Any]]:
+    subscriptions = stripe.Subscription.list(status=status, limit=page_size)
+    return [
+        {"id": sub["id"], "customer": sub["customer"], "status": sub["status"], "created": sub.get("created") or 0,
+         "price": ((sub.get("items") or {}).get("data") or [{}])[0].get("price", {}).get("id"),
+         "period_end": period_end(sub)}
+        for sub in subscriptions.auto_paging_iter()
+    ]
+
+
+def _best_per_customer(subscriptions: Iterable[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """One subscription per customer: an active one if any, then the newest."""
+    best: Dict[str, Dict[str, Any]] = {}
+    for sub in subscriptions:
+        rank = (sub["status"] in ACTIVE_STATUSES, sub["created"])
+        current = best.get(sub["customer"])
+        if current is None or rank > (current["status"] in ACTIVE_STATUSES, current["created"]):
+            best[sub["customer"]] = sub
+    return best
+
+
+def _desired(row, sub: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    if sub is None or sub["status"] not in ACTIVE_STATUSES:
+        return {"is_subscribed": False, "subscription_id": None, "stripe_price_id": row.stripe_price_id,
+                "subscription_status": sub["status"] if sub else None, "current_period_end": None}
+    return {"is_subscribed": True, "subscription_id": sub["id"], "stripe_price_id": sub["price"] or row.stripe_price_id,
+            "subscription_status": sub["status"], "current_period_end": sub["period_end"]}
+
+
+def reconcile(*, dry_run: bool = False, concurrency: Optional[int] = None, batch_size: Optional[int] = None,
+              lister: Optional[Callable[[str], List[Dict[str, Any]]]] = None) -> ReconcileReport:
+    """Diff Stripe's subscriptions against ``organizations`` and bulk-apply the corrections."""
+    config = current_app.config
+    concurrency = concurrency or config.get("STRIPE_RECONCILE_CONCURRENCY", 4)
+    batch_size = batch_size or config.get("STRIPE_RECONCILE_BATCH_SIZE", 500)
+    page_size = config.get("STRIPE_RECONCILE_PAGE_SIZE", 100)
+    lister = lister or (lambda status: _list_status(status, page_size))
+    report = ReconcileReport(dry_run=dry_run)
+
+    listed_at = datetime.utcnow()
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="stripe-reconcile") as pool:
+        pages = list(pool.map(lister, SUBSCRIPTION_STATUSES))
+    subscriptions = [sub for page in pages for sub in page]
+    report.subscriptions = len(subscriptions)
+    truth = _best_per_customer(subscriptions)
+
+    rows = db.session.execute(
+        select(Organization.id, Organization.stripe_customer_id,
+               *(getattr(Organization, name) for name in _FIELDS))
+        .where(Organization.stripe_customer_id.is_not(None))
+    ).all()
+    report.organizations = len(rows)
+    for row in rows:
+        after = _desired(row, truth.get(row.stripe_customer_id))
+        before = {name: getattr(row, name) for name in _FIELDS}
+        if after != before:
+            report.changes.append({"id": row.id, "customer": row.stripe_customer_id, "before": before, "after": after})
+
+    report.batches = -(-len(report.changes) // batch_size)
+    if dry_run or not report.changes:
+        return report
+
+    from . import api_key_cache, entitlements, identity_cache
+
+    applied: List[Dict[str, Any]] = []
+    for start in range(0, len(report.changes), batch_size):
+        batch = report.changes[start:start + batch_size]
+        # Bulk conditional UPDATE by primary key: one executemany per batch, no ORM hooks.
+        db.session.execute(_CONDITIONAL_UPDATE, [
+            {"org_id": change["id"], "listed_at": listed_at, **change["after"]} for change in batch
+        ])
+        # executemany has no per-row rowcount; the rows it wrote carry our timestamp.
+        ids = set(db.session.scalars(
+            select(Organization.id).where(Organization.id.in_([change["id"] for change in batch]),
+                                          Organization.stripe_event_at == listed_at)
+        ))
+        if not ids:
+            db.session.commit()
+            continue
+        versions = bump_members(db.session.connection(), sorted(ids))
+        db.session.commit()
+        for org_id in ids:
+            api_key_cache.invalidate_org(org_id)
+        identity_cache.invalidate(sorted(versions.items()))
+        entitlements.refresh(sorted(ids))
+        applied.extend(change for change in batch if change["id"] in ids)
+    report.skipped = len(report.changes) - len(applied)
+    report.changes = applied
+    metrics.counter("billing.reconciled").inc(len(applied))
+    if report.skipped:
+        metrics.counter("billing.reconcile_skipped").inc(report.skipped)
+    return report
+
+
+@celery.task(name="billing.reconcile_subscriptions")
+def reconcile_subscriptions(dry_run: bool = False) -> Dict[str, Any]:
+    """Periodic (celery beat) reconciliation; returns the report's counts."""
+    report = reconcile(dry_run=dry_run)
+    current_app.logger.info("Stripe reconciliation: %s", report.summary())
+    return {"subscriptions": report.subscriptions, "organizations": report.organizations,
+            "changes": len(report.changes), "skipped": report.skipped, "dry_run": report.dry_run}
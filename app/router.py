@@ -0,0 +1,461 @@
+"""Multi‑provider model router with hedged requests and circuit breakers.
+
+With ``LLM_BACKEND = "router"`` generations go to the backends listed in
+``LLM_ROUTES`` (in preference order), e.g. ``"openai,hf,local"``:
+
+* ``openai`` – the pooled OpenAI gateway (:mod:`app.llm`)
+* ``hf``     – the Hugging Face Inference API (``HF_API_KEY`` / ``HF_MODEL``)
+* ``local``  – the local CPU engine (:mod:`app.engine`)
+
+For every backend the router keeps a rolling window of latencies and
+outcomes (p50 / p95 / p99, error rate).  A backend whose error rate crosses
+``LLM_ROUTER_ERROR_THRESHOLD`` – or whose p99 exceeds ``LLM_ROUTER_MAX_P99_MS``
+– has its circuit opened for ``LLM_ROUTER_COOLDOWN`` seconds; afterwards a
+single probe request decides whether it closes again.
+
+If the primary has not answered after its own p95 latency, a *hedged* request
+goes to the next healthy backend (or the same one, if it is the only one) and
+the first success wins.  The loser is cancelled: queued attempts never start,
+and running ones are told to stop through their ``cancel`` event (backends
+that can't be interrupted mid‑call have their late result discarded).
+
+Usage:
+  completion = router.complete(prompt, max_tokens=60)
+  completion.meta  # {"backend": "hf", "hedged": True}
+"""
+from __future__ import annotations
+
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from typing import Any, Deque, Dict, Iterator, List, Optional, Tuple
+
+import requests
+
+from .llm import Completion
+from .metrics import LatencyStats, metrics
+
+__all__ = ["BackendHealth", "CircuitBreaker", "HFBackend", "ModelRouter", "NoHealthyBackend"]
+
+
+class NoHealthyBackend(RuntimeError):
+    """Every configured backend is failing or has an open circuit."""
+
+
+# ---------------------------------------------------------------------------
+# Health tracking
+# ---------------------------------------------------------------------------
+
+class BackendHealth:
+    """Rolling latency percentiles and error rate of one backend."""
+
+    def __init__(self, window: int = 200) -> None:
+        self.window = window
+        self.latency = LatencyStats(window=window)
+        self._outcomes: Deque[bool] = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds: Optional[float], ok: bool) -> None:
+        if ok and seconds is not None:
+            self.latency.observe(seconds)
+        with self._lock:
+            self._outcomes.append(ok)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._outcomes.clear()
+        self.latency = LatencyStats(window=self.window)
+
+    @property
+    def samples(self) -> int:
+        """Successful calls with a latency sample in the window."""
+        with self._lock:
+            return self._outcomes.count(True)
+
+    @property
+    def calls(self) -> int:
+        return len(self._outcomes)
+
+    @property
+    def error_rate(self) -> float:
+        with self._lock:
+            return self._outcomes.count(False) / len(self._outcomes) if self._outcomes else 0.0
+
+    def percentile(self, pct: float) -> Optional[float]:
+        return self.latency.percentile(pct)
+
+    def snapshot(self) -> Dict[str, Any]:
+        ms = lambda v: round(v * 1000, 3) if v is not None else None  # noqa: E731
+        return {
+            "calls": self.calls,
+            "error_rate": round(self.error_rate, 4),
+            "p50_ms": ms(self.percentile(50)),
+            "p95_ms": ms(self.percentile(95)),
+            "p99_ms": ms(self.percentile(99)),
+        }
+
+
+class CircuitBreaker:
+    """closed → open (after degradation) → half‑open (one probe) → closed/open."""
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, error_threshold: float = 0.5, min_calls: int = 10, cooldown: float = 30.0,
+                 max_p99: Optional[float] = None) -> None:
+        self.error_threshold = error_threshold
+        self.min_calls = min_calls
+        self.cooldown = cooldown
+        self.max_p99 = max_p99
+        self.state = self.CLOSED
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def available(self) -> bool:
+        """Could a request go to this backend now?  Claims nothing (see :meth:`allow`)."""
+        with self._lock:
+            self._maybe_half_open()
+            return self.state == self.CLOSED or (self.state == self.HALF_OPEN and not self._probing)
+
+    def allow(self) -> bool:
+        """May a request go to this backend now?  Claims the probe when half‑open.
+
+        Call it only for a request that is about to be sent: a claimed probe
+        is freed by :meth:`after_call`, or by :meth:`release` if the request
+        never ran.
+        """
+        with self._lock:
+            self._maybe_half_open()
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def release(self) -> None:
+        """Free a probe claimed by :meth:`allow` whose request never reported an outcome."""
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self._probing = False
+
+    def _maybe_half_open(self) -> None:
+        if self.state == self.OPEN and time.monotonic() - self._opened_at >= self.cooldown:
+            self.state = self.HALF_OPEN
+            self._probing = False
+
+    def after_call(self, ok: bool, health: BackendHealth) -> Optional[str]:
+        """Update the state after a call; returns the new state if it changed."""
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self._probing = False
+                if ok:
+                    self.state = self.CLOSED
+                    health.reset()
+                    return self.CLOSED
+                self._open()
+                return self.OPEN
+            if self.state == self.CLOSED and health.calls >= self.min_calls and self._degraded(health):
+                self._open()
+                return self.OPEN
+            return None
+
+    def _degraded(self, health: BackendHealth) -> bool:
+        if health.error_rate >= self.error_threshold:
+            return True
+        p99 = health.percentile(99)
+        return self.max_p99 is not None and p99 is not None and p99 > self.max_p99
+
+    def _open(self) -> None:
+        self.state = self.OPEN
+        self._opened_at = time.monotonic()
+
+
+# ---------------------------------------------------------------------------
+# Hugging Face backend
+# ---------------------------------------------------------------------------
+
+class HFBackend:
+    """Text generation through the Hugging Face Inference API."""
+
+    url = "https://api-inference.huggingface.co/models/{model}"
+
+    def __init__(self, api_key: Optional[str], model: str, timeout: float = 30.0) -> None:
+        self.api_key = api_key
+        self.default_model = model
+        self.timeout = timeout
+        self._session: Optional[requests.Session] = None
+        self._session_pid: Optional[int] = None
+
+    @property
+    def session(self) -> requests.Session:
+        if self._session is None or self._session_pid != os.getpid():
+            self._session = requests.Session()
+            self._session.headers["Authorization"] = f"Bearer {self.api_key}"
+            self._session_pid = os.getpid()
+        return self._session
+
+    def complete(self, prompt: str, *, model: Optional[str] = None, max_tokens: Optional[int] = None,
+                 **params: Any) -> Completion:
+        model = model or self.default_model
+        started = time.perf_counter()
+        response = self.session.post(
+            self.url.format(model=model),
+            json={
+                "inputs": prompt,
+                "parameters": {"max_new_tokens": max_tokens or 60, "return_full_text": False, **params},
+                "options": {"wait_for_model": False},
+            },
+            timeout=self.timeout,
+        )
+        response.raise_for_status()
+        payload = response.json()
+        text = payload[0]["generated_text"] if isinstance(payload, list) else payload["generated_text"]
+        return Completion(text=text.strip(), model=model,
+                          latency_ms=round((time.perf_counter() - started) * 1000, 3))
+
+    def stream(self, prompt: str, **kwargs: Any) -> Iterator[str]:
+        yield self.complete(prompt, **kwargs).text
+
+
+# ---------------------------------------------------------------------------
+# Router
+# ---------------------------------------------------------------------------
+
+@dataclass
+class _Route:
+    name: str
+    backend: Any
+    health: BackendHealth
+    breaker: CircuitBreaker
+
+
+class ModelRouter:
+    """Route completions across backends with health tracking and hedging."""
+
+    default_model = "router"
+
+    def __init__(self, app=None) -> None:
+        self.routes: Dict[str, _Route] = {}
+        self.order: List[str] = []
+        self.hedge = True
+        self.hedge_percentile = 95.0
+        self.hedge_min_samples = 20
+        self.hedge_default = 1.0
+        self.hedge_floor = 0.05
+        self.timeout = 60.0
+        self.breaker_settings: Dict[str, Any] = {}
+        self.health_window = 200
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._executor_pid: Optional[int] = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app) -> None:
+        from . import engine, llm  # late import: extensions are created in app/__init__
+
+        self.hedge = app.config.get("LLM_ROUTER_HEDGE", True)
+        self.hedge_percentile = app.config.get("LLM_ROUTER_HEDGE_PERCENTILE", self.hedge_percentile)
+        self.hedge_default = app.config.get("LLM_ROUTER_HEDGE_DEFAULT_MS", 1000) / 1000.0
+        self.timeout = app.config.get("LLM_ROUTER_TIMEOUT", self.timeout)
+        max_p99_ms = app.config.get("LLM_ROUTER_MAX_P99_MS")
+        self.breaker_settings = {
+            "error_threshold": app.config.get("LLM_ROUTER_ERROR_THRESHOLD", 0.5),
+            "min_calls": app.config.get("LLM_ROUTER_MIN_CALLS", 10),
+            "cooldown": app.config.get("LLM_ROUTER_COOLDOWN", 30.0),
+            "max_p99": max_p99_ms / 1000.0 if max_p99_ms else None,
+        }
+        available = {
+            "openai": lambda: llm,
+            "local": lambda: engine,
+            "hf": lambda: HFBackend(app.config.get("HF_API_KEY"), app.config.get("HF_MODEL", "gpt2"),
+                                    app.config.get("LLM_READ_TIMEOUT", 30.0)),
+        }
+        self.routes, self.order = {}, []
+        for name in [n.strip() for n in app.config.get("LLM_ROUTES", "openai").split(",") if n.strip()]:
+            self.register(name, available[name]())
+        app.extensions["router"] = self
+
+    def register(self, name: str, backend: Any) -> None:
+        """Add (or replace) a backend at the end of the preference order."""
+        self.routes[name] = _Route(name, backend, BackendHealth(self.health_window),
+                                   CircuitBreaker(**self.breaker_settings))
+        if name not in self.order:
+            self.order.append(name)
+
+    # ------------------------------------------------------------------
+    # Internals
+    # ------------------------------------------------------------------
+
+    def _pool(self) -> ThreadPoolExecutor:
+        pid = os.getpid()
+        with self._lock:
+            if self._executor is None or self._executor_pid != pid:
+                self._executor = ThreadPoolExecutor(max_workers=32, thread_name_prefix="router")
+                self._executor_pid = pid
+            return self._executor
+
+    def _candidates(self) -> List[_Route]:
+        # Only a look: the probe of a half-open circuit is claimed when a request is launched.
+        return [self.routes[name] for name in self.order if self.routes[name].breaker.available()]
+
+    def hedge_delay(self, route: _Route) -> float:
+        """Wait this long for *route* before hedging: its p95, once known."""
+        if route.health.samples < self.hedge_min_samples:
+            return self.hedge_default
+        return max(self.hedge_floor, route.health.percentile(self.hedge_percentile) or self.hedge_default)
+
+    def _call(self, route: _Route, cancel: threading.Event, prompt: str, kwargs: Dict[str, Any]) -> Completion:
+        if cancel.is_set():
+            route.breaker.release()
+            raise _Cancelled()
+        started = time.perf_counter()
+        try:
+            if getattr(route.backend, "supports_cancel", False):
+                completion = route.backend.complete(prompt, cancel=cancel, **kwargs)
+            else:
+                completion = route.backend.complete(prompt, **kwargs)
+        except Exception:
+            if cancel.is_set():  # a cancelled loser failing is not the backend's fault
+                route.breaker.release()
+            else:
+                self._record(route, None, ok=False)
+            raise
+        if cancel.is_set():
+            route.breaker.release()
+        else:
+            self._record(route, time.perf_counter() - started, ok=True)
+        return completion
+
+    def _record(self, route: _Route, seconds: Optional[float], ok: bool) -> None:
+        route.health.record(seconds, ok)
+        metrics.counter(f"router.{route.name}.{'ok' if ok else 'errors'}").inc()
+        if seconds is not None:
+            metrics.latency(f"router.{route.name}").observe(seconds)
+        changed = route.breaker.after_call(ok, route.health)
+        if changed:
+            metrics.counter(f"router.{route.name}.circuit_{changed}").inc()
+
+    # ------------------------------------------------------------------
+    # Public API
+    # ------------------------------------------------------------------
+
+    def complete(self, prompt: str, *, model: Optional[str] = None, max_tokens: Optional[int] = None,
+                 **params: Any) -> Completion:
+        """Complete via the healthiest backends, hedging a slow primary."""
+        candidates = self._candidates()
+        if not candidates:
+            metrics.counter("router.unavailable").inc()
+            raise NoHealthyBackend("all model backends are unavailable")
+        kwargs = dict(params, max_tokens=max_tokens)
+        if model and model != self.default_model:
+            kwargs["model"] = model
+
+        pool = self._pool()
+        inflight: Dict[Future, Tuple[_Route, threading.Event]] = {}
+        queue = list(candidates)
+        hedged = False
+        last_error: Optional[BaseException] = None
+        deadline = time.monotonic() + self.timeout
+
+        def launch(route: _Route) -> bool:
+            if not route.breaker.allow():  # e.g. another request took the half-open probe meanwhile
+                return False
+            cancel = threading.Event()
+            inflight[pool.submit(self._call, route, cancel, prompt, kwargs)] = (route, cancel)
+            return True
+
+        def launch_next() -> bool:
+            while queue:
+                if launch(queue.pop(0)):
+                    return True
+            return False
+
+        if not launch_next():
+            metrics.counter("router.unavailable").inc()
+            raise NoHealthyBackend("all model backends are unavailable")
+        try:
+            while inflight:
+                primary_route = next(iter(inflight.values()))[0]
+                can_hedge = self.hedge and not hedged and len(inflight) == 1
+                timeout = self.hedge_delay(primary_route) if can_hedge else deadline - time.monotonic()
+                done, _ = wait(list(inflight), timeout=max(0.0, timeout), return_when=FIRST_COMPLETED)
+
+                if not done:
+                    if can_hedge:
+                        hedged = True
+                        metrics.counter("router.hedges").inc()
+                        launch_next() or launch(primary_route)
+                        continue
+                    raise TimeoutError(f"no backend answered within {self.timeout:.1f}s")
+
+                for future in done:
+                    route, _ = inflight.pop(future)
+                    try:
+                        completion = future.result()
+                    except Exception as exc:
+                        last_error = exc
+                        if not inflight:
+                            launch_next()  # fail over to the next backend
+                        continue
+                    if hedged:
+                        metrics.counter(f"router.hedge_wins.{route.name}").inc()
+                    completion.meta = {**completion.meta, "backend": route.name, "hedged": hedged}
+                    return completion
+        finally:
+            for future, (route, cancel) in inflight.items():  # the losers
+                cancel.set()
+                if future.cancel():  # never started: _call will not free its probe
+                    route.breaker.release()
+                metrics.counter("router.cancelled").inc()
+
+        metrics.counter("router.failures").inc()
+        raise last_error or NoHealthyBackend("all model backends failed")
+
+    def stream(self, prompt: str, *, model: Optional[str] = None, max_tokens: Optional[int] = None,
+               **params: Any) -> Iterator[str]:
+        """Stream from the first healthy backend, failing over before the first delta.
+
+        Streams are not hedged: two streams racing would both cost tokens and
+        only one could be relayed.
+        """
+        kwargs = dict(params, max_tokens=max_tokens)
+        if model and model != self.default_model:
+            kwargs["model"] = model
+        last_error: Optional[BaseException] = None
+        for route in self._candidates():
+            if not route.breaker.allow():
+                continue
+            started = time.perf_counter()
+            emitted = reported = False
+            try:
+                for delta in route.backend.stream(prompt, **kwargs):
+                    if not emitted:
+                        emitted = reported = True
+                        self._record(route, time.perf_counter() - started, ok=True)
+                    yield delta
+                return
+            except Exception as exc:
+                if emitted:
+                    raise
+                reported = True
+                self._record(route, None, ok=False)
+                last_error = exc
+            finally:
+                if not reported:  # empty stream, or the caller stopped reading before the first delta
+                    route.breaker.release()
+        raise last_error or NoHealthyBackend("all model backends are unavailable")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            name: {**self.routes[name].health.snapshot(), "circuit": self.routes[name].breaker.state}
+            for name in self.order
+        }
+
+
+class _Cancelled(Exception):
+    """Raised inside an attempt that lost the race before it started."""
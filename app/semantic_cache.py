@@ -0,0 +1,361 @@
+"""Embedding‑based semantic cache for the generation endpoints.
+
+The exact‑match :mod:`app.cache` misses prompts that differ only in wording.
+This cache embeds each prompt and serves a cached completion when a stored
+prompt of the same organization is at least ``SEMANTIC_CACHE_THRESHOLD``
+cosine‑similar.
+
+* Vectors of one organization (and one model / max_tokens / params scope) live
+  in a single contiguous ``float32`` matrix, so a lookup is one matrix‑vector
+  product plus an ``argpartition`` top‑k – no per‑entry Python work.
+* Each index holds at most ``SEMANTIC_CACHE_CAPACITY`` entries; when full the
+  least recently used entry is overwritten in place.
+* With ``SEMANTIC_CACHE_DIR`` set, indexes are snapshotted to disk and
+  memory‑mapped (copy‑on‑write) on start‑up, so workers share the page cache
+  and survive restarts without re‑embedding.
+
+Embedders are pluggable: ``"hashing"`` (deterministic feature hashing, no
+network – used in tests), ``"openai"``, or a ``"module:Class"`` path.
+
+Usage:
+  completion = semantic_cache.lookup(prompt, org=org, model=model, max_tokens=60)
+  semantic_cache.store(prompt, completion, org=org, model=model, max_tokens=60)
+"""
+from __future__ import annotations
+
+import atexit
+import hashlib
+import importlib
+import json
+import os
+import re
+import threading
+import time
+import uuid
+from typing import Any, Dict, List, Mapping, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .cache import LRUCache, normalize_prompt
+from .llm import Completion
+from .metrics import metrics
+
+__all__ = ["HashingEmbedder", "OpenAIEmbedder", "SemanticCache", "VectorIndex"]
+
+_WORD = re.compile(r"\w+", re.UNICODE)
+
+
+def _normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (matrix / norms).astype(np.float32, copy=False)
+
+
+# ---------------------------------------------------------------------------
+# Embedders
+# ---------------------------------------------------------------------------
+
+class HashingEmbedder:
+    """Deterministic bag of words + character trigrams, feature‑hashed to ``dim``.
+
+    Stable across processes and restarts (``blake2b``, not ``hash()``), cheap,
+    and good enough to match rewordings that share most of their vocabulary.
+    """
+
+    def __init__(self, dim: int = 256) -> None:
+        self.dim = dim
+
+    def _features(self, text: str) -> List[Tuple[str, float]]:
+        features = []
+        for word in _WORD.findall(text.lower()):
+            features.append((word, 1.0))
+            padded = f"<{word}>"
+            features.extend((padded[i:i + 3], 0.5) for i in range(len(padded) - 2))
+        return features
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        out = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature, weight in self._features(text):
+                digest = hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest()
+                bucket = int.from_bytes(digest[:4], "little") % self.dim
+                sign = 1.0 if digest[4] & 1 else -1.0
+                out[row, bucket] += sign * weight
+        return _normalize_rows(out)
+
+
+class OpenAIEmbedder:
+    """Embeddings from the OpenAI API through the shared gateway connection pool."""
+
+    def __init__(self, model: str = "text-embedding-3-small") -> None:
+        self.model = model
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        from . import llm
+
+        response = llm.client.embeddings.create(model=self.model, input=list(texts))
+        return _normalize_rows(np.array([item.embedding for item in response.data], dtype=np.float32))
+
+
+def _load_embedder(spec: str, dim: int, model: Optional[str]):
+    if spec == "hashing":
+        return HashingEmbedder(dim)
+    if spec == "openai":
+        return OpenAIEmbedder(model) if model else OpenAIEmbedder()
+    module, _, name = spec.partition(":")
+    return getattr(importlib.import_module(module), name)()
+
+
+# ---------------------------------------------------------------------------
+# Vector index
+# ---------------------------------------------------------------------------
+
+class VectorIndex:
+    """Fixed‑capacity cosine index over L2‑normalized ``float32`` rows.
+
+    ``payloads[i]`` belongs to ``vectors[i]``; ``stamps[i]`` is its last use
+    (for LRU eviction).  With a ``path`` the index is persisted as
+    ``<path>.json`` (metadata + payloads) referencing a ``.f32`` snapshot that is
+    memory‑mapped copy‑on‑write when reopened.
+    """
+
+    def __init__(self, dim: int, capacity: int, path: Optional[str] = None) -> None:
+        self.dim = dim
+        self.capacity = capacity
+        self.path = path
+        self.size = 0
+        self.payloads: List[Any] = [None] * capacity
+        self.stamps = np.zeros(capacity, dtype=np.float64)
+        self.vectors = np.zeros((capacity, dim), dtype=np.float32)
+        self._lock = threading.RLock()
+        self._dirty = False
+        self._snapshot: Optional[str] = None
+        if path is not None:
+            self._load()
+
+    def __len__(self) -> int:
+        return self.size
+
+    # -- search / insert ---------------------------------------------------
+
+    def search(self, vector: np.ndarray, k: int = 1) -> Tuple[np.ndarray, np.ndarray]:
+        """Return ``(slots, scores)`` of the *k* most similar rows, best first."""
+        with self._lock:
+            if self.size == 0:
+                return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+            scores = self.vectors[: self.size] @ vector
+            k = min(k, self.size)
+            if k == 1:
+                top = np.array([np.argmax(scores)])
+            else:
+                top = np.argpartition(-scores, k - 1)[:k] if k < self.size else np.arange(self.size)
+                top = top[np.argsort(-scores[top])]
+            return top, scores[top]
+
+    def match(self, vector: np.ndarray, threshold: float) -> Optional[Tuple[Any, float]]:
+        """Return ``(payload, score)`` of the closest row if it scores *threshold* or more, and mark it used.
+
+        The payload is read under the same lock as the search, so a concurrent
+        :meth:`add` cannot evict the slot in between.
+        """
+        with self._lock:
+            slots, scores = self.search(vector, k=1)
+            if not len(slots) or scores[0] < threshold:
+                return None
+            slot = int(slots[0])
+            self.stamps[slot] = time.time()
+            return self.payloads[slot], float(scores[0])
+
+    def touch(self, slot: int) -> None:
+        with self._lock:
+            self.stamps[slot] = time.time()
+
+    def add(self, vector: np.ndarray, payload: Any) -> int:
+        """Insert one row, overwriting the least recently used entry when full."""
+        with self._lock:
+            if self.size < self.capacity:
+                slot = self.size
+                self.size += 1
+            else:
+                slot = int(np.argmin(self.stamps))
+                metrics.counter("semcache.evictions").inc()
+            self.vectors[slot] = vector
+            self.payloads[slot] = payload
+            self.stamps[slot] = time.time()
+            self._dirty = True
+            return slot
+
+    # -- persistence -------------------------------------------------------
+
+    def _load(self) -> None:
+        try:
+            with open(f"{self.path}.json", encoding="utf-8") as fh:
+                meta = json.load(fh)
+            if (meta["dim"], meta["capacity"]) != (self.dim, self.capacity):
+                return  # settings changed: start empty, the next flush replaces it
+            snapshot = os.path.join(os.path.dirname(self.path), meta["vectors"])
+            vectors = np.memmap(snapshot, dtype=np.float32, mode="c", shape=(self.capacity, self.dim))
+        except (OSError, ValueError, KeyError):
+            return
+        self.vectors = vectors
+        self.size = meta["size"]
+        self.payloads = meta["payloads"] + [None] * (self.capacity - len(meta["payloads"]))
+        self.stamps[: self.size] = meta["stamps"]
+        self._snapshot = snapshot
+
+    def flush(self) -> bool:
+        """Write a new snapshot atomically (vectors first, then the metadata)."""
+        if self.path is None:
+            return False
+        with self._lock:
+            if not self._dirty:
+                return False
+            directory, base = os.path.split(self.path)
+            vectors_name = f"{base}.{uuid.uuid4().hex[:12]}.f32"
+            self.vectors.tofile(os.path.join(directory, vectors_name))
+            meta = {
+                "dim": self.dim,
+                "capacity": self.capacity,
+                "size": self.size,
+                "vectors": vectors_name,
+                "payloads": self.payloads[: self.size],
+                "stamps": self.stamps[: self.size].tolist(),
+            }
+            tmp = f"{self.path}.json.{os.getpid()}.tmp"
+            with open(tmp, "w", encoding="utf-8") as fh:
+                json.dump(meta, fh, separators=(",", ":"))
+            os.replace(tmp, f"{self.path}.json")
+            previous, self._snapshot = self._snapshot, os.path.join(directory, vectors_name)
+            if previous and previous != self._snapshot:
+                try:
+                    os.remove(previous)  # mapped copies elsewhere stay valid (POSIX)
+                except OSError:
+                    pass
+            self._dirty = False
+            return True
+
+
+# ---------------------------------------------------------------------------
+# Cache
+# ---------------------------------------------------------------------------
+
+class SemanticCache:
+    """Per‑organization nearest‑neighbour cache of completions."""
+
+    def __init__(self, app=None) -> None:
+        self.enabled = False
+        self.threshold = 0.92
+        self.capacity = 10_000
+        self.directory: Optional[str] = None
+        self.flush_interval = 60.0
+        self.embedder: Any = HashingEmbedder()
+        self._embeddings = LRUCache(maxsize=1024, ttl=60, name="semcache.embeddings")
+        self._indexes: Dict[str, VectorIndex] = {}
+        self._lock = threading.Lock()
+        self._last_flush = time.monotonic()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app) -> None:
+        self.enabled = app.config.get("SEMANTIC_CACHE_ENABLED", False)
+        self.threshold = app.config.get("SEMANTIC_CACHE_THRESHOLD", self.threshold)
+        self.capacity = app.config.get("SEMANTIC_CACHE_CAPACITY", self.capacity)
+        self.directory = app.config.get("SEMANTIC_CACHE_DIR")
+        self.flush_interval = app.config.get("SEMANTIC_CACHE_FLUSH_INTERVAL", self.flush_interval)
+        self.embedder = _load_embedder(
+            app.config.get("SEMANTIC_CACHE_EMBEDDER", "hashing"),
+            app.config.get("SEMANTIC_CACHE_DIM", 256),
+            app.config.get("SEMANTIC_CACHE_EMBEDDING_MODEL"),
+        )
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+        self.clear()
+        app.extensions["semantic_cache"] = self
+
+    def enabled_for(self, org) -> bool:
+        return self.enabled and (org is None or getattr(org, "response_cache_enabled", True) is not False)
+
+    # ------------------------------------------------------------------
+    # Internals
+    # ------------------------------------------------------------------
+
+    @staticmethod
+    def _scope(org, model: str, max_tokens: int, params: Optional[Mapping[str, Any]]) -> str:
+        material = json.dumps([model, int(max_tokens), dict(params or {})], sort_keys=True, separators=(",", ":"))
+        org_part = f"org-{org.id}" if org is not None else "global"
+        return f"{org_part}-{hashlib.sha256(material.encode()).hexdigest()[:12]}"
+
+    def _embed(self, prompt: str) -> np.ndarray:
+        text = normalize_prompt(prompt)
+        vector = self._embeddings.get(text)
+        if vector is None:
+            vector = self.embedder.embed([text])[0]
+            self._embeddings.set(text, vector)
+        return vector
+
+    def _index(self, scope: str, dim: int, create: bool) -> Optional[VectorIndex]:
+        with self._lock:
+            index = self._indexes.get(scope)
+            if index is None and (create or self.directory):
+                path = os.path.join(self.directory, scope) if self.directory else None
+                index = self._indexes[scope] = VectorIndex(dim, self.capacity, path)
+            return index
+
+    # ------------------------------------------------------------------
+    # Public API
+    # ------------------------------------------------------------------
+
+    def lookup(self, prompt: str, *, org=None, model: str, max_tokens: int,
+               params: Optional[Mapping[str, Any]] = None) -> Optional[Completion]:
+        """Return the cached completion of the closest stored prompt, if close enough."""
+        started = time.perf_counter()
+        vector = self._embed(prompt)
+        index = self._index(self._scope(org, model, max_tokens, params), vector.shape[0], create=False)
+        hit = index.match(vector, self.threshold) if index is not None else None
+        metrics.latency("semcache.lookup").observe(time.perf_counter() - started)
+
+        if hit is not None:
+            payload, score = hit
+            metrics.counter("semcache.hits").inc()
+            completion = Completion.from_dict(payload)
+            completion.meta = {**completion.meta, "semantic_score": round(score, 4)}
+            return completion
+        metrics.counter("semcache.misses").inc()
+        return None
+
+    def store(self, prompt: str, completion: Completion, *, org=None, model: str, max_tokens: int,
+              params: Optional[Mapping[str, Any]] = None) -> None:
+        vector = self._embed(prompt)
+        index = self._index(self._scope(org, model, max_tokens, params), vector.shape[0], create=True)
+        index.add(vector, completion.to_dict())
+        if self.directory and time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self) -> int:
+        """Snapshot every changed index to ``SEMANTIC_CACHE_DIR``."""
+        self._last_flush = time.monotonic()
+        with self._lock:
+            indexes = list(self._indexes.values())
+        return sum(index.flush() for index in indexes)
+
+    def clear(self) -> None:
+        """Drop in‑memory indexes (snapshots on disk are kept)."""
+        with self._lock:
+            self._indexes = {}
+        self._embeddings.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        snapshot = metrics.snapshot(prefix="semcache.")
+        with self._lock:
+            snapshot["entries"] = {scope: len(index) for scope, index in self._indexes.items()}
+        return snapshot
+
+
+def _flush_at_exit() -> None:
+    from . import semantic_cache
+
+    if semantic_cache.directory:
+        semantic_cache.flush()
+
+
+atexit.register(_flush_at_exit)
@@ -0,0 +1,189 @@
+"""Compiled template cache shared by web and Celery worker processes.
+
+A fresh process (a gunicorn worker after ``max_requests``, a Celery worker
+restarted by ``--max-tasks-per-child``, a new container) has to parse and
+compile every Jinja template before its first render.  :class:`TemplateCache`
+removes that cold start in three steps:
+
+* A persistent **bytecode cache**, selected with ``TEMPLATE_BYTECODE_CACHE``:
+  ``"filesystem"`` (``TEMPLATE_BYTECODE_CACHE_DIR``, shared by the processes
+  on a host), ``"redis"`` (:class:`RedisBytecodeCache` on the shared ``kv``
+  store, shared by every host) or ``"none"``.  A process that finds a
+  template's bytecode there skips the compiler and only unmarshals it.
+  Jinja keys each entry by template name and file and checks the source
+  checksum and Python bytecode version on load, so an edited template or a
+  new interpreter simply recompiles.
+* A **warm-up** at boot (``TEMPLATE_WARMUP``, or ``flask warm-templates`` in
+  a deploy step) that loads every template under the app's and blueprints'
+  template folders.  The first request or email then starts from the
+  in-memory template cache.
+* **Static fragments** for email: ``{{ static_fragment("email/_signature.html") }}``
+  renders a template that takes no per-recipient context once per process
+  and reuses the output (``EMAIL_FRAGMENT_CACHE``).  A template reload
+  (debug ``auto_reload``) renders it again.
+
+Usage:
+  template_cache.warm(app)           # called by create_app when TEMPLATE_WARMUP is set
+  template_cache.stats()
+"""
+from __future__ import annotations
+
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+from jinja2 import BytecodeCache, FileSystemBytecodeCache
+from jinja2.bccache import Bucket
+from markupsafe import Markup
+
+from .metrics import metrics
+
+__all__ = ["RedisBytecodeCache", "TemplateCache"]
+
+logger = logging.getLogger(__name__)
+
+# Files under the template folders that are templates (static assets are skipped by the warm-up).
+TEMPLATE_EXTENSIONS = (".html", ".txt", ".xml", ".svg", ".j2", ".jinja")
+
+
+class RedisBytecodeCache(BytecodeCache):
+    """Jinja bytecode cache on the shared Redis store; a Redis outage only means recompiling."""
+
+    def __init__(self, store, prefix: str = "jinja:bc:", ttl: Optional[int] = None) -> None:
+        self.store = store
+        self.prefix = prefix
+        self.ttl = ttl
+
+    def load_bytecode(self, bucket: Bucket) -> None:
+        client = self.store.client
+        if client is None:
+            return
+        try:
+            code = client.get(self.prefix + bucket.key)
+        except Exception:  # pragma: no cover - Redis down
+            metrics.counter("template.bytecode.error").inc()
+            return
+        if code is not None:
+            bucket.bytecode_from_string(code)
+
+    def dump_bytecode(self, bucket: Bucket) -> None:
+        client = self.store.client
+        if client is None:
+            return
+        try:
+            client.set(self.prefix + bucket.key, bucket.bytecode_to_string(), ex=self.ttl or None)
+        except Exception:  # pragma: no cover - Redis down
+            metrics.counter("template.bytecode.error").inc()
+
+    def clear(self) -> None:
+        client = self.store.client
+        if client is not None:
+            for key in client.scan_iter(match=self.prefix + "*", count=500):
+                client.delete(key)
+
+
+class _CountingCache(BytecodeCache):
+    """Wraps a bytecode cache to count hits (bytecode loaded) and misses (template compiled)."""
+
+    def __init__(self, inner: BytecodeCache) -> None:
+        self.inner = inner
+
+    def load_bytecode(self, bucket: Bucket) -> None:
+        self.inner.load_bytecode(bucket)
+        metrics.counter("template.bytecode.hit" if bucket.code is not None else "template.bytecode.miss").inc()
+
+    def dump_bytecode(self, bucket: Bucket) -> None:
+        self.inner.dump_bytecode(bucket)
+
+    def clear(self) -> None:
+        self.inner.clear()
+
+
+class TemplateCache:
+    """Flask extension installing the bytecode cache, warm-up and static email fragments."""
+
+    def __init__(self, app=None, store=None) -> None:
+        self.backend = "none"
+        self.directory: Optional[str] = None
+        self.fragments_enabled = True
+        self.bytecode_cache: Optional[BytecodeCache] = None
+        self._fragments: Dict[str, Tuple[Any, Markup]] = {}
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app, store)
+
+    def init_app(self, app, store=None) -> None:
+        """Install the cache on *app*'s Jinja environment; call before the environment is first used."""
+        self.backend = (app.config.get("TEMPLATE_BYTECODE_CACHE") or "none").lower()
+        self.directory = app.config.get("TEMPLATE_BYTECODE_CACHE_DIR")
+        self.fragments_enabled = app.config.get("EMAIL_FRAGMENT_CACHE", True)
+        self._fragments = {}
+
+        if self.backend == "filesystem":
+            if self.directory:
+                os.makedirs(self.directory, exist_ok=True)
+            inner: Optional[BytecodeCache] = FileSystemBytecodeCache(self.directory)
+        elif self.backend == "redis" and store is not None:
+            inner = RedisBytecodeCache(store, ttl=app.config.get("TEMPLATE_BYTECODE_CACHE_TTL"))
+        elif self.backend in ("none", "off", ""):
+            inner = None
+        else:
+            raise ValueError(f"Unknown TEMPLATE_BYTECODE_CACHE {self.backend!r}; use filesystem, redis or none")
+        self.bytecode_cache = _CountingCache(inner) if inner is not None else None
+
+        if "jinja_env" in app.__dict__:  # environment already built (cached_property)
+            app.jinja_env.bytecode_cache = self.bytecode_cache
+        else:
+            app.jinja_options = {**app.jinja_options, "bytecode_cache": self.bytecode_cache}
+        app.add_template_global(self.static_fragment, "static_fragment")
+        app.extensions["template_cache"] = self
+
+    # ------------------------------------------------------------------
+    # Warm-up
+    # ------------------------------------------------------------------
+
+    def warm(self, app) -> int:
+        """Load (compile, or fetch the bytecode of) every template of *app*; returns how many loaded."""
+        started = time.perf_counter()
+        env, loaded = app.jinja_env, 0
+        for name in env.list_templates(filter_func=lambda name: name.endswith(TEMPLATE_EXTENSIONS)):
+            try:
+                env.get_template(name)
+            except Exception:
+                logger.exception("Template warm-up: %s does not compile", name)
+                continue
+            loaded += 1
+        elapsed = time.perf_counter() - started
+        metrics.latency("template.warm").observe(elapsed)
+        logger.info("Template warm-up: %d templates in %.0f ms (bytecode cache: %s)",
+                    loaded, elapsed * 1000, self.backend)
+        return loaded
+
+    # ------------------------------------------------------------------
+    # Static fragments
+    # ------------------------------------------------------------------
+
+    def static_fragment(self, name: str) -> Markup:
+        """The output of template *name* rendered without context, cached per process."""
+        from flask import current_app
+
+        template = current_app.jinja_env.get_template(name)
+        if self.fragments_enabled:
+            cached = self._fragments.get(name)
+            if cached is not None and cached[0] is template:  # same compiled template: not reloaded
+                metrics.counter("template.fragment.hit").inc()
+                return cached[1]
+        metrics.counter("template.fragment.miss").inc()
+        rendered = Markup(template.render())
+        if self.fragments_enabled:
+            with self._lock:
+                self._fragments[name] = (template, rendered)
+        return rendered
+
+    def stats(self) -> Dict[str, Any]:
+        snapshot = metrics.snapshot(prefix="template.")
+        snapshot["backend"] = self.backend
+        snapshot["fragments"] = len(self._fragments)
+        return snapshot
@@ -0,0 +1,123 @@
+"""Usage storage: bulk event writes and the hourly rollup.
+
+Raw :class:`~app.models.UsageEvent` rows are only ever written in batches
+(see :mod:`app.metering`) and only ever read by :func:`rollup_hours`, which
+rebuilds :class:`~app.models.UsageHourly` for the trailing hours.  Dashboards
+and billing read the hourly table via :func:`hourly_usage`.
+"""
+from __future__ import annotations
+
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional
+
+from sqlalchemy import case, delete, func, insert, select
+
+from . import celery, db
+from .models import UsageEvent, UsageHourly
+
+__all__ = ["flush_key_usage", "hourly_usage", "ingest_usage", "rollup_hours", "rollup_usage", "write_events"]
+
+
+# Rows per INSERT statement; keeps bound parameters well under the SQLite
+# (32766) and PostgreSQL (65535) limits.
+INSERT_CHUNK = 1000
+
+
+def write_events(events: List[Dict[str, Any]]) -> int:
+    """Insert *events* as multi‑row ``INSERT … VALUES (…), (…)`` statements.
+
+    One statement per :data:`INSERT_CHUNK` rows, on a dedicated connection so
+    the write stays out of any request session.
+    """
+    if not events:
+        return 0
+    with db.engine.begin() as conn:
+        for start in range(0, len(events), INSERT_CHUNK):
+            conn.execute(insert(UsageEvent).values(events[start:start + INSERT_CHUNK]))
+    return len(events)
+
+
+def _hour_floor(moment: datetime) -> datetime:
+    return moment.replace(minute=0, second=0, microsecond=0)
+
+
+def rollup_hours(hours: int = 2, now: Optional[datetime] = None) -> int:
+    """Recompute hourly aggregates for the current hour and the *hours* − 1 before it.
+
+    Each hour is rebuilt from raw events inside one transaction (delete, then
+    insert), so re‑running is idempotent and late‑arriving events are picked up
+    on the next pass.  Returns the number of hourly rows written.
+    """
+    current = _hour_floor(now or datetime.utcnow())
+    written = 0
+    with db.engine.begin() as conn:
+        for offset in range(hours - 1, -1, -1):
+            start = current - timedelta(hours=offset)
+            end = start + timedelta(hours=1)
+            rows = conn.execute(
+                select(
+                    UsageEvent.organization_id,
+                    func.count(),
+                    func.sum(case((UsageEvent.status != "ok", 1), else_=0)),
+                    func.sum(UsageEvent.prompt_tokens),
+                    func.sum(UsageEvent.completion_tokens),
+                    func.sum(UsageEvent.latency_ms),
+                    func.max(UsageEvent.latency_ms),
+                )
+                .where(UsageEvent.created_at >= start, UsageEvent.created_at < end)
+                .group_by(UsageEvent.organization_id)
+            ).all()
+
+            conn.execute(delete(UsageHourly).where(UsageHourly.hour == start))
+            if rows:
+                conn.execute(insert(UsageHourly), [
+                    {
+                        "organization_id": org_id,
+                        "hour": start,
+                        "requests": count,
+                        "errors": errors or 0,
+                        "prompt_tokens": prompt_tokens or 0,
+                        "completion_tokens": completion_tokens or 0,
+                        "total_latency_ms": total_latency or 0.0,
+                        "max_latency_ms": max_latency or 0.0,
+                    }
+                    for org_id, count, errors, prompt_tokens, completion_tokens, total_latency, max_latency in rows
+                ])
+                written += len(rows)
+    return written
+
+
+def hourly_usage(org_id: int, since: Optional[datetime] = None) -> List[UsageHourly]:
+    """Hourly usage rows for *org_id*, oldest first (default: the last 24 hours)."""
+    since = since or _hour_floor(datetime.utcnow()) - timedelta(hours=23)
+    return db.session.scalars(
+        select(UsageHourly)
+        .where(UsageHourly.organization_id == org_id, UsageHourly.hour >= since)
+        .order_by(UsageHourly.hour)
+    ).all()
+
+
+# ---------------------------------------------------------------------------
+# Celery tasks
+# ---------------------------------------------------------------------------
+
+@celery.task(name="usage.ingest")
+def ingest_usage(events: Iterable[Dict[str, Any]]) -> int:
+    """Bulk‑write a batch of serialized events handed off by a web worker."""
+    return write_events([
+        {**event, "created_at": datetime.fromisoformat(event["created_at"])} for event in events
+    ])
+
+
+@celery.task(name="usage.rollup")
+def rollup_usage(hours: int = 2) -> int:
+    """Periodic (celery beat) refresh of the trailing hourly aggregates."""
+    return rollup_hours(hours)
+
+
+@celery.task(name="apikeys.flush_usage")
+def flush_key_usage() -> int:
+    """Periodic (celery beat) write‑behind of API key ``last_used_at`` / request counts."""
+    from . import api_key_usage
+
+    return api_key_usage.flush()
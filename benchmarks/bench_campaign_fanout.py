@@ -0,0 +1,122 @@
+"""Fan-out cost of emailing every member: one task per recipient vs campaign chunks.
+
+Fills a SQLite database with N confirmed users (each a member of an
+organization) and measures the fan-out step alone, with no mail sent:
+
+* ``per-recipient``: the old way, i.e. load the members and call
+  ``send_email.delay(email, subject, template, **context)`` for each one.
+* ``campaign``: :func:`app.campaigns.plan_campaign`, which streams the ids
+  with ``yield_per`` and queues one ``email.send_campaign_chunk`` task per
+  ``--chunk-size`` recipients.
+
+``.delay`` is replaced by a stub that only measures the JSON payload each
+task would put on the broker.  Reported per row: Python heap peak
+(tracemalloc), tasks queued, broker bytes and wall time.  The campaign's
+peak should not grow with N.
+
+Run from the repository root:
+  python benchmarks/bench_campaign_fanout.py
+  python benchmarks/bench_campaign_fanout.py --sizes 10000 100000 1000000 --fanouts campaign
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+from unittest import mock
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+# Importing ``app`` loads config.py and create_app() the payments blueprint, which insist on these.
+os.environ.setdefault("SECRET_KEY", "bench")
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+os.environ.setdefault("STRIPE_SECRET_KEY", "sk_test_bench")
+
+from sqlalchemy import delete, insert, select  # noqa: E402
+
+from app import create_app, db  # noqa: E402
+from app.campaigns import plan_campaign, recipient_filter, send_campaign_chunk  # noqa: E402
+from app.email import send_email  # noqa: E402
+from app.models import Campaign, CampaignChunk, Membership, Organization, User  # noqa: E402
+
+CONTEXT = {"headline": "New models", "body": "Faster and cheaper generation for every plan. " * 10}
+
+
+def _populate(size: int, start: int) -> None:
+    if start == 0:
+        db.session.add(Organization(id=1, name="Bench"))
+        db.session.commit()
+    for offset in range(start, size, 10_000):
+        stop = min(size, offset + 10_000)
+        db.session.execute(insert(User), [{"id": n + 1, "email": f"user{n}@example.com", "confirmed": True,
+                                           "session_version": 1, "is_admin": False} for n in range(offset, stop)])
+        db.session.execute(insert(Membership), [{"user_id": n + 1, "organization_id": 1, "role": "member"}
+                                                for n in range(offset, stop)])
+    db.session.commit()
+
+
+def _measure(fanout):
+    payload = {"tasks": 0, "bytes": 0}
+
+    def fake_delay(*args, **kwargs):
+        payload["tasks"] += 1
+        payload["bytes"] += len(json.dumps([args, kwargs], default=str))
+
+    tracemalloc.start()
+    started = time.perf_counter()
+    fanout(fake_delay)
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak / 2**20, payload["tasks"], payload["bytes"], elapsed
+
+
+def _per_recipient(fake_delay) -> None:
+    with mock.patch.object(send_email, "delay", fake_delay):
+        users = db.session.scalars(select(User).where(*recipient_filter(1)).order_by(User.id)).all()
+        for user in users:
+            send_email.delay(user.email, "New models", "email/announcement", **CONTEXT)
+    db.session.expunge_all()
+
+
+def _campaign(chunk_size: int):
+    def fanout(fake_delay) -> None:
+        campaign = Campaign(subject="New models", template="email/announcement", context=json.dumps(CONTEXT),
+                            organization_id=1, chunk_size=chunk_size)
+        db.session.add(campaign)
+        db.session.commit()
+        with mock.patch.object(send_campaign_chunk, "delay", fake_delay):
+            plan_campaign.run(campaign.id)
+        db.session.execute(delete(CampaignChunk))
+        db.session.commit()
+    return fanout
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000])
+    parser.add_argument("--chunk-size", type=int, default=500)
+    parser.add_argument("--fanouts", nargs="+", choices=["per-recipient", "campaign"],
+                        default=["per-recipient", "campaign"])
+    args = parser.parse_args()
+
+    app = create_app("test")
+    with app.app_context():
+        db.create_all()
+        populated = 0
+        print(f"{'recipients':>10}  {'fan-out':<14} {'peak heap':>10} {'tasks':>8} {'broker':>11} {'time':>8}")
+        for size in sorted(args.sizes):
+            _populate(size, populated)
+            populated = size
+            for label, fanout in (("per-recipient", _per_recipient), ("campaign", _campaign(args.chunk_size))):
+                if label not in args.fanouts:
+                    continue
+                peak, tasks, sent_bytes, elapsed = _measure(fanout)
+                print(f"{size:>10}  {label:<14} {peak:8.1f} MB {tasks:>8} {sent_bytes / 2**10:8.0f} KB "
+                      f"{elapsed:7.2f} s")
+
+
+if __name__ == "__main__":
+    main()
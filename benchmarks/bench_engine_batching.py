@@ -0,0 +1,111 @@
+"""Local engine throughput: micro‑batched vs one‑at‑a‑time inference.
+
+Many client threads send single prompts to :class:`app.engine.LocalEngine`
+concurrently, once with batching off (``batch_max_size=1``) and once with the
+micro‑batcher on, and the script reports throughput and latency percentiles.
+
+Two backends are compared: the built‑in ``template`` backend (cheap forward
+pass, so batching mostly amortizes process‑pool round trips) and ``mlp``, a
+small NumPy MLP whose cost is dominated by matrix products and therefore
+benefits from batched GEMM like a real CPU model would.
+
+Run from the repository root:
+  python benchmarks/bench_engine_batching.py
+  python benchmarks/bench_engine_batching.py --clients 32 --requests 20 --wait-ms 2 --max-batch 32
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+# Importing ``app`` loads config.py, which insists on these being set.
+os.environ.setdefault("SECRET_KEY", "bench")
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+from app.engine import LocalEngine  # noqa: E402
+from app.metrics import LatencyStats  # noqa: E402
+from app.semantic_cache import HashingEmbedder  # noqa: E402
+
+
+class MLPBackend:
+    """Synthetic CPU model: hashed embedding → 3 dense layers → one label word."""
+
+    name = "mlp"
+    dim, hidden, layers = 256, 1024, 3
+
+    def __init__(self) -> None:
+        rng = np.random.default_rng(0)
+        self.embedder = HashingEmbedder(self.dim)
+        shapes = [(self.dim, self.hidden)] + [(self.hidden, self.hidden)] * (self.layers - 1)
+        self.weights = [rng.standard_normal(s).astype(np.float32) / np.sqrt(s[0]) for s in shapes]
+        self.vocab = np.array([f"token{i}" for i in range(self.hidden)])
+
+    def generate_batch(self, prompts, max_tokens, deadline=None):
+        x = self.embedder.embed(prompts)
+        for w in self.weights:
+            x = np.maximum(x @ w, 0.0)
+        return [" ".join(self.vocab[np.argsort(-row)[:max_tokens]]) for row in x]
+
+
+BACKENDS = {"template": "template", "mlp": "bench_engine_batching:MLPBackend"}
+
+
+def run(backend: str, clients: int, requests: int, max_batch: int, wait_ms: float, workers: int):
+    engine = LocalEngine()
+    engine.backend, engine.workers, engine.budget = BACKENDS[backend], workers, 120
+    engine.max_queue = clients * 2
+    engine.batch_max_size, engine.batch_wait_ms = max_batch, wait_ms
+    stats = LatencyStats(window=clients * requests)
+    try:
+        engine.complete("warm up the worker processes", max_tokens=8)
+        barrier = threading.Barrier(clients + 1)
+
+        def client(n: int) -> None:
+            barrier.wait()
+            for i in range(requests):
+                started = time.perf_counter()
+                engine.complete(f"client {n} request {i}: a marketplace for local farmers", max_tokens=8)
+                stats.observe(time.perf_counter() - started)
+
+        threads = [threading.Thread(target=client, args=(n,)) for n in range(clients)]
+        for t in threads:
+            t.start()
+        barrier.wait()
+        started = time.perf_counter()
+        for t in threads:
+            t.join()
+        elapsed = time.perf_counter() - started
+    finally:
+        engine.shutdown()
+    return clients * requests / elapsed, stats
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backends", nargs="+", default=["template", "mlp"], choices=sorted(BACKENDS))
+    parser.add_argument("--clients", type=int, default=32)
+    parser.add_argument("--requests", type=int, default=20, help="requests per client")
+    parser.add_argument("--workers", type=int, default=2, help="engine worker processes")
+    parser.add_argument("--max-batch", type=int, default=32)
+    parser.add_argument("--wait-ms", type=float, default=2.0)
+    args = parser.parse_args()
+
+    print(f"{args.clients} clients x {args.requests} requests, {args.workers} worker processes")
+    for backend in args.backends:
+        for label, max_batch, wait_ms in [
+            ("one-at-a-time", 1, 0.0),
+            (f"batched (<= {args.max_batch}, {args.wait_ms:g} ms)", args.max_batch, args.wait_ms),
+        ]:
+            rps, stats = run(backend, args.clients, args.requests, max_batch, wait_ms, args.workers)
+            print(f"{backend:<9} {label:<26} {rps:9.1f} req/s   "
+                  f"p50 {stats.percentile(50) * 1000:7.2f} ms   p99 {stats.percentile(99) * 1000:7.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
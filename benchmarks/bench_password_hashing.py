@@ -0,0 +1,93 @@
+"""Login throughput of one web worker: inline hashing vs the bounded hash pool.
+
+Simulates a threaded gunicorn worker (``--threads``) under a login burst:
+every request thread verifies one password, which is what dominates the cost
+of ``POST /auth/login``.  The baseline calls werkzeug inline in the request
+thread (the old ``User.check_password``); the other rows go through
+:class:`app.passwords.PasswordHasher` with different pool sizes, reporting
+logins/s, latency of admitted logins and how many were shed with 503 instead
+of queueing.
+
+Run from the repository root:
+  python benchmarks/bench_password_hashing.py
+  python benchmarks/bench_password_hashing.py --method pbkdf2:sha256:600000 --threads 16 --logins 400
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+# Importing ``app`` loads config.py, which insists on these being set.
+os.environ.setdefault("SECRET_KEY", "bench")
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+from werkzeug.security import check_password_hash, generate_password_hash  # noqa: E402
+
+from app.metrics import LatencyStats  # noqa: E402
+from app.passwords import HashPoolSaturated, PasswordHasher  # noqa: E402
+
+
+def _burst(verify, threads: int, logins: int):
+    stats = LatencyStats(window=logins)
+    shed = 0
+    lock = threading.Lock()
+    remaining = iter(range(logins))
+
+    def request_thread() -> None:
+        nonlocal shed
+        while True:
+            with lock:
+                if next(remaining, None) is None:
+                    return
+            started = time.perf_counter()
+            try:
+                assert verify()
+            except HashPoolSaturated:
+                with lock:
+                    shed += 1
+                continue
+            stats.observe(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    pool = [threading.Thread(target=request_thread) for _ in range(threads)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    return (logins - shed) / (time.perf_counter() - started), stats, shed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--method", default="scrypt:32768:8:1")
+    parser.add_argument("--threads", type=int, default=8, help="request threads per web worker")
+    parser.add_argument("--logins", type=int, default=200)
+    parser.add_argument("--pool-sizes", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--max-pending", type=int, default=4)
+    args = parser.parse_args()
+
+    password_hash = generate_password_hash("password123", args.method)
+    print(f"{args.method}, {args.threads} request threads, {args.logins} logins, {os.cpu_count()} CPUs")
+
+    rows = [("inline (no pool)", lambda: check_password_hash(password_hash, "password123"), None)]
+    for size in args.pool_sizes:
+        hasher = PasswordHasher()
+        hasher.workers, hasher.max_pending = size, max(args.max_pending, size)
+        rows.append((f"pool={size} max_pending={hasher.max_pending}",
+                     lambda h=hasher: h.verify(password_hash, "password123"), hasher))
+
+    for label, verify, hasher in rows:
+        throughput, stats, shed = _burst(verify, args.threads, args.logins)
+        ms = lambda pct: stats.percentile(pct) * 1000  # noqa: E731
+        print(f"{label:<26} {throughput:7.1f} logins/s   p50 {ms(50):7.1f} ms   p99 {ms(99):7.1f} ms   "
+              f"shed {shed}")
+        if hasher is not None:
+            hasher.shutdown()
+
+
+if __name__ == "__main__":
+    main()
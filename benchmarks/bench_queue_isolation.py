@@ -0,0 +1,101 @@
+"""Latency of a real-time task queued behind a bulk backlog: one queue vs the queue topology.
+
+Queues ``--backlog`` campaign chunks (``email.send_campaign_chunk``), each
+standing in for ``--chunk-ms`` of SMTP work, then one ``generation.run``.
+It reports how long the generation job waited:
+
+* ``single queue``: the old setup.  Every task goes to the default queue,
+  and two workers consume it.
+* ``topology``: :mod:`app.queues` routing, with a ``bulk`` worker and a
+  ``realtime`` worker started from their profiles.
+
+The workers are in-process threads (solo pool, one task at a time) on
+kombu's in-memory broker, so the numbers show queueing delay, not broker
+overhead.
+
+Run from the repository root:
+  python benchmarks/bench_queue_isolation.py
+  python benchmarks/bench_queue_isolation.py --backlog 200 --chunk-ms 20
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+import threading
+import time
+from contextlib import ExitStack
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+# Importing ``app`` loads config.py, which insists on these.
+os.environ.setdefault("SECRET_KEY", "bench")
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+from celery import Celery  # noqa: E402
+from celery.contrib.testing.worker import start_worker  # noqa: E402
+
+from app.queues import apply_worker_profile, configure  # noqa: E402
+
+
+def _app(name: str, topology: bool, chunk_seconds: float, done: threading.Event) -> Celery:
+    app = Celery(name, broker="memory://", set_as_current=False)
+    if topology:
+        configure(app, {"CELERY_BROKER_URL": "memory://"})
+    app.conf.update(task_ignore_result=True, worker_hijack_root_logger=False, worker_prefetch_multiplier=1,
+                    broker_transport_options={"polling_interval": 0.005})  # the memory transport polls
+    app.finalize()
+    for task in ("email.send_campaign_chunk", "generation.run"):
+        app.tasks.pop(task, None)  # the app's real tasks are shared with every Celery app
+
+    @app.task(name="email.send_campaign_chunk")
+    def send_chunk(campaign_id, index):
+        time.sleep(chunk_seconds)
+
+    @app.task(name="generation.run")
+    def generate(org_id, prompt):
+        done.set()
+
+    return app
+
+
+def _measure(topology: bool, backlog: int, chunk_seconds: float) -> float:
+    done = threading.Event()
+    if topology:
+        workers = []
+        for profile in ("bulk", "realtime"):
+            app = _app(profile, True, chunk_seconds, done)
+            apply_worker_profile(app, profile)
+            workers.append(app)
+    else:
+        workers = [_app(f"single-{n}", False, chunk_seconds, done) for n in range(2)]
+    producer = workers[-1]
+
+    with ExitStack() as stack:
+        for app in workers:
+            stack.enter_context(start_worker(app, pool="solo", perform_ping_check=False, shutdown_timeout=60))
+        for index in range(backlog):
+            producer.send_task("email.send_campaign_chunk", (1, index))
+        started = time.perf_counter()
+        producer.send_task("generation.run", (1, "hello"))
+        done.wait()
+        waited = time.perf_counter() - started
+        with producer.connection_for_write() as conn:  # drop what is left of the backlog
+            for queue in ("celery", "bulk"):
+                conn.default_channel.queue_purge(queue)
+    return waited
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backlog", type=int, default=100, help="campaign chunks queued first")
+    parser.add_argument("--chunk-ms", type=float, default=20, help="work per chunk")
+    args = parser.parse_args()
+
+    print(f"{'setup':<14} {'generation.run waited':>22}")
+    for label, topology in (("single queue", False), ("topology", True)):
+        waited = _measure(topology, args.backlog, args.chunk_ms / 1000)
+        print(f"{label:<14} {waited * 1000:19.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""Semantic cache lookup latency at 10^5–10^6 entries.
+
+Fills one :class:`app.semantic_cache.VectorIndex` (a single organization's
+matrix) with random unit vectors and times ``search`` – the vectorized
+matrix‑vector product plus top‑k – for a stream of queries.  Also reports the
+cost of embedding a prompt with the hashing embedder.
+
+Run from the repository root:
+  python benchmarks/bench_semantic_cache.py
+  python benchmarks/bench_semantic_cache.py --sizes 100000 1000000 --dim 256 --queries 200
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+# Importing ``app`` loads config.py, which insists on these being set.
+os.environ.setdefault("SECRET_KEY", "bench")
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+from app.metrics import LatencyStats  # noqa: E402
+from app.semantic_cache import HashingEmbedder, VectorIndex  # noqa: E402
+
+
+def _fill(index: VectorIndex, n: int, dim: int, seed: int = 0) -> None:
+    rng = np.random.default_rng(seed)
+    chunk = 50_000
+    for start in range(0, n, chunk):
+        rows = rng.standard_normal((min(chunk, n - start), dim)).astype(np.float32)
+        rows /= np.linalg.norm(rows, axis=1, keepdims=True)
+        index.vectors[start:start + len(rows)] = rows  # bulk load; add() is per row
+    index.size = n
+
+
+def _row(label: str, stats: LatencyStats) -> str:
+    ms = lambda pct: stats.percentile(pct) * 1000  # noqa: E731
+    return f"{label:<28} p50 {ms(50):8.3f} ms   p95 {ms(95):8.3f} ms   p99 {ms(99):8.3f} ms"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100_000, 1_000_000])
+    parser.add_argument("--dim", type=int, default=256)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=1)
+    args = parser.parse_args()
+
+    embedder = HashingEmbedder(args.dim)
+    embed = LatencyStats(window=args.queries)
+    for i in range(args.queries):
+        started = time.perf_counter()
+        embedder.embed([f"What is the capital of country number {i}? Answer briefly."])
+        embed.observe(time.perf_counter() - started)
+    print(_row(f"embed (hashing, dim={args.dim})", embed))
+
+    for n in args.sizes:
+        index = VectorIndex(dim=args.dim, capacity=n)
+        _fill(index, n, args.dim)
+        queries = np.random.default_rng(1).standard_normal((args.queries, args.dim)).astype(np.float32)
+        queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+
+        index.search(queries[0], k=args.k)  # warm up BLAS threads / page in
+        stats = LatencyStats(window=args.queries)
+        for query in queries:
+            started = time.perf_counter()
+            index.search(query, k=args.k)
+            stats.observe(time.perf_counter() - started)
+        mb = index.vectors.nbytes / 2**20
+        print(_row(f"search n={n:,} ({mb:,.0f} MiB)", stats))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""Per‑request database work on ``GET /dashboard`` with and without the identity cache.
+
+Logs one user in, then requests the dashboard repeatedly, each request in
+its own app context (as in production: fresh ``g`` and DB session), and
+counts the SQL statements issued and the latency – first with
+``IDENTITY_CACHE_ENABLED`` off (one eager‑loaded user query per request),
+then with the cache on, in‑process and through Redis (fakeredis).
+
+Run from the repository root:
+  python benchmarks/bench_session_identity.py
+  python benchmarks/bench_session_identity.py --requests 2000
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+import time
+
+import fakeredis
+from sqlalchemy import event
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+# Importing ``app`` loads config.py, which insists on these being set.
+os.environ.setdefault("SECRET_KEY", "bench")
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+from app import create_app, db, identity_cache, kv  # noqa: E402
+from app.metrics import LatencyStats  # noqa: E402
+from app.models import Membership, Organization, User  # noqa: E402
+
+
+def _run(app, requests: int, mode: str):
+    identity_cache.enabled = mode != "off"
+    kv.use(fakeredis.FakeRedis() if mode == "redis" else None)
+    identity_cache.clear_local()
+    client = app.test_client()
+    with app.app_context():
+        client.post("/auth/login", data={"email": "bench@example.com", "password": "password123"})
+        engine = db.engine
+
+    statements = []
+    count = lambda *args: statements.append(args[2])  # noqa: E731
+    event.listen(engine, "before_cursor_execute", count)
+    stats = LatencyStats(window=requests)
+    try:
+        for _ in range(requests):
+            started = time.perf_counter()
+            with app.app_context():
+                assert client.get("/dashboard").status_code == 200
+            stats.observe(time.perf_counter() - started)
+    finally:
+        event.remove(engine, "before_cursor_execute", count)
+    user_queries = sum("FROM users" in sql for sql in statements)
+    return len(statements) / requests, user_queries / requests, stats
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=500)
+    args = parser.parse_args()
+
+    app = create_app("testing")
+    with app.app_context():
+        db.create_all()
+        user = User(email="bench@example.com", confirmed=True)
+        user.set_password("password123")
+        org = Organization(name="Bench Org", is_subscribed=True)
+        db.session.add_all([user, org, Membership(user=user, organization=org, role="owner")])
+        db.session.commit()
+
+    for mode in ("off", "local", "redis"):
+        per_request, user_loads, stats = _run(app, args.requests, mode)
+        ms = lambda pct: stats.percentile(pct) * 1000  # noqa: E731
+        print(f"identity cache {mode:<6} {per_request:5.2f} statements/req "
+              f"({user_loads:4.2f} user loads)   p50 {ms(50):7.3f} ms   p95 {ms(95):7.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""Email throughput of one Celery worker: a connection per email vs the SMTP pool.
+
+Starts a local ``aiosmtpd`` server as a stand-in for the mail relay and
+sends the same messages two ways from a single worker thread:
+
+* ``direct``: Flask‑Mail's ``mail.send`` per message, which is what
+  ``email.send`` does with ``MAIL_DELIVERY_MODE = "direct"``.  Every message
+  pays for connect, EHLO and QUIT.
+* ``pooled``: :meth:`app.mailer.SMTPPool.submit` into the Redis outbox
+  (fakeredis), then one :meth:`~app.mailer.SMTPPool.drain`, at different
+  ``SMTP_BATCH_SIZE`` values.
+
+Loopback connections are nearly free, while a real relay costs a TCP and TLS
+handshake plus AUTH over the network.  ``--handshake-ms`` adds that cost to
+every new session, in the server's EHLO reply.  Reported: messages/s per
+worker and how many SMTP sessions were opened.
+
+Run from the repository root (needs ``pip install aiosmtpd``):
+  python benchmarks/bench_smtp_delivery.py
+  python benchmarks/bench_smtp_delivery.py --messages 2000 --handshake-ms 80 --batch-sizes 50 500
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import os
+import socket
+import sys
+import time
+
+import fakeredis
+from aiosmtpd.controller import Controller
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+# Importing ``app`` loads config.py and create_app() the payments blueprint, which insist on these.
+os.environ.setdefault("SECRET_KEY", "bench")
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+os.environ.setdefault("STRIPE_SECRET_KEY", "sk_test_bench")
+
+from flask_mail import Message  # noqa: E402
+
+from app import create_app, kv, mail, smtp_pool  # noqa: E402
+
+
+class RelayStandIn:
+    """Accepts everything; counts messages and sessions, and delays EHLO by the handshake cost."""
+
+    def __init__(self, handshake: float) -> None:
+        self.handshake = handshake
+        self.messages = 0
+        self.sessions = 0
+
+    async def handle_EHLO(self, server, session, envelope, hostname, responses):
+        self.sessions += 1
+        session.host_name = hostname
+        await asyncio.sleep(self.handshake)
+        return responses
+
+    async def handle_DATA(self, server, session, envelope):
+        self.messages += 1
+        return "250 Message accepted for delivery"
+
+
+def _messages(count: int):
+    return [Message(subject="Confirm your account", sender="noreply@example.com", recipients=[f"user{n}@example.com"],
+                    body="Welcome!\n" * 20, html="<p>Welcome!</p>" * 20) for n in range(count)]
+
+
+def _free_port() -> int:
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=500)
+    parser.add_argument("--handshake-ms", type=float, default=30.0, help="emulated TLS + AUTH cost per session")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[10, 100])
+    args = parser.parse_args()
+
+    relay = RelayStandIn(args.handshake_ms / 1000)
+    port = _free_port()
+    controller = Controller(relay, hostname="127.0.0.1", port=port)
+    controller.start()
+
+    app = create_app("test")
+    app.config.update(MAIL_SERVER="127.0.0.1", MAIL_PORT=port, MAIL_SUPPRESS_SEND=False,
+                      MAIL_DELIVERY_MODE="pooled")
+    mail.init_app(app)
+    smtp_pool.init_app(app, kv)
+    kv.use(fakeredis.FakeRedis())
+    print(f"{args.messages} messages, {args.handshake_ms:.0f} ms per SMTP session setup, one worker thread")
+
+    try:
+        with app.app_context():
+            rows = [("direct (connection per email)", lambda msgs: [mail.send(m) for m in msgs])]
+            for size in args.batch_sizes:
+                def pooled(msgs, size=size):
+                    smtp_pool.batch_size = size
+                    kv.client.set(smtp_pool.scheduled_key, 1)  # a drain is "scheduled": the benchmark runs it
+                    for m in msgs:
+                        smtp_pool.submit(m)
+                    smtp_pool.drain()
+                rows.append((f"pooled batch={size}", pooled))
+
+            for label, send in rows:
+                smtp_pool.close()
+                relay.messages = relay.sessions = 0
+                msgs = _messages(args.messages)
+                started = time.perf_counter()
+                send(msgs)
+                elapsed = time.perf_counter() - started
+                assert relay.messages == args.messages, relay.messages
+                print(f"{label:<32} {args.messages / elapsed:8.1f} msgs/s   {relay.sessions:5d} SMTP sessions")
+    finally:
+        smtp_pool.close()
+        controller.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""Broker message cost of a task argument: ORM objects or data snapshots vs ``ref()``.
+
+Builds the ``email.send_email`` body, ``(args, kwargs, {})``, for a
+confirmation email and serializes it with kombu the way Celery does on
+``apply_async``.  The ``user`` keyword is passed four ways:
+
+* ``pickle-orm``: the ``User`` object itself, with the pickle serializer
+  (the only one that accepts it; its instance state comes along).
+* ``json-snapshot``: every column of the user as a dict, the usual
+  workaround for JSON.
+* ``json-ref``: :func:`app.payloads.ref`, i.e. ``{"$ref": "User", "id": n}``.
+* ``json-ref+hydrate``: the same, plus the worker's
+  :func:`app.payloads.hydrate_many` for a batch of ``--batch`` messages
+  (one ``SELECT … IN`` per batch).
+
+Reported per row: message size and the mean time to dump and load one
+message.
+
+Run from the repository root:
+  python benchmarks/bench_task_payloads.py
+  python benchmarks/bench_task_payloads.py --iterations 20000 --batch 500
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+# Importing ``app`` loads config.py and create_app() the payments blueprint, which insist on these.
+os.environ.setdefault("SECRET_KEY", "bench")
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+os.environ.setdefault("STRIPE_SECRET_KEY", "sk_test_bench")
+
+from kombu import serialization  # noqa: E402
+
+from app import create_app, db  # noqa: E402
+from app.models import User  # noqa: E402
+from app.payloads import hydrate_many, ref  # noqa: E402
+
+
+def _snapshot(user: User) -> dict:
+    return {column.key: getattr(user, column.key) for column in User.__table__.columns}
+
+
+def _roundtrip(body, serializer: str, iterations: int):
+    content_type, encoding, data = serialization.dumps(body, serializer)
+    started = time.perf_counter()
+    for _ in range(iterations):
+        content_type, encoding, data = serialization.dumps(body, serializer)
+        serialization.loads(data, content_type, encoding, accept=[content_type])
+    return len(data), (time.perf_counter() - started) / iterations
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=5000)
+    parser.add_argument("--batch", type=int, default=100, help="messages hydrated together by a worker")
+    args = parser.parse_args()
+
+    app = create_app("test")
+    with app.app_context():
+        db.create_all()
+        users = [User(email=f"user{n}@example.com", confirmed=True) for n in range(args.batch)]
+        for user in users:
+            user.set_password("password123")
+        db.session.add_all(users)
+        db.session.commit()
+        user = users[0]
+        body = lambda value: ((user.email, "Confirm Your Account", "email/confirm"),  # noqa: E731
+                              {"user": value, "token": "t" * 120}, {})
+
+        rows = [
+            ("pickle-orm",) + _roundtrip(body(user), "pickle", args.iterations),
+            ("json-snapshot",) + _roundtrip(body(_snapshot(user)), "json", args.iterations),
+            ("json-ref",) + _roundtrip(body(ref(user)), "json", args.iterations),
+        ]
+
+        size, per_message = _roundtrip(body(ref(user)), "json", args.iterations)
+        messages = [body(ref(u))[1] for u in users]
+        rounds = max(1, args.iterations // args.batch)
+        started = time.perf_counter()
+        for _ in range(rounds):
+            db.session.expunge_all()
+            hydrate_many(messages)
+        rows.append(("json-ref+hydrate", size, per_message + (time.perf_counter() - started) / (rounds * args.batch)))
+
+        print(f"{'payload':<18} {'message':>9} {'per message':>12}")
+        for label, size, seconds in rows:
+            print(f"{label:<18} {size:>7} B {seconds * 1e6:9.1f} us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""Time to first render after a worker starts, with and without the template bytecode cache.
+
+Each measurement is a fresh Python process, like a restarted gunicorn or
+Celery worker.  The process builds the app and then times:
+
+* ``warm-up``: :meth:`app.templating.TemplateCache.warm`, when enabled
+  (``TEMPLATE_WARMUP``); it moves the compile cost to boot.
+* ``first email``: ``render_message`` for ``email/confirm`` (.txt + .html),
+  i.e. what the first ``email.send`` task pays.
+* ``first page``: ``render_template("landing_page.html")`` (extends ``base.html``).
+
+Scenarios:
+
+* ``none``: no bytecode cache; every template is compiled from source.
+* ``filesystem cold``: empty ``TEMPLATE_BYTECODE_CACHE_DIR`` (the first
+  worker on a host).
+* ``filesystem warm``: the directory filled by an earlier process (every
+  later restart).
+* ``redis warm``: same via the kv store; only with ``--redis-url``.
+
+Run from the repository root:
+  python benchmarks/bench_template_cold_start.py
+  python benchmarks/bench_template_cold_start.py --runs 10 --redis-url redis://localhost:6379/15
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+
+def _child(backend: str, warmup: bool) -> None:
+    started = time.perf_counter()
+    sys.path.insert(0, ROOT)
+    from flask import render_template
+
+    from app import create_app, kv, template_cache
+    from app.email import render_message
+    from app.models import User
+
+    app = create_app("test")
+    # The test config pins the cache off; switch it to the backend under measurement.
+    app.config.update(TEMPLATE_BYTECODE_CACHE=backend, TEMPLATE_BYTECODE_CACHE_DIR=os.environ["BENCH_CACHE_DIR"])
+    if os.environ.get("BENCH_REDIS_URL"):
+        import redis
+
+        kv.use(redis.Redis.from_url(os.environ["BENCH_REDIS_URL"]))
+    template_cache.init_app(app, kv)
+    booted = time.perf_counter()
+    with app.app_context():
+        warm_started = time.perf_counter()
+        if warmup:
+            template_cache.warm(app)
+        warm = time.perf_counter() - warm_started
+
+        first = time.perf_counter()
+        render_message("cold@example.com", "Confirm", "email/confirm", user=User(email="cold@example.com"), token="t")
+        email = time.perf_counter() - first
+
+        with app.test_request_context("/"):
+            first = time.perf_counter()
+            render_template("landing_page.html")
+            page = time.perf_counter() - first
+    print(json.dumps({"boot": booted - started, "warm": warm, "email": email, "page": page}))
+
+
+def _run(backend: str, warmup: bool, env: dict) -> dict:
+    out = subprocess.run([sys.executable, __file__, "--child", backend, "--warmup" if warmup else "--no-warmup"],
+                         env=env, cwd=ROOT, check=True, capture_output=True, text=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5, help="processes per scenario (median reported)")
+    parser.add_argument("--redis-url", default=None, help="also measure the redis backend on this server")
+    parser.add_argument("--child", default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--warmup", action=argparse.BooleanOptionalAction, default=True, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        _child(args.child, args.warmup)
+        return
+
+    # The child processes build the "test" app; these stand in for its required settings.
+    base = dict(os.environ, SECRET_KEY="bench", DATABASE_URL="sqlite://", STRIPE_SECRET_KEY="sk_test_bench",
+                PYTHONDONTWRITEBYTECODE="1")
+
+    print(f"{'scenario':<22} {'warm-up':>8} {'first email':>12} {'first page':>11} {'warm-up + both':>15}")
+    with tempfile.TemporaryDirectory() as directory:
+        base["BENCH_CACHE_DIR"] = directory
+        scenarios = [("none", "none"), ("filesystem cold", "filesystem"), ("filesystem warm", "filesystem")]
+        if args.redis_url:
+            base["BENCH_REDIS_URL"] = args.redis_url
+            scenarios.append(("redis warm", "redis"))
+            _run("redis", True, base)  # fill it
+        for label, backend in scenarios:
+            for warmup in (False, True):
+                samples = []
+                for _ in range(args.runs):
+                    if label == "filesystem cold":
+                        for name in os.listdir(directory):
+                            os.remove(os.path.join(directory, name))
+                    samples.append(_run(backend, warmup, base))
+                med = {key: statistics.median(s[key] for s in samples) * 1000 for key in samples[0]}
+                name = f"{label}{' +warm' if warmup else ''}"
+                print(f"{name:<22} {med['warm']:6.1f} ms {med['email']:9.1f} ms {med['page']:8.1f} ms "
+                      f"{med['warm'] + med['email'] + med['page']:12.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
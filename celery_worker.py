@@ -1,5 +1,6 @@
 import os
 from app import create_app, celery
+from app.queues import apply_worker_profile, configure
 
 # Set the Flask configuration (e.g., 'dev', 'prod', 'test')
 config_name = os.getenv('FLASK_CONFIG', 'prod')
@@ -16,6 +17,14 @@ celery.conf.update(
     broker_url=redis_url,
     result_backend=redis_url
 )
+configure(celery, {**app.config, 'CELERY_BROKER_URL': redis_url})  # priorities follow the actual broker
+
+# Worker profile (app/queues.py): which queues this worker consumes, its concurrency and prefetch.
+# Unset, the worker consumes every queue, e.g.:
+#   CELERY_WORKER_PROFILE=realtime celery -A celery_worker.celery worker -n realtime@%h
+profile = app.config.get('CELERY_WORKER_PROFILE')
+if profile:
+    apply_worker_profile(celery, profile)
 
 # Optionally import tasks here to ensure they are registered
 # from app.tasks import *  # noqa
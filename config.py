@@ -1,3 +1,4 @@
+import json
 import os
 
 class Config:
@@ -17,12 +18,144 @@ class Config:
     STRIPE_SECRET_KEY = os.environ.get('STRIPE_SECRET_KEY')
     STRIPE_WEBHOOK_SECRET = os.environ.get('STRIPE_WEBHOOK_SECRET')
     STRIPE_PRICE_ID = os.environ.get('STRIPE_PRICE_ID')
+    # Webhook events are stored on receipt and applied by celery (app/billing.py)
+    STRIPE_EVENT_MAX_ATTEMPTS = int(os.environ.get('STRIPE_EVENT_MAX_ATTEMPTS', 5))
+    STRIPE_EVENT_SWEEP_INTERVAL = int(os.environ.get('STRIPE_EVENT_SWEEP_INTERVAL', 60))  # beat: retry pending
+    STRIPE_EVENT_RETENTION_DAYS = int(os.environ.get('STRIPE_EVENT_RETENTION_DAYS', 30))  # dedup window
+    # Bulk reconciliation of organizations against Stripe (beat; `flask reconcile-subscriptions`)
+    STRIPE_RECONCILE_INTERVAL = int(os.environ.get('STRIPE_RECONCILE_INTERVAL', 6 * 3600))
+    STRIPE_RECONCILE_CONCURRENCY = int(os.environ.get('STRIPE_RECONCILE_CONCURRENCY', 4))  # parallel listings
+    STRIPE_RECONCILE_BATCH_SIZE = int(os.environ.get('STRIPE_RECONCILE_BATCH_SIZE', 500))  # rows per UPDATE batch
+    STRIPE_RECONCILE_PAGE_SIZE = int(os.environ.get('STRIPE_RECONCILE_PAGE_SIZE', 100))  # Stripe's max
+    # Entitlement snapshots for premium checks (local TTL over Redis, pushed by billing writes).
+    # A cancellation reaches every worker within ENTITLEMENT_LOCAL_TTL seconds
+    ENTITLEMENT_CACHE_ENABLED = os.environ.get('ENTITLEMENT_CACHE_ENABLED', 'true').lower() in ('true', 'on', '1')
+    ENTITLEMENT_LOCAL_TTL = float(os.environ.get('ENTITLEMENT_LOCAL_TTL', 5))
+    ENTITLEMENT_LOCAL_MAXSIZE = int(os.environ.get('ENTITLEMENT_LOCAL_MAXSIZE', 10000))
+    ENTITLEMENT_REDIS_TTL = int(os.environ.get('ENTITLEMENT_REDIS_TTL', 3600))  # bound if Redis missed a publish
 
     OPENAI_API_KEY = os.environ.get('OPENAI_API_KEY')
     GOOGLE_API_KEY = os.environ.get('GOOGLE_API_KEY')
     HF_API_KEY = os.environ.get('HF_API_KEY')
     SERPER_API_KEY = os.environ.get('SERPER_API_KEY')
 
+    # LLM gateway — one keep-alive pool per gunicorn worker process
+    LLM_MODEL = os.environ.get('LLM_MODEL', 'gpt-3.5-turbo-instruct')
+    LLM_BASE_URL = os.environ.get('LLM_BASE_URL')  # e.g. a proxy or local stub
+    LLM_MAX_TOKENS = int(os.environ.get('LLM_MAX_TOKENS', 60))
+    LLM_CONNECT_TIMEOUT = float(os.environ.get('LLM_CONNECT_TIMEOUT', 5))
+    LLM_READ_TIMEOUT = float(os.environ.get('LLM_READ_TIMEOUT', 30))
+    LLM_POOL_MAXSIZE = int(os.environ.get('LLM_POOL_MAXSIZE', 10))
+    LLM_KEEPALIVE_EXPIRY = float(os.environ.get('LLM_KEEPALIVE_EXPIRY', 60))
+    LLM_MAX_RETRIES = int(os.environ.get('LLM_MAX_RETRIES', 2))
+    LLM_RETRY_BUDGET = float(os.environ.get('LLM_RETRY_BUDGET', 0.2))  # retries per call
+
+    # Upstream for /api/v1/generate and the feature pages: 'openai', 'local' (the engine below)
+    # or 'router' (LLM_ROUTES in preference order, with hedging and circuit breakers)
+    LLM_BACKEND = os.environ.get('LLM_BACKEND', 'openai')
+    LLM_ROUTES = os.environ.get('LLM_ROUTES', 'openai')  # e.g. 'openai,hf,local'
+    HF_MODEL = os.environ.get('HF_MODEL', 'mistralai/Mistral-7B-Instruct-v0.2')
+    LLM_ROUTER_TIMEOUT = float(os.environ.get('LLM_ROUTER_TIMEOUT', 60))
+    LLM_ROUTER_HEDGE = os.environ.get('LLM_ROUTER_HEDGE', 'true').lower() in ('true', 'on', '1')
+    LLM_ROUTER_HEDGE_PERCENTILE = float(os.environ.get('LLM_ROUTER_HEDGE_PERCENTILE', 95))
+    LLM_ROUTER_HEDGE_DEFAULT_MS = float(os.environ.get('LLM_ROUTER_HEDGE_DEFAULT_MS', 1000))  # until p95 is known
+    LLM_ROUTER_ERROR_THRESHOLD = float(os.environ.get('LLM_ROUTER_ERROR_THRESHOLD', 0.5))
+    LLM_ROUTER_MIN_CALLS = int(os.environ.get('LLM_ROUTER_MIN_CALLS', 10))
+    LLM_ROUTER_COOLDOWN = float(os.environ.get('LLM_ROUTER_COOLDOWN', 30))  # seconds a circuit stays open
+    LLM_ROUTER_MAX_P99_MS = float(os.environ.get('LLM_ROUTER_MAX_P99_MS', 0))  # also open on slow p99 (0 = off)
+
+    # Local CPU inference engine (landing-page /generate); runs in its own process pool
+    LOCAL_ENGINE_BACKEND = os.environ.get('LOCAL_ENGINE_BACKEND', 'template')  # or 'module:Class'
+    LOCAL_ENGINE_MODE = os.environ.get('LOCAL_ENGINE_MODE', 'process')  # 'process' or 'thread'
+    LOCAL_ENGINE_WORKERS = int(os.environ.get('LOCAL_ENGINE_WORKERS', 2))
+    LOCAL_ENGINE_MAX_QUEUE = int(os.environ.get('LOCAL_ENGINE_MAX_QUEUE', 64))
+    LOCAL_ENGINE_TIMEOUT = float(os.environ.get('LOCAL_ENGINE_TIMEOUT', 5))  # per-request latency budget, s
+    LOCAL_ENGINE_MAX_TOKENS = int(os.environ.get('LOCAL_ENGINE_MAX_TOKENS', 120))
+    # Micro-batching: wait up to N ms for concurrent prompts to share one forward pass (size 1 = off)
+    LOCAL_ENGINE_BATCH_MAX_SIZE = int(os.environ.get('LOCAL_ENGINE_BATCH_MAX_SIZE', 16))
+    LOCAL_ENGINE_BATCH_WAIT_MS = float(os.environ.get('LOCAL_ENGINE_BATCH_WAIT_MS', 5))
+
+    # Verified API-key cache (in-process LRU + Redis); revocations reach other workers within LOCAL_TTL
+    API_KEY_CACHE_ENABLED = os.environ.get('API_KEY_CACHE_ENABLED', 'true').lower() in ('true', 'on', '1')
+    API_KEY_CACHE_LOCAL_MAXSIZE = int(os.environ.get('API_KEY_CACHE_LOCAL_MAXSIZE', 10000))
+    API_KEY_CACHE_LOCAL_TTL = float(os.environ.get('API_KEY_CACHE_LOCAL_TTL', 30))
+    API_KEY_CACHE_REDIS_TTL = int(os.environ.get('API_KEY_CACHE_REDIS_TTL', 300))
+    API_KEY_CACHE_NEGATIVE_TTL = float(os.environ.get('API_KEY_CACHE_NEGATIVE_TTL', 60))  # unknown keys
+    # Write-behind last_used_at / request counts per key (celery beat, or the web worker without Redis)
+    API_KEY_USAGE_FLUSH_INTERVAL = float(os.environ.get('API_KEY_USAGE_FLUSH_INTERVAL', 60))
+
+    # Session identity snapshots for the Flask-Login user loader. With Redis, User.session_version
+    # rejects stale snapshots at once; without it other workers catch up within LOCAL_TTL
+    IDENTITY_CACHE_ENABLED = os.environ.get('IDENTITY_CACHE_ENABLED', 'true').lower() in ('true', 'on', '1')
+    IDENTITY_CACHE_LOCAL_MAXSIZE = int(os.environ.get('IDENTITY_CACHE_LOCAL_MAXSIZE', 10000))
+    IDENTITY_CACHE_LOCAL_TTL = float(os.environ.get('IDENTITY_CACHE_LOCAL_TTL', 30))
+    IDENTITY_CACHE_REDIS_TTL = int(os.environ.get('IDENTITY_CACHE_REDIS_TTL', 300))
+
+    # Password hashing: werkzeug method string (algorithm + cost), run in a bounded thread pool.
+    # Past MAX_PENDING in-flight hashes, login/signup answer 503; older hashes are upgraded on login
+    PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD', 'scrypt:32768:8:1')
+    PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', 2))
+    PASSWORD_HASH_MAX_PENDING = int(os.environ.get('PASSWORD_HASH_MAX_PENDING', 8))
+    PASSWORD_HASH_TIMEOUT = float(os.environ.get('PASSWORD_HASH_TIMEOUT', 10))
+
+    # Shared Redis for caches / limiters (defaults to the Celery broker)
+    CELERY_BROKER_URL = os.environ.get('CELERY_BROKER_URL')
+    CELERY_RESULT_BACKEND = os.environ.get('CELERY_RESULT_BACKEND')
+    CELERY_RESULT_EXPIRES = int(os.environ.get('CELERY_RESULT_EXPIRES', 3600))  # async job results TTL
+    # Task arguments are ids and small values (app/payloads.py); bigger messages are refused
+    TASK_PAYLOAD_MAX_BYTES = int(os.environ.get('TASK_PAYLOAD_MAX_BYTES', 256 * 1024))
+    REDIS_URL = os.environ.get('REDIS_URL') or CELERY_BROKER_URL
+    # Queues and worker profiles (app/queues.py): tasks are routed to realtime, billing, email
+    # and bulk; a worker started with CELERY_WORKER_PROFILE consumes only its profile's queues
+    CELERY_WORKER_PROFILE = os.environ.get('CELERY_WORKER_PROFILE')  # unset: every queue
+    CELERY_WORKER_PROFILES = json.loads(os.environ.get('CELERY_WORKER_PROFILES', '{}'))  # e.g. '{"realtime": {"concurrency": 16}}'
+
+    # Prompt/response cache: in-process LRU + shared Redis tier
+    RESPONSE_CACHE_ENABLED = os.environ.get('RESPONSE_CACHE_ENABLED', 'true').lower() in ('true', '1', 't')
+    RESPONSE_CACHE_LOCAL_MAXSIZE = int(os.environ.get('RESPONSE_CACHE_LOCAL_MAXSIZE', 1024))
+    RESPONSE_CACHE_LOCAL_TTL = int(os.environ.get('RESPONSE_CACHE_LOCAL_TTL', 300))
+    RESPONSE_CACHE_REDIS_TTL = int(os.environ.get('RESPONSE_CACHE_REDIS_TTL', 3600))
+
+    # Semantic cache: serve completions of near-identical prompts (same org/model/params)
+    SEMANTIC_CACHE_ENABLED = os.environ.get('SEMANTIC_CACHE_ENABLED', 'false').lower() in ('true', '1', 't')
+    SEMANTIC_CACHE_THRESHOLD = float(os.environ.get('SEMANTIC_CACHE_THRESHOLD', 0.92))  # cosine similarity
+    SEMANTIC_CACHE_CAPACITY = int(os.environ.get('SEMANTIC_CACHE_CAPACITY', 10000))  # entries per org index
+    SEMANTIC_CACHE_EMBEDDER = os.environ.get('SEMANTIC_CACHE_EMBEDDER', 'hashing')  # 'hashing', 'openai' or 'module:Class'
+    SEMANTIC_CACHE_EMBEDDING_MODEL = os.environ.get('SEMANTIC_CACHE_EMBEDDING_MODEL')
+    SEMANTIC_CACHE_DIM = int(os.environ.get('SEMANTIC_CACHE_DIM', 256))  # hashing embedder only
+    SEMANTIC_CACHE_DIR = os.environ.get('SEMANTIC_CACHE_DIR')  # memory-mapped snapshots; unset = in-memory
+    SEMANTIC_CACHE_FLUSH_INTERVAL = float(os.environ.get('SEMANTIC_CACHE_FLUSH_INTERVAL', 60))
+
+    # Single-flight coalescing of identical in-flight generations
+    COALESCE_ENABLED = os.environ.get('COALESCE_ENABLED', 'true').lower() in ('true', '1', 't')
+    COALESCE_LOCK_TTL = float(os.environ.get('COALESCE_LOCK_TTL', 60))  # > LLM_READ_TIMEOUT
+    COALESCE_WAIT_TIMEOUT = float(os.environ.get('COALESCE_WAIT_TIMEOUT', 30))
+
+    # Per-org / per-API-key token buckets; plans keyed by Organization.stripe_price_id, e.g.
+    # RATE_LIMIT_PLANS='{"price_pro": {"rate": 20, "burst": 100, "daily_quota": 50000}}'
+    RATE_LIMIT_ENABLED = os.environ.get('RATE_LIMIT_ENABLED', 'true').lower() in ('true', '1', 't')
+    RATE_LIMIT_DEFAULT = json.loads(os.environ.get('RATE_LIMIT_DEFAULT', '{"rate": 5, "burst": 30}'))
+    RATE_LIMIT_PLANS = json.loads(os.environ.get('RATE_LIMIT_PLANS', '{}'))
+
+    # Async generation jobs: optional HMAC signing of completion callbacks
+    JOB_CALLBACK_SECRET = os.environ.get('JOB_CALLBACK_SECRET')
+    JOB_CALLBACK_TIMEOUT = float(os.environ.get('JOB_CALLBACK_TIMEOUT', 5))
+    # Comma-separated host names callbacks may go to; unset = any host that resolves to a public address
+    JOB_CALLBACK_ALLOWED_HOSTS = os.environ.get('JOB_CALLBACK_ALLOWED_HOSTS')
+
+    # Usage metering: buffered bulk writes ('inline' or 'celery' hand-off) + hourly rollup
+    USAGE_METERING_ENABLED = os.environ.get('USAGE_METERING_ENABLED', 'true').lower() in ('true', '1', 't')
+    USAGE_FLUSH_MODE = os.environ.get('USAGE_FLUSH_MODE', 'inline')
+    USAGE_BUFFER_SIZE = int(os.environ.get('USAGE_BUFFER_SIZE', 500))
+    USAGE_FLUSH_INTERVAL = float(os.environ.get('USAGE_FLUSH_INTERVAL', 5))  # seconds
+    USAGE_MAX_PENDING = int(os.environ.get('USAGE_MAX_PENDING', 50000))  # per worker, while the DB is down
+    USAGE_ROLLUP_INTERVAL = float(os.environ.get('USAGE_ROLLUP_INTERVAL', 300))  # celery beat, seconds
+
+    # Batch generation (/api/v1/generate/batch)
+    BATCH_MAX_PROMPTS = int(os.environ.get('BATCH_MAX_PROMPTS', 100))
+    BATCH_CONCURRENCY_PER_ORG = int(os.environ.get('BATCH_CONCURRENCY_PER_ORG', 4))
+    BATCH_WORKER_THREADS = int(os.environ.get('BATCH_WORKER_THREADS', 32))
+
     # Email settings
     MAIL_SERVER = os.environ.get('MAIL_SERVER')
     MAIL_PORT = int(os.environ.get('MAIL_PORT', 25))
@@ -31,6 +164,33 @@ class Config:
     MAIL_USERNAME = os.environ.get('MAIL_USERNAME')
     MAIL_PASSWORD = os.environ.get('MAIL_PASSWORD')
     MAIL_DEFAULT_SENDER = os.environ.get('MAIL_DEFAULT_SENDER')
+    # 'direct': one SMTP connection per email (Flask-Mail); 'pooled': persistent
+    # per-worker connections fed in batches from a Redis outbox (app/mailer.py)
+    MAIL_DELIVERY_MODE = os.environ.get('MAIL_DELIVERY_MODE', 'direct')
+    SMTP_POOL_SIZE = int(os.environ.get('SMTP_POOL_SIZE', 2))  # idle connections kept per worker process
+    SMTP_POOL_MAX_IDLE = float(os.environ.get('SMTP_POOL_MAX_IDLE', 30))  # seconds before a connection is dropped
+    SMTP_POOL_MAX_MESSAGES = int(os.environ.get('SMTP_POOL_MAX_MESSAGES', 500))  # per connection, then reconnect
+    SMTP_BATCH_SIZE = int(os.environ.get('SMTP_BATCH_SIZE', 100))  # messages popped from the outbox per connection
+    SMTP_OUTBOX_LINGER = float(os.environ.get('SMTP_OUTBOX_LINGER', 1))  # seconds a burst gathers before draining
+    SMTP_OUTBOX_SWEEP_INTERVAL = float(os.environ.get('SMTP_OUTBOX_SWEEP_INTERVAL', 60))  # celery beat, seconds
+    SMTP_TIMEOUT = float(os.environ.get('SMTP_TIMEOUT', 10))
+    SMTP_MAX_RETRIES = int(os.environ.get('SMTP_MAX_RETRIES', 4))
+    SMTP_MAX_DEFERRALS = int(os.environ.get('SMTP_MAX_DEFERRALS', 10))  # 4xx refusals of one message, then rejected
+    SMTP_RETRY_BACKOFF = float(os.environ.get('SMTP_RETRY_BACKOFF', 0.5))  # seconds, doubled per retry
+    SMTP_RETRY_BACKOFF_MAX = float(os.environ.get('SMTP_RETRY_BACKOFF_MAX', 30))
+
+    # Email campaigns (app/campaigns.py): recipients per chunk task, chunks per planner insert
+    CAMPAIGN_CHUNK_SIZE = int(os.environ.get('CAMPAIGN_CHUNK_SIZE', 500))
+    CAMPAIGN_PLAN_BATCH = int(os.environ.get('CAMPAIGN_PLAN_BATCH', 100))
+
+    # Compiled templates (app/templating.py): bytecode cache shared by web and celery
+    # processes, 'filesystem', 'redis' (the kv store) or 'none'; warm-up compiles all at boot
+    TEMPLATE_BYTECODE_CACHE = os.environ.get('TEMPLATE_BYTECODE_CACHE', 'filesystem')
+    TEMPLATE_BYTECODE_CACHE_DIR = os.environ.get('TEMPLATE_BYTECODE_CACHE_DIR')  # default: a per-user temp dir
+    TEMPLATE_BYTECODE_CACHE_TTL = int(os.environ.get('TEMPLATE_BYTECODE_CACHE_TTL', 7 * 24 * 3600))  # redis only
+    TEMPLATE_WARMUP = os.environ.get('TEMPLATE_WARMUP', 'true').lower() in ('true', 'on', '1')
+    # Render {{ static_fragment(...) }} email partials once per process
+    EMAIL_FRAGMENT_CACHE = os.environ.get('EMAIL_FRAGMENT_CACHE', 'true').lower() in ('true', 'on', '1')
 
     SENTRY_DSN = os.environ.get('SENTRY_DSN')
 
@@ -53,8 +213,19 @@ class TestingConfig(Config):
     """Testing config; use in-memory SQLite."""
     TESTING = True
     SQLALCHEMY_DATABASE_URI = 'sqlite:///:memory:'
+    REDIS_URL = None  # tests inject an in-memory stand-in via kv.use()
+    CELERY_BROKER_URL = 'memory://'
+    CELERY_RESULT_BACKEND = 'cache+memory://'
+    CELERY_TASK_ALWAYS_EAGER = True
+    USAGE_FLUSH_INTERVAL = 0  # no background flusher; tests flush explicitly
+    API_KEY_USAGE_FLUSH_INTERVAL = 0
+    PASSWORD_HASH_METHOD = 'pbkdf2:sha256:1000'  # cheap hashes keep the suite fast
+    STRIPE_WEBHOOK_SECRET = 'whsec_test'  # signature checks are mocked
+    LOCAL_ENGINE_MODE = 'thread'
     WTF_CSRF_ENABLED = False
     SERVER_NAME = 'localhost.localdomain'
+    TEMPLATE_BYTECODE_CACHE = 'none'  # compile in-process; nothing written outside the tree
+    TEMPLATE_WARMUP = False
 
 
 # Mapping for create_app
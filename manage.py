@@ -1,6 +1,5 @@
-# manage.py
-"""
 #!/usr/bin/env python
+# manage.py
 """
 Command-line utilities for managing the Flask application.
 
@@ -13,6 +12,10 @@ Then use Flask CLI:
   flask db migrate    # generate a new migration
   flask db upgrade    # apply migrations
   flask create-admin <email> <password>
+  flask reconcile-subscriptions [--dry-run] [--concurrency N] [--batch-size N]
+  flask send-campaign <subject> <template> (--org-id ID | --all) [--context JSON] [--chunk-size N]
+  flask campaign-status <campaign_id>
+  flask warm-templates
 """
 import os
 import click
@@ -49,6 +52,68 @@ def create_admin(email, password):
 
         click.secho(f"Admin user '{email}' created successfully.", fg='green')
 
+@app.cli.command('reconcile-subscriptions')
+@click.option('--dry-run', is_flag=True, help='Report the corrections without writing them.')
+@click.option('--concurrency', type=int, default=None, help='Parallel Stripe listings (STRIPE_RECONCILE_CONCURRENCY).')
+@click.option('--batch-size', type=int, default=None, help='Rows per UPDATE batch (STRIPE_RECONCILE_BATCH_SIZE).')
+def reconcile_subscriptions(dry_run, concurrency, batch_size):
+    """Bring organization subscription flags in line with Stripe."""
+    from app.reconcile import reconcile
+
+    with app.app_context():
+        report = reconcile(dry_run=dry_run, concurrency=concurrency, batch_size=batch_size)
+
+    for change in report.changes:
+        diff = ', '.join(f"{name}: {change['before'][name]!r} -> {value!r}"
+                         for name, value in change['after'].items() if change['before'][name] != value)
+        click.echo(f"org {change['id']} ({change['customer']}): {diff}")
+    click.secho(report.summary(), fg='yellow' if dry_run else 'green')
+
+@app.cli.command('send-campaign')
+@click.argument('subject')
+@click.argument('template')
+@click.option('--org-id', type=int, default=None, help='Email the members of this organization.')
+@click.option('--all', 'all_orgs', is_flag=True, help='Email the members of every organization.')
+@click.option('--context', default=None, help='Template variables as a JSON object, e.g. \'{"headline": "..."}\'.')
+@click.option('--chunk-size', type=int, default=None, help='Recipients per Celery task (CAMPAIGN_CHUNK_SIZE).')
+def send_campaign(subject, template, org_id, all_orgs, context, chunk_size):
+    """Queue a bulk email to organization members, sent in chunked tasks."""
+    import json
+    from app.campaigns import start_campaign
+
+    if (org_id is None) == (not all_orgs):
+        raise click.UsageError('Pass exactly one of --org-id or --all.')
+    with app.app_context():
+        campaign = start_campaign(subject, template, organization_id=org_id,
+                                  context=json.loads(context) if context else None, chunk_size=chunk_size)
+        click.secho(f"Campaign {campaign.id} queued; follow it with: flask campaign-status {campaign.id}", fg='green')
+
+@app.cli.command('campaign-status')
+@click.argument('campaign_id', type=int)
+def campaign_status(campaign_id):
+    """Show a campaign's progress and its failing chunks."""
+    from app.campaigns import campaign_progress
+
+    with app.app_context():
+        progress = campaign_progress(campaign_id)
+    if progress is None:
+        click.secho(f"Error: campaign {campaign_id} not found.", fg='red')
+        return
+
+    click.echo(f"Campaign {progress['id']}: {progress['status']}, {progress['sent']} sent, {progress['failed']} failed "
+               f"of {progress['recipients']} ({progress['chunks_done']}/{progress['chunks']} chunks)")
+    for chunk in progress['problem_chunks']:
+        click.echo(f"  chunk {chunk['index']}: {chunk['status']}, {chunk['sent']} sent, {chunk['failed']} failed, "
+                   f"{chunk['attempts']} retries, last error: {chunk['last_error']}")
+
+@app.cli.command('warm-templates')
+def warm_templates():
+    """Compile every template into the shared bytecode cache (TEMPLATE_BYTECODE_CACHE)."""
+    from app import template_cache
+
+    loaded = template_cache.warm(app)
+    click.secho(f"{loaded} templates compiled into the '{template_cache.backend}' bytecode cache.", fg='green')
+
 if __name__ == '__main__':
     # When invoked directly: run Flask CLI
     from flask.cli import main
@@ -0,0 +1,26 @@
+"""Add per-organization response cache opt-out
+
+Revision ID: 3f1c2a7d9b10
+Revises: 84a49e2aa2ce
+Create Date: 2026-10-17 09:12:44.180211
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f1c2a7d9b10'
+down_revision = '84a49e2aa2ce'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('organizations', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('response_cache_enabled', sa.Boolean(), server_default=sa.true(), nullable=False))
+
+
+def downgrade():
+    with op.batch_alter_table('organizations', schema=None) as batch_op:
+        batch_op.drop_column('response_cache_enabled')
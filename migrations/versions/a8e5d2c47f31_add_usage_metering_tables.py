@@ -0,0 +1,59 @@
+"""Add usage_events and usage_hourly tables
+
+Revision ID: a8e5d2c47f31
+Revises: 3f1c2a7d9b10
+Create Date: 2026-10-17 11:40:05.512384
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a8e5d2c47f31'
+down_revision = '3f1c2a7d9b10'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('usage_events',
+    sa.Column('id', sa.BigInteger().with_variant(sa.Integer(), 'sqlite'), nullable=False),
+    sa.Column('organization_id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=True),
+    sa.Column('endpoint', sa.String(length=64), nullable=False),
+    sa.Column('model', sa.String(length=64), nullable=True),
+    sa.Column('status', sa.String(length=16), nullable=False),
+    sa.Column('prompt_tokens', sa.Integer(), nullable=False),
+    sa.Column('completion_tokens', sa.Integer(), nullable=False),
+    sa.Column('latency_ms', sa.Float(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['organization_id'], ['organizations.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='SET NULL'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('usage_events', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_usage_events_created_at'), ['created_at'], unique=False)
+        batch_op.create_index('ix_usage_events_org_created', ['organization_id', 'created_at'], unique=False)
+
+    op.create_table('usage_hourly',
+    sa.Column('organization_id', sa.Integer(), nullable=False),
+    sa.Column('hour', sa.DateTime(), nullable=False),
+    sa.Column('requests', sa.Integer(), nullable=False),
+    sa.Column('errors', sa.Integer(), nullable=False),
+    sa.Column('prompt_tokens', sa.BigInteger(), nullable=False),
+    sa.Column('completion_tokens', sa.BigInteger(), nullable=False),
+    sa.Column('total_latency_ms', sa.Float(), nullable=False),
+    sa.Column('max_latency_ms', sa.Float(), nullable=False),
+    sa.ForeignKeyConstraint(['organization_id'], ['organizations.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('organization_id', 'hour')
+    )
+
+
+def downgrade():
+    op.drop_table('usage_hourly')
+    with op.batch_alter_table('usage_events', schema=None) as batch_op:
+        batch_op.drop_index('ix_usage_events_org_created')
+        batch_op.drop_index(batch_op.f('ix_usage_events_created_at'))
+
+    op.drop_table('usage_events')
@@ -0,0 +1,29 @@
+"""Widen api_keys.prefix for 64-bit key prefixes
+
+Revision ID: b8d2f6a0c3e7
+Revises: a7c5e1f4b9d6
+Create Date: 2026-10-17 22:14:51.603127
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b8d2f6a0c3e7'
+down_revision = 'a7c5e1f4b9d6'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('api_keys', schema=None) as batch_op:
+        batch_op.alter_column('prefix', existing_type=sa.String(length=16), type_=sa.String(length=24),
+                              existing_nullable=False)
+
+
+def downgrade():
+    # New prefixes are 20 characters; they do not fit back into 16.
+    with op.batch_alter_table('api_keys', schema=None) as batch_op:
+        batch_op.alter_column('prefix', existing_type=sa.String(length=24), type_=sa.String(length=16),
+                              existing_nullable=False)
@@ -0,0 +1,96 @@
+"""Add api_keys table and move users.api_key into it (hashed)
+
+Revision ID: c3d9e1f0a6b2
+Revises: a8e5d2c47f31
+Create Date: 2026-10-17 14:05:21.634907
+
+"""
+import hashlib
+import secrets
+from datetime import datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c3d9e1f0a6b2'
+down_revision = 'a8e5d2c47f31'
+branch_labels = None
+depends_on = None
+
+PREFIX_LENGTH = 12
+
+
+def upgrade():
+    api_keys = op.create_table('api_keys',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('organization_id', sa.Integer(), nullable=True),
+    sa.Column('name', sa.String(length=64), nullable=False),
+    sa.Column('prefix', sa.String(length=16), nullable=False),
+    sa.Column('key_hash', sa.String(length=64), nullable=False),
+    sa.Column('scopes', sa.String(length=255), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.Column('expires_at', sa.DateTime(), nullable=True),
+    sa.Column('revoked_at', sa.DateTime(), nullable=True),
+    sa.Column('last_used_at', sa.DateTime(), nullable=True),
+    sa.Column('request_count', sa.BigInteger(), nullable=False),
+    sa.ForeignKeyConstraint(['organization_id'], ['organizations.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('api_keys', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_api_keys_prefix'), ['prefix'], unique=True)
+        batch_op.create_index(batch_op.f('ix_api_keys_user_id'), ['user_id'], unique=False)
+
+    # Carry over the existing plaintext keys: they keep working, but only their
+    # hash (and public prefix) survives.  Org = the user's first membership.
+    conn = op.get_bind()
+    users = conn.execute(sa.text(
+        'SELECT u.id, u.api_key, '
+        '(SELECT m.organization_id FROM memberships m WHERE m.user_id = u.id '
+        ' ORDER BY m.organization_id LIMIT 1) '
+        'FROM users u WHERE u.api_key IS NOT NULL'
+    )).fetchall()
+    now = datetime.utcnow()
+    if users:
+        op.bulk_insert(api_keys, [
+            {
+                'user_id': user_id,
+                'organization_id': org_id,
+                'name': 'Default',
+                'prefix': api_key[:PREFIX_LENGTH],
+                'key_hash': hashlib.sha256(api_key.encode()).hexdigest(),
+                'scopes': '*',
+                'created_at': now,
+                'request_count': 0,
+            }
+            for user_id, api_key, org_id in users
+        ])
+
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.drop_index('ix_users_api_key')
+        batch_op.drop_column('api_key')
+
+
+def downgrade():
+    # Only hashes were kept, so the old plaintext keys cannot be restored:
+    # every user gets a fresh key.
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('api_key', sa.String(length=64), nullable=True))
+
+    conn = op.get_bind()
+    for (user_id,) in conn.execute(sa.text('SELECT id FROM users')).fetchall():
+        conn.execute(sa.text('UPDATE users SET api_key = :key WHERE id = :id'),
+                     {'key': secrets.token_hex(32), 'id': user_id})
+
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.alter_column('api_key', existing_type=sa.String(length=64), nullable=False)
+        batch_op.create_index('ix_users_api_key', ['api_key'], unique=True)
+
+    with op.batch_alter_table('api_keys', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_api_keys_user_id'))
+        batch_op.drop_index(batch_op.f('ix_api_keys_prefix'))
+
+    op.drop_table('api_keys')
@@ -0,0 +1,48 @@
+"""Replace email_campaign_chunks.cursor with deferred_user_ids
+
+Revision ID: c9e3a7b1d4f8
+Revises: b8d2f6a0c3e7
+Create Date: 2026-10-18 09:41:27.350912
+
+"""
+import json
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c9e3a7b1d4f8'
+down_revision = 'b8d2f6a0c3e7'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('email_campaign_chunks', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('deferred_user_ids', sa.Text(), nullable=True))
+
+    # Chunks waiting for a retry resume with the users after their cursor.
+    conn = op.get_bind()
+    chunks = sa.table('email_campaign_chunks', sa.column('campaign_id'), sa.column('index'),
+                      sa.column('last_user_id'), sa.column('cursor'), sa.column('status'),
+                      sa.column('deferred_user_ids'))
+    users = sa.table('users', sa.column('id'))
+    pending = conn.execute(sa.select(chunks.c.campaign_id, chunks.c.index, chunks.c.cursor, chunks.c.last_user_id)
+                           .where(chunks.c.status == 'pending', chunks.c.cursor.is_not(None))).all()
+    for campaign_id, index, cursor, last_user_id in pending:
+        ids = conn.execute(sa.select(users.c.id).where(users.c.id > cursor, users.c.id <= last_user_id)
+                           .order_by(users.c.id)).scalars().all()
+        conn.execute(chunks.update()
+                     .where(chunks.c.campaign_id == campaign_id, chunks.c.index == index)
+                     .values(deferred_user_ids=json.dumps(ids)))
+
+    with op.batch_alter_table('email_campaign_chunks', schema=None) as batch_op:
+        batch_op.drop_column('cursor')
+
+
+def downgrade():
+    # Chunks waiting for a retry start over from their first user.
+    with op.batch_alter_table('email_campaign_chunks', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('cursor', sa.Integer(), nullable=True))
+        batch_op.drop_column('deferred_user_ids')
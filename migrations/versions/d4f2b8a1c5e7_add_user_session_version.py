@@ -0,0 +1,26 @@
+"""Add users.session_version for cached session identities
+
+Revision ID: d4f2b8a1c5e7
+Revises: c3d9e1f0a6b2
+Create Date: 2026-10-17 16:42:08.119354
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd4f2b8a1c5e7'
+down_revision = 'c3d9e1f0a6b2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('session_version', sa.Integer(), server_default='1', nullable=False))
+
+
+def downgrade():
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.drop_column('session_version')
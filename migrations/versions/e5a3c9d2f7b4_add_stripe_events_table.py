@@ -0,0 +1,47 @@
+"""Add stripe_events table and organizations.stripe_event_at
+
+Revision ID: e5a3c9d2f7b4
+Revises: d4f2b8a1c5e7
+Create Date: 2026-10-17 18:20:47.502133
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e5a3c9d2f7b4'
+down_revision = 'd4f2b8a1c5e7'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('stripe_events',
+    sa.Column('id', sa.String(length=255), nullable=False),
+    sa.Column('type', sa.String(length=100), nullable=False),
+    sa.Column('account', sa.String(length=120), nullable=True),
+    sa.Column('created', sa.DateTime(), nullable=False),
+    sa.Column('payload', sa.Text(), nullable=False),
+    sa.Column('status', sa.String(length=16), nullable=False),
+    sa.Column('attempts', sa.Integer(), nullable=False),
+    sa.Column('last_error', sa.Text(), nullable=True),
+    sa.Column('received_at', sa.DateTime(), nullable=False),
+    sa.Column('processed_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('stripe_events', schema=None) as batch_op:
+        batch_op.create_index('ix_stripe_events_status_account', ['status', 'account', 'created'], unique=False)
+
+    with op.batch_alter_table('organizations', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('stripe_event_at', sa.DateTime(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('organizations', schema=None) as batch_op:
+        batch_op.drop_column('stripe_event_at')
+
+    with op.batch_alter_table('stripe_events', schema=None) as batch_op:
+        batch_op.drop_index('ix_stripe_events_status_account')
+
+    op.drop_table('stripe_events')
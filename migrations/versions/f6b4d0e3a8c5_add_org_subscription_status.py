@@ -0,0 +1,28 @@
+"""Add organizations.subscription_status and current_period_end
+
+Revision ID: f6b4d0e3a8c5
+Revises: e5a3c9d2f7b4
+Create Date: 2026-10-17 20:03:12.871440
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f6b4d0e3a8c5'
+down_revision = 'e5a3c9d2f7b4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('organizations', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('subscription_status', sa.String(length=32), nullable=True))
+        batch_op.add_column(sa.Column('current_period_end', sa.DateTime(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('organizations', schema=None) as batch_op:
+        batch_op.drop_column('current_period_end')
+        batch_op.drop_column('subscription_status')
@@ -1,13 +1,21 @@
 # tests/conftest.py
 
+import json
+import socket
 import sys
 import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
 import pytest
-from app import create_app, db
+from app import create_app, db, usage_meter
+from app.models import Membership, Organization, User
 
 # Add the project root to the Python path
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
+
 @pytest.fixture(scope='module')
 def test_app():
     """Creates a test Flask application instance for a test module."""
@@ -15,10 +23,183 @@ def test_app():
     with app.app_context():
         db.create_all()
         yield app  # this is where the testing happens
+        usage_meter.flush()  # write buffered usage while the schema still exists
         db.session.remove()
         db.drop_all()
 
+
 @pytest.fixture(scope='module')
 def test_client(test_app):
     """Creates a test client for the Flask application."""
-    return test_app.test_client()
\ No newline at end of file
+    return test_app.test_client()
+
+
+@pytest.fixture(scope='module')
+def api_user(test_app):
+    """Factory for a confirmed user with an API key and a subscribed organization.
+
+    ``api_user(email, password=None, role='member', **org_columns)`` returns
+    ``(user, org)``; the plaintext key is ``user.api_key``.  Organization
+    columns override the defaults, e.g. ``is_subscribed=False``.
+    """
+    def create(email, password=None, role='member', **org_columns):
+        user = User(email=email, confirmed=True)
+        if password:
+            user.set_password(password)
+        org = Organization(name=f'{email} Org', **{'is_subscribed': True, **org_columns})
+        db.session.add_all([user, org, Membership(user=user, organization=org, role=role)])
+        db.session.commit()
+        return user, org
+
+    return create
+
+
+class _StubCompletionsHandler(BaseHTTPRequestHandler):
+    """Speaks just enough of the OpenAI completions API for the gateway tests."""
+
+    protocol_version = 'HTTP/1.1'  # keep-alive, so connection reuse is observable
+
+    def do_POST(self):
+        stub = self.server.stub
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        stub.requests.append(body)
+        stub.connections.add(self.client_address)
+        if stub.delay:
+            time.sleep(stub.delay)
+
+        if stub.failures > 0:
+            stub.failures -= 1
+            self._send(500, {'error': {'message': 'upstream exploded', 'type': 'server_error'}})
+            return
+
+        text = stub.reply_text.format(prompt=body.get('prompt'))
+        if body.get('stream'):
+            self._stream(body, text)
+            return
+        self._send(200, {
+            'id': 'cmpl-stub',
+            'object': 'text_completion',
+            'created': int(time.time()),
+            'model': body.get('model'),
+            'choices': [{'text': f' {text}', 'index': 0, 'logprobs': None, 'finish_reason': 'stop'}],
+            'usage': {'prompt_tokens': 3, 'completion_tokens': 5, 'total_tokens': 8},
+        })
+
+    def _send(self, status, payload):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _stream(self, body, text):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        for token in text.split(' '):
+            chunk = {
+                'id': 'cmpl-stub',
+                'object': 'text_completion',
+                'created': int(time.time()),
+                'model': body.get('model'),
+                'choices': [{'text': f' {token}', 'index': 0, 'logprobs': None, 'finish_reason': None}],
+            }
+            self._write_chunk(f'data: {json.dumps(chunk)}\n\n'.encode())
+            if self.server.stub.token_delay:
+                time.sleep(self.server.stub.token_delay)
+        self._write_chunk(b'data: [DONE]\n\n')
+        self._write_chunk(b'')
+
+    def _write_chunk(self, data):
+        self.wfile.write(f'{len(data):x}\r\n'.encode() + data + b'\r\n')
+        self.wfile.flush()
+
+    def log_message(self, *args):  # keep pytest output quiet
+        pass
+
+
+class StubLLMServer:
+    """Local HTTP server standing in for the upstream model provider."""
+
+    def __init__(self):
+        self.requests = []
+        self.connections = set()
+        self.failures = 0
+        self.delay = 0.0
+        self.token_delay = 0.0
+        self.reply_text = 'stub reply to: {prompt}'
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), _StubCompletionsHandler)
+        self._server.daemon_threads = True
+        self._server.stub = self
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address
+        return f'http://{host}:{port}/v1'
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+@pytest.fixture
+def llm_stub(test_app):
+    """Point the shared LLM gateway at a local stub server for one test."""
+    from app import llm
+
+    previous = llm.settings
+    with StubLLMServer() as stub:
+        llm.configure(base_url=stub.base_url, api_key='sk-test', retry_backoff=0.0)
+        yield stub
+    llm.settings = previous
+    llm.reset()
+
+
+class RecordingSMTPHandler:
+    """aiosmtpd handler that records messages and the SMTP sessions (connections) they came over."""
+
+    def __init__(self):
+        self.messages = []
+        self.sessions = set()
+        self.reject = set()
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        if address in self.reject:
+            return '550 5.1.1 No such user'
+        envelope.rcpt_tos.append(address)
+        return '250 OK'
+
+    async def handle_DATA(self, server, session, envelope):
+        self.messages.append((envelope.rcpt_tos[0], envelope.content))
+        self.sessions.add(id(session))
+        return '250 Message accepted for delivery'
+
+
+@pytest.fixture
+def smtp_server(test_app, monkeypatch):
+    """A local aiosmtpd relay that the SMTP pool delivers to for one test."""
+    from app import smtp_pool
+
+    controller_module = pytest.importorskip('aiosmtpd.controller')
+    handler = RecordingSMTPHandler()
+    with socket.socket() as probe:  # aiosmtpd connects to its own port on start, so it cannot be 0
+        probe.bind(('127.0.0.1', 0))
+        handler.port = probe.getsockname()[1]
+    controller = controller_module.Controller(handler, hostname='127.0.0.1', port=handler.port)
+    controller.start()
+    monkeypatch.setattr(smtp_pool, 'suppress', False)
+    monkeypatch.setattr(smtp_pool, 'server', '127.0.0.1')
+    monkeypatch.setattr(smtp_pool, 'port', handler.port)
+    monkeypatch.setattr(smtp_pool, 'backoff', 0)
+    monkeypatch.setitem(test_app.config, 'MAIL_DEFAULT_SENDER', 'noreply@example.com')
+    smtp_pool.close()
+    yield handler
+    smtp_pool.close()
+    controller.stop()
@@ -1,20 +1,27 @@
 # tests/test_api.py
 
-from app import db
+import json
+
+from app import db, llm
+from app.llm import Completion
+from app.metrics import metrics
 from app.models import User, Organization, Membership
 
+
 def test_api_unauthorized(test_client):
     """Test API access without a key."""
     response = test_client.get('/api/v1/status')
     assert response.status_code == 401
     assert 'Authorization header is missing' in response.json['error']
 
+
 def test_api_invalid_key(test_client):
     """Test API access with an invalid key."""
     response = test_client.get('/api/v1/status', headers={'Authorization': 'Bearer invalid-key'})
     assert response.status_code == 401
     assert 'Invalid API key' in response.json['error']
 
+
 def test_api_valid_key(test_client, test_app):
     """Test successful API access."""
     with test_app.app_context():
@@ -29,6 +36,7 @@ def test_api_valid_key(test_client, test_app):
     assert response.status_code == 200
     assert response.json['authenticated_user'] == 'api_user@example.com'
 
+
 def test_premium_api_for_unsubscribed_user(test_client, test_app):
     """Test premium API access for an unsubscribed user."""
     with test_app.app_context():
@@ -45,6 +53,7 @@ def test_premium_api_for_unsubscribed_user(test_client, test_app):
     assert response.status_code == 403
     assert 'requires an active subscription' in response.json['error']
 
+
 def test_premium_api_for_subscribed_user(test_client, test_app, mocker):
     """Test successful premium API access."""
     with test_app.app_context():
@@ -57,14 +66,14 @@ def test_premium_api_for_subscribed_user(test_client, test_app, mocker):
         db.session.commit()
         api_key = user.api_key
 
-    mock_create = mocker.patch('app.api.OpenAI').return_value.completions.create
-    mock_create.return_value.choices[0].text = "API test response"
+    mock_create = mocker.patch.object(llm, 'complete', return_value=Completion(text="API test response", model="test"))
 
     response = test_client.post('/api/v1/generate', headers={'Authorization': f'Bearer {api_key}'}, json={'prompt': 'test'})
     assert response.status_code == 200
     assert response.json['generated_text'] == "API test response"
     mock_create.assert_called_once()
 
+
 def test_premium_api_missing_prompt(test_client, test_app):
     """Test premium API access without a prompt."""
     with test_app.app_context():
@@ -79,4 +88,73 @@ def test_premium_api_missing_prompt(test_client, test_app):
 
     response = test_client.post('/api/v1/generate', headers={'Authorization': f'Bearer {api_key}'}, json={})
     assert response.status_code == 400
-    assert 'Prompt is required' in response.json['error']
\ No newline at end of file
+    assert 'Prompt is required' in response.json['error']
+
+
+def _sse_events(body):
+    events = []
+    for block in body.decode().strip().split('\n\n'):
+        fields = dict(line.split(': ', 1) for line in block.split('\n'))
+        events.append((fields.get('event', 'message'), json.loads(fields['data'])))
+    return events
+
+
+def test_generate_stream_relays_tokens(test_client, test_app, llm_stub, api_user):
+    """
+    GIVEN a subscribed user and a streaming upstream
+    WHEN /api/v1/generate is called with stream=true
+    THEN tokens arrive as SSE messages followed by a final 'done' event.
+    """
+    user, _ = api_user('api_stream@example.com')
+    llm_stub.reply_text = 'one two three'
+    ttft_before = metrics.latency('llm.stream.ttft').snapshot()['count']
+
+    response = test_client.post('/api/v1/generate', headers={'Authorization': f'Bearer {user.api_key}'},
+                                json={'prompt': 'count', 'stream': True})
+
+    assert response.status_code == 200
+    assert response.mimetype == 'text/event-stream'
+    events = _sse_events(response.data)
+    assert [data['text'] for event, data in events if event == 'message'] == ['one', ' two', ' three']
+    assert events[-1] == ('done', {'generated_text': 'one two three'})
+    assert llm_stub.requests[-1]['stream'] is True
+    assert metrics.latency('llm.stream.ttft').snapshot()['count'] == ttft_before + 1
+
+
+def test_generate_stream_first_token_before_completion(test_client, test_app, llm_stub, api_user):
+    """Time-to-first-token is recorded separately from (and below) total duration."""
+    user, _ = api_user('api_stream_slow@example.com')
+    llm_stub.reply_text = 'a b c d'
+    llm_stub.token_delay = 0.05
+
+    response = test_client.post('/api/v1/generate', headers={'Authorization': f'Bearer {user.api_key}'},
+                                json={'prompt': 'slow', 'stream': True})
+    assert response.status_code == 200
+    assert _sse_events(response.data)[-1][0] == 'done'
+
+    ttft = metrics.latency('llm.stream.ttft').percentile(100)
+    duration = metrics.latency('llm.stream.duration').percentile(100)
+    assert ttft < duration
+    assert duration >= 0.15
+
+
+def test_generate_stream_requires_subscription(test_client, test_app, llm_stub, api_user):
+    user, _ = api_user('api_stream_unsub@example.com', is_subscribed=False)
+
+    response = test_client.post('/api/v1/generate', headers={'Authorization': f'Bearer {user.api_key}'},
+                                json={'prompt': 'nope', 'stream': True})
+
+    assert response.status_code == 403
+    assert llm_stub.requests == []
+
+
+def test_generate_stream_reports_upstream_errors(test_client, test_app, llm_stub, api_user):
+    user, _ = api_user('api_stream_err@example.com')
+    llm_stub.failures = 1
+
+    response = test_client.post('/api/v1/generate', headers={'Authorization': f'Bearer {user.api_key}'},
+                                json={'prompt': 'boom', 'stream': True})
+
+    event, data = _sse_events(response.data)[-1]
+    assert event == 'error'
+    assert 'An error occurred' in data['error']
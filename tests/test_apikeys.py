@@ -0,0 +1,145 @@
+# tests/test_apikeys.py
+
+from datetime import datetime, timedelta
+
+import fakeredis
+import pytest
+from sqlalchemy import event
+
+from app import api_key_cache, api_key_usage, db, kv, llm
+from app.llm import Completion
+from app.models import ApiKey
+
+
+@pytest.fixture(autouse=True)
+def fresh_state(test_app):
+    api_key_cache.clear_local()
+    api_key_usage.drain()
+    yield
+    api_key_usage.drain()
+    kv.use(None)
+
+
+def _status(test_client, api_key):
+    return test_client.get('/api/v1/status', headers={'Authorization': f'Bearer {api_key}'})
+
+
+def test_keys_are_stored_hashed_with_an_indexed_prefix(test_app, api_user):
+    user, _ = api_user('keys_hashed@example.com')
+    key = user.api_keys[0]
+
+    assert user.api_key.startswith(key.prefix)
+    assert len(key.prefix) == ApiKey.PREFIX_LENGTH
+    assert user.api_key not in (key.key_hash, key.prefix)
+    assert key.verify(user.api_key)
+    assert not key.verify(user.api_key[:-1] + 'x')
+
+
+@pytest.mark.parametrize('plaintext', [
+    'aig_0a1b2c3d_' + 'x' * 43,  # issued before prefixes grew to 64 bits
+    'f' * 64,  # carried over from users.api_key
+])
+def test_older_key_formats_still_authenticate(test_client, test_app, plaintext, api_user):
+    """
+    GIVEN a key with a 32-bit prefix (or a legacy 64-hex key) stored before the prefix was widened
+    WHEN it is presented next to new keys with 64-bit prefixes
+    THEN it is still found by its 12-character prefix and authenticates.
+    """
+    user, _ = api_user(f'keys_format_{plaintext[:4]}@example.com')
+    db.session.add(ApiKey(user_id=user.id, prefix=plaintext[:12], key_hash=ApiKey.hash_key(plaintext)))
+    db.session.commit()
+
+    new_prefix = user.api_keys[0].prefix
+    assert new_prefix.startswith('aig_') and len(new_prefix) == 20 and int(new_prefix[4:], 16) >= 0
+    assert ApiKey.prefix_of(plaintext) == plaintext[:12]
+    assert _status(test_client, plaintext).status_code == 200
+    assert _status(test_client, user.api_key).status_code == 200
+
+
+def test_many_keys_per_user_and_scopes(test_client, test_app, mocker, api_user):
+    """
+    GIVEN a user with a second, status-only API key
+    WHEN each key calls a generate endpoint
+    THEN both authenticate, but only the key with the 'generate' scope may generate.
+    """
+    user, org = api_user('keys_scopes@example.com')
+    read_only, read_only_key = ApiKey.generate(user_id=user.id, organization_id=org.id,
+                                               name='status only', scopes='status')
+    db.session.add(read_only)
+    db.session.commit()
+    mocker.patch.object(llm, 'complete', return_value=Completion(text='ok', model='test'))
+
+    def generate(api_key):
+        return test_client.post('/api/v1/generate', json={'prompt': 'scoped'},
+                                headers={'Authorization': f'Bearer {api_key}'})
+
+    assert _status(test_client, read_only_key).status_code == 200
+    assert generate(read_only_key).status_code == 403
+    assert generate(user.api_key).status_code == 200
+
+
+def test_expired_and_revoked_keys_are_rejected(test_client, test_app, api_user):
+    user, _ = api_user('keys_expiry@example.com')
+    expiring, expiring_key = ApiKey.generate(user_id=user.id, expires_at=datetime.utcnow() + timedelta(seconds=1))
+    db.session.add(expiring)
+    db.session.commit()
+    assert _status(test_client, expiring_key).status_code == 200
+
+    expiring.expires_at = datetime.utcnow() - timedelta(seconds=1)
+    user.api_keys[0].revoked_at = datetime.utcnow()
+    db.session.commit()
+
+    assert _status(test_client, expiring_key).status_code == 401
+    assert _status(test_client, user.api_key).status_code == 401
+
+
+@pytest.mark.parametrize('backend', ['local', 'redis'])
+def test_usage_is_written_behind_in_bulk(test_client, test_app, backend, api_user):
+    """
+    GIVEN authenticated API calls from two keys
+    WHEN the requests are served
+    THEN no UPDATE hits api_keys until the flush, which writes all counts in one statement.
+    """
+    if backend == 'redis':
+        kv.use(fakeredis.FakeRedis())
+    first, org = api_user(f'keys_usage_a_{backend}@example.com')
+    second, _ = api_user(f'keys_usage_b_{backend}@example.com')
+    statements = []
+
+    def before_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append((statement, executemany))
+
+    event.listen(db.engine, 'before_cursor_execute', before_execute)
+    try:
+        for api_key in [first.api_key] * 3 + [second.api_key]:
+            assert _status(test_client, api_key).status_code == 200
+        assert not any('UPDATE api_keys' in sql for sql, _ in statements)
+
+        assert api_key_usage.flush() == 2
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', before_execute)
+
+    updates = [many for sql, many in statements if 'UPDATE api_keys' in sql]
+    assert updates == [True]
+    db.session.expire_all()
+    assert first.api_keys[0].request_count == 3
+    assert second.api_keys[0].request_count == 1
+    assert first.api_keys[0].last_used_at is not None
+    assert api_key_usage.flush() == 0
+
+
+def test_dashboard_creates_and_revokes_keys(test_client, test_app, api_user):
+    user, _ = api_user('keys_dashboard@example.com', password='password123', role='owner')
+    test_client.post('/auth/login', data={'email': 'keys_dashboard@example.com', 'password': 'password123'})
+
+    response = test_client.post('/dashboard/api-keys', data={'name': 'CI'}, follow_redirects=True)
+
+    assert response.status_code == 200
+    created = db.session.scalars(db.select(ApiKey).filter_by(user_id=user.id, name='CI')).one()
+    assert f'{created.prefix}…'.encode() in response.data  # listed by prefix only
+    assert created.key_hash.encode() not in response.data
+
+    test_client.post(f'/dashboard/api-keys/{created.id}/revoke')
+    db.session.refresh(created)
+    assert created.revoked_at is not None
+    test_client.get('/auth/logout')
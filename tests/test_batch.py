@@ -0,0 +1,91 @@
+# tests/test_batch.py
+
+import threading
+import time
+
+from app import batch_runner, llm
+from app.llm import Completion
+
+
+class SlowUpstream:
+    """Fake gateway call that sleeps and records peak concurrency."""
+
+    def __init__(self, delay):
+        self.delay = delay
+        self.in_flight = 0
+        self.peak = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, prompt, **kwargs):
+        with self._lock:
+            self.in_flight += 1
+            self.peak = max(self.peak, self.in_flight)
+        try:
+            time.sleep(self.delay)
+            if prompt == 'explode':
+                raise RuntimeError('upstream failed')
+            return Completion(text=f'echo {prompt}', model='test')
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+
+def test_batch_returns_results_in_input_order(test_client, test_app, mocker, api_user):
+    """
+    GIVEN a subscribed API user
+    WHEN a batch with a failing and an empty prompt is submitted
+    THEN results come back in input order with per-item errors.
+    """
+    user, _ = api_user('batch_order@example.com')
+    mocker.patch.object(llm, 'complete', side_effect=SlowUpstream(0.01))
+
+    response = test_client.post('/api/v1/generate/batch', headers={'Authorization': f'Bearer {user.api_key}'},
+                                json={'prompts': ['a', 'explode', '', 'd']})
+
+    assert response.status_code == 200
+    results = response.json['results']
+    assert [r['index'] for r in results] == [0, 1, 2, 3]
+    assert results[0]['generated_text'] == 'echo a'
+    assert 'upstream failed' in results[1]['error']
+    assert 'Prompt is required' in results[2]['error']
+    assert results[3]['generated_text'] == 'echo d'
+
+
+def test_batch_concurrency_is_capped_per_org(test_client, test_app, mocker, api_user):
+    """
+    GIVEN a per-org cap of 4
+    WHEN 8 slow prompts are submitted
+    THEN at most 4 run at once and wall time scales with the cap, not the count.
+    """
+    user, _ = api_user('batch_cap@example.com')
+    upstream = SlowUpstream(0.1)
+    mocker.patch.object(llm, 'complete', side_effect=upstream)
+    mocker.patch.object(batch_runner, 'per_org', 4)
+    batch_runner._semaphores.clear()
+
+    started = time.perf_counter()
+    response = test_client.post('/api/v1/generate/batch', headers={'Authorization': f'Bearer {user.api_key}'},
+                                json={'prompts': [f'p{i}' for i in range(8)]})
+    elapsed = time.perf_counter() - started
+
+    assert response.status_code == 200
+    assert upstream.peak == 4
+    assert 0.2 <= elapsed < 0.6  # two waves of 0.1s, versus 0.8s sequentially
+
+
+def test_batch_requires_subscription(test_client, test_app, api_user):
+    user, _ = api_user('batch_unsub@example.com', is_subscribed=False)
+
+    response = test_client.post('/api/v1/generate/batch', headers={'Authorization': f'Bearer {user.api_key}'},
+                                json={'prompts': ['a']})
+
+    assert response.status_code == 403
+
+
+def test_batch_validates_prompts(test_client, test_app, api_user):
+    user, _ = api_user('batch_invalid@example.com')
+    headers = {'Authorization': f'Bearer {user.api_key}'}
+
+    assert test_client.post('/api/v1/generate/batch', headers=headers, json={'prompts': []}).status_code == 400
+    too_many = {'prompts': ['x'] * (batch_runner.max_items + 1)}
+    assert test_client.post('/api/v1/generate/batch', headers=headers, json=too_many).status_code == 400
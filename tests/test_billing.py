@@ -0,0 +1,141 @@
+# tests/test_billing.py
+
+import itertools
+import json
+
+import pytest
+from sqlalchemy import event
+
+from app import billing, db
+from app.billing import ingest_event, process_account
+from app.models import Organization, StripeEvent
+
+_ids = itertools.count(1)
+
+
+@pytest.fixture
+def org(test_app, request):
+    org = Organization(name=f'{request.node.name} Org')
+    db.session.add(org)
+    db.session.commit()
+    return org
+
+
+@pytest.fixture
+def deferred(mocker):
+    """Queue nothing: tests run the processing task themselves."""
+    return mocker.patch.object(billing.process_events, 'delay')
+
+
+def _event(type_, obj, created):
+    return {'id': f'evt_billing_{next(_ids)}', 'object': 'event', 'type': type_, 'created': created,
+            'data': {'object': obj}}
+
+
+def _post(test_client, mocker, stripe_event):
+    mocker.patch('stripe.Webhook.construct_event', return_value=stripe_event)
+    return test_client.post('/payments/stripe/webhook', data=json.dumps(stripe_event),
+                            headers={'Stripe-Signature': 'sig'})
+
+
+def test_webhook_only_stores_the_event(test_client, test_app, org, deferred, mocker):
+    """
+    GIVEN a verified Stripe event
+    WHEN the webhook receives it
+    THEN the only database work is one INSERT into stripe_events, and processing is queued.
+    """
+    org_id = org.id
+    statements = []
+    listener = lambda conn, cursor, statement, *args: statements.append(statement)  # noqa: E731
+    event.listen(db.engine, 'before_cursor_execute', listener)
+    try:
+        stripe_event = _event('checkout.session.completed',
+                              {'client_reference_id': str(org_id), 'customer': 'cus_fast', 'subscription': 'sub_fast'},
+                              1_700_000_000)
+        response = _post(test_client, mocker, stripe_event)
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', listener)
+
+    assert response.status_code == 200
+    assert len(statements) == 1 and statements[0].startswith('INSERT INTO stripe_events')
+    deferred.assert_called_once_with('cus_fast')
+    assert db.session.get(Organization, org_id).is_subscribed is False  # not applied yet
+
+    assert process_account('cus_fast') == 1
+    assert db.session.get(Organization, org_id).is_subscribed is True
+
+
+def test_duplicate_deliveries_are_acknowledged_once(test_client, test_app, org, deferred, mocker):
+    stripe_event = _event('customer.subscription.updated',
+                          {'id': 'sub_dup', 'customer': 'cus_dup', 'status': 'active'}, 1_700_000_000)
+
+    first = _post(test_client, mocker, stripe_event)
+    second = _post(test_client, mocker, stripe_event)
+
+    assert first.json['status'] == 'success'
+    assert second.status_code == 200 and second.json['status'] == 'duplicate'
+    assert deferred.call_count == 1
+
+
+def test_batch_is_applied_in_created_order(test_app, org, deferred):
+    """
+    GIVEN a subscription lifecycle for one organization delivered out of order
+    WHEN the account's events are processed
+    THEN they are applied oldest first, including a subscription event sent before checkout completed.
+    """
+    customer = f'cus_order_{org.id}'
+    events = [
+        _event('customer.subscription.deleted', {'id': 'sub_order', 'customer': customer}, 1_700_000_300),
+        _event('checkout.session.completed', {'client_reference_id': str(org.id), 'customer': customer,
+                                              'subscription': 'sub_order'}, 1_700_000_100),
+        _event('customer.subscription.created', {'id': 'sub_order', 'customer': customer, 'status': 'active',
+                                                 'items': {'data': [{'price': {'id': 'price_pro'}}]}},
+               1_700_000_000),
+        _event('invoice.paid', {'id': 'in_1', 'customer': customer, 'subscription': 'sub_order'}, 1_700_000_200),
+        _event('charge.refunded', {'id': 'ch_1', 'customer': customer}, 1_700_000_250),
+    ]
+    for stripe_event in events:
+        ingest_event(stripe_event)
+
+    assert process_account(customer) == 5
+
+    db.session.refresh(org)
+    assert org.stripe_customer_id == customer
+    assert org.stripe_price_id == 'price_pro'
+    assert org.is_subscribed is False and org.subscription_id is None
+    statuses = {e.type: e.status for e in db.session.scalars(db.select(StripeEvent).filter_by(account=customer))}
+    assert statuses['charge.refunded'] == StripeEvent.IGNORED
+    assert statuses['invoice.paid'] == StripeEvent.PROCESSED
+
+
+def test_late_older_event_does_not_roll_back(test_app, org, deferred):
+    customer = f'cus_stale_{org.id}'
+    org.stripe_customer_id = customer
+    db.session.commit()
+    ingest_event(_event('customer.subscription.updated',
+                        {'id': 'sub_stale', 'customer': customer, 'status': 'canceled'}, 1_700_000_500))
+    process_account(customer)
+
+    ingest_event(_event('customer.subscription.updated',
+                        {'id': 'sub_stale', 'customer': customer, 'status': 'active'}, 1_700_000_400))
+    process_account(customer)
+
+    assert db.session.get(Organization, org.id).is_subscribed is False
+
+
+def test_failing_event_keeps_later_events_pending(test_app, org, deferred, mocker):
+    customer = f'cus_fail_{org.id}'
+    org.stripe_customer_id = customer
+    db.session.commit()
+    mocker.patch.dict(billing.HANDLERS, {'invoice.paid': mocker.Mock(side_effect=RuntimeError('boom'))})
+    ingest_event(_event('invoice.paid', {'customer': customer, 'subscription': 'sub_fail'}, 1_700_000_000))
+    later = _event('customer.subscription.updated', {'id': 'sub_fail', 'customer': customer, 'status': 'active'},
+                   1_700_000_100)
+    ingest_event(later)
+
+    assert process_account(customer) == 0
+
+    failed = db.session.scalars(db.select(StripeEvent).filter_by(account=customer, type='invoice.paid')).one()
+    assert failed.status == StripeEvent.PENDING and failed.attempts == 1 and 'boom' in failed.last_error
+    assert db.session.get(StripeEvent, later['id']).status == StripeEvent.PENDING
+    assert db.session.get(Organization, org.id).is_subscribed is False
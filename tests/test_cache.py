@@ -0,0 +1,117 @@
+# tests/test_cache.py
+
+import time
+
+import fakeredis
+import pytest
+import redis
+
+from app import kv, llm, response_cache
+from app.cache import LRUCache, ResponseCache
+from app.llm import Completion
+from app.metrics import metrics
+
+
+@pytest.fixture
+def fake_redis():
+    client = fakeredis.FakeRedis()
+    kv.use(client)
+    yield client
+    kv.use(None)
+
+
+def test_lru_evicts_least_recently_used():
+    cache = LRUCache(maxsize=2, ttl=60, name='test.lru')
+    evictions = metrics.counter('test.lru.evictions').value
+
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.get('a')          # 'b' is now the oldest
+    cache.set('c', 3)
+
+    assert cache.get('b') is None
+    assert cache.get('a') == 1 and cache.get('c') == 3
+    assert metrics.counter('test.lru.evictions').value == evictions + 1
+
+
+def test_lru_expires_entries():
+    cache = LRUCache(maxsize=10, ttl=0.01, name='test.ttl')
+    cache.set('k', 'v')
+    time.sleep(0.02)
+
+    assert cache.get('k') is None
+    assert metrics.counter('test.ttl.expired').value >= 1
+
+
+def test_cache_key_is_normalized():
+    key = ResponseCache.make_key
+    assert key('m', '  hello\r\nworld ', 60, {'a': 1, 'b': 2}) == key('m', 'hello\nworld', 60, {'b': 2, 'a': 1})
+    assert key('m', 'hello', 60) != key('m', 'hello', 61)
+    assert key('m', 'hello', 60) != key('other', 'hello', 60)
+
+
+def test_repeated_prompt_is_served_from_local_tier(test_client, test_app, mocker, api_user):
+    """
+    GIVEN a subscribed API user
+    WHEN the same prompt is generated twice
+    THEN the upstream is only called once.
+    """
+    user, _ = api_user('cache_local@example.com')
+    upstream = mocker.patch.object(llm, 'complete', return_value=Completion(text='cached answer', model='test'))
+    hits = metrics.counter('cache.local.hits').value
+
+    for _ in range(2):
+        response = test_client.post('/api/v1/generate', headers={'Authorization': f'Bearer {user.api_key}'},
+                                    json={'prompt': 'product blurb for socks'})
+        assert response.json['generated_text'] == 'cached answer'
+
+    upstream.assert_called_once()
+    assert metrics.counter('cache.local.hits').value == hits + 1
+
+
+def test_shared_tier_serves_other_workers(test_client, test_app, mocker, fake_redis, api_user):
+    """
+    GIVEN a completion cached through Redis
+    WHEN the local tier is cold (another worker)
+    THEN the response comes from Redis without calling upstream.
+    """
+    user, _ = api_user('cache_redis@example.com')
+    upstream = mocker.patch.object(llm, 'complete', return_value=Completion(text='shared answer', model='test'))
+    headers = {'Authorization': f'Bearer {user.api_key}'}
+
+    test_client.post('/api/v1/generate', headers=headers, json={'prompt': 'shared prompt'})
+    response_cache.clear_local()
+    redis_hits = metrics.counter('cache.redis.hits').value
+    response = test_client.post('/api/v1/generate', headers=headers, json={'prompt': 'shared prompt'})
+
+    assert response.json['generated_text'] == 'shared answer'
+    upstream.assert_called_once()
+    assert metrics.counter('cache.redis.hits').value == redis_hits + 1
+    assert any(k.startswith(b'respcache:') for k in fake_redis.keys())
+
+
+def test_org_can_opt_out(test_client, test_app, mocker, fake_redis, api_user):
+    user, _ = api_user('cache_optout@example.com', response_cache_enabled=False)
+    upstream = mocker.patch.object(llm, 'complete', return_value=Completion(text='fresh', model='test'))
+
+    for _ in range(2):
+        test_client.post('/api/v1/generate', headers={'Authorization': f'Bearer {user.api_key}'},
+                         json={'prompt': 'private prompt'})
+
+    assert upstream.call_count == 2
+    assert fake_redis.keys('respcache:*') == []
+
+
+def test_redis_outage_does_not_fail_requests(test_client, test_app, mocker, api_user):
+    user, _ = api_user('cache_outage@example.com')
+    kv.use(redis.Redis(port=1, socket_connect_timeout=0.05))  # nothing listens there
+    mocker.patch.object(llm, 'complete', return_value=Completion(text='still works', model='test'))
+    errors = metrics.counter('cache.redis.errors').value
+    try:
+        response = test_client.post('/api/v1/generate', headers={'Authorization': f'Bearer {user.api_key}'},
+                                    json={'prompt': 'redis is down'})
+    finally:
+        kv.use(None)
+
+    assert response.json['generated_text'] == 'still works'
+    assert metrics.counter('cache.redis.errors').value > errors
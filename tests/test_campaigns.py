@@ -0,0 +1,138 @@
+# tests/test_campaigns.py
+
+import pytest
+
+from app import campaigns, db, smtp_pool
+from app.campaigns import campaign_progress, send_campaign_chunk, start_campaign
+from app.models import Campaign, CampaignChunk, Membership, Organization, User
+
+CONTEXT = {'headline': 'New models', 'body': 'Faster and cheaper.'}
+
+
+@pytest.fixture
+def org_with_members(test_app, request):
+    name = request.node.name
+    org = Organization(name=f'{name} Org')
+    members = [User(email=f'{name}{n}@example.com', confirmed=True) for n in range(5)]
+    unconfirmed = User(email=f'{name}-unconfirmed@example.com', confirmed=False)
+    outsider = User(email=f'{name}-outsider@example.com', confirmed=True)
+    db.session.add_all([org, *members, unconfirmed, outsider])
+    db.session.add_all(Membership(user=user, organization=org) for user in [*members, unconfirmed])
+    db.session.commit()
+    return org, members
+
+
+def _recipients(smtp_server):
+    return sorted(to for to, _ in smtp_server.messages)
+
+
+def test_campaign_reaches_confirmed_members_in_chunks(test_app, smtp_server, org_with_members, mocker):
+    """
+    GIVEN an organization with five confirmed members, one unconfirmed member and an outsider
+    WHEN a campaign is started for it with two recipients per chunk
+    THEN three chunk tasks are queued carrying only (campaign_id, index), and each confirmed member gets one email.
+    """
+    org, members = org_with_members
+    chunk_task = mocker.spy(send_campaign_chunk, 'delay')
+
+    campaign = start_campaign('New models', 'email/announcement', organization_id=org.id, context=CONTEXT,
+                              chunk_size=2)
+
+    assert [call.args for call in chunk_task.call_args_list] == [(campaign.id, 0), (campaign.id, 1), (campaign.id, 2)]
+    assert _recipients(smtp_server) == sorted(user.email for user in members)
+    assert b'Faster and cheaper.' in smtp_server.messages[0][1]
+    progress = campaign_progress(campaign.id)
+    assert (progress['status'], progress['recipients'], progress['sent'], progress['failed']) == ('done', 5, 5, 0)
+    assert (progress['chunks'], progress['chunks_done']) == (3, 3)
+    assert len(smtp_server.sessions) == 1  # chunks share the worker's pooled connection
+
+
+def test_rejected_recipients_are_counted_per_chunk(test_app, smtp_server, org_with_members):
+    org, members = org_with_members
+    smtp_server.reject.add(members[3].email)
+
+    campaign = start_campaign('New models', 'email/announcement', organization_id=org.id, context=CONTEXT,
+                              chunk_size=2)
+
+    progress = campaign_progress(campaign.id)
+    assert (progress['status'], progress['sent'], progress['failed']) == ('done', 4, 1)
+    assert [(c['index'], c['failed']) for c in progress['problem_chunks']] == [(1, 1)]
+
+
+def test_deferred_chunk_resumes_without_resending(test_app, smtp_server, org_with_members, mocker, monkeypatch):
+    """
+    GIVEN a chunk whose SMTP server goes away after the first message
+    WHEN the chunk is retried
+    THEN it resumes after the last delivered recipient, so nobody gets the email twice.
+    """
+    org, members = org_with_members
+    mocker.patch.object(send_campaign_chunk, 'delay')  # run the chunk by hand
+    campaign = start_campaign('New models', 'email/announcement', organization_id=org.id, context=CONTEXT,
+                              chunk_size=5)
+    real_deliver = smtp_pool.deliver
+
+    def flaky_deliver(envelopes):
+        report = real_deliver(envelopes[:1])
+        report.deferred, report.error = envelopes[1:], OSError('connection reset')
+        return report
+
+    monkeypatch.setattr(smtp_pool, 'deliver', flaky_deliver)
+    with pytest.raises(campaigns.DeliveryDeferred):
+        send_campaign_chunk.run(campaign.id, 0)
+    chunk = db.session.get(CampaignChunk, (campaign.id, 0))
+    assert (chunk.status, chunk.sent, chunk.attempts) == (CampaignChunk.PENDING, 1, 1)
+
+    monkeypatch.setattr(smtp_pool, 'deliver', real_deliver)
+    assert send_campaign_chunk.run(campaign.id, 0) == 4
+    assert send_campaign_chunk.run(campaign.id, 0) == 0  # redelivered task: nothing left to do
+
+    assert _recipients(smtp_server) == sorted(user.email for user in members)
+    assert db.session.get(Campaign, campaign.id).status == Campaign.DONE
+
+
+def test_recipient_deferred_mid_chunk_is_retried_alone(test_app, smtp_server, org_with_members, mocker):
+    """
+    GIVEN a chunk whose third recipient is greylisted (451 on RCPT) once, while the ones after it are accepted
+    WHEN the chunk is sent and then retried
+    THEN the retry sends to that recipient only: everyone gets exactly one email.
+    """
+    org, members = org_with_members
+    greylisted = {members[2].email}
+    recording = smtp_server.handle_RCPT
+
+    async def greylist_once(server, session, envelope, address, rcpt_options):
+        if address in greylisted:
+            greylisted.discard(address)
+            return '451 4.7.1 Greylisted, please try again later'
+        return await recording(server, session, envelope, address, rcpt_options)
+
+    smtp_server.handle_RCPT = greylist_once
+    mocker.patch.object(send_campaign_chunk, 'delay')  # run the chunk by hand
+    campaign = start_campaign('New models', 'email/announcement', organization_id=org.id, context=CONTEXT,
+                              chunk_size=5)
+
+    with pytest.raises(campaigns.DeliveryDeferred):
+        send_campaign_chunk.run(campaign.id, 0)
+    chunk = db.session.get(CampaignChunk, (campaign.id, 0))
+    assert (chunk.status, chunk.sent, chunk.failed) == (CampaignChunk.PENDING, 4, 0)
+    assert chunk.deferred_user_ids == f'[{members[2].id}]'
+
+    assert send_campaign_chunk.run(campaign.id, 0) == 1
+
+    assert sorted(to for to, _ in smtp_server.messages) == sorted(user.email for user in members)
+    progress = campaign_progress(campaign.id)
+    assert (progress['status'], progress['sent'], progress['failed']) == ('done', 5, 0)
+
+
+def test_all_organizations_campaign_emails_each_user_once(test_app, smtp_server, org_with_members):
+    org, members = org_with_members
+    second = Organization(name='Second Org')
+    db.session.add_all([second, Membership(user=members[0], organization=second)])
+    db.session.commit()
+
+    campaign = start_campaign('New models', 'email/announcement', context=CONTEXT)
+
+    progress = campaign_progress(campaign.id)
+    delivered = [to for to, _ in smtp_server.messages]
+    assert progress['status'] == 'done' and progress['sent'] == len(delivered)
+    assert len(delivered) == len(set(delivered)) and members[0].email in delivered
@@ -0,0 +1,152 @@
+# tests/test_coalesce.py
+
+import threading
+import time
+
+import fakeredis
+import pytest
+
+from app import db, generation, llm, single_flight
+from app.coalesce import SingleFlight
+from app.llm import Completion
+from app.metrics import metrics
+from app.models import Organization
+
+
+class _KV:
+    """Minimal stand-in for app.kv bound to one fake Redis client."""
+
+    def __init__(self, client):
+        self.client = client
+
+
+def _run_concurrently(n, fn):
+    barrier = threading.Barrier(n)
+    results, errors = [None] * n, []
+
+    def worker(i):
+        barrier.wait()
+        try:
+            results[i] = fn()
+        except Exception as exc:  # pragma: no cover - surfaced via assertion below
+            errors.append(exc)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(n)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert not errors
+    return results
+
+
+def test_identical_requests_share_one_upstream_call(test_app, mocker):
+    """
+    GIVEN ten concurrent identical generations in one worker
+    WHEN the upstream is slow
+    THEN only one upstream call is made and everyone gets its result.
+    """
+    calls = []
+
+    def slow_complete(prompt, **kwargs):
+        calls.append(prompt)
+        time.sleep(0.1)
+        return Completion(text='viral answer', model='test')
+
+    mocker.patch.object(llm, 'complete', side_effect=slow_complete)
+    collapsed = metrics.counter('coalesce.collapsed.local').value
+
+    def call():
+        with test_app.app_context():
+            return generation.complete('the viral prompt').text
+
+    results = _run_concurrently(10, call)
+
+    assert results == ['viral answer'] * 10
+    assert len(calls) == 1
+    assert metrics.counter('coalesce.collapsed.local').value == collapsed + 9
+
+
+def test_leader_errors_propagate_to_local_followers(test_app, mocker):
+    def failing(prompt, **kwargs):
+        time.sleep(0.05)
+        raise RuntimeError('upstream down')
+
+    upstream = mocker.patch.object(llm, 'complete', side_effect=failing)
+
+    def call():
+        with test_app.app_context():
+            try:
+                generation.complete('doomed prompt')
+            except RuntimeError as exc:
+                return str(exc)
+
+    assert _run_concurrently(4, call) == ['upstream down'] * 4
+    assert upstream.call_count == 1
+
+
+def test_coalescing_across_workers_via_redis(test_app):
+    """
+    GIVEN two worker processes sharing Redis
+    WHEN both start the same generation
+    THEN the second waits for the first's published result.
+    """
+    server = fakeredis.FakeServer()
+    worker_a = SingleFlight(test_app, _KV(fakeredis.FakeRedis(server=server)))
+    worker_b = SingleFlight(test_app, _KV(fakeredis.FakeRedis(server=server)))
+    started = threading.Event()
+    b_calls = []
+    remote = metrics.counter('coalesce.collapsed.remote').value
+
+    def leader_work():
+        started.set()
+        time.sleep(0.2)
+        return {'text': 'from worker a'}
+
+    result_a = {}
+    thread = threading.Thread(target=lambda: result_a.update(worker_a.do('k1', leader_work)))
+    thread.start()
+    started.wait()
+    result_b = worker_b.do('k1', lambda: b_calls.append(1) or {'text': 'from worker b'})
+    thread.join()
+
+    assert result_a == result_b == {'text': 'from worker a'}
+    assert b_calls == []
+    assert metrics.counter('coalesce.collapsed.remote').value == remote + 1
+
+
+def test_follower_falls_back_when_remote_leader_fails(test_app):
+    server = fakeredis.FakeServer()
+    worker_a = SingleFlight(test_app, _KV(fakeredis.FakeRedis(server=server)))
+    worker_b = SingleFlight(test_app, _KV(fakeredis.FakeRedis(server=server)))
+    started = threading.Event()
+
+    def leader_work():
+        started.set()
+        time.sleep(0.1)
+        raise RuntimeError('leader crashed')
+
+    def run_leader():
+        with pytest.raises(RuntimeError):
+            worker_a.do('k2', leader_work)
+
+    thread = threading.Thread(target=run_leader)
+    thread.start()
+    started.wait()
+    result = worker_b.do('k2', lambda: {'text': 'recomputed'})
+    thread.join()
+
+    assert result == {'text': 'recomputed'}
+
+
+def test_opted_out_orgs_are_not_coalesced(test_app, mocker):
+    with test_app.app_context():
+        org = Organization(name='Private Org', response_cache_enabled=False)
+        db.session.add(org)
+        db.session.commit()
+        do = mocker.spy(single_flight, 'do')
+        mocker.patch.object(llm, 'complete', return_value=Completion(text='private', model='test'))
+
+        generation.complete('secret prompt', org=org)
+
+    do.assert_not_called()
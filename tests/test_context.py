@@ -0,0 +1,85 @@
+# tests/test_context.py
+
+from contextlib import contextmanager
+
+import pytest
+from sqlalchemy import event
+
+from app import db, identity_cache
+from app.models import Membership, Organization, User
+
+
+@contextmanager
+def _count_queries():
+    statements = []
+
+    def before_execute(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', before_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', before_execute)
+
+
+@pytest.fixture
+def logged_in_owner(test_client, test_app, request):
+    name = request.node.name
+    user = User(email=f'{name}@example.com', confirmed=True)
+    user.set_password('password123')
+    org = Organization(name=f'{name} Org', is_subscribed=True, stripe_customer_id=f'cus_{name}')
+    db.session.add_all([user, org, Membership(user=user, organization=org, role='owner')])
+    db.session.commit()
+    test_client.post('/auth/login', data={'email': f'{name}@example.com', 'password': 'password123'})
+    yield user
+    test_client.get('/auth/logout')
+
+
+def _fresh_request(test_app, send):
+    """Run one request with its own app context (fresh ``g`` and session), counting queries.
+
+    The identity cache is cleared so the request takes the database path.
+    """
+    identity_cache.clear_local()
+    with test_app.app_context(), _count_queries() as statements:
+        response = send()
+    return response, statements
+
+
+def test_subscription_required_page_costs_one_query(test_client, test_app, logged_in_owner):
+    """
+    GIVEN a logged-in, subscribed user
+    WHEN they open a page guarded by login_required and subscription_required
+    THEN user, membership and organization are loaded by a single query.
+    """
+    response, statements = _fresh_request(test_app, lambda: test_client.get('/features/generate-text'))
+
+    assert response.status_code == 200
+    assert len(statements) == 1
+    assert 'JOIN memberships' in statements[0] and 'JOIN organizations' in statements[0]
+
+
+def test_role_required_view_costs_one_query(test_client, test_app, logged_in_owner, mocker):
+    portal = mocker.patch('stripe.billing_portal.Session.create', return_value=mocker.Mock(url='https://stripe.test/p'))
+
+    response, statements = _fresh_request(test_app, lambda: test_client.post('/payments/customer-portal'))
+
+    assert response.status_code in (302, 303)
+    assert response.location == 'https://stripe.test/p'
+    assert portal.call_args.kwargs['customer'] == 'cus_test_role_required_view_costs_one_query'
+    assert len(statements) == 1
+
+
+def test_role_required_rejects_non_owner(test_client, test_app):
+    user = User(email='context_member@example.com', confirmed=True)
+    user.set_password('password123')
+    org = Organization(name='Context Member Org', is_subscribed=True, stripe_customer_id='cus_member')
+    db.session.add_all([user, org, Membership(user=user, organization=org, role='member')])
+    db.session.commit()
+    test_client.post('/auth/login', data={'email': 'context_member@example.com', 'password': 'password123'})
+
+    response = test_client.post('/payments/customer-portal', follow_redirects=True)
+    test_client.get('/auth/logout')
+
+    assert b"This action requires the &#39;owner&#39; role." in response.data
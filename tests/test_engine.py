@@ -0,0 +1,176 @@
+# tests/test_engine.py
+
+import threading
+import time
+from concurrent.futures import Future
+
+import pytest
+
+from app import engine, llm
+from app.engine import EngineTimeout, LocalEngine, MicroBatcher, TemplateBackend
+
+
+def test_template_backend_routes_and_is_deterministic():
+    backend = TemplateBackend()
+    prompts = ['A mobile habit tracker for students', 'An online store that sells handmade candles']
+
+    texts = backend.generate_batch(prompts, max_tokens=200)
+
+    assert texts == backend.generate_batch(prompts, max_tokens=200)
+    assert texts == [backend.generate_batch([p], max_tokens=200)[0] for p in prompts]
+    assert texts[0].startswith('Project plan: mobile habit tracker students')
+    assert 'TestFlight' in texts[0]
+    assert 'checkout' in texts[1]
+    assert len(backend.generate_batch(prompts[:1], max_tokens=5)[0].split(' ')) == 5
+
+
+def test_landing_page_generate_uses_local_engine(test_client):
+    """
+    GIVEN the landing page
+    WHEN a concept is posted to /generate
+    THEN the local engine returns a project plan without sleeping or calling upstream.
+    """
+    started = time.perf_counter()
+    response = test_client.post('/generate', json={'prompt': 'A dashboard for tracking SaaS subscriptions'})
+
+    assert response.status_code == 200
+    assert response.json['result'].startswith('Project plan:')
+    assert time.perf_counter() - started < 1.0
+
+
+def test_landing_page_generate_rejects_empty_prompt(test_client):
+    assert test_client.post('/generate', json={'prompt': '   '}).status_code == 400
+    assert test_client.post('/generate', data='not json').status_code == 400
+
+
+def test_latency_budget_returns_504_and_skips_stale_work(test_client, mocker):
+    """
+    GIVEN an engine backend slower than the request budget
+    WHEN the budget runs out
+    THEN the caller gets a 504 and queued work past its deadline is never run.
+    """
+    release = threading.Event()
+    calls = []
+    original = TemplateBackend.generate_batch
+
+    def slow(self, prompts, max_tokens, deadline=None):
+        calls.append(prompts[0])
+        release.wait(1)
+        return original(self, prompts, max_tokens, deadline)
+
+    mocker.patch.object(TemplateBackend, 'generate_batch', slow)
+    mocker.patch.object(engine, 'budget', 0.05)
+    mocker.patch.object(engine, 'workers', 1)
+    engine.shutdown()
+    try:
+        first = test_client.post('/generate', json={'prompt': 'first slow concept'})
+        second = test_client.post('/generate', json={'prompt': 'second queued concept'})
+        release.set()
+        time.sleep(0.1)
+    finally:
+        engine.shutdown()
+
+    assert (first.status_code, second.status_code) == (504, 504)
+    assert calls == ['first slow concept']
+
+
+def test_full_queue_returns_503(test_client, mocker):
+    mocker.patch.object(engine, 'max_queue', 0)
+
+    response = test_client.post('/generate', json={'prompt': 'any concept'})
+
+    assert response.status_code == 503
+
+
+def test_api_can_use_local_engine(test_client, test_app, mocker, api_user):
+    user, _ = api_user('engine_api@example.com')
+    mocker.patch.dict(test_app.config, {'LLM_BACKEND': 'local'})
+    upstream = mocker.patch.object(llm, 'complete')
+
+    response = test_client.post('/api/v1/generate', headers={'Authorization': f'Bearer {user.api_key}'},
+                                json={'prompt': 'A podcast about open source maintainers'})
+
+    assert response.status_code == 200
+    assert response.json['generated_text'].startswith('Project plan:')
+    upstream.assert_not_called()
+
+
+def test_process_pool_mode(test_app):
+    local = LocalEngine()
+    local.mode, local.workers, local.budget = 'process', 1, 60
+    try:
+        completion = local.complete('A sensor network for greenhouse monitoring')
+    finally:
+        local.shutdown()
+
+    assert completion.model == 'local:template'
+    assert completion.text == TemplateBackend().generate_batch(
+        ['A sensor network for greenhouse monitoring'], local.max_tokens)[0]
+
+
+def test_deadline_is_checked_before_running():
+    with pytest.raises(EngineTimeout):
+        TemplateBackend().generate_batch(['late'], max_tokens=10, deadline=time.time() - 1)
+
+
+def _concurrently(n, fn):
+    barrier = threading.Barrier(n)
+    results = [None] * n
+
+    def worker(i):
+        barrier.wait()
+        results[i] = fn(i)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(n)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return results
+
+
+def test_concurrent_requests_share_one_forward_pass(test_app, mocker):
+    """
+    GIVEN eight concurrent single-prompt requests
+    WHEN they arrive within the batching window
+    THEN they run as one batched call and each caller gets its own text.
+    """
+    local = LocalEngine()
+    local.mode, local.batch_max_size, local.batch_wait_ms = 'thread', 16, 200
+    batches = []
+    original = TemplateBackend.generate_batch
+
+    def spy(self, prompts, max_tokens, deadline=None):
+        batches.append(len(prompts))
+        return original(self, prompts, max_tokens, deadline)
+
+    mocker.patch.object(TemplateBackend, 'generate_batch', spy)
+    prompts = [f'Concept number {i} for a recipe sharing website' for i in range(8)]
+    try:
+        texts = _concurrently(8, lambda i: local.complete(prompts[i]).text)
+    finally:
+        local.shutdown()
+
+    assert batches == [8]
+    assert texts == original(TemplateBackend(), prompts, local.max_tokens)
+
+
+def test_batches_respect_max_size_and_max_tokens():
+    dispatched = []
+
+    def dispatch(prompts, max_tokens, deadline):
+        dispatched.append((len(prompts), max_tokens))
+        future = Future()
+        future.set_result([f'{p}:{max_tokens}' for p in prompts])
+        return future
+
+    batcher = MicroBatcher(dispatch, max_batch_size=3, max_wait_ms=100, max_in_flight=1)
+    deadline = time.time() + 5
+    futures = [batcher.submit(f'p{i}', 10 if i < 4 else 20, deadline) for i in range(6)]
+    try:
+        results = [f.result(timeout=5) for f in futures]
+    finally:
+        batcher.close()
+
+    assert results == ['p0:10', 'p1:10', 'p2:10', 'p3:10', 'p4:20', 'p5:20']
+    assert sorted(dispatched) == [(1, 10), (2, 20), (3, 10)]
@@ -0,0 +1,134 @@
+# tests/test_entitlements.py
+
+import time
+from contextlib import contextmanager
+
+import fakeredis
+import pytest
+from sqlalchemy import event
+
+from app import billing, db, entitlements, identity_cache, kv, rate_limiter
+from app.billing import ingest_event, process_account
+from app.entitlements import Entitlement
+from app.models import Membership, Organization, User
+
+
+@pytest.fixture
+def redis_kv(test_app):
+    kv.use(fakeredis.FakeRedis())
+    entitlements.clear_local()
+    yield kv.client
+    entitlements.clear_local()
+    kv.use(None)
+
+
+@pytest.fixture
+def subscriber(test_client, test_app, request):
+    name = request.node.name
+    user = User(email=f'{name}@example.com', confirmed=True)
+    user.set_password('password123')
+    org = Organization(name=f'{name} Org', is_subscribed=True, stripe_customer_id=f'cus_{name}',
+                       subscription_id=f'sub_{name}', stripe_price_id='price_pro', subscription_status='active')
+    db.session.add_all([user, org, Membership(user=user, organization=org, role='owner')])
+    db.session.commit()
+    test_client.post('/auth/login', data={'email': f'{name}@example.com', 'password': 'password123'})
+    yield org
+    test_client.get('/auth/logout')
+
+
+@contextmanager
+def _count_queries():
+    statements = []
+
+    def before_execute(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', before_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', before_execute)
+
+
+def _cancel(org, created):
+    ingest_event({'id': f'evt_cancel_{org.id}_{created}', 'type': 'customer.subscription.deleted', 'created': created,
+                  'data': {'object': {'id': org.subscription_id, 'customer': org.stripe_customer_id}}})
+
+
+def test_premium_page_is_served_without_queries(test_client, test_app, redis_kv, subscriber):
+    """
+    GIVEN a subscribed organization whose snapshot was pushed when it was created
+    WHEN a member opens a premium page in a fresh worker (empty local caches)
+    THEN the entitlement comes from Redis and the page costs no query at all.
+    """
+    with test_app.app_context():
+        test_client.get('/features/generate-text')  # warm the session identity
+    entitlements.clear_local()
+
+    with test_app.app_context(), _count_queries() as statements:
+        response = test_client.get('/features/generate-text')
+
+    assert response.status_code == 200
+    assert statements == []
+    assert entitlements.stats()['entitlement.redis.hits'] >= 1
+
+
+def test_snapshot_carries_plan_status_limits_and_period_end(test_app, redis_kv, subscriber):
+    test_app.config['RATE_LIMIT_PLANS']['price_pro'] = {'rate': 20, 'burst': 100, 'daily_quota': 50000}
+    rate_limiter.init_app(test_app, kv)
+    try:
+        update_event = {
+            'id': f'evt_update_{subscriber.id}', 'type': 'customer.subscription.updated', 'created': 1_700_000_000,
+            'data': {'object': {'id': subscriber.subscription_id, 'customer': subscriber.stripe_customer_id,
+                                'status': 'trialing', 'current_period_end': 1_702_592_000,
+                                'items': {'data': [{'price': {'id': 'price_pro'}}]}}}}
+        ingest_event(update_event)
+
+        entitlements.clear_local()  # read what was pushed to Redis
+        snapshot = entitlements.get(subscriber.id)
+    finally:
+        del test_app.config['RATE_LIMIT_PLANS']['price_pro']
+        rate_limiter.init_app(test_app, kv)
+
+    assert (snapshot.active, snapshot.plan, snapshot.status) == (True, 'price_pro', 'trialing')
+    assert snapshot.period_end == 1_702_592_000
+    assert snapshot.limits['rate'] == 20 and snapshot.limits['daily_quota'] == 50000
+
+
+def test_cancellation_reaches_other_workers_within_the_local_ttl(test_client, test_app, redis_kv, subscriber,
+                                                                 monkeypatch):
+    """
+    GIVEN another worker holding an 'active' snapshot in its local cache
+    WHEN the billing task processes a cancellation
+    THEN Redis has the new snapshot at once, and the stale local copy is gone within ENTITLEMENT_LOCAL_TTL.
+    """
+    monkeypatch.setattr(entitlements.local, 'ttl', 0.2)
+    org_id = subscriber.id
+    stale = Entitlement(org_id=org_id, active=True, plan='price_pro', status='active')
+
+    monkeypatch.setattr(billing.process_events, 'delay', lambda account: None)
+    _cancel(subscriber, created=1_700_000_000)
+    process_account(subscriber.stripe_customer_id)
+    assert Entitlement.from_json(redis_kv.get(f'entitlement:{org_id}')).active is False
+
+    entitlements.local.set(org_id, stale)  # what a worker that read before the commit still holds
+    assert entitlements.get(org_id).active is True
+    time.sleep(0.25)
+    assert entitlements.get(org_id).active is False
+
+    identity_cache.clear_local()
+    response = test_client.get('/features/generate-text')
+    assert response.status_code == 302
+
+
+def test_fill_from_the_database_never_overwrites_a_publish(test_app, redis_kv, subscriber):
+    org_id = subscriber.id
+    fresh = Entitlement(org_id=org_id, active=False, status='canceled')
+    entitlements.publish([fresh])
+    entitlements.clear_local()
+
+    # A reader that loaded the row before the cancellation committed tries to fill the cache.
+    entitlements._store([Entitlement(org_id=org_id, active=True)], only_if_absent=True)
+
+    entitlements.clear_local()
+    assert entitlements.get(org_id).active is False
@@ -1,6 +1,7 @@
 # tests/test_features.py
 
-from app import db
+from app import db, llm
+from app.llm import Completion
 from app.models import User, Organization, Membership
 
 def test_feature_page_for_unsubscribed_user(test_client, test_app):
@@ -49,9 +50,8 @@ def test_feature_page_for_subscribed_user(test_client, test_app, mocker):
     
     test_client.post('/auth/login', data={'email': 'subscribed@example.com', 'password': 'password123'})
 
-    # Mock the OpenAI client's create method to avoid real API calls
-    mock_create = mocker.patch('app.features.OpenAI').return_value.completions.create
-    mock_create.return_value.choices[0].text = "This is a test response from the AI."
+    # Mock the shared LLM gateway to avoid real API calls
+    mock_create = mocker.patch.object(llm, 'complete', return_value=Completion(text="This is a test response from the AI.", model="test"))
 
     response = test_client.post('/features/generate-text', data={'prompt': 'test prompt'}, follow_redirects=True)
 
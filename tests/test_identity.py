@@ -0,0 +1,141 @@
+# tests/test_identity.py
+
+from contextlib import contextmanager
+
+import fakeredis
+import pytest
+from sqlalchemy import event
+
+from app import db, identity_cache, kv
+from app.models import Membership, Organization, User
+
+
+@pytest.fixture(params=['local', 'redis'])
+def backend(request, test_app):
+    if request.param == 'redis':
+        kv.use(fakeredis.FakeRedis())
+    identity_cache.clear_local()
+    yield request.param
+    identity_cache.clear_local()
+    kv.use(None)
+
+
+@pytest.fixture
+def logged_in(test_client, test_app, backend, request):
+    name = request.node.name.replace('[', '_').rstrip(']')
+    user = User(email=f'{name}@example.com', confirmed=True)
+    user.set_password('password123')
+    org = Organization(name=f'{name} Org', is_subscribed=True)
+    membership = Membership(user=user, organization=org, role='owner')
+    db.session.add_all([user, org, membership])
+    db.session.commit()
+    test_client.post('/auth/login', data={'email': f'{name}@example.com', 'password': 'password123'})
+    yield user, org, membership
+    test_client.get('/auth/logout')
+
+
+@contextmanager
+def _count_queries():
+    statements = []
+
+    def before_execute(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', before_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', before_execute)
+
+
+def _fresh_request(test_app, send):
+    """Run one request with its own app context (fresh ``g`` and session), counting queries."""
+    with test_app.app_context(), _count_queries() as statements:
+        response = send()
+    return response, statements
+
+
+def _loads_user(statements):
+    return any('FROM users' in sql for sql in statements)
+
+
+def test_repeat_requests_skip_the_user_query(test_client, test_app, logged_in):
+    """
+    GIVEN a logged-in, subscribed user whose identity has been loaded once
+    WHEN they open a subscription-guarded page again
+    THEN the user, membership and organization come from the cache, with no query at all.
+    """
+    response, statements = _fresh_request(test_app, lambda: test_client.get('/features/generate-text'))
+    assert response.status_code == 200 and _loads_user(statements)
+
+    response, statements = _fresh_request(test_app, lambda: test_client.get('/features/generate-text'))
+
+    assert response.status_code == 200
+    assert statements == []
+
+
+def test_demoted_admin_is_rejected_on_the_next_request(test_client, test_app, logged_in):
+    user, _, _ = logged_in
+    user.is_admin = True
+    db.session.commit()
+    _fresh_request(test_app, lambda: test_client.get('/admin/user/'))
+    assert _fresh_request(test_app, lambda: test_client.get('/admin/user/'))[0].status_code == 200
+
+    user.is_admin = False
+    db.session.commit()
+
+    assert _fresh_request(test_app, lambda: test_client.get('/admin/user/'))[0].status_code != 200
+
+
+def test_role_and_subscription_changes_reach_the_session(test_client, test_app, logged_in, mocker):
+    """
+    GIVEN a cached owner of a subscribed organization
+    WHEN they are demoted, and later the organization loses its subscription
+    THEN each change takes effect on the very next request.
+    """
+    _, org, membership = logged_in
+    mocker.patch('stripe.billing_portal.Session.create', return_value=mocker.Mock(url='https://stripe.test/p'))
+    org.stripe_customer_id = f'cus_identity_{id(org)}'
+    db.session.commit()
+    portal = lambda: test_client.post('/payments/customer-portal')  # noqa: E731
+    assert _fresh_request(test_app, portal)[0].status_code == 303
+    version = db.session.get(User, membership.user_id).session_version
+
+    membership.role = 'member'
+    db.session.commit()
+
+    assert _fresh_request(test_app, portal)[0].status_code != 303
+    assert db.session.get(User, membership.user_id).session_version == version + 1
+
+    page = lambda: test_client.get('/features/generate-text')  # noqa: E731
+    assert _fresh_request(test_app, page)[0].status_code == 200
+    org.is_subscribed = False
+    db.session.commit()
+
+    assert _fresh_request(test_app, page)[0].status_code != 200
+
+
+def test_password_change_bumps_the_session_version(test_client, test_app, logged_in):
+    user, _, _ = logged_in
+    version = user.session_version
+    _fresh_request(test_app, lambda: test_client.get('/dashboard'))
+
+    user.set_password('new-password456')
+    db.session.commit()
+
+    assert user.session_version == version + 1
+    response, statements = _fresh_request(test_app, lambda: test_client.get('/dashboard'))
+    assert response.status_code == 200
+    assert _loads_user(statements)
+
+
+def test_rolled_back_changes_keep_the_cached_identity(test_client, test_app, logged_in):
+    user, _, _ = logged_in
+    _fresh_request(test_app, lambda: test_client.get('/features/generate-text'))
+
+    user.is_admin = True
+    db.session.flush()
+    db.session.rollback()
+
+    _, statements = _fresh_request(test_app, lambda: test_client.get('/features/generate-text'))
+    assert statements == []
@@ -0,0 +1,148 @@
+# tests/test_jobs.py
+
+import socket
+
+import pytest
+
+from app import celery, llm
+from app.jobs import UnsafeCallbackURL, deliver_callback, job_owner
+from app.llm import Completion
+
+
+def test_async_generate_returns_job_and_result(test_client, test_app, mocker, api_user):
+    """
+    GIVEN a subscribed API user
+    WHEN /api/v1/generate is called with async=true
+    THEN a job id is returned immediately and the job endpoint serves the result.
+    """
+    user, org = api_user('job_user@example.com')
+    mocker.patch.object(llm, 'complete', return_value=Completion(text='async answer', model='test'))
+    headers = {'Authorization': f'Bearer {user.api_key}'}
+
+    response = test_client.post('/api/v1/generate', headers=headers, json={'prompt': 'slow one', 'async': True})
+
+    assert response.status_code == 202
+    job_id = response.json['job_id']
+    assert job_owner(job_id) == org.id
+    assert response.json['status_url'].endswith(f'/api/v1/jobs/{job_id}')
+
+    status = test_client.get(f'/api/v1/jobs/{job_id}', headers=headers)
+    assert status.status_code == 200
+    assert status.json == {'job_id': job_id, 'status': 'success', 'generated_text': 'async answer'}
+
+
+def test_job_status_is_scoped_to_owner(test_client, test_app, mocker, api_user):
+    owner, _ = api_user('job_owner@example.com')
+    other, _ = api_user('job_other@example.com')
+    mocker.patch.object(llm, 'complete', return_value=Completion(text='secret', model='test'))
+
+    job_id = test_client.post('/api/v1/generate', headers={'Authorization': f'Bearer {owner.api_key}'},
+                              json={'prompt': 'mine', 'async': True}).json['job_id']
+    response = test_client.get(f'/api/v1/jobs/{job_id}', headers={'Authorization': f'Bearer {other.api_key}'})
+
+    assert response.status_code == 404
+
+
+def test_async_generate_fires_callback(test_client, test_app, mocker, api_user):
+    user, _ = api_user('job_callback@example.com')
+    mocker.patch.object(llm, 'complete', return_value=Completion(text='done!', model='test'))
+    post = mocker.patch('app.jobs._http.post')
+    _resolves_to(mocker, '93.184.216.34')
+    mocker.patch.dict(test_app.config, {'JOB_CALLBACK_SECRET': 'cb-secret'})
+
+    response = test_client.post('/api/v1/generate', headers={'Authorization': f'Bearer {user.api_key}'},
+                                json={'prompt': 'call me', 'async': True, 'callback_url': 'https://example.com/hook'})
+
+    post.assert_called_once()
+    url = post.call_args.args[0]
+    kwargs = post.call_args.kwargs
+    assert url == 'https://example.com/hook'
+    assert '"generated_text":"done!"' in kwargs['data']
+    assert response.json['job_id'] in kwargs['data']
+    assert kwargs['headers']['X-AIGenesis-Signature'].startswith('sha256=')
+    assert kwargs['allow_redirects'] is False
+
+
+def test_failed_job_reports_error(test_client, test_app, mocker, api_user):
+    user, _ = api_user('job_fail@example.com')
+    mocker.patch.object(llm, 'complete', side_effect=RuntimeError('upstream down'))
+    headers = {'Authorization': f'Bearer {user.api_key}'}
+
+    job_id = test_client.post('/api/v1/generate', headers=headers, json={'prompt': 'fail', 'async': True}).json['job_id']
+    status = test_client.get(f'/api/v1/jobs/{job_id}', headers=headers)
+
+    assert status.json['status'] == 'failure'
+    assert 'upstream down' in status.json['error']
+
+
+def test_rejects_non_http_callback(test_client, test_app, api_user):
+    user, _ = api_user('job_badcb@example.com')
+
+    response = test_client.post('/api/v1/generate', headers={'Authorization': f'Bearer {user.api_key}'},
+                                json={'prompt': 'x', 'async': True, 'callback_url': 'file:///etc/passwd'})
+
+    assert response.status_code == 400
+
+
+def _resolves_to(mocker, *addresses):
+    return mocker.patch('app.jobs.socket.getaddrinfo', return_value=[
+        (socket.AF_INET6 if ':' in address else socket.AF_INET, socket.SOCK_STREAM, socket.IPPROTO_TCP, '',
+         (address, 443)) for address in addresses])
+
+
+@pytest.fixture(scope='module')
+def ssrf_api_key(test_app, api_user):
+    user, _ = api_user('job_ssrf@example.com')
+    return user.api_key
+
+
+@pytest.mark.parametrize('callback_url, addresses', [
+    ('http://127.0.0.1:6379/', ['127.0.0.1']),
+    ('http://169.254.169.254/latest/meta-data/', ['169.254.169.254']),
+    ('http://[::1]/hook', ['::1']),
+    ('http://[::ffff:10.0.0.5]/hook', ['::ffff:10.0.0.5']),
+    ('https://hooks.internal.example/hook', ['93.184.216.34', '10.0.0.5']),
+])
+def test_rejects_callback_to_internal_address(test_client, ssrf_api_key, mocker, callback_url, addresses):
+    """
+    GIVEN a callback URL whose host resolves to a private, loopback or link-local address
+    WHEN an async job is requested with it
+    THEN the request is refused and nothing is queued.
+    """
+    _resolves_to(mocker, *addresses)
+    enqueue = mocker.patch('app.jobs.enqueue_generation')
+
+    response = test_client.post('/api/v1/generate', headers={'Authorization': f'Bearer {ssrf_api_key}'},
+                                json={'prompt': 'x', 'async': True, 'callback_url': callback_url})
+
+    assert response.status_code == 400
+    assert 'private or reserved' in response.json['error']
+    enqueue.assert_not_called()
+
+
+def test_callback_is_rechecked_at_delivery(test_app, mocker):
+    """The host is resolved again when the callback is sent: it may have been re-pointed since the job was queued."""
+    post = mocker.patch('app.jobs._http.post')
+    _resolves_to(mocker, '10.1.2.3')
+
+    with pytest.raises(UnsafeCallbackURL):
+        deliver_callback('https://rebound.example.com/hook', {'job_id': '1.x', 'status': 'success'})
+
+    post.assert_not_called()
+
+
+def test_callback_allowlist(test_app, mocker):
+    post = mocker.patch('app.jobs._http.post')
+    resolve = _resolves_to(mocker, '10.0.0.7')
+    mocker.patch.dict(test_app.config, {'JOB_CALLBACK_ALLOWED_HOSTS': 'hooks.partner.example, ci.internal'})
+
+    deliver_callback('http://ci.internal/hook', {'job_id': '1.x', 'status': 'success'})
+    with pytest.raises(UnsafeCallbackURL, match='not allowed'):
+        deliver_callback('https://example.com/hook', {'job_id': '1.x', 'status': 'success'})
+
+    assert post.call_count == 1
+    resolve.assert_not_called()
+
+
+def test_results_expire(test_app):
+    assert celery.conf.result_expires == test_app.config['CELERY_RESULT_EXPIRES']
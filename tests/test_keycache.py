@@ -0,0 +1,115 @@
+# tests/test_keycache.py
+
+import secrets
+from contextlib import contextmanager
+from datetime import datetime
+
+import fakeredis
+import pytest
+from sqlalchemy import event
+
+from app import api_key_cache, db, kv
+from app.metrics import metrics
+from app.models import ApiKey
+
+
+@pytest.fixture
+def key_cache(test_app):
+    api_key_cache.clear_local()
+    yield api_key_cache
+    api_key_cache.clear_local()
+    kv.use(None)
+
+
+@contextmanager
+def _count_queries():
+    statements = []
+
+    def before_execute(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', before_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', before_execute)
+
+
+def _status(test_client, api_key):
+    return test_client.get('/api/v1/status', headers={'Authorization': f'Bearer {api_key}'})
+
+
+def test_repeat_callers_cost_no_queries(test_client, test_app, key_cache, api_user):
+    """
+    GIVEN a valid API key that has been used once
+    WHEN the same caller hits the API again
+    THEN the key is resolved from the cache without touching the database.
+    """
+    user, _ = api_user('keycache_hot@example.com')
+    api_key = user.api_key
+    assert _status(test_client, api_key).status_code == 200
+
+    with _count_queries() as statements:
+        response = _status(test_client, api_key)
+
+    assert response.status_code == 200
+    assert response.json['authenticated_user'] == 'keycache_hot@example.com'
+    assert statements == []
+    assert metrics.snapshot(prefix='apikey.local.')['counters']['apikey.local.hits'] >= 1
+
+
+def test_invalid_key_flood_is_negatively_cached(test_client, key_cache):
+    bogus = secrets.token_hex(32)
+    assert _status(test_client, bogus).status_code == 401
+
+    with _count_queries() as statements:
+        responses = [_status(test_client, bogus) for _ in range(20)]
+
+    assert {r.status_code for r in responses} == {401}
+    assert statements == []
+
+
+def test_rotated_and_deleted_keys_stop_working(test_client, test_app, key_cache, api_user):
+    user, _ = api_user('keycache_rotate@example.com')
+    old_key = user.api_key
+    assert _status(test_client, old_key).status_code == 200
+
+    user.api_keys[0].revoked_at = datetime.utcnow()
+    replacement, new_key = ApiKey.generate(user_id=user.id)
+    db.session.add(replacement)
+    db.session.commit()
+
+    assert _status(test_client, old_key).status_code == 401
+    assert _status(test_client, new_key).status_code == 200
+
+    db.session.delete(user)
+    db.session.commit()
+
+    assert _status(test_client, new_key).status_code == 401
+
+
+def test_subscription_change_invalidates_through_redis(test_client, test_app, key_cache, mocker, api_user):
+    """
+    GIVEN a key cached in both tiers for an unsubscribed organization
+    WHEN the organization subscribes
+    THEN the next call sees the new flag, and other workers repopulate from the database.
+    """
+    kv.use(fakeredis.FakeRedis())
+    user, org = api_user('keycache_sub@example.com', is_subscribed=False)
+    api_key = user.api_key
+    mocker.patch('app.generation.complete', return_value=mocker.Mock(text='ok', model='m',
+                                                                      prompt_tokens=0, completion_tokens=0))
+
+    generate = lambda: test_client.post('/api/v1/generate', json={'prompt': 'hi'},  # noqa: E731
+                                        headers={'Authorization': f'Bearer {api_key}'})
+    assert generate().status_code == 403
+
+    api_key_cache.clear_local()  # another worker: served from Redis
+    with _count_queries() as statements:
+        assert _status(test_client, api_key).status_code == 200
+    assert statements == []
+
+    org.is_subscribed = True
+    db.session.commit()
+
+    assert generate().status_code == 200
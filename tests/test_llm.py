@@ -0,0 +1,100 @@
+# tests/test_llm.py
+
+import openai
+import pytest
+
+from app import db, llm
+from app.llm import RetryBudget
+from app.metrics import metrics
+from app.models import User, Organization, Membership
+
+
+def test_gateway_reuses_one_connection(llm_stub):
+    """
+    GIVEN the gateway pointed at a local stub server
+    WHEN several completions run back to back
+    THEN they share a single keep-alive connection and report usage.
+    """
+    results = [llm.complete(f'prompt {i}') for i in range(5)]
+
+    assert [r.text for r in results] == [f'stub reply to: prompt {i}' for i in range(5)]
+    assert results[0].prompt_tokens == 3 and results[0].completion_tokens == 5
+    assert len(llm_stub.requests) == 5
+    assert len(llm_stub.connections) == 1
+    assert llm_stub.requests[0]['model'] == 'gpt-3.5-turbo-instruct'
+    assert llm_stub.requests[0]['max_tokens'] == 60
+
+
+def test_gateway_retries_transient_errors(llm_stub):
+    """
+    GIVEN an upstream that fails once with a 5xx
+    WHEN a completion is requested
+    THEN the gateway retries within its budget and succeeds.
+    """
+    llm_stub.failures = 1
+    retries_before = metrics.counter('llm.retries').value
+
+    completion = llm.complete('retry me')
+
+    assert completion.text == 'stub reply to: retry me'
+    assert len(llm_stub.requests) == 2
+    assert metrics.counter('llm.retries').value == retries_before + 1
+
+
+def test_gateway_gives_up_when_budget_is_spent(llm_stub):
+    """
+    GIVEN an exhausted retry budget
+    WHEN the upstream fails
+    THEN the error is raised after a single attempt.
+    """
+    llm.retry_budget = RetryBudget(ratio=0.0, minimum=0)
+    llm_stub.failures = 3
+
+    with pytest.raises(openai.InternalServerError):
+        llm.complete('no retries left')
+    assert len(llm_stub.requests) == 1
+
+
+def test_gateway_records_latency(llm_stub):
+    before = llm.stats()['latency'].get('llm.complete', {}).get('count', 0)
+    llm.complete('time me')
+    stats = llm.stats()['latency']['llm.complete']
+    assert stats['count'] == before + 1
+    assert stats['p99_ms'] is not None
+
+
+def test_generate_endpoint_uses_shared_gateway(test_client, test_app, llm_stub):
+    """
+    GIVEN a subscribed API user and the stub upstream
+    WHEN /api/v1/generate is called twice
+    THEN both calls go through the same pooled connection.
+    """
+    with test_app.app_context():
+        user = User(email='gateway_user@example.com', confirmed=True)
+        org = Organization(name="Gateway Org", is_subscribed=True)
+        db.session.add_all([user, org, Membership(user=user, organization=org)])
+        db.session.commit()
+        api_key = user.api_key
+
+    headers = {'Authorization': f'Bearer {api_key}'}
+    first = test_client.post('/api/v1/generate', headers=headers, json={'prompt': 'one'})
+    second = test_client.post('/api/v1/generate', headers=headers, json={'prompt': 'two'})
+
+    assert first.json['generated_text'] == 'stub reply to: one'
+    assert second.json['generated_text'] == 'stub reply to: two'
+    assert len(llm_stub.connections) == 1
+
+
+def test_metrics_endpoint_requires_admin(test_client, test_app):
+    with test_app.app_context():
+        admin = User(email='metrics_admin@example.com', confirmed=True, is_admin=True)
+        admin.set_password('password123')
+        db.session.add(admin)
+        db.session.commit()
+
+    test_client.post('/auth/login', data={'email': 'metrics_admin@example.com', 'password': 'password123'})
+    response = test_client.get('/metrics')
+    test_client.get('/auth/logout')
+
+    assert response.status_code == 200
+    assert 'counters' in response.json and 'latency' in response.json
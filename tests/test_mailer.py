@@ -0,0 +1,188 @@
+# tests/test_mailer.py
+
+import json
+import smtplib
+
+import fakeredis
+import pytest
+
+from app import kv, smtp_pool
+from app import email as email_tasks
+from app.email import send_email
+from app.metrics import metrics
+
+
+@pytest.fixture
+def pooled(test_app, smtp_server, monkeypatch):
+    monkeypatch.setattr(smtp_pool, 'mode', 'pooled')
+    kv.use(fakeredis.FakeRedis())
+    yield smtp_pool
+    kv.use(None)
+
+
+class GreylistingHandler:
+    """aiosmtpd RCPT hook: 451 for the greylisted addresses, the recording handler's reply for the rest."""
+
+    def __init__(self, handler, addresses):
+        self.recording = handler.handle_RCPT
+        self.addresses = set(addresses)
+
+    async def __call__(self, server, session, envelope, address, rcpt_options):
+        if address in self.addresses:
+            return '451 4.7.1 Greylisted, please try again later'
+        return await self.recording(server, session, envelope, address, rcpt_options)
+
+
+def test_burst_is_drained_over_one_connection(test_app, smtp_server, pooled, monkeypatch):
+    """
+    GIVEN a burst of emails queued by the email.send task in pooled mode
+    WHEN the outbox is drained
+    THEN every message is delivered, in order, over a single SMTP connection.
+    """
+    scheduled = []
+    monkeypatch.setattr(email_tasks.drain_outbox, 'apply_async', lambda **kw: scheduled.append(kw))
+    for n in range(25):
+        send_email.delay(f'user{n}@example.com', 'Hello', 'email/confirm', user=None, token='t')
+
+    assert len(scheduled) == 1  # one drain per burst
+    assert smtp_server.messages == [] and pooled.queued == 25
+
+    assert email_tasks.drain_outbox.run() == 25
+    assert [to for to, _ in smtp_server.messages] == [f'user{n}@example.com' for n in range(25)]
+    assert len(smtp_server.sessions) == 1
+
+    # The connection stays open for the next task.
+    send_email.delay('late@example.com', 'Hello', 'email/confirm', user=None, token='t')
+    email_tasks.drain_outbox.run()
+    assert len(smtp_server.sessions) == 1
+
+
+def test_dropped_connection_is_reopened(test_app, smtp_server, pooled):
+    with pooled.connection() as conn:
+        conn.host.sock.close()  # the server (or a NAT) dropped the idle session
+
+    message = {'from': 'noreply@example.com', 'to': ['a@example.com'], 'data': 'Subject: hi\r\n\r\nbody'}
+    report = pooled.deliver([message, {**message, 'to': ['b@example.com']}])
+
+    assert report.sent == 2 and report.deferred == []
+    assert [to for to, _ in smtp_server.messages] == ['a@example.com', 'b@example.com']
+
+
+def test_permanent_rejection_drops_only_that_message(test_app, smtp_server, pooled):
+    smtp_server.reject.add('gone@example.com')
+    message = {'from': 'noreply@example.com', 'data': 'Subject: hi\r\n\r\nbody'}
+
+    report = pooled.deliver([{**message, 'to': [to]} for to in ('a@example.com', 'gone@example.com', 'b@example.com')])
+
+    assert report.sent == 2 and [m['to'] for m in report.rejected] == [['gone@example.com']]
+    assert len(smtp_server.sessions) == 1
+
+
+def test_unreachable_server_defers_back_to_the_outbox(test_app, smtp_server, pooled, monkeypatch):
+    """
+    GIVEN queued emails and an SMTP server that refuses connections
+    WHEN the drain gives up after its retries
+    THEN the messages go back to the head of the outbox and are delivered once the server is back.
+    """
+    monkeypatch.setattr(email_tasks.drain_outbox, 'apply_async', lambda **kw: None)
+    monkeypatch.setattr(pooled, 'max_retries', 2)
+    for n in range(3):
+        send_email.delay(f'user{n}@example.com', 'Hello', 'email/confirm', user=None, token='t')
+
+    monkeypatch.setattr(pooled, 'port', 1)  # nothing listens there
+    assert pooled.drain() == 0
+    assert pooled.queued == 3 and smtp_server.messages == []
+
+    monkeypatch.setattr(pooled, 'port', smtp_server.port)
+    assert pooled.drain() == 3
+    assert [to for to, _ in smtp_server.messages] == ['user0@example.com', 'user1@example.com', 'user2@example.com']
+
+
+def test_greylisted_recipient_is_deferred_not_rejected(test_app, smtp_server, pooled, monkeypatch):
+    """
+    GIVEN an SMTP server that answers RCPT with 451 for one recipient
+    WHEN a batch including that recipient is drained
+    THEN the other messages are sent, and the greylisted one goes back to the outbox instead of being dropped.
+    """
+    monkeypatch.setattr(email_tasks.drain_outbox, 'apply_async', lambda **kw: None)
+    smtp_server.handle_RCPT = greylist = GreylistingHandler(smtp_server, ['grey@example.com'])
+    message = {'from': 'noreply@example.com', 'data': 'Subject: hi\r\n\r\nbody'}
+    pooled.redis.rpush(pooled.outbox_key, *(json.dumps({**message, 'to': [to]})
+                                            for to in ('a@example.com', 'grey@example.com', 'b@example.com')))
+
+    assert pooled.drain() == 2
+    assert [to for to, _ in smtp_server.messages] == ['a@example.com', 'b@example.com']
+    assert pooled.queued == 1
+
+    greylist.addresses.clear()  # the retry is let through
+    assert pooled.drain() == 1
+    assert smtp_server.messages[-1][0] == 'grey@example.com'
+
+
+def test_mixed_refusals_defer_only_the_4xx_recipients(test_app, smtp_server, pooled):
+    smtp_server.reject.add('gone@example.com')
+    smtp_server.handle_RCPT = GreylistingHandler(smtp_server, ['grey@example.com'])
+    message = {'from': 'noreply@example.com', 'to': ['grey@example.com', 'gone@example.com'],
+               'data': 'Subject: hi\r\n\r\nbody'}
+
+    report = pooled.deliver([message, {**message, 'to': ['a@example.com', 'grey@example.com']}])
+
+    assert report.sent == 1 and isinstance(report.error, smtplib.SMTPRecipientsRefused)
+    assert [m['to'] for m in report.deferred] == [['grey@example.com'], ['grey@example.com']]
+    assert [m['to'] for m in report.rejected] == [['gone@example.com']]
+
+
+def test_missing_starttls_fails_fast(test_app, smtp_server, pooled, monkeypatch, mocker):
+    monkeypatch.setattr(pooled, 'use_tls', True)  # the test server offers no STARTTLS
+    connect = mocker.spy(pooled, '_connect')
+    message = {'from': 'noreply@example.com', 'to': ['a@example.com'], 'data': 'Subject: hi\r\n\r\nbody'}
+
+    with pytest.raises(smtplib.SMTPNotSupportedError):
+        pooled.deliver([message])
+
+    assert connect.call_count == 1
+
+
+def test_connect_time_failure_keeps_the_batch_in_the_outbox(test_app, smtp_server, pooled, monkeypatch):
+    """
+    GIVEN queued emails and an SMTP server that rejects the login with 535
+    WHEN the drain runs (twice)
+    THEN the error is raised and every message stays in the outbox, in order.
+    """
+    monkeypatch.setattr(email_tasks.drain_outbox, 'apply_async', lambda **kw: None)
+    message = {'from': 'noreply@example.com', 'data': 'Subject: hi\r\n\r\nbody'}
+    queued = [json.dumps({**message, 'to': [f'user{n}@example.com']}) for n in range(3)]
+    pooled.redis.rpush(pooled.outbox_key, *queued)
+
+    def bad_credentials():
+        raise smtplib.SMTPAuthenticationError(535, b'5.7.8 Authentication credentials invalid')
+
+    monkeypatch.setattr(pooled, '_connect', bad_credentials)
+    for _ in range(2):
+        with pytest.raises(smtplib.SMTPAuthenticationError):
+            pooled.drain()
+
+    assert [item.decode() for item in pooled.redis.lrange(pooled.outbox_key, 0, -1)] == queued
+    assert smtp_server.messages == []
+
+
+def test_recipient_refused_every_time_is_eventually_rejected(test_app, smtp_server, pooled, monkeypatch):
+    """
+    GIVEN a recipient the SMTP server refuses with 451 on every attempt
+    WHEN the outbox is drained more than SMTP_MAX_DEFERRALS times
+    THEN the message is dropped as rejected instead of going back to the outbox forever.
+    """
+    monkeypatch.setattr(email_tasks.drain_outbox, 'apply_async', lambda **kw: None)
+    monkeypatch.setattr(pooled, 'max_deferrals', 2)
+    smtp_server.handle_RCPT = GreylistingHandler(smtp_server, ['stuck@example.com'])
+    pooled.redis.rpush(pooled.outbox_key, json.dumps(
+        {'from': 'noreply@example.com', 'to': ['stuck@example.com'], 'data': 'Subject: hi\r\n\r\nbody'}))
+    exhausted = metrics.snapshot(prefix='mail.')['counters'].get('mail.deferrals_exhausted', 0)
+
+    for attempts in (1, 2):
+        assert pooled.drain() == 0
+        assert json.loads(pooled.redis.lindex(pooled.outbox_key, 0))['attempts'] == attempts
+    assert pooled.drain() == 0
+
+    assert pooled.queued == 0 and smtp_server.messages == []
+    assert metrics.snapshot(prefix='mail.')['counters']['mail.deferrals_exhausted'] == exhausted + 1
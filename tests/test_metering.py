@@ -0,0 +1,167 @@
+# tests/test_metering.py
+
+import time
+from datetime import datetime
+
+from sqlalchemy import event, select
+
+from app import db, llm, usage, usage_meter
+from app.llm import Completion
+from app.metrics import metrics
+from app.models import UsageEvent
+from app.usage import hourly_usage, rollup_hours, write_events
+
+
+def _events(org_id):
+    return db.session.scalars(select(UsageEvent).filter_by(organization_id=org_id)).all()
+
+
+def _count_inserts(table):
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if statement.startswith(f'INSERT INTO {table}'):
+            statements.append(executemany)
+
+    engine = db.engine
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    return statements, lambda: event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+
+
+def test_generate_records_usage_without_a_db_write(test_client, test_app, mocker, api_user):
+    """
+    GIVEN a subscribed API user
+    WHEN /api/v1/generate succeeds
+    THEN a usage event is buffered (not written) and persisted on flush.
+    """
+    user, org = api_user('meter_api@example.com')
+    mocker.patch.object(llm, 'complete', return_value=Completion(
+        text='metered', model='test-model', prompt_tokens=7, completion_tokens=11))
+    usage_meter.flush()
+
+    response = test_client.post('/api/v1/generate', headers={'Authorization': f'Bearer {user.api_key}'},
+                                json={'prompt': 'meter me'})
+
+    assert response.status_code == 200
+    assert usage_meter.pending == 1
+    assert _events(org.id) == []
+
+    assert usage_meter.flush() == 1
+    (row,) = _events(org.id)
+    assert (row.user_id, row.endpoint, row.model, row.status) == (user.id, 'api.generate', 'test-model', 'ok')
+    assert (row.prompt_tokens, row.completion_tokens) == (7, 11)
+    assert row.latency_ms >= 0
+
+
+def test_failed_generation_is_recorded_as_error(test_client, test_app, mocker, api_user):
+    user, org = api_user('meter_error@example.com')
+    mocker.patch.object(llm, 'complete', side_effect=RuntimeError('boom'))
+
+    response = test_client.post('/api/v1/generate', headers={'Authorization': f'Bearer {user.api_key}'},
+                                json={'prompt': 'meter a failure'})
+    usage_meter.flush()
+
+    assert response.status_code == 500
+    assert [e.status for e in _events(org.id)] == ['error']
+
+
+def test_flush_is_one_multi_row_insert(test_app, api_user):
+    _, org = api_user('meter_bulk@example.com')
+    for i in range(200):
+        usage_meter.record(org.id, 'api.generate', Completion(text='x', model='m', completion_tokens=i))
+
+    statements, stop = _count_inserts('usage_events')
+    try:
+        flushed = usage_meter.flush()
+    finally:
+        stop()
+
+    assert flushed == 200
+    assert statements == [False]  # a single INSERT ... VALUES (...), (...), ...
+    assert len(_events(org.id)) == 200
+
+
+def test_full_buffer_triggers_a_flush(test_app, mocker, api_user):
+    _, org = api_user('meter_size@example.com')
+    mocker.patch.object(usage_meter, 'buffer_size', 3)
+
+    for _ in range(3):
+        usage_meter.record(org.id, 'api.generate')
+
+    assert usage_meter.pending == 0
+    assert len(_events(org.id)) == 3
+
+
+def test_background_flush_after_interval(test_app, mocker, api_user):
+    _, org = api_user('meter_timer@example.com')
+    mocker.patch.object(usage_meter, 'flush_interval', 0.05)
+
+    usage_meter.record(org.id, 'features.generate_text')
+    deadline = time.monotonic() + 2
+    while not _events(org.id) and time.monotonic() < deadline:
+        time.sleep(0.01)  # pending drops to 0 before the flusher's write commits
+        db.session.expire_all()
+
+    assert usage_meter.pending == 0
+    assert len(_events(org.id)) == 1
+
+
+def test_celery_mode_hands_batches_to_ingest_task(test_app, mocker, api_user):
+    _, org = api_user('meter_celery@example.com')
+    mocker.patch.object(usage_meter, 'mode', 'celery')
+    delay = mocker.spy(usage.ingest_usage, 'delay')
+
+    usage_meter.record(org.id, 'api.generate.async', Completion(text='x', model='m', prompt_tokens=2))
+    usage_meter.flush()
+
+    delay.assert_called_once()
+    assert [e.prompt_tokens for e in _events(org.id)] == [2]
+
+
+def test_failed_flush_keeps_events_buffered(test_app, mocker, api_user):
+    _, org = api_user('meter_down@example.com')
+    mocker.patch('app.usage.write_events', side_effect=RuntimeError('database down'))
+    errors = metrics.counter('usage.flush.errors').value
+
+    usage_meter.record(org.id, 'api.generate')
+    assert usage_meter.flush() == 0
+
+    assert usage_meter.pending == 1
+    assert metrics.counter('usage.flush.errors').value == errors + 1
+    mocker.stopall()
+    assert usage_meter.flush() == 1
+
+
+def test_rollup_builds_hourly_aggregates(test_app, api_user):
+    """
+    GIVEN raw usage events for two organizations across two hours
+    WHEN the rollup runs (twice)
+    THEN one row per org and hour holds the sums, and re-running is idempotent.
+    """
+    _, org_a = api_user('rollup_a@example.com')
+    _, org_b = api_user('rollup_b@example.com')
+    now = datetime(2026, 10, 17, 15, 30)
+    earlier = datetime(2026, 10, 17, 14, 10)
+
+    def ev(org_id, at, status='ok', tokens=(1, 2), latency=10.0):
+        return {'organization_id': org_id, 'user_id': None, 'endpoint': 'api.generate', 'model': 'm',
+                'status': status, 'prompt_tokens': tokens[0], 'completion_tokens': tokens[1],
+                'latency_ms': latency, 'created_at': at}
+
+    write_events([
+        ev(org_a.id, earlier), ev(org_a.id, earlier, latency=30.0),
+        ev(org_a.id, now, status='error', tokens=(0, 0)),
+        ev(org_b.id, now, tokens=(5, 8), latency=50.0),
+    ])
+
+    assert rollup_hours(hours=2, now=now) == 3
+    assert rollup_hours(hours=2, now=now) == 3
+
+    rows = hourly_usage(org_a.id, since=datetime(2026, 10, 17))
+    assert [(r.hour.hour, r.requests, r.errors, r.prompt_tokens, r.completion_tokens) for r in rows] == [
+        (14, 2, 0, 2, 4), (15, 1, 1, 0, 0),
+    ]
+    assert rows[0].avg_latency_ms == 20.0
+    assert rows[0].max_latency_ms == 30.0
+    (b_row,) = hourly_usage(org_b.id, since=datetime(2026, 10, 17))
+    assert (b_row.requests, b_row.prompt_tokens, b_row.completion_tokens) == (1, 5, 8)
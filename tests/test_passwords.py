@@ -0,0 +1,127 @@
+# tests/test_passwords.py
+
+import threading
+
+import pytest
+from werkzeug.security import generate_password_hash
+
+from app import db, password_hasher
+from app.models import User
+from app.passwords import HashPoolSaturated, PasswordHasher
+
+
+def _user(email, password_hash):
+    user = User(email=email, confirmed=True)
+    user.password_hash = password_hash
+    db.session.add(user)
+    db.session.commit()
+    return user
+
+
+def test_hashes_use_the_configured_method(test_app):
+    user = User(email='passwords_method@example.com')
+    user.set_password('password123')
+
+    assert user.password_hash.startswith('pbkdf2:sha256:1000$')
+    assert user.check_password('password123')
+    assert not user.check_password('wrong')
+    assert not password_hasher.needs_rehash(user.password_hash)
+
+
+def test_login_upgrades_an_outdated_hash(test_client, test_app):
+    """
+    GIVEN a user whose password was hashed with an older algorithm and cost
+    WHEN they log in successfully
+    THEN the stored hash is transparently replaced with one using the configured method.
+    """
+    user = _user('passwords_rehash@example.com', generate_password_hash('password123', 'pbkdf2:sha256:500'))
+    assert password_hasher.needs_rehash(user.password_hash)
+
+    response = test_client.post('/auth/login', data={'email': user.email, 'password': 'password123'})
+
+    assert response.status_code == 302
+    db.session.refresh(user)
+    assert user.password_hash.startswith('pbkdf2:sha256:1000$')
+    assert user.check_password('password123')
+    test_client.get('/auth/logout')
+
+
+def test_failed_login_keeps_the_old_hash(test_client, test_app):
+    old_hash = generate_password_hash('password123', 'pbkdf2:sha256:500')
+    user = _user('passwords_norehash@example.com', old_hash)
+
+    test_client.post('/auth/login', data={'email': user.email, 'password': 'not-it'})
+
+    db.session.refresh(user)
+    assert user.password_hash == old_hash
+
+
+def test_saturated_pool_rejects_instead_of_queueing():
+    hasher = PasswordHasher()
+    hasher.workers, hasher.max_pending = 1, 1
+    release = threading.Event()
+    started = threading.Event()
+
+    def slow(*args):
+        started.set()
+        release.wait(5)
+        return 'done'
+
+    holder = threading.Thread(target=lambda: hasher._run('hash', slow))
+    holder.start()
+    try:
+        assert started.wait(5)
+        with pytest.raises(HashPoolSaturated):
+            hasher.hash('password123')
+    finally:
+        release.set()
+        holder.join()
+        hasher.shutdown()
+    assert hasher.stats()['counters']['passwords.rejected'] >= 1
+
+
+def test_login_answers_503_when_hashing_is_saturated(test_client, test_app, mocker):
+    user = _user('passwords_busy@example.com', generate_password_hash('password123', 'pbkdf2:sha256:1000'))
+    mocker.patch.object(password_hasher, 'verify', side_effect=HashPoolSaturated('busy'))
+
+    response = test_client.post('/auth/login', data={'email': user.email, 'password': 'password123'})
+
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '1'
+    assert b'Please try again in a moment' in response.data
+
+
+def test_login_skips_the_upgrade_when_hashing_is_saturated(test_client, test_app, mocker):
+    """
+    GIVEN a user with an outdated hash, and a hashing pool that fills up right after their password is verified
+    WHEN they log in
+    THEN they are logged in and the hash is left for the next login, instead of a 503.
+    """
+    old_hash = generate_password_hash('password123', 'pbkdf2:sha256:500')
+    user = _user('passwords_busy_rehash@example.com', old_hash)
+    mocker.patch.object(password_hasher, 'hash', side_effect=HashPoolSaturated('busy'))
+
+    response = test_client.post('/auth/login', data={'email': user.email, 'password': 'password123'})
+
+    assert response.status_code == 302
+    db.session.refresh(user)
+    assert user.password_hash == old_hash
+    test_client.get('/auth/logout')
+
+
+def test_timed_out_hash_keeps_its_slot_until_it_finishes():
+    hasher = PasswordHasher()
+    hasher.workers, hasher.max_pending, hasher.timeout = 1, 1, 0.05
+    release = threading.Event()
+    executor = hasher.executor
+
+    try:
+        with pytest.raises(HashPoolSaturated, match='no hash result'):
+            hasher._run('hash', lambda: release.wait(5))
+        assert hasher.stats()['pending'] == 1  # the thread is still hashing
+        with pytest.raises(HashPoolSaturated, match='saturated'):
+            hasher.hash('password123')
+    finally:
+        release.set()
+        executor.shutdown(wait=True)
+    assert hasher.stats()['pending'] == 0
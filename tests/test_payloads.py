@@ -0,0 +1,98 @@
+# tests/test_payloads.py
+
+import json
+
+import pytest
+from sqlalchemy import event
+
+from celery import current_task
+
+from app import celery, db, mail
+from app.email import send_email
+from app.models import Membership, Organization, User
+from app.payloads import PayloadTooLarge, hydrate_many, ref
+
+
+@pytest.fixture
+def users(test_app, request):
+    rows = [User(email=f'{request.node.name}{n}@example.com') for n in range(3)]
+    db.session.add_all(rows)
+    db.session.commit()
+    return rows
+
+
+def test_register_enqueues_ids_and_tokens_only(test_client, test_app, mocker):
+    """
+    GIVEN the registration form
+    WHEN a new user signs up
+    THEN the confirmation email task gets the user as a reference, and its payload is small plain JSON.
+    """
+    delay = mocker.patch('app.auth.send_email.delay')
+
+    test_client.post('/auth/register', data={'email': 'payload@example.com', 'password': 'password123',
+                                             'password2': 'password123'})
+
+    args, kwargs = delay.call_args
+    user = User.query.filter_by(email='payload@example.com').one()
+    assert kwargs['user'] == {'$ref': 'User', 'id': user.id}
+    assert len(json.dumps([args, kwargs])) < 512
+
+
+def test_worker_renders_with_the_hydrated_object(test_app, users, monkeypatch):
+    monkeypatch.setitem(test_app.config, 'MAIL_DEFAULT_SENDER', 'noreply@example.com')
+    with mail.record_messages() as outbox:
+        send_email.delay(users[0].email, 'Confirm Your Account', 'email/confirm', user=ref(users[0]), token='tok')
+
+    assert f'Dear {users[0].email}' in outbox[0].body
+
+
+def test_references_are_loaded_in_one_query_per_model(test_app, users):
+    org = Organization(name='Payload Org')
+    db.session.add_all([org, Membership(user=users[0], organization=org)])
+    db.session.commit()
+    payloads = [{'user': ref(user), 'org': ref(org)} for user in users]
+    payloads.append({'membership': ref(Membership, [users[0].id, org.id]), 'missing': ref(User, 10**9)})
+    db.session.expire_all()
+
+    statements = []
+    listener = lambda conn, cursor, statement, *args: statements.append(statement)  # noqa: E731
+    event.listen(db.engine, 'before_cursor_execute', listener)
+    try:
+        hydrated = hydrate_many(payloads)
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', listener)
+
+    assert len(statements) == 3  # users, organizations, memberships
+    assert [p['user'].email for p in hydrated[:3]] == [user.email for user in users]
+    assert hydrated[3]['membership'].role == 'member' and hydrated[3]['missing'] is None
+
+
+def test_orm_objects_and_oversize_payloads_are_refused(test_app, users, monkeypatch):
+    """
+    GIVEN the task payload guard
+    WHEN a task is given an ORM object, or arguments over its payload limit
+    THEN it is refused before anything is queued.
+    """
+    with pytest.raises(TypeError, match='ref'):
+        send_email.delay(users[0].email, 'Hi', 'email/confirm', user=users[0], token='tok')
+
+    monkeypatch.setattr(send_email, 'payload_max_bytes', 1024)
+    with mail.record_messages() as outbox, pytest.raises(PayloadTooLarge):
+        send_email.delay(users[0].email, 'Hi', 'email/confirm', user=ref(users[0]), token='x' * 2000)
+    assert outbox == []
+
+
+def test_bound_task_called_directly_sees_its_own_request(test_app, users):
+    seen = {}
+
+    @celery.task(bind=True, name='tests.payloads.whoami', shared=False)
+    def whoami(self, user):
+        seen.update(task=current_task.name, args=self.request.args, user=user)
+
+    try:
+        whoami(ref(users[0]))
+    finally:
+        celery.tasks.pop(whoami.name, None)
+
+    assert seen['task'] == 'tests.payloads.whoami'
+    assert seen['user'] == users[0] and list(seen['args']) == [users[0]]
@@ -0,0 +1,108 @@
+# tests/test_queues.py
+
+import threading
+import time
+
+import pytest
+from celery import Celery
+from celery.contrib.testing.worker import start_worker
+
+from app import celery
+from app.queues import QUEUES, ROUTES, apply_worker_profile, configure, priorities
+
+
+def test_every_task_has_a_declared_queue(test_app):
+    """
+    GIVEN the app's registered Celery tasks
+    WHEN the routes are resolved
+    THEN each task goes to one of the declared queues, campaigns never share the transactional email queue.
+    """
+    names = [name for name in celery.tasks if not name.startswith('celery.')]
+    assert names and set(names) <= set(ROUTES)
+    for name in names:
+        assert celery.amqp.router.route({}, name)['queue'].name in QUEUES
+
+    assert celery.amqp.router.route({}, 'email.send')['queue'].name == 'email'
+    assert celery.amqp.router.route({}, 'email.send_campaign_chunk')['queue'].name == 'bulk'
+    assert priorities('redis://localhost')['high'] < priorities('redis://localhost')['low']
+    assert priorities('amqp://localhost')['high'] > priorities('amqp://localhost')['low']
+
+
+def _worker_app(test_app, profile, ran, done):
+    """A Celery app with the production topology and stand-ins for a bulk and a real-time task."""
+    app = Celery(f'test-{profile}', broker='memory://', set_as_current=False)
+    configure(app, test_app.config)
+    app.conf.update(task_ignore_result=True, worker_hijack_root_logger=False,
+                    broker_transport_options={'polling_interval': 0.01})  # the memory transport polls
+    app.finalize()
+    for name in ('email.send_campaign_chunk', 'generation.run'):
+        app.tasks.pop(name, None)  # the real ones: @celery.task tasks are shared with every Celery app
+
+    @app.task(name='email.send_campaign_chunk')
+    def send_chunk(campaign_id, index):
+        time.sleep(0.1)
+        ran.append(('bulk', index))
+
+    @app.task(name='generation.run')
+    def generate(org_id, prompt):
+        ran.append(('realtime', prompt))
+        done.set()
+
+    apply_worker_profile(app, profile)
+    return app
+
+
+def test_bulk_backlog_does_not_delay_realtime_tasks(test_app):
+    """
+    GIVEN a bulk worker with a 3 second backlog of campaign chunks, and a real-time worker
+    WHEN a generation job is queued behind the backlog
+    THEN it runs at once, while the chunks are still queued.
+    """
+    ran, done = [], threading.Event()
+    bulk = _worker_app(test_app, 'bulk', ran, done)
+    realtime = _worker_app(test_app, 'realtime', ran, done)
+
+    try:
+        with start_worker(bulk, pool='solo', perform_ping_check=False, shutdown_timeout=5), \
+                start_worker(realtime, pool='solo', perform_ping_check=False, shutdown_timeout=5):
+            for index in range(30):
+                realtime.send_task('email.send_campaign_chunk', (1, index))
+            started = time.monotonic()
+            realtime.send_task('generation.run', (1, 'hello'))
+
+            assert done.wait(2)
+            assert time.monotonic() - started < 1
+            assert len([entry for entry in ran if entry[0] == 'bulk']) < 30
+    finally:
+        with bulk.connection_for_write() as conn:
+            conn.default_channel.queue_purge('bulk')
+        celery.set_current()
+        celery.set_default()
+
+
+def test_realtime_worker_drains_the_pre_routing_default_queue(test_app):
+    """
+    GIVEN a generation job published to the old default ``celery`` queue before the upgrade
+    WHEN a real-time worker starts
+    THEN it still runs the job, and the Redis priority lists keep kombu's key separator.
+    """
+    ran, done = [], threading.Event()
+    realtime = _worker_app(test_app, 'realtime', ran, done)
+
+    try:
+        realtime.send_task('generation.run', (1, 'queued before deploy'), queue='celery')
+        with start_worker(realtime, pool='solo', perform_ping_check=False, shutdown_timeout=5):
+            assert done.wait(2)
+    finally:
+        celery.set_current()
+        celery.set_default()
+
+    assert ran == [('realtime', 'queued before deploy')]
+    redis_app = Celery('test-redis', broker='redis://localhost', set_as_current=False)
+    configure(redis_app, {'CELERY_BROKER_URL': 'redis://localhost'})
+    assert 'sep' not in redis_app.conf.broker_transport_options
+
+
+def test_unknown_worker_profile_is_refused(test_app):
+    with pytest.raises(ValueError, match='realtime'):
+        apply_worker_profile(Celery('test', broker='memory://', set_as_current=False), 'nope')
@@ -0,0 +1,138 @@
+# tests/test_ratelimit.py
+
+import time
+
+import fakeredis
+import pytest
+
+from app import kv, llm, rate_limiter
+from app.llm import Completion
+from app.metrics import LatencyStats
+from app.ratelimit import RateLimit
+
+
+@pytest.fixture(params=['local', 'redis'])
+def limiter_backend(request):
+    """Run a test against the in-process buckets and the Lua/Redis path."""
+    if request.param == 'redis':
+        kv.use(fakeredis.FakeRedis())
+    yield request.param
+    kv.use(None)
+
+
+@pytest.fixture
+def upstream(mocker):
+    return mocker.patch.object(llm, 'complete', return_value=Completion(text='ok', model='test'))
+
+
+def _generate(test_client, api_key, prompt='hi'):
+    return test_client.post('/api/v1/generate', headers={'Authorization': f'Bearer {api_key}'},
+                            json={'prompt': prompt})
+
+
+def test_rate_limit_headers_on_success(test_client, test_app, upstream, limiter_backend, api_user):
+    user, _ = api_user(f'rl_headers_{limiter_backend}@example.com')
+
+    response = _generate(test_client, user.api_key)
+
+    assert response.status_code == 200
+    assert response.headers['X-RateLimit-Limit'] == str(rate_limiter.default.burst)
+    assert int(response.headers['X-RateLimit-Remaining']) == rate_limiter.default.burst - 1
+
+
+def test_burst_exhaustion_returns_429(test_client, test_app, upstream, mocker, limiter_backend, api_user):
+    """
+    GIVEN a plan with a burst of 2 and a negligible refill rate
+    WHEN a third request arrives
+    THEN it is rejected with 429 and a Retry-After header, without calling upstream.
+    """
+    mocker.patch.object(rate_limiter, 'default', RateLimit(rate=0.01, burst=2))
+    user, _ = api_user(f'rl_burst_{limiter_backend}@example.com')
+
+    statuses = [_generate(test_client, user.api_key, f'{limiter_backend} p{i}').status_code for i in range(2)]
+    limited = _generate(test_client, user.api_key, f'{limiter_backend} p2')
+
+    assert statuses == [200, 200]
+    assert limited.status_code == 429
+    assert int(limited.headers['Retry-After']) >= 1
+    assert limited.headers['X-RateLimit-Remaining'] == '0'
+    assert upstream.call_count == 2
+
+
+def test_limits_follow_stripe_price(test_client, test_app, upstream, mocker, limiter_backend, api_user):
+    mocker.patch.dict(rate_limiter.plans, {'price_tiny': RateLimit(rate=0.01, burst=1)})
+    user, _ = api_user(f'rl_plan_{limiter_backend}@example.com', stripe_price_id='price_tiny')
+
+    assert _generate(test_client, user.api_key, 'a').status_code == 200
+    response = _generate(test_client, user.api_key, 'b')
+
+    assert response.status_code == 429
+    assert response.headers['X-RateLimit-Limit'] == '1'
+
+
+def test_daily_quota(test_client, test_app, upstream, mocker, limiter_backend, api_user):
+    mocker.patch.object(rate_limiter, 'default', RateLimit(rate=100, burst=100, daily_quota=3))
+    user, _ = api_user(f'rl_quota_{limiter_backend}@example.com')
+
+    statuses = [_generate(test_client, user.api_key, f'q{i}').status_code for i in range(4)]
+
+    assert statuses == [200, 200, 200, 429]
+
+
+def test_batch_costs_one_token_per_prompt(test_client, test_app, upstream, mocker, limiter_backend, api_user):
+    mocker.patch.object(rate_limiter, 'default', RateLimit(rate=0.01, burst=5))
+    user, _ = api_user(f'rl_batch_{limiter_backend}@example.com')
+    headers = {'Authorization': f'Bearer {user.api_key}'}
+
+    first = test_client.post('/api/v1/generate/batch', headers=headers, json={'prompts': ['a', 'b', 'c', 'd']})
+    second = test_client.post('/api/v1/generate/batch', headers=headers, json={'prompts': ['e', 'f']})
+
+    assert first.status_code == 200
+    assert first.headers['X-RateLimit-Remaining'] == '1'
+    assert second.status_code == 429
+
+
+def test_batch_over_the_plan_burst_is_rejected_not_throttled(test_client, test_app, upstream, mocker,
+                                                            limiter_backend, api_user):
+    """
+    GIVEN a plan with a burst of 5
+    WHEN a batch of 6 prompts is sent
+    THEN it gets 413 with an explanation (no Retry-After, it would never fit), and no tokens are spent.
+    """
+    mocker.patch.object(rate_limiter, 'default', RateLimit(rate=0.01, burst=5))
+    user, _ = api_user(f'rl_oversize_{limiter_backend}@example.com')
+    headers = {'Authorization': f'Bearer {user.api_key}'}
+
+    oversize = test_client.post('/api/v1/generate/batch', headers=headers, json={'prompts': list('abcdef')})
+    fits = test_client.post('/api/v1/generate/batch', headers=headers, json={'prompts': list('abcde')})
+
+    assert oversize.status_code == 413
+    assert 'at most 5' in oversize.json['error'] and 'Retry-After' not in oversize.headers
+    assert fits.status_code == 200
+    assert fits.headers['X-RateLimit-Remaining'] == '0'  # the whole bucket: the 413 spent nothing
+
+
+def test_redis_buckets_are_shared_between_workers(test_app):
+    server = fakeredis.FakeServer()
+    limit = RateLimit(rate=0.01, burst=2)
+    kv.use(fakeredis.FakeRedis(server=server))
+    try:
+        first = rate_limiter.hit(1, 'key-a', limit)
+        kv.use(fakeredis.FakeRedis(server=server))  # a second worker process
+        second = rate_limiter.hit(1, 'key-a', limit)
+        third = rate_limiter.hit(1, 'key-a', limit)
+    finally:
+        kv.use(None)
+
+    assert (first.allowed, second.allowed, third.allowed) == (True, True, False)
+
+
+def test_local_fallback_overhead_is_sub_millisecond(test_app):
+    limit = RateLimit(rate=1_000_000, burst=1_000_000)
+    stats = LatencyStats(window=2000)
+    for i in range(2000):
+        started = time.perf_counter()
+        rate_limiter.hit(42, f'key-{i % 10}', limit)
+        stats.observe(time.perf_counter() - started)
+
+    assert stats.percentile(99) < 0.001
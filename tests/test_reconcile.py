@@ -0,0 +1,168 @@
+# tests/test_reconcile.py
+
+import json
+import os
+from datetime import datetime, timedelta
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+import stripe
+from sqlalchemy import event
+
+from app import api_key_cache, db
+from app.models import Membership, Organization, User
+from app import reconcile as reconcile_module
+from app.reconcile import reconcile, reconcile_subscriptions
+
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures', 'stripe_subscriptions.json')
+
+
+class RecordedStripeClient(stripe.HTTPClient):
+    """Replays recorded ``GET /v1/subscriptions`` pages, following ``starting_after`` cursors."""
+
+    name = 'recorded'
+
+    def __init__(self, pages):
+        super().__init__()
+        self.pages = pages
+        self.requests = []
+
+    def request(self, method, url, headers, post_data=None):
+        query = parse_qs(urlparse(url).query)
+        self.requests.append(query)
+        pages = self.pages.get(query['status'][0], [{'object': 'list', 'url': '/v1/subscriptions',
+                                                     'has_more': False, 'data': []}])
+        index = 0
+        if 'starting_after' in query:
+            index = next(i for i, page in enumerate(pages)
+                         if page['data'] and page['data'][-1]['id'] == query['starting_after'][0]) + 1
+        return json.dumps(pages[index]), 200, {}
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def recorded_stripe(monkeypatch):
+    with open(FIXTURES) as f:
+        client = RecordedStripeClient(json.load(f))
+    monkeypatch.setattr(stripe, 'default_http_client', client)
+    return client
+
+
+@pytest.fixture
+def orgs(test_app):
+    rows = {
+        'ok': Organization(name='Rec OK', stripe_customer_id='cus_rec_ok', is_subscribed=True,
+                           subscription_id='sub_rec_ok', stripe_price_id='price_basic', subscription_status='active'),
+        'missed': Organization(name='Rec Missed', stripe_customer_id='cus_rec_missed'),
+        'upgraded': Organization(name='Rec Upgraded', stripe_customer_id='cus_rec_upgraded', is_subscribed=True,
+                                 subscription_id='sub_rec_old', stripe_price_id='price_basic'),
+        'late': Organization(name='Rec Late', stripe_customer_id='cus_rec_late', is_subscribed=True,
+                             subscription_id='sub_rec_late', stripe_price_id='price_basic',
+                             subscription_status='past_due'),
+        'gone': Organization(name='Rec Gone', stripe_customer_id='cus_rec_gone', is_subscribed=True,
+                             subscription_id='sub_rec_gone'),
+        'unknown': Organization(name='Rec Unknown', stripe_customer_id='cus_rec_unknown', is_subscribed=True,
+                                subscription_id='sub_rec_unknown'),
+    }
+    db.session.add_all(rows.values())
+    db.session.commit()
+    yield rows
+    for org in rows.values():
+        db.session.delete(org)
+    db.session.commit()
+
+
+def test_dry_run_reports_without_writing(test_app, recorded_stripe, orgs):
+    """
+    GIVEN organizations whose subscription flags drifted from Stripe
+    WHEN a dry run is made
+    THEN every subscription is listed (following pagination) and the drift is reported, but nothing is written.
+    """
+    report = reconcile(dry_run=True)
+
+    assert report.subscriptions == 6 and report.organizations == 6
+    assert {change['customer'] for change in report.changes} == {
+        'cus_rec_missed', 'cus_rec_upgraded', 'cus_rec_gone', 'cus_rec_unknown'}
+    assert any('starting_after' in query for query in recorded_stripe.requests)
+    db.session.expire_all()
+    assert orgs['missed'].is_subscribed is False and orgs['gone'].is_subscribed is True
+
+
+def test_corrections_are_applied_in_bulk_batches(test_app, recorded_stripe, orgs):
+    updates = []
+
+    def before_execute(conn, cursor, statement, parameters, context, executemany):
+        if statement.startswith('UPDATE organizations'):
+            updates.append(len(parameters) if executemany else 1)
+
+    event.listen(db.engine, 'before_cursor_execute', before_execute)
+    try:
+        report = reconcile(batch_size=3)
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', before_execute)
+
+    assert len(report.changes) == 4 and report.batches == 2
+    assert updates == [3, 1]
+    db.session.expire_all()
+    assert (orgs['missed'].is_subscribed, orgs['missed'].subscription_id, orgs['missed'].stripe_price_id) == \
+        (True, 'sub_rec_missed', 'price_pro')
+    assert orgs['missed'].current_period_end == datetime(2023, 12, 14, 22, 13, 20)
+    assert (orgs['upgraded'].subscription_id, orgs['upgraded'].stripe_price_id) == ('sub_rec_new', 'price_pro')
+    assert (orgs['gone'].is_subscribed, orgs['gone'].subscription_id, orgs['gone'].subscription_status) == \
+        (False, None, 'canceled')
+    assert orgs['unknown'].is_subscribed is False
+    assert orgs['late'].is_subscribed is True
+    assert reconcile(dry_run=True).changes == []
+
+
+def test_bulk_update_invalidates_member_caches(test_client, test_app, recorded_stripe, orgs):
+    """
+    GIVEN a member of an organization that Stripe says is no longer subscribed, with a cached API key
+    WHEN the reconciliation task runs
+    THEN their API key and session identity are invalidated and the key loses access at once.
+    """
+    user = User(email='reconcile_member@example.com', confirmed=True)
+    db.session.add_all([user, Membership(user=user, organization=orgs['gone'])])
+    db.session.commit()
+    api_key, version = user.api_key, user.session_version
+    generate = lambda: test_client.post('/api/v1/generate', json={'prompt': ''},  # noqa: E731
+                                        headers={'Authorization': f'Bearer {api_key}'})
+    assert generate().status_code == 400  # subscribed: reaches prompt validation
+
+    assert reconcile_subscriptions.delay().get()['changes'] == 4
+
+    assert generate().status_code == 403
+    db.session.refresh(user)
+    assert user.session_version == version + 1
+    db.session.delete(user)
+    db.session.commit()
+    api_key_cache.clear_local()
+
+
+def test_webhook_applied_during_the_listing_is_not_overwritten(test_app, recorded_stripe, orgs, mocker):
+    """
+    GIVEN a reconciliation pass that has listed Stripe's subscriptions
+    WHEN a webhook cancels one of the organizations before the bulk UPDATE runs
+    THEN the UPDATE leaves that row alone, and only the rows it wrote get their caches refreshed.
+    """
+    best_per_customer = reconcile_module._best_per_customer
+
+    def webhook_lands(subscriptions):
+        orgs['missed'].subscription_status = 'canceled'
+        orgs['missed'].stripe_event_at = datetime.utcnow() + timedelta(seconds=1)
+        db.session.commit()
+        return best_per_customer(subscriptions)
+
+    mocker.patch.object(reconcile_module, '_best_per_customer', side_effect=webhook_lands)
+    invalidate = mocker.spy(api_key_cache, 'invalidate_org')
+
+    report = reconcile()
+
+    assert report.skipped == 1
+    assert {change['customer'] for change in report.changes} == {'cus_rec_upgraded', 'cus_rec_gone', 'cus_rec_unknown'}
+    assert orgs['missed'].id not in {call.args[0] for call in invalidate.call_args_list}
+    db.session.expire_all()
+    assert (orgs['missed'].is_subscribed, orgs['missed'].subscription_status) == (False, 'canceled')
+    assert orgs['gone'].is_subscribed is False
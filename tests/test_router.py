@@ -0,0 +1,179 @@
+# tests/test_router.py
+
+import threading
+import time
+
+import pytest
+
+from app import db, generation, llm
+from app.llm import Completion
+from app.models import Organization
+from app.router import CircuitBreaker, HFBackend, ModelRouter, NoHealthyBackend
+
+
+class StubBackend:
+    """Local stand-in for a provider with injectable latency and failures."""
+
+    supports_cancel = True
+
+    def __init__(self, name, latency=0.0, fail=False):
+        self.name, self.latency, self.fail = name, latency, fail
+        self.default_model = f'stub:{name}'
+        self.calls = 0
+        self.cancelled = threading.Event()
+
+    def complete(self, prompt, *, cancel, max_tokens=None, model=None, **params):
+        self.calls += 1
+        if cancel.wait(self.latency):
+            self.cancelled.set()
+            raise RuntimeError('cancelled')
+        if self.fail:
+            raise ConnectionError(f'{self.name} is down')
+        return Completion(text=f'{self.name}: {prompt}', model=model or self.default_model)
+
+    def stream(self, prompt, **kwargs):
+        if self.fail:
+            raise ConnectionError(f'{self.name} is down')
+        yield from [self.name, ': ', prompt]
+
+
+def _router(*backends, **settings):
+    router = ModelRouter()
+    router.breaker_settings = {'error_threshold': 0.5, 'min_calls': 4, 'cooldown': 60, 'max_p99': None}
+    for key, value in settings.items():
+        setattr(router, key, value)
+    for backend in backends:
+        router.register(backend.name, backend)
+    return router
+
+
+def test_healthy_primary_serves_without_hedging():
+    primary, secondary = StubBackend('primary'), StubBackend('secondary')
+    router = _router(primary, secondary, hedge_default=1.0)
+
+    completion = router.complete('hello', max_tokens=10)
+
+    assert completion.text == 'primary: hello'
+    assert completion.meta == {'backend': 'primary', 'hedged': False}
+    assert (primary.calls, secondary.calls) == (1, 0)
+
+
+def test_slow_primary_is_hedged_and_the_loser_cancelled():
+    """
+    GIVEN a primary that stalls well past the hedge delay
+    WHEN a completion is requested
+    THEN the hedged request to the next backend wins and the stalled one is cancelled.
+    """
+    primary, secondary = StubBackend('primary', latency=2.0), StubBackend('secondary', latency=0.01)
+    router = _router(primary, secondary, hedge_default=0.05)
+
+    started = time.perf_counter()
+    completion = router.complete('hedge me')
+    elapsed = time.perf_counter() - started
+
+    assert completion.meta == {'backend': 'secondary', 'hedged': True}
+    assert elapsed < 0.5
+    assert primary.cancelled.wait(1)
+    assert router.routes['primary'].health.error_rate == 0.0  # losing is not failing
+
+
+def test_hedge_delay_tracks_the_primary_p95():
+    primary = StubBackend('primary')
+    router = _router(primary, hedge_default=1.0, hedge_min_samples=20, hedge_floor=0.0)
+    route = router.routes['primary']
+
+    assert router.hedge_delay(route) == 1.0
+    for ms in range(1, 21):
+        route.health.record(ms / 1000, ok=True)
+
+    assert router.hedge_delay(route) == pytest.approx(0.019)
+
+
+def test_errors_fail_over_and_open_the_circuit():
+    """
+    GIVEN a primary backend that errors on every call
+    WHEN requests keep arriving
+    THEN each is served by the fallback and, once degraded, the primary is skipped.
+    """
+    broken, fallback = StubBackend('broken', fail=True), StubBackend('fallback')
+    router = _router(broken, fallback, hedge=False)
+
+    texts = [router.complete(f'call {i}').text for i in range(6)]
+
+    assert texts == [f'fallback: call {i}' for i in range(6)]
+    assert broken.calls == 4
+    assert router.stats()['broken']['circuit'] == CircuitBreaker.OPEN
+
+
+def test_half_open_probe_closes_a_recovered_circuit():
+    backend = StubBackend('flaky', fail=True)
+    router = _router(backend, hedge=False)
+    for _ in range(4):
+        with pytest.raises(ConnectionError):
+            router.complete('boom')
+    with pytest.raises(NoHealthyBackend):
+        router.complete('still open')
+
+    backend.fail = False
+    router.routes['flaky'].breaker.cooldown = 0
+
+    assert router.complete('probe').text == 'flaky: probe'
+    stats = router.stats()['flaky']
+    assert (stats['circuit'], stats['error_rate']) == ('closed', 0.0)
+
+
+@pytest.mark.parametrize('call', ['complete', 'stream'])
+def test_unused_fallback_keeps_its_half_open_probe(call):
+    """
+    GIVEN a fallback whose circuit has cooled down to half-open
+    WHEN several requests are served by the healthy primary alone
+    THEN the fallback's probe is still free, so once the primary fails the fallback is tried and closes.
+    """
+    primary, fallback = StubBackend('a'), StubBackend('b')
+    router = _router(primary, fallback, hedge=False)
+    breaker = router.routes['b'].breaker
+    breaker._open()
+    breaker.cooldown = 0
+
+    def request(prompt):
+        return router.complete(prompt).text if call == 'complete' else ''.join(router.stream(prompt))
+
+    assert [request(f'call {i}') for i in range(5)] == [f'a: call {i}' for i in range(5)]
+    assert fallback.calls == 0 and breaker.available()
+
+    primary.fail = True
+    assert request('fail over') == 'b: fail over'
+    assert router.stats()['b']['circuit'] == CircuitBreaker.CLOSED
+
+
+def test_stream_fails_over_before_the_first_delta():
+    router = _router(StubBackend('down', fail=True), StubBackend('up'))
+
+    assert ''.join(router.stream('streamed')) == 'up: streamed'
+
+
+def test_hf_backend_parses_inference_api_response(mocker):
+    backend = HFBackend('hf_test', 'some/model', timeout=3)
+    response = mocker.Mock(json=lambda: [{'generated_text': ' a plan '}])
+    post = mocker.patch.object(backend.session, 'post', return_value=response)
+
+    completion = backend.complete('prompt', max_tokens=12)
+
+    assert (completion.text, completion.model) == ('a plan', 'some/model')
+    assert post.call_args.args[0].endswith('/models/some/model')
+    assert post.call_args.kwargs['json']['parameters']['max_new_tokens'] == 12
+    assert backend.session.headers['Authorization'] == 'Bearer hf_test'
+
+
+def test_generation_routes_through_router_with_openai_seam(test_app, mocker):
+    org = Organization(name='Router Org', response_cache_enabled=False)
+    db.session.add(org)
+    db.session.commit()
+    mocker.patch.dict(test_app.config, {'LLM_BACKEND': 'router'})
+    upstream = mocker.patch.object(llm, 'complete', return_value=Completion(text='routed', model='gpt'))
+
+    completion = generation.complete('through the router', org=org, max_tokens=20)
+
+    assert completion.text == 'routed'
+    assert completion.meta['backend'] == 'openai'
+    assert 'model' not in upstream.call_args.kwargs
@@ -0,0 +1,168 @@
+# tests/test_semantic_cache.py
+
+import threading
+
+import numpy as np
+import pytest
+
+from app import db, generation, llm, semantic_cache
+from app.llm import Completion
+from app.models import Organization
+from app.semantic_cache import HashingEmbedder, VectorIndex
+
+
+def _unit_rows(n, dim, seed=0):
+    rows = np.random.default_rng(seed).standard_normal((n, dim)).astype(np.float32)
+    return rows / np.linalg.norm(rows, axis=1, keepdims=True)
+
+
+@pytest.fixture
+def semantic(test_app, mocker):
+    mocker.patch.object(semantic_cache, 'enabled', True)
+    semantic_cache.clear()
+    yield semantic_cache
+    semantic_cache.clear()
+
+
+def _org(test_app, name, **kwargs):
+    org = Organization(name=name, **kwargs)
+    db.session.add(org)
+    db.session.commit()
+    return org
+
+
+def test_hashing_embedder_is_deterministic_and_normalized():
+    embedder = HashingEmbedder(dim=128)
+    a, b, c = embedder.embed([
+        'What is the capital of France?',
+        'what is the capital of france',
+        'Write a limerick about databases',
+    ])
+
+    assert np.allclose(embedder.embed(['What is the capital of France?'])[0], a)
+    assert np.isclose(np.linalg.norm(a), 1.0)
+    assert a @ b > 0.99
+    assert a @ c < 0.5
+
+
+def test_vector_index_top_k_matches_brute_force():
+    rows = _unit_rows(500, 32)
+    index = VectorIndex(dim=32, capacity=1000)
+    for i, row in enumerate(rows):
+        index.add(row, {'i': i})
+    query = _unit_rows(1, 32, seed=1)[0]
+
+    slots, scores = index.search(query, k=5)
+
+    expected = np.argsort(-(rows @ query))[:5]
+    assert list(slots) == list(expected)
+    assert np.all(np.diff(scores) <= 0)
+
+
+def test_vector_index_evicts_least_recently_used():
+    rows = _unit_rows(3, 16)
+    index = VectorIndex(dim=16, capacity=2)
+    first = index.add(rows[0], 'first')
+    index.add(rows[1], 'second')
+    index.touch(first)  # 'second' is now the least recently used
+
+    slot = index.add(rows[2], 'third')
+
+    assert len(index) == 2
+    assert index.payloads[slot] == 'third'
+    assert sorted(p for p in index.payloads if p) == ['first', 'third']
+
+
+def test_match_returns_the_payload_it_found_despite_a_concurrent_eviction(mocker):
+    """
+    GIVEN a full index and a writer that evicts the best slot as soon as the search has found it
+    WHEN a lookup matches that slot
+    THEN it gets the payload of the row that matched, not the one written over it.
+    """
+    rows = _unit_rows(2, 16)
+    index = VectorIndex(dim=16, capacity=1)
+    index.add(rows[0], 'matched')
+    search = index.search
+    writer = threading.Thread(target=index.add, args=(rows[1], 'evicted'))
+
+    def search_then_evict(vector, k=1):
+        found = search(vector, k)
+        writer.start()
+        writer.join(0.2)  # blocks on the index lock while the lookup holds it
+        return found
+
+    mocker.patch.object(index, 'search', side_effect=search_then_evict)
+
+    assert index.match(rows[0], threshold=0.99) == ('matched', pytest.approx(1.0))
+    writer.join()
+    assert index.payloads == ['evicted']  # the eviction went through afterwards
+
+
+def test_vector_index_persists_via_memory_mapped_snapshot(tmp_path):
+    rows = _unit_rows(10, 16)
+    path = str(tmp_path / 'org-1-scope')
+    index = VectorIndex(dim=16, capacity=64, path=path)
+    for i, row in enumerate(rows):
+        index.add(row, {'i': i})
+    assert index.flush()
+
+    reopened = VectorIndex(dim=16, capacity=64, path=path)
+
+    assert isinstance(reopened.vectors, np.memmap)
+    assert len(reopened) == 10
+    slots, scores = reopened.search(rows[7], k=1)
+    assert reopened.payloads[slots[0]] == {'i': 7}
+    assert scores[0] == pytest.approx(1.0, abs=1e-5)
+    assert len(list(tmp_path.glob('*.f32'))) == 1
+
+
+def test_reworded_prompt_is_served_from_semantic_cache(test_app, semantic, mocker):
+    """
+    GIVEN a completion produced for one wording of a prompt
+    WHEN the same organization asks with different casing and punctuation
+    THEN the cached completion is returned without an upstream call.
+    """
+    org = _org(test_app, 'Semantic Org')
+    upstream = mocker.patch.object(llm, 'complete', return_value=Completion(text='Paris', model='test'))
+
+    first = generation.complete('What is the capital of France?', org=org)
+    second = generation.complete('what is the capital of france', org=org)
+
+    assert first.text == second.text == 'Paris'
+    assert upstream.call_count == 1
+    assert second.meta['semantic_score'] >= semantic.threshold
+
+
+def test_unrelated_prompts_and_other_orgs_miss(test_app, semantic, mocker):
+    org = _org(test_app, 'Semantic Org A')
+    other = _org(test_app, 'Semantic Org B')
+    upstream = mocker.patch.object(llm, 'complete', return_value=Completion(text='answer', model='test'))
+
+    generation.complete('Explain how photosynthesis works', org=org)
+    generation.complete('Write a limerick about databases', org=org)
+    generation.complete('explain how photosynthesis works', org=other)
+
+    assert upstream.call_count == 3
+
+
+def test_opted_out_orgs_skip_semantic_cache(test_app, semantic, mocker):
+    org = _org(test_app, 'Semantic Private Org', response_cache_enabled=False)
+    mocker.patch.object(llm, 'complete', return_value=Completion(text='private', model='test'))
+    store = mocker.spy(semantic, 'store')
+
+    generation.complete('a private semantic prompt', org=org)
+
+    store.assert_not_called()
+
+
+def test_semantic_cache_reloads_from_disk(test_app, semantic, mocker, tmp_path):
+    org = _org(test_app, 'Semantic Persistent Org')
+    mocker.patch.object(semantic, 'directory', str(tmp_path))
+    upstream = mocker.patch.object(llm, 'complete', return_value=Completion(text='kept', model='test'))
+
+    generation.complete('Summarize the plot of Hamlet', org=org)
+    assert semantic.flush() == 1
+    semantic.clear()  # simulate a restart
+
+    assert generation.complete('summarize the plot of hamlet!', org=org).text == 'kept'
+    assert upstream.call_count == 1
@@ -0,0 +1,62 @@
+# tests/test_templating.py
+
+import fakeredis
+import pytest
+
+from app import kv, template_cache
+from app.email import render_message
+from app.metrics import metrics
+from app.models import User
+
+
+@pytest.fixture
+def bytecode_cache(test_app, tmp_path):
+    """Switch the app to a bytecode cache backend; restores the test config afterwards."""
+    def use(backend):
+        kv.use(fakeredis.FakeRedis())
+        test_app.config.update(TEMPLATE_BYTECODE_CACHE=backend, TEMPLATE_BYTECODE_CACHE_DIR=str(tmp_path))
+        template_cache.init_app(test_app, kv)
+        return template_cache.bytecode_cache
+
+    yield use
+    test_app.config.update(TEMPLATE_BYTECODE_CACHE='none', TEMPLATE_BYTECODE_CACHE_DIR=None)
+    template_cache.init_app(test_app, kv)
+    test_app.jinja_env.cache.clear()
+    kv.use(None)
+
+
+def _counter(name):
+    return metrics.snapshot(prefix=name)['counters'].get(name, 0)
+
+
+@pytest.mark.parametrize('backend', ['redis', 'filesystem'])
+def test_restarted_worker_loads_bytecode_instead_of_compiling(test_app, bytecode_cache, backend, mocker):
+    """
+    GIVEN a worker that warmed every template into the shared bytecode cache
+    WHEN a restarted worker (empty in-memory template cache) warms up again
+    THEN every template comes from the bytecode cache and nothing is compiled.
+    """
+    bytecode_cache(backend)
+    env = test_app.jinja_env
+    env.cache.clear()
+    first = template_cache.warm(test_app)
+    assert first >= 10 and 'email/confirm.html' in env.list_templates()
+
+    env.cache.clear()  # the restart
+    compile_ = mocker.spy(env, 'compile')
+    hits = _counter('template.bytecode.hit')
+    assert template_cache.warm(test_app) == first
+    assert compile_.call_count == 0
+    assert _counter('template.bytecode.hit') - hits == first
+
+
+def test_static_email_fragment_is_rendered_once(test_app):
+    user = User(email='fragment@example.com')
+    misses = _counter('template.fragment.miss')
+
+    messages = [render_message(user.email, 'Confirm', 'email/confirm', user=user, token=str(n)) for n in range(3)]
+
+    assert _counter('template.fragment.miss') - misses == 2  # the .txt and the .html signature, once each
+    assert messages[2].body.endswith('Sincerely,\nThe AI Genesis Engine Team')
+    assert '<p>Sincerely,</p>\n<p>The AI Genesis Engine Team</p>' in messages[2].html
+    assert '/auth/confirm/2' in messages[2].body  # the per-recipient part is still rendered per message
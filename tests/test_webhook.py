@@ -37,7 +37,7 @@ def test_webhook_checkout_session_completed(test_client, test_app, mocker):
     mocker.patch('stripe.Webhook.construct_event', return_value=mock_event_payload)
 
     # 4. Make the POST request to our webhook endpoint
-    response = test_client.post('/payments/webhook',
+    response = test_client.post('/payments/stripe/webhook',
                                 data='mock_payload',
                                 headers={'Stripe-Signature': 'mock_sig'})
 
@@ -58,7 +58,7 @@ def test_webhook_invalid_signature(test_client, mocker):
     # Mock the construct_event to simulate a signature verification failure
     mocker.patch('stripe.Webhook.construct_event', side_effect=stripe.error.SignatureVerificationError('test error', 'sig_header'))
 
-    response = test_client.post('/payments/webhook', data='payload', headers={'Stripe-Signature': 'bad_sig'})
+    response = test_client.post('/payments/stripe/webhook', data='payload', headers={'Stripe-Signature': 'bad_sig'})
 
     assert response.status_code == 400
 
@@ -91,7 +91,7 @@ def test_webhook_subscription_deleted(test_client, test_app, mocker):
     mocker.patch('stripe.Webhook.construct_event', return_value=mock_event_payload)
 
     # 4. Make the request
-    response = test_client.post('/payments/webhook', data='mock_payload', headers={'Stripe-Signature': 'mock_sig'})
+    response = test_client.post('/payments/stripe/webhook', data='mock_payload', headers={'Stripe-Signature': 'mock_sig'})
 
     # 5. Assertions
     assert response.status_code == 200